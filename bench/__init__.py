@@ -0,0 +1,22 @@
+"""
+bench - ルール評価まわりのベンチマーク・バックテスト
+
+合成マーケット（N 通貨ペア × 5m/15m/1H/4H/D/W/M/Y の雲）で webhook_log.txt と同じ形の
+ペイロードとルールを生成し、本番コードをプロセス内で直接呼んで計測する。
+
+    bench.synthetic  合成ペイロード・ルールの生成（乱数シード固定で再現可能）
+    bench.run        シナリオ実行・集計・ベースライン比較（python -m bench.run）
+    bench.backtest   過去のペイロードでルールの発火タイムラインを再現（python -m bench.backtest）
+    bench.equivalence  コンパイル済み比較関数（comparators）と参照実装の一致確認（python -m bench.equivalence）
+    bench.journal    webhook_journal の読み出しと旧ログ全行からの総当たりの一致確認（python -m bench.journal）
+
+シナリオ:
+    webhook  evaluate_and_fire_rules（Webhook 1件ごとのルール評価）
+    sweep    evaluate_all_symbols_from_db（全シンボル一括評価）
+    trend    calculate_trend_strength_v2 / calculate_trend_strength_cached
+    strength calculate_currency_strength_data（差分更新。最後に全件再計算と突き合わせる）
+
+使い方:
+    python -m bench.run --pairs 28 --rules 60 --out bench_base.json
+    python -m bench.run --pairs 28 --rules 60 --baseline bench_base.json   # 退行があれば終了コード 1
+"""
@@ -0,0 +1,366 @@
+"""
+bench/backtest.py
+
+過去の Webhook ペイロードでルールをバックテストする（有効化前に「いつ発火していたか」を確認する）
+
+    python -m bench.backtest [--log webhook_log.txt] [--journal DIR] [--backup DIR]
+                             [--db webhook_data.db] [--rule RULE_ID ...] [--from 26/01/05] [--to 26/02/01]
+                             [--out fires.jsonl]
+
+- 入力はすべてジェネレーターで1件ずつ読む（ファイル全体をメモリに載せない）
+    webhook_log.txt / ジャーナルのセグメント（.log / .log.gz）: 1行1レコード、ほぼ受信順
+    TradingViewBackup_JSON/SYMBOL/TF/*.json: フォルダごとにファイル名順 = 時刻順
+- 各入力を小さな並べ替えバッファで sent_time 順に整え、heapq.merge で1本の時系列にする
+- 状態は一時ディレクトリの DB（bench.run.BenchEnvironment）に本番と同じ形で書き込み、
+  本番の evaluate_and_fire_rules（エッジトリガー判定・rule_state・active_fires を含む）をそのまま呼ぶ
+- 発火は一時 DB の fire_history から読み、トリガーになったペイロードの時刻を付けて返す
+  （評価1回ごとに rule_effects の発火件数を見て、増えたときだけ書き込みを待って新しい行を読む）
+- --from より前のペイロードは「起動直後モード」で流す（状態だけ作って発火しない）
+
+メモリに残るのは 入力ごとの並べ替えバッファ + (symbol, tf) ごとの最新状態 + ルール × シンボルの評価状態 だけ。
+"""
+
+import argparse
+import contextlib
+import glob
+import gzip
+import heapq
+import itertools
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+from collections import Counter, namedtuple
+from datetime import datetime
+
+import pytz
+
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+
+_jst = pytz.timezone('Asia/Tokyo')
+
+# 1件分の入力。ts_ms は並べ替えキー（sent_time、なければ payload.time / 受信時刻）
+Event = namedtuple('Event', 'ts_ms source symbol tf sent_time payload')
+
+# 並べ替えバッファの件数（同じ入力内で sent_time が前後する範囲）
+REORDER_WINDOW = 2048
+
+
+def sent_time_to_ms(sent_time):
+    """'YY/MM/DD/HH:MM'（JST）→ エポックミリ秒（解釈できなければ None）"""
+    try:
+        yy, mm, dd, hhmm = sent_time.split('/')
+        hh, mn = hhmm.split(':')
+        dt = _jst.localize(datetime(2000 + int(yy), int(mm), int(dd), int(hh), int(mn)))
+        return int(dt.timestamp() * 1000)
+    except Exception:
+        return None
+
+
+def _iso_to_ms(value):
+    try:
+        return int(datetime.fromisoformat(value).timestamp() * 1000)
+    except Exception:
+        return None
+
+
+def _event(source, received_at, symbol, tf, sent_time, payload):
+    sent_time = sent_time or payload.get('sent_time') or ''
+    ts_ms = sent_time_to_ms(sent_time) if sent_time else None
+    if ts_ms is None:
+        ts_ms = payload.get('time') or (_iso_to_ms(received_at) if received_at else None)
+    if not ts_ms:
+        return None
+    return Event(int(ts_ms), source, payload.get('symbol', symbol), str(payload.get('tf', tf)), sent_time, payload)
+
+
+def _iter_lines(lines, source):
+    from webhook_journal import parse_line
+
+    for line in lines:
+        parsed = parse_line(line)
+        if parsed is None:
+            continue
+        received_at, symbol, tf, sent_time, payload = parsed
+        if isinstance(payload, dict):
+            event = _event(source, received_at, symbol, tf, sent_time, payload)
+            if event is not None:
+                yield event
+
+
+def iter_log_file(path, source='log'):
+    """webhook_log.txt 形式のファイル（.gz も可）"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8', errors='replace') as f:
+        yield from _iter_lines(f, source)
+
+
+def iter_journal(journal_dir):
+    """ジャーナルのセグメントを古い順に読む（索引は使わず全行を流す）"""
+    names = sorted(n for n in os.listdir(journal_dir)
+                   if n.startswith('segment-') and (n.endswith('.log') or n.endswith('.log.gz')))
+    plain = {n for n in names if n.endswith('.log')}
+    for name in names:
+        # 圧縮途中で落ちた場合は非圧縮側を正とする（webhook_journal と同じ）
+        if name.endswith('.gz') and name[:-3] in plain:
+            continue
+        yield from iter_log_file(os.path.join(journal_dir, name), source='journal')
+
+
+def _iter_backup_dir(tf_dir, symbol, tf):
+    for path in sorted(glob.glob(os.path.join(tf_dir, '*.json'))):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                payload = json.load(f)
+        except Exception:
+            continue
+        if isinstance(payload, dict):
+            event = _event('backup', None, symbol, tf, payload.get('sent_time', ''), payload)
+            if event is not None:
+                yield event
+
+
+def iter_backup_folder(root):
+    """TradingViewBackup_JSON/SYMBOL/TF/*.json（フォルダごとにファイル名順 = 時刻順なのでそのまま merge）"""
+    streams = []
+    for symbol in sorted(os.listdir(root)):
+        symbol_dir = os.path.join(root, symbol)
+        if not os.path.isdir(symbol_dir):
+            continue
+        for tf in sorted(os.listdir(symbol_dir)):
+            tf_dir = os.path.join(symbol_dir, tf)
+            if os.path.isdir(tf_dir):
+                streams.append(_iter_backup_dir(tf_dir, symbol, tf))
+    return heapq.merge(*streams, key=lambda e: e.ts_ms)
+
+
+def reorder(events, window=REORDER_WINDOW):
+    """ほぼ時刻順の入力を、window 件のバッファで時刻順に並べ替える"""
+    heap = []
+    counter = itertools.count()
+    for event in events:
+        heapq.heappush(heap, (event.ts_ms, next(counter), event))
+        if len(heap) > window:
+            yield heapq.heappop(heap)[2]
+    while heap:
+        yield heapq.heappop(heap)[2]
+
+
+def merge_sources(streams, window=REORDER_WINDOW):
+    """各入力を並べ替えてから1本の時系列にする。同じ時刻・(symbol, tf, sent_time) の重複は1件にする
+
+    ジャーナルは webhook_log.txt を取り込んでいるため、両方を指定すると同じレコードが2回現れる。
+    """
+    merged = heapq.merge(*(reorder(s, window) for s in streams), key=lambda e: e.ts_ms)
+    current_ts = None
+    seen = set()
+    for event in merged:
+        if event.ts_ms != current_ts:
+            current_ts = event.ts_ms
+            seen.clear()
+        # 同じ時刻の中で (symbol, tf, sent_time) が同じなら重複（sent_time のない旧形式は時刻で判定）
+        key = (event.symbol, event.tf, event.sent_time)
+        if key in seen:
+            continue
+        seen.add(key)
+        yield event
+
+
+def load_rules(db_path, rule_ids=None):
+    """rules テーブルから [(id, name, scope, rule)]（rule_ids 指定時は無効なルールも含める）"""
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        if rule_ids:
+            marks = ','.join('?' * len(rule_ids))
+            rows = conn.execute(f'SELECT id, name, scope_json, rule_json FROM rules WHERE id IN ({marks}) '
+                                'ORDER BY sort_order, rowid', list(rule_ids)).fetchall()
+        else:
+            rows = conn.execute('SELECT id, name, scope_json, rule_json FROM rules WHERE enabled = 1 '
+                                'ORDER BY sort_order, rowid').fetchall()
+    finally:
+        conn.close()
+    return [(rule_id, name, json.loads(scope_json or '{}'), json.loads(rule_json or '{}'))
+            for rule_id, name, scope_json, rule_json in rows]
+
+
+class Backtester:
+    """一時 DB 上で本番のルール評価を時系列どおりに流す"""
+
+    def __init__(self, rules, workdir=None):
+        from bench.run import BenchEnvironment
+
+        self.workdir = workdir or tempfile.mkdtemp(prefix='tv_backtest_')
+        # render_server 側のモジュール（db_writer など）は環境変数を設定してから import する
+        self.env = BenchEnvironment(self.workdir)
+        self.rs = self.env.rs
+        self.rule_names = {rule_id: name for rule_id, name, _scope, _rule in rules}
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            self.env.install_rules(rules)
+        # ペイロードの time による「起動前データ」判定は使わない
+        self.rs.SERVER_START_TIME = None
+        self._latest_sent = {}   # (symbol, tf) -> sent_time の ms（古いペイロードを捨てる）
+        self._last_fire_id = 0
+        self._fire_count = self._committed_fires()
+        self.stats = Counter()
+
+    def close(self):
+        self.env.flush()
+
+    @staticmethod
+    def _committed_fires():
+        from rule_effects import evaluation_batch_stats
+        return evaluation_batch_stats()['fires']
+
+    def _new_fires(self):
+        """前回以降に fire_history へ書かれた発火 [(rule_id, symbol, direction)]（id 順）"""
+        count = self._committed_fires()
+        if count == self._fire_count:
+            return []
+        self._fire_count = count
+        self.env.flush()
+        conn = self.rs.get_connection(self.rs.DB_PATH)
+        try:
+            rows = conn.execute('SELECT id, rule_id, symbol, direction FROM fire_history WHERE id > ? ORDER BY id',
+                                (self._last_fire_id,)).fetchall()
+        finally:
+            conn.close()
+        if rows:
+            self._last_fire_id = rows[-1][0]
+        return [row[1:] for row in rows]
+
+    def _accept(self, event):
+        """本番の Webhook 受信と同じ前処理（tf・row_order の正規化、空 clouds・古い sent_time の除外）"""
+        rs = self.rs
+        payload = dict(event.payload)
+        tf = rs._normalize_tf(event.tf)
+        if isinstance(payload.get('row_order'), list):
+            payload['row_order'] = rs._normalize_row_order(payload['row_order'])
+        if not payload.get('clouds'):
+            self.stats['skipped_empty'] += 1
+            return None
+        key = (event.symbol, tf)
+        if event.sent_time:
+            latest = self._latest_sent.get(key)
+            if latest is not None and event.ts_ms < latest:
+                self.stats['skipped_older'] += 1
+                return None
+            self._latest_sent[key] = event.ts_ms
+        payload['symbol'] = event.symbol
+        payload['tf'] = tf
+        return payload
+
+    def run(self, events, from_ms=None, to_ms=None):
+        """発火を1件ずつ返すジェネレーター
+
+        from_ms より前のペイロードは状態づくりだけ（起動直後モードで評価し、発火しない）。
+        """
+        rs = self.rs
+        warming = from_ms is not None
+        rs._server_just_started = warming
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            for event in events:
+                if to_ms is not None and event.ts_ms > to_ms:
+                    break
+                if warming and event.ts_ms >= from_ms:
+                    warming = False
+                    rs._server_just_started = False
+                payload = self._accept(event)
+                if payload is None:
+                    continue
+                self.stats['events'] += 1
+                self.stats['warmup' if warming else 'evaluated'] += 1
+                self.env.store_payload(payload)
+                rs.evaluate_and_fire_rules(payload, payload['symbol'], payload['tf'])
+                for rule_id, identity, direction in self._new_fires():
+                    self.stats['fires'] += 1
+                    yield {
+                        'time': datetime.fromtimestamp(event.ts_ms / 1000, _jst).isoformat(),
+                        'sent_time': event.sent_time,
+                        'rule_id': rule_id,
+                        'rule_name': self.rule_names.get(rule_id, rule_id),
+                        'symbol': identity,
+                        'direction': direction,
+                        'trigger': f'{payload["symbol"]}/{payload["tf"]}',
+                        'source': event.source,
+                    }
+
+
+def _date_to_ms(text):
+    """'YY/MM/DD' または 'YY/MM/DD/HH:MM'"""
+    if text is None:
+        return None
+    ms = sent_time_to_ms(text if text.count('/') == 3 else text + '/00:00')
+    if ms is None:
+        raise ValueError(f'invalid date: {text} (expected YY/MM/DD or YY/MM/DD/HH:MM)')
+    return ms
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='過去の Webhook ペイロードでルールをバックテスト')
+    parser.add_argument('--log', action='append', default=[], help='webhook_log.txt 形式のファイル（複数可）')
+    parser.add_argument('--journal', help='Webhook ジャーナルのディレクトリ')
+    parser.add_argument('--backup', help='TradingViewBackup_JSON フォルダ')
+    parser.add_argument('--db', default=os.path.join(os.getenv('PERSISTENT_STORAGE_PATH', BASE_DIR), 'webhook_data.db'),
+                        help='ルールを読む DB（読み取り専用で開く）')
+    parser.add_argument('--rule', action='append', default=[], help='対象ルールID（省略時は有効ルールすべて）')
+    parser.add_argument('--from', dest='date_from', help='この時刻から発火を数える（YY/MM/DD[/HH:MM]、それ以前は状態づくりのみ）')
+    parser.add_argument('--to', dest='date_to', help='この時刻まで（YY/MM/DD[/HH:MM]）')
+    parser.add_argument('--window', type=int, default=REORDER_WINDOW, help='入力ごとの並べ替えバッファ件数')
+    parser.add_argument('--out', help='発火タイムラインの保存先（JSON Lines）')
+    args = parser.parse_args(argv)
+
+    rules = load_rules(args.db, args.rule)
+    if not rules:
+        print('[BACKTEST] No rules to test')
+        return 1
+    missing = set(args.rule) - {r[0] for r in rules}
+    if missing:
+        print(f'[BACKTEST] Rules not found: {", ".join(sorted(missing))}')
+
+    streams = [iter_log_file(path) for path in args.log]
+    if args.journal:
+        streams.append(iter_journal(args.journal))
+    if args.backup:
+        streams.append(iter_backup_folder(args.backup))
+    if not streams:
+        streams.append(iter_log_file(os.path.join(BASE_DIR, 'webhook_log.txt')))
+
+    backtester = Backtester(rules)
+    per_key = {}
+    out = open(args.out, 'w', encoding='utf-8') if args.out else None
+    try:
+        for fire in backtester.run(merge_sources(streams, args.window),
+                                   _date_to_ms(args.date_from), _date_to_ms(args.date_to)):
+            if out:
+                out.write(json.dumps(fire, ensure_ascii=False) + '\n')
+            key = (fire['rule_name'], fire['symbol'])
+            summary = per_key.setdefault(key, {'fires': 0, 'up': 0, 'down': 0, 'first': fire['time'], 'last': None})
+            summary['fires'] += 1
+            summary['last'] = fire['time']
+            if fire['direction'] == '上昇':
+                summary['up'] += 1
+            elif fire['direction'] == '下降':
+                summary['down'] += 1
+    finally:
+        if out:
+            out.close()
+        backtester.close()
+
+    stats = backtester.stats
+    print(f'[BACKTEST] {len(rules)} rules, {stats["events"]} payloads '
+          f'(warmup {stats["warmup"]}, skipped older {stats["skipped_older"]}, empty {stats["skipped_empty"]}), '
+          f'{stats["fires"]} fires')
+    for (rule_name, symbol), s in sorted(per_key.items()):
+        print(f'  {rule_name:<24} {symbol:<10} fires={s["fires"]:<4} up={s["up"]:<4} down={s["down"]:<4} '
+              f'first={s["first"]} last={s["last"]}')
+    if args.out:
+        print(f'[BACKTEST] Saved timeline to {args.out}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,282 @@
+"""
+bench/equivalence.py
+
+comparators（コンパイル済み比較関数）と ichimoku_utils の参照実装の一致確認
+- 実際の値の正規化    : canonical_value(field, v).value  ==  _normalize_actual(field, v)
+- 比較               : compile_comparator(op, b)(canonical_value(field, a))
+                       ==  bool(_compare_values(_normalize_actual(field, a), op, b))
+- 時刻のミリ秒化      : time_ms(v)  ==  _parse_time_to_ms(v)
+- 横断判定の特徴行列  : ConditionMatrix.evaluate（NumPy / リスト演算の両方）== シンボルごとの素朴な判定
+- 通貨強弱の全件計算  : compute_full(use_numpy=True)  ==  compute_full(use_numpy=False)
+  （NumPy が入っていなければこの2つはリスト演算同士の比較になるため、件数の横に numpy=False と表示）
+- 値は境界値の一覧（別名・数値文字列・真偽値・None・NaN・不正な時刻など）+ 乱数で生成した値
+- 不一致があれば最初の数件を表示して終了コード 1
+
+使い方:
+    python -m bench.equivalence
+    python -m bench.equivalence --random 200000 --seed 3
+"""
+
+import argparse
+import itertools
+import math
+import random
+import sys
+import time
+
+import condition_matrix
+import currency_strength
+from comparators import canonical_value, compile_comparator, time_ms
+from ichimoku_utils import _compare_values, _normalize_actual, _parse_time_to_ms
+from rule_cache import compile_condition
+from state_store import CloudIndex
+
+
+FIELDS = ('gc', 'dauten', 'bos_count', 'po', 'angle', 'thickness', 'distance_from_prev',
+          'distance_from_price', 'dauten_start_time_str', 'cross_start_time', 'trend', None)
+
+OPS = ('==', '!=', '>', '<', '>=', '<=', '=', '~', '', None)
+
+# 実際の値（雲のフィールド値として現れ得るもの + 壊れた値）
+ACTUAL_VALUES = (
+    None, True, False, 0, 1, -1, 2, 0.0, 1.0, -2.5, 35.7, float('nan'), float('inf'), -float('inf'),
+    '', ' ', '-', '✕', '0', '1', '-1', ' 12 ', '3.5', '-40.25', '1e3', 'nan', 'inf', '-inf',
+    'true', 'false', 'True', 'FALSE', 'yes', 'no', 'y', 'n',
+    '▲GC', '▼DC', 'gc', 'dc', 'GC', 'DC', ' ▲gc ', 'ゴールデンクロス', 'golden',
+    '▲Dow', '▼Dow', 'up', 'down', 'UP', 'Down', '上', '下', '上昇', '下降', 'upward', 'sideways',
+    '▲P2', '▲P3', '▲PO', '▼P2', '▼P3', '▼PO', '▲', '▼', '買', '売', '▲35%', '▼7%',
+    '25/10/31/21:35', '26/01/05/09:00', '2026/01/05/09', '25/13/01/00:00', '25/10/31', '1700000000000',
+    [], {}, [1], {'a': 1},
+)
+
+# 期待値（条件の value として保存され得るもの + 壊れた値）
+EXPECTED_VALUES = (
+    None, True, False, 0, 1, 2.5, -3, float('nan'),
+    '', ' ', 'true', 'false', ' TRUE ', 'gc', '▲GC', ' ▲gc', 'ゴールデンクロス', 'golden', 'goldencross',
+    'dc', '▼DC', 'デッドクロス', 'dead', 'deadcross', 'up', '▲', '▲Dow', '上', '上昇', 'upward',
+    'down', '▼', '▼Dow', '下', '下降', 'downward', '0', '1', '10', ' 20 ', '-30', '3.5', '1e2', 'nan',
+    'inf', '▲P2', '▼PO', '-', 'abc', ' Mixed Case ', '買', [], {'x': 1},
+)
+
+# 特徴行列・通貨強弱の乱数データ
+MATRIX_LABELS = ('5m', '15m', '1H', '4H', 'D')
+MATRIX_FIELDS = ('gc', 'dauten', 'bos_count', 'po', 'angle')
+STRENGTH_SYMBOLS = ('EURUSD', 'USDJPY', 'GBPJPY', 'AUDUSD', 'EURGBP', 'NZDUSD', 'OANDA:CHFJPY',
+                    'XAUUSD', 'EURUSDT', 'SPX')
+STRENGTH_TFS = ('5', '15', '15M', '60', '1H', '240', '4H', 'D', '1440', '1')
+STRENGTH_PCTS = (None, 0, 0, 1, -1, 35, -80, 100, 12.5, -3.25)
+
+TIME_VALUES = (
+    None, 0, 12, -5, 1.9, float('nan'), float('inf'), True, '', ' ', '123', ' 456 ', '-7', '1.5',
+    '25/10/31/21:35', '25/10/31/21', '2025/10/31/21:35', '99/12/31/23:59', '00/01/01/00:00',
+    '25/02/30/10:00', '25/10/31/25:00', '25/10/31/21:61', '25/10/31/ab', '25/10/31', 'a/b/c/d',
+    '25/10/31/21:35/extra', '25/1/2/3:4', [], {'t': 1},
+)
+
+
+def _same(a, b):
+    """型と値が同じか（NaN 同士は一致とみなす）"""
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, float) and math.isnan(a) and math.isnan(b):
+        return True
+    try:
+        return bool(a == b)
+    except Exception:
+        return False
+
+
+def _random_actual(rng):
+    kind = rng.random()
+    if kind < 0.3:
+        return rng.choice(ACTUAL_VALUES)
+    if kind < 0.55:
+        return round(rng.uniform(-80, 80), rng.choice((0, 1, 2, 4)))
+    if kind < 0.75:
+        return str(round(rng.uniform(-80, 80), rng.choice((0, 2))))
+    if kind < 0.9:
+        return rng.choice(('', ' ', '  ')) + rng.choice(ACTUAL_VALUES[15:60]) + rng.choice(('', ' '))
+    return rng.randint(-3, 5)
+
+
+def _random_expected(rng):
+    kind = rng.random()
+    if kind < 0.5:
+        return rng.choice(EXPECTED_VALUES)
+    if kind < 0.8:
+        return str(rng.choice((0, 5, 10, 20, 30, -10, 1.5)))
+    return rng.choice(('', ' ')) + str(rng.choice(EXPECTED_VALUES[8:])) + rng.choice(('', ' '))
+
+
+def check_normalize(fields, values, mismatches):
+    count = 0
+    for field, value in itertools.product(fields, values):
+        count += 1
+        expected = _normalize_actual(field, value)
+        canonical = canonical_value(field, value)
+        actual = canonical.value if canonical is not None else None
+        if not _same(actual, expected):
+            mismatches.append(('normalize', field, value, actual, expected))
+    return count
+
+
+def check_compare(field, actual_value, op, expected_value, mismatches):
+    reference = bool(_compare_values(_normalize_actual(field, actual_value), op, expected_value))
+    compiled = compile_comparator(op, expected_value)(canonical_value(field, actual_value))
+    if compiled is not reference:
+        mismatches.append(('compare', field, actual_value, op, expected_value, compiled, reference))
+
+
+def check_time(values, mismatches):
+    for value in values:
+        # 2回目はメモから返る
+        for _ in range(2):
+            actual = time_ms(value)
+            expected = _parse_time_to_ms(value)
+            if not _same(actual, expected):
+                mismatches.append(('time', value, actual, expected))
+    return len(values)
+
+
+def _reference_matrix(cloud_maps, predicates):
+    """シンボルごとの素朴な判定 → {symbol: (matched, direction)}"""
+    result = {}
+    for sym, clouds in cloud_maps.items():
+        matched, up, down = True, False, False
+        for pred in predicates:
+            cloud = clouds.get(pred.tf_label)
+            if cloud is None:
+                ok = False
+            elif pred.value is None or str(pred.value).strip() == '':
+                ok = cloud.get(pred.field) is not None
+            else:
+                ok = str(cloud.get(pred.field)) == str(pred.value)
+            if not ok:
+                matched = False
+                continue
+            code = condition_matrix.direction_code(pred.field, cloud.get(pred.field))
+            up = up or code > 0
+            down = down or code < 0
+        result[sym] = (matched, 1 if up and not down else -1 if down and not up else 0)
+    return result
+
+
+def _random_cloud_maps(rng, n_symbols):
+    cloud_maps = {}
+    for i in range(n_symbols):
+        clouds = {}
+        for label in MATRIX_LABELS:
+            if rng.random() < 0.15:
+                continue
+            clouds[label] = {field: rng.choice(ACTUAL_VALUES[:60]) for field in MATRIX_FIELDS
+                             if rng.random() < 0.9}
+        cloud_maps[f'SYM{i}'] = clouds
+    return cloud_maps
+
+
+def check_matrix(rng, n_cases, mismatches):
+    """NumPy / リスト演算の両方の評価結果を素朴な判定と比べる"""
+    numpy_module = condition_matrix.np
+    for case in range(n_cases):
+        cloud_maps = _random_cloud_maps(rng, rng.randint(1, 30))
+        predicates = []
+        for _ in range(rng.randint(1, 4)):
+            clouds = cloud_maps[rng.choice(list(cloud_maps))]
+            label = rng.choice(MATRIX_LABELS)
+            field = rng.choice(MATRIX_FIELDS)
+            # 半分は実在する値を期待値にする（一致するケースを作る）
+            if label in clouds and rng.random() < 0.5:
+                value = clouds[label].get(field)
+            else:
+                value = rng.choice(EXPECTED_VALUES)
+            predicates.append(compile_condition({'timeframe': label, 'field': field, 'value': value}))
+        reference = _reference_matrix(cloud_maps, predicates)
+        backends = (('numpy', numpy_module), ('list', None)) if numpy_module is not None else (('list', None),)
+        for backend, module in backends:
+            condition_matrix.np = module
+            try:
+                matrix = condition_matrix.ConditionMatrix(cloud_maps, case)
+                matched, dirs = matrix.evaluate(predicates)
+            finally:
+                condition_matrix.np = numpy_module
+            actual = {sym: (bool(matched[i]), int(dirs[i])) for i, sym in enumerate(matrix.symbols)}
+            if actual != reference:
+                diff = {sym: (actual[sym], reference[sym]) for sym in reference if actual[sym] != reference[sym]}
+                mismatches.append(('matrix', backend, predicates, diff))
+    return n_cases
+
+
+def _random_strength_rows(rng, n_rows):
+    rows = []
+    for i in range(n_rows):
+        clouds = []
+        for label in rng.sample(('5', '15', '60', '240', 'D', None), rng.randint(0, 3)):
+            clouds.append({'label': label, 'trend_pct': rng.choice(STRENGTH_PCTS)})
+        rows.append({'symbol': rng.choice(STRENGTH_SYMBOLS), 'tf': rng.choice(STRENGTH_TFS),
+                     'row_order': rng.choice((None, '', f'{i}')) if rng.random() < 0.1 else f'{i}',
+                     'clouds_json': 'x' if clouds else '', 'clouds': clouds,
+                     'cloud_index': CloudIndex.from_clouds(clouds)})
+    return rows
+
+
+def check_strength(rng, n_cases, mismatches):
+    """compute_full の NumPy（接続行列）とリスト演算の結果を比べる"""
+    overrides = {'XAUUSD': ['XAU', 'USD'], 'SPX': None}
+    for _ in range(n_cases):
+        rows = _random_strength_rows(rng, rng.randint(0, 60))
+        pair_weights = {'EURUSD': 1.5} if rng.random() < 0.3 else {}
+        with_numpy = currency_strength.compute_full(rows, overrides, pair_weights, {}, use_numpy=True)
+        without = currency_strength.compute_full(rows, overrides, pair_weights, {}, use_numpy=False)
+        diff = currency_strength.compare_results(with_numpy, without)
+        if diff:
+            mismatches.append(('strength', diff))
+    return n_cases
+
+
+def run(n_random=50000, seed=0):
+    """全チェックを実行して (件数, 不一致のリスト) を返す"""
+    mismatches = []
+    counts = {}
+    counts['normalize'] = check_normalize(FIELDS, ACTUAL_VALUES, mismatches)
+    compare_count = 0
+    for field, actual_value, op, expected_value in itertools.product(FIELDS, ACTUAL_VALUES, OPS, EXPECTED_VALUES):
+        check_compare(field, actual_value, op, expected_value, mismatches)
+        compare_count += 1
+    rng = random.Random(seed)
+    for _ in range(n_random):
+        check_compare(rng.choice(FIELDS), _random_actual(rng), rng.choice(OPS[:6]), _random_expected(rng), mismatches)
+        compare_count += 1
+    counts['compare'] = compare_count
+    times = list(TIME_VALUES)
+    for _ in range(min(n_random, 5000)):
+        times.append(f'{rng.randint(0, 120):02d}/{rng.randint(0, 13):02d}/{rng.randint(0, 32):02d}/'
+                     f'{rng.randint(0, 25):02d}:{rng.randint(0, 61):02d}')
+    counts['time'] = check_time(times, mismatches)
+    counts['matrix'] = check_matrix(rng, max(1, n_random // 50), mismatches)
+    counts['strength'] = check_strength(rng, max(1, n_random // 100), mismatches)
+    return counts, mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='コンパイル済み比較関数と参照実装の一致確認')
+    parser.add_argument('--random', type=int, default=50000, help='乱数で生成する比較の件数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--show', type=int, default=20, help='表示する不一致の件数')
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    counts, mismatches = run(args.random, args.seed)
+    elapsed = time.perf_counter() - started
+    summary = ', '.join(f'{name}={count}' for name, count in counts.items())
+    print(f'[EQUIVALENCE] checked {summary} (numpy={condition_matrix.np is not None}) in {elapsed:.1f}s')
+    if mismatches:
+        print(f'[EQUIVALENCE] {len(mismatches)} mismatches')
+        for m in mismatches[:args.show]:
+            print('  ', m)
+        return 1
+    print('[EQUIVALENCE] all equivalent')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""
+bench/journal.py
+
+webhook_journal の読み出しと総当たりの一致確認（旧 webhook_log.txt を取り込んだジャーナル）
+- 一時ディレクトリに小さいセグメントで取り込み、索引経由の読み出しを旧ログの全行から求めた結果と突き合わせる
+    read_range(from, to, symbol, tf)  ==  受信時刻が [from, to] の行（受信時刻順、同時刻はファイル順）
+    tail(n, symbol)                    ==  上の並びの末尾 n 行
+- 圧縮・保持（run_maintenance）の後にもう一度確認する（取り込んだ履歴は保持期間では消えない）
+- 不一致があれば最初の数件を表示して終了コード 1
+
+使い方:
+    python -m bench.journal
+    python -m bench.journal --log webhook_log.txt --windows 2000 --seed 3
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from webhook_journal import LEGACY_LOG_PATH, WebhookJournal, _iso_to_ms, _LINE_RE
+
+
+def load_reference(path):
+    """旧ログの全行 → [(ts_ms, symbol, tf, line)]（受信時刻順）"""
+    records = []
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            m = _LINE_RE.match(line)
+            if m:
+                records.append((_iso_to_ms(m.group(1)) or 0, m.group(2), m.group(3),
+                                line if line.endswith('\n') else line + '\n'))
+    records.sort(key=lambda r: r[0])
+    return records
+
+
+def check(journal, records, n_windows, rng, label, mismatches):
+    symbols = sorted({r[1] for r in records})
+    lo_ms, hi_ms = records[0][0], records[-1][0]
+    checked = 0
+    for i in range(n_windows):
+        a, b = sorted((rng.randint(lo_ms - 60000, hi_ms + 60000), rng.randint(lo_ms - 60000, hi_ms + 60000)))
+        symbol = rng.choice(symbols) if i % 3 == 0 else None
+        expected = [r[3] for r in records if a <= r[0] <= b and (symbol is None or r[1] == symbol)]
+        got = journal.read_range(a, b, symbol=symbol, limit=None)
+        checked += 1
+        if got != expected:
+            mismatches.append(f'{label} read_range({a}, {b}, symbol={symbol}): expected {len(expected)} got {len(got)}')
+    for n in (1, 10, 50, len(records), len(records) + 5):
+        for symbol in (None, symbols[0]):
+            expected = [r[3] for r in records if symbol is None or r[1] == symbol][-n:]
+            got = journal.tail(n, symbol=symbol)
+            checked += 1
+            if got != expected:
+                mismatches.append(f'{label} tail({n}, symbol={symbol}): expected {len(expected)} got {len(got)}')
+    if journal.count() != len(records):
+        mismatches.append(f'{label} count: expected {len(records)} got {journal.count()}')
+    return checked
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='webhook_journal の読み出しと総当たりの一致確認')
+    parser.add_argument('--log', default=LEGACY_LOG_PATH, help='取り込む旧形式のログ')
+    parser.add_argument('--windows', type=int, default=500, help='確認する期間 [from, to] の数')
+    parser.add_argument('--segment-bytes', type=int, default=16 * 1024, help='セグメントの上限サイズ（小さいほど境界を多く通る）')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--show', type=int, default=20, help='表示する不一致の件数')
+    args = parser.parse_args(argv)
+
+    records = load_reference(args.log)
+    if not records:
+        print(f'[JOURNAL_CHECK] no records in {args.log}')
+        return 1
+    rng = random.Random(args.seed)
+    mismatches = []
+    tmp = tempfile.mkdtemp(prefix='journal-check-')
+    started = time.perf_counter()
+    try:
+        journal = WebhookJournal(tmp, segment_bytes=args.segment_bytes, legacy_path=args.log)
+        checked = check(journal, records, args.windows, rng, 'plain', mismatches)
+        journal.run_maintenance()
+        checked += check(journal, records, args.windows, rng, 'compressed', mismatches)
+        # 再起動（索引の読み直し）
+        checked += check(WebhookJournal(tmp, segment_bytes=args.segment_bytes, legacy_path=args.log),
+                         records, args.windows, rng, 'reloaded', mismatches)
+        stats = journal.stats()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    elapsed = time.perf_counter() - started
+    print(f'[JOURNAL_CHECK] {len(records)} records, {stats["segments"]} segments, {checked} checks in {elapsed:.1f}s')
+    if mismatches:
+        print(f'[JOURNAL_CHECK] {len(mismatches)} mismatches')
+        for m in mismatches[:args.show]:
+            print('  ', m)
+        return 1
+    print('[JOURNAL_CHECK] all equivalent')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
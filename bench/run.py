@@ -0,0 +1,309 @@
+"""
+bench/run.py
+
+合成マーケットでルール評価・トレンド計算を計測する
+
+    python -m bench.run [--pairs 28] [--rules 60] [--webhooks 2000] [--sweeps 20] [--trend 2000]
+                        [--strength 2000] [--scenarios webhook,sweep,trend,strength] [--mix po=3,gc=2,dauten=2,angle=1,align=1]
+                        [--multi-symbol-ratio 0.1] [--seed 0]
+                        [--out result.json] [--baseline base.json] [--tolerance 0.25] [--noise-ms 0.25]
+
+- 一時ディレクトリに空の DB を作り（PERSISTENT_STORAGE_PATH）、render_server を import して init_db()
+- 合成ルールを rules テーブルに入れ、全ペア × 全チャート TF の初期状態を状態ストアに書き込む
+- シナリオごとに1呼び出しずつ時間を測り、件数・スループット・平均・p50・p99・最大を出す
+- --baseline を指定すると p50 / p99 / スループットを比較し、tolerance を超えて悪化していれば終了コード 1
+
+計測中の render_server の print はすべて捨てる（print のコスト自体は計測に含まれる）。
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+
+def _parse_mix(text):
+    mix = {}
+    for item in text.split(','):
+        if item.strip():
+            kind, _, weight = item.partition('=')
+            mix[kind.strip()] = float(weight or 1)
+    return mix
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def summarize(samples_ms, wall_sec):
+    """1シナリオ分の集計（samples_ms: 1呼び出しごとの所要時間）"""
+    values = sorted(samples_ms)
+    n = len(values)
+    return {
+        'count': n,
+        'wall_sec': round(wall_sec, 4),
+        'throughput_per_sec': round(n / wall_sec, 2) if wall_sec > 0 else None,
+        'mean_ms': round(sum(values) / n, 4) if n else None,
+        'p50_ms': round(_percentile(values, 50), 4) if n else None,
+        'p99_ms': round(_percentile(values, 99), 4) if n else None,
+        'max_ms': round(values[-1], 4) if n else None,
+    }
+
+
+class _Timer:
+    def __init__(self):
+        self.samples = []
+        self.wall = 0.0
+
+    @contextlib.contextmanager
+    def measure(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.samples.append(elapsed * 1000.0)
+            self.wall += elapsed
+
+
+class BenchEnvironment:
+    """一時 DB 上の render_server"""
+
+    def __init__(self, workdir):
+        self.workdir = workdir
+        # render_server の import 前に保存先を一時ディレクトリへ向ける
+        os.environ['PERSISTENT_STORAGE_PATH'] = workdir
+        os.environ['WEBHOOK_JOURNAL_DIR'] = os.path.join(workdir, 'journal')
+        os.environ.setdefault('LOG_FILE', os.path.join(workdir, 'bench.log'))
+        os.environ.setdefault('LOG_CONSOLE_LEVEL', 'ERROR')
+        # 一時 DB なので書き込みはまとめ待ちせず、fsync もしない（状態の保存待ちで時間を使わない）
+        os.environ.setdefault('DB_WRITER_BATCH_MS', '0')
+        os.environ.setdefault('SQLITE_SYNCHRONOUS', 'OFF')
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            import render_server as rs
+            rs.init_db()
+        rs.NOTIFICATIONS_PATH = os.path.join(workdir, 'notifications.json')
+        self.rs = rs
+
+    @property
+    def state_store(self):
+        return self.rs.get_state_store(self.rs.DB_PATH)
+
+    def install_rules(self, rules):
+        """rules テーブルを合成ルールで置き換える"""
+        rs = self.rs
+        now = datetime.now().isoformat()
+        conn = rs.get_connection(rs.DB_PATH)
+        try:
+            conn.execute('DELETE FROM rules')
+            conn.executemany(
+                'INSERT INTO rules (id, name, enabled, scope_json, rule_json, created_at, updated_at, sort_order) '
+                'VALUES (?, ?, 1, ?, ?, ?, ?, ?)',
+                [(rule_id, name, json.dumps(scope, ensure_ascii=False), json.dumps(rule, ensure_ascii=False), now, now, i)
+                 for i, (rule_id, name, scope, rule) in enumerate(rules)])
+            conn.commit()
+        finally:
+            conn.close()
+        rs.get_rule_cache(rs.DB_PATH).invalidate()
+
+    def store_payload(self, payload):
+        """本番の Webhook 処理と同じ形で states に書き込む（ルール評価・配信はしない）"""
+        rs = self.rs
+        now = datetime.now(rs.pytz.timezone('Asia/Tokyo')).isoformat()
+        self.state_store.upsert(rs._state_values_from_payload(
+            payload, payload['symbol'], payload['tf'], now, now, payload.get('sent_time', '')))
+
+    def flush(self):
+        self.rs.get_writer(self.rs.DB_PATH).flush()
+
+
+def run_webhook(env, market, n):
+    """Webhook 1件ごとの evaluate_and_fire_rules（状態の保存は計測に含めない）"""
+    timer = _Timer()
+    for payload in market.ticks(n):
+        env.store_payload(payload)
+        with timer.measure():
+            env.rs.evaluate_and_fire_rules(payload, payload['symbol'], payload['tf'])
+    env.flush()
+    return summarize(timer.samples, timer.wall)
+
+
+def run_sweep(env, market, n, ticks_between=None):
+    """evaluate_all_symbols_from_db（各回の間に市場を進めて状態を変える）"""
+    ticks_between = len(market.pairs) if ticks_between is None else ticks_between
+    timer = _Timer()
+    for _ in range(n):
+        for payload in market.ticks(ticks_between):
+            env.store_payload(payload)
+        with timer.measure():
+            env.rs.evaluate_all_symbols_from_db(cooldown=0)
+    env.flush()
+    return summarize(timer.samples, timer.wall)
+
+
+def run_trend(env, market, n):
+    """トレンド強度計算（v2 直接呼び出しとメモ化版）"""
+    from trend_strength_calculator_v2 import calculate_trend_strength_v2, calculate_trend_strength_cached
+    from state_store import normalize_trend_tf
+
+    inputs = []
+    for payload in market.ticks(n):
+        env.store_payload(payload)
+        tf = normalize_trend_tf(payload['tf'])
+        all_states = env.state_store.trend_states(payload['symbol'])
+        state_data = all_states.get(tf, {'clouds': payload['clouds'], 'row_order': ','.join(payload['row_order'])})
+        inputs.append((tf, state_data, all_states))
+    results = {}
+    # trend_cached は入力がすべて新しい雲（Webhook 直後と同じミス）、trend_cached_hit は同じ入力の2周目（ヒット）
+    for name, func in (('trend_v2', calculate_trend_strength_v2), ('trend_cached', calculate_trend_strength_cached),
+                       ('trend_cached_hit', calculate_trend_strength_cached)):
+        timer = _Timer()
+        for tf, state_data, all_states in inputs:
+            with timer.measure():
+                func(tf, state_data, all_states)
+        results[name] = summarize(timer.samples, timer.wall)
+    return results
+
+
+def run_strength(env, market, n):
+    """Webhook 1件ごとの通貨強弱計算（差分更新）。最後に全件再計算と突き合わせる"""
+    from currency_strength import get_currency_strength_engine
+
+    timer = _Timer()
+    for payload in market.ticks(n):
+        env.store_payload(payload)
+        with timer.measure():
+            env.rs.calculate_currency_strength_data()
+    result = summarize(timer.samples, timer.wall)
+    result['verify_mismatches'] = len(get_currency_strength_engine(env.rs.DB_PATH).verify())
+    return result
+
+
+def compare(result, baseline, tolerance, noise_ms=0.25):
+    """ベースラインとの比較 → (行のリスト, 退行があるか)
+
+    p50 / p99 は差が noise_ms 未満なら悪化とみなさない（マイクロ秒単位の処理の揺らぎ対策）。
+    """
+    lines = []
+    regressed = False
+    for name, cur in result['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if not base:
+            lines.append(f'  {name:<14} (no baseline)')
+            continue
+        parts = []
+        for key, higher_is_better in (('p50_ms', False), ('p99_ms', False), ('throughput_per_sec', True)):
+            b, c = base.get(key), cur.get(key)
+            if not b or c is None:
+                continue
+            ratio = c / b
+            if higher_is_better:
+                worse = ratio < 1 - tolerance
+            else:
+                worse = ratio > 1 + tolerance and c - b >= noise_ms
+            regressed = regressed or worse
+            parts.append(f'{key}={c:g} ({ratio:.2f}x{" REGRESSION" if worse else ""})')
+        lines.append(f'  {name:<14} ' + '  '.join(parts))
+    return lines, regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='ルール評価・トレンド計算のベンチマーク（合成マーケット）')
+    parser.add_argument('--pairs', type=int, default=10, help='通貨ペア数（最大 28）')
+    parser.add_argument('--rules', type=int, default=40, help='有効ルール数')
+    parser.add_argument('--mix', default='po=3,gc=2,dauten=2,angle=1,align=1', help='条件の種類と重み')
+    parser.add_argument('--conditions', default='1-3', help='ルールあたりの条件数（min-max）')
+    parser.add_argument('--multi-symbol-ratio', type=float, default=0.1, help='match_all_symbols ルールの割合')
+    parser.add_argument('--scoped-ratio', type=float, default=0.5, help='scope.symbols を指定するルールの割合')
+    parser.add_argument('--scenarios', default='webhook,sweep,trend,strength')
+    parser.add_argument('--webhooks', type=int, default=1000, help='webhook シナリオの件数')
+    parser.add_argument('--sweeps', type=int, default=20, help='sweep シナリオの回数')
+    parser.add_argument('--trend', type=int, default=1000, help='trend シナリオの件数')
+    parser.add_argument('--strength', type=int, default=1000, help='strength シナリオの件数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='結果 JSON の保存先')
+    parser.add_argument('--baseline', help='比較するベースライン結果 JSON')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='退行とみなす悪化率（0.25 = 25%%）')
+    parser.add_argument('--noise-ms', type=float, default=0.25, help='p50/p99 でこれ未満の差は無視する')
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from bench.synthetic import SyntheticMarket, generate_rules
+
+    lo, _, hi = args.conditions.partition('-')
+    workdir = tempfile.mkdtemp(prefix='tv_bench_')
+    env = BenchEnvironment(workdir)
+    market = SyntheticMarket(args.pairs, seed=args.seed)
+    rules = generate_rules(market.pairs, args.rules, mix=_parse_mix(args.mix),
+                           conditions_per_rule=(int(lo), int(hi or lo)),
+                           multi_symbol_ratio=args.multi_symbol_ratio, scoped_ratio=args.scoped_ratio,
+                           seed=args.seed)
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+
+    result = {
+        'created_at': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'params': {k: v for k, v in vars(args).items() if k not in ('out', 'baseline')},
+        'scenarios': {},
+    }
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        env.install_rules(rules)
+        for payload in market.snapshot():
+            env.store_payload(payload)
+        # 起動直後モード（初回評価は発火しない）を抜けてから計測する
+        env.rs.evaluate_all_symbols_from_db(cooldown=0)
+        env.flush()
+        if 'webhook' in scenarios:
+            result['scenarios']['webhook'] = run_webhook(env, market, args.webhooks)
+        if 'sweep' in scenarios:
+            result['scenarios']['sweep'] = run_sweep(env, market, args.sweeps)
+        if 'trend' in scenarios:
+            result['scenarios'].update(run_trend(env, market, args.trend))
+        if 'strength' in scenarios:
+            result['scenarios']['strength'] = run_strength(env, market, args.strength)
+        conn = env.rs.get_connection(env.rs.DB_PATH)
+        try:
+            result['fires'] = conn.execute('SELECT COUNT(*) FROM fire_history').fetchone()[0]
+        finally:
+            conn.close()
+
+    print(f'[BENCH] pairs={args.pairs} rules={args.rules} fires={result["fires"]} workdir={workdir}')
+    for name, s in result['scenarios'].items():
+        print(f'  {name:<14} n={s["count"]:<6} {s["throughput_per_sec"]:>10}/s  '
+              f'mean={s["mean_ms"]}ms p50={s["p50_ms"]}ms p99={s["p99_ms"]}ms max={s["max_ms"]}ms')
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f'[BENCH] Saved {args.out}')
+
+    mismatches = result['scenarios'].get('strength', {}).get('verify_mismatches')
+    if mismatches:
+        print(f'[BENCH] currency strength differs from full recompute ({mismatches} mismatches)')
+        return 1
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        lines, regressed = compare(result, baseline, args.tolerance, args.noise_ms)
+        print(f'[BENCH] Compared with {args.baseline} (tolerance {args.tolerance:.0%})')
+        for line in lines:
+            print(line)
+        if regressed:
+            print('[BENCH] REGRESSION detected')
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,211 @@
+"""
+bench/synthetic.py
+
+合成マーケットの生成
+- 通貨ペアごと・TF ごとに雲の状態（GC/DC・角度・ダウ転・PO など）をランダムウォークで進める
+- ペイロードは webhook_log.txt の現行形式（チャート TF ごとに自TF + 上位3TF の雲）と同じ形
+- ルールは rules テーブルの scope_json / rule_json と同じ形（条件の種類・マルチシンボルの割合を指定可能）
+- random.Random(seed) だけを使うので、同じ引数なら同じ系列になる
+"""
+
+import itertools
+import random
+from datetime import datetime, timedelta
+
+
+CURRENCIES = ('USD', 'EUR', 'JPY', 'GBP', 'AUD', 'CHF', 'CAD', 'NZD')
+
+# 雲ラベル（ペイロードの label 値 → 条件で使う正規化ラベル）
+CLOUD_LABELS = ('5', '15', '60', '240', 'D', 'W', 'M', 'Y')
+CONDITION_LABELS = {'5': '5m', '15': '15m', '60': '1H', '240': '4H', 'D': 'D', 'W': 'W', 'M': 'M', 'Y': 'Y'}
+
+# チャート TF（Webhook の tf）→ (含まれる雲ラベル, row_order)
+CHART_TFS = {
+    '5': (('5', '15', '60', '240'), ['4H', '1H', '15m', 'price', '5m']),
+    '15': (('15', '60', '240', 'D'), ['4H', '1H', '15m', 'price', 'D']),
+    '60': (('60', '240', 'D', 'W'), ['4H', '1H', 'price', 'D', 'W']),
+    '240': (('240', 'D', 'W', 'M'), ['4H', 'price', 'D', 'W', 'M']),
+    'D': (('D', 'W', 'M', 'Y'), ['price', 'D', 'W', 'M', 'Y']),
+}
+# 受信頻度の重み（webhook_log.txt の実績に近い比率）
+CHART_TF_WEIGHTS = {'5': 4, '15': 8, '60': 4, '240': 4, 'D': 4}
+
+# 条件の種類（--mix で指定する名前）
+CONDITION_KINDS = ('po', 'gc', 'dauten', 'angle', 'align')
+
+_PO_VALUES = ('▲P2', '▲P3', '▲PO', '▼P2', '▼P3', '▼PO')
+
+
+def pair_universe(n_pairs):
+    """CURRENCIES の組み合わせから n_pairs 個の通貨ペア名（最大 28）"""
+    pairs = [a + b for a, b in itertools.combinations(CURRENCIES, 2)]
+    if n_pairs > len(pairs):
+        raise ValueError(f'n_pairs must be <= {len(pairs)}')
+    return pairs[:n_pairs]
+
+
+def _fmt_time(dt):
+    return dt.strftime('%y/%m/%d/%H:%M')
+
+
+class _CloudState:
+    """通貨ペア × 雲ラベル 1つ分の状態"""
+
+    __slots__ = ('gc', 'angle', 'thickness', 'distance', 'dauten', 'po', 'cross_at', 'dauten_at', 'po_at')
+
+    def __init__(self, rng, now):
+        self.gc = rng.random() < 0.5
+        self.angle = rng.uniform(-40, 40)
+        self.thickness = rng.uniform(1, 50)
+        self.distance = rng.uniform(-80, 80)
+        self.dauten = rng.choice(('▲Dow', '▼Dow', '-'))
+        self.po = '-'
+        self.cross_at = now
+        self.dauten_at = now
+        self.po_at = None
+
+    def step(self, rng, now, volatility):
+        if rng.random() < 0.08 * volatility:
+            self.gc = not self.gc
+            self.cross_at = now
+        self.angle = max(-70.0, min(70.0, self.angle + rng.gauss(0, 4 * volatility)))
+        self.thickness = max(0.1, self.thickness + rng.gauss(0, 2))
+        self.distance += rng.gauss(0, 6 * volatility)
+        if rng.random() < 0.06 * volatility:
+            self.dauten = '▼Dow' if self.dauten == '▲Dow' else '▲Dow'
+            self.dauten_at = now
+        # PO は発火 → しばらく点灯 → 消灯を繰り返す
+        if self.po == '-':
+            if rng.random() < 0.05 * volatility:
+                self.po = rng.choice(_PO_VALUES)
+                self.po_at = now
+        elif rng.random() < 0.25:
+            self.po = '-'
+
+    def to_cloud(self, label):
+        gc = '▲GC' if self.gc else '▼DC'
+        up = self.gc
+        return {
+            'label': label,
+            'gc': gc,
+            'thickness': round(self.thickness, 4),
+            'angle': round(self.angle, 4),
+            'distance_from_price': round(self.distance, 4),
+            'distance_from_prev': round(self.distance / 2, 4),
+            'cross_start_time_str': _fmt_time(self.cross_at),
+            'dauten': self.dauten,
+            'dauten_start_time_str': _fmt_time(self.dauten_at) if self.dauten != '-' else '',
+            'po': self.po,
+            'po_fire_time_str': _fmt_time(self.po_at) if self.po_at and self.po != '-' else '',
+            'hantei': '買' if up else '売',
+            'trend': ('▲' if up else '▼') + f'{int(abs(self.angle)) % 101}%',
+            'trend_pct': int(abs(self.angle)) % 101,
+        }
+
+
+class SyntheticMarket:
+    """合成マーケット
+
+    market = SyntheticMarket(28, seed=1)
+    for payload in market.ticks(1000): ...          # 1件ずつ（ペア・TF はランダム）
+    payloads = market.snapshot()                    # 全ペア × 全チャート TF の1巡分
+    """
+
+    def __init__(self, n_pairs=10, seed=0, volatility=1.0, start=None):
+        self.rng = random.Random(seed)
+        self.pairs = pair_universe(n_pairs)
+        self.volatility = volatility
+        self.now = start or datetime(2026, 1, 5, 9, 0)
+        self.prices = {pair: (150.0 if pair.endswith('JPY') else 1.2) * self.rng.uniform(0.7, 1.3)
+                       for pair in self.pairs}
+        self.clouds = {(pair, label): _CloudState(self.rng, self.now)
+                       for pair in self.pairs for label in CLOUD_LABELS}
+        self._tf_choices = list(CHART_TF_WEIGHTS)
+        self._tf_weights = [CHART_TF_WEIGHTS[tf] for tf in self._tf_choices]
+
+    def payload(self, pair, tf):
+        """pair / チャート TF の状態を1ステップ進めてペイロードを返す"""
+        self.now += timedelta(minutes=1)
+        labels, row_order = CHART_TFS[tf]
+        price = self.prices[pair] * (1 + self.rng.gauss(0, 0.0005 * self.volatility))
+        self.prices[pair] = price
+        clouds = []
+        for label in labels:
+            state = self.clouds[(pair, label)]
+            state.step(self.rng, self.now, self.volatility)
+            clouds.append(state.to_cloud(label))
+        own = clouds[0]
+        return {
+            'symbol': pair,
+            'tf': tf,
+            'sent_time': _fmt_time(self.now),
+            'daytrade': {'bos': '-'},
+            'po': {'status': own['po'], 'fire_time_str': own['po_fire_time_str']},
+            'row_order': list(row_order),
+            'clouds': clouds,
+            'price': round(price, 5),
+        }
+
+    def ticks(self, n):
+        """ランダムなペア・チャート TF のペイロードを n 件"""
+        for _ in range(n):
+            pair = self.rng.choice(self.pairs)
+            tf = self.rng.choices(self._tf_choices, self._tf_weights)[0]
+            yield self.payload(pair, tf)
+
+    def snapshot(self):
+        """全ペア × 全チャート TF のペイロード（DB の初期状態用）"""
+        return [self.payload(pair, tf) for pair in self.pairs for tf in CHART_TFS]
+
+
+def _condition(rng, kind):
+    label = CONDITION_LABELS[rng.choice(CLOUD_LABELS)]
+    if kind == 'po':
+        return {'timeframe': label, 'field': 'po', 'value': ''}
+    if kind == 'gc':
+        return {'timeframe': label, 'field': 'gc', 'value': rng.choice(('▲GC', '▼DC'))}
+    if kind == 'dauten':
+        return {'timeframe': label, 'field': 'dauten', 'value': rng.choice(('▲Dow', '▼Dow'))}
+    if kind == 'angle':
+        return {'timeframe': label, 'field': 'angle', 'value': str(rng.choice((10, 20, 30)))}
+    raise ValueError(f'unknown condition kind: {kind}')
+
+
+def generate_rules(pairs, n_rules=20, mix=None, conditions_per_rule=(1, 3),
+                   multi_symbol_ratio=0.1, scoped_ratio=0.5, seed=0):
+    """rules テーブルに入れる行 [(id, name, scope_json 用 dict, rule_json 用 dict), ...]
+
+    mix: {条件の種類: 重み}（CONDITION_KINDS。'align' は cloudAlign ルール）
+    multi_symbol_ratio: match_all_symbols ルールの割合
+    scoped_ratio: scope.symbols を指定するルールの割合（残りは全シンボル対象）
+    """
+    rng = random.Random(seed)
+    mix = mix or {'po': 3, 'gc': 2, 'dauten': 2, 'angle': 1, 'align': 1}
+    kinds = [k for k in mix if mix[k] > 0]
+    weights = [mix[k] for k in kinds]
+    rules = []
+    for i in range(n_rules):
+        kind = rng.choices(kinds, weights)[0]
+        rule = {
+            'voice': {'message': f'bench {kind} {i}', 'messageUp': '上昇。', 'messageDown': '下降。',
+                      'messagePosition': 'both', 'directionBased': True},
+            'cloudAlign': {'allTimeframes': False, 'timeframes': [], 'missingBehavior': 'ignore'},
+            'conditions': [],
+        }
+        if kind == 'align':
+            tfs = sorted(rng.sample(('5m', '15m', '1H', '4H'), 3), key=('5m', '15m', '1H', '4H').index)
+            rule['cloudAlign'] = {'allTimeframes': False, 'timeframes': tfs, 'missingBehavior': 'ignore'}
+            rule['displayTf'] = tfs[-1]
+        else:
+            # 1件目はルールの種類、2件目以降は mix から選ぶ（align は条件にならないので po で代用）
+            cond_kinds = [kind] + rng.choices(kinds, weights, k=rng.randint(*conditions_per_rule) - 1)
+            rule['conditions'] = [_condition(rng, k if k != 'align' else 'po') for k in cond_kinds]
+            rule['displayTf'] = rule['conditions'][0]['timeframe']
+        scope = {}
+        r = rng.random()
+        if r < multi_symbol_ratio and len(pairs) > 1:
+            scope = {'symbols': rng.sample(pairs, min(len(pairs), rng.randint(2, 4))), 'match_all_symbols': True}
+        elif r < multi_symbol_ratio + scoped_ratio:
+            scope = {'symbols': rng.sample(pairs, min(len(pairs), rng.randint(1, 5))), 'match_all_symbols': False}
+        rules.append((f'bench_rule_{i:04d}', f'BENCH_{kind}_{i}', scope, rule))
+    return rules
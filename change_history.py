@@ -0,0 +1,187 @@
+"""
+change_history.py
+
+通貨強弱の最弱・最強の変更履歴（change_history テーブル）の記録
+- 時間足ごとの基準（最後に記録した最弱・最強とその期間）を起動時に change_history の最新行から読み込む
+  （再起動直後の1回目の計算で、同じ組み合わせを記録し直したり変化を取りこぼしたりしない）
+- 記録の判定はメモリ上の基準だけで行い、INSERT と古い行の削除は db_writer 経由で書き込む
+- ヒステリシス（CHANGE_HISTORY_HYSTERESIS_PCT）: 今の最弱（最強）の通貨は、別の通貨がパーセントで
+  その幅以上に下回る（上回る）まで入れ替えない。スコアがほぼ同じ2通貨の間で最弱・最強が
+  行ったり来たりしても行が増え続けない（0 なら無効。以前と同じ判定）
+
+記録の条件（以前と同じ）:
+    最弱・最強の組み合わせが最後に記録した行と違い、かつ最後に記録した行と期間（5m / 15m / 1H / 4H の足。
+    それ以外の時間足は1分）が違うときだけ1行追加する。時間足ごとに最新 CHANGE_HISTORY_MAX_ROWS 行を保持
+"""
+
+import os
+import threading
+from datetime import datetime
+
+import pytz
+
+from db_pool import get_connection
+from db_writer import get_writer
+
+
+# ============================================================
+# 【設定】環境変数で上書き可能
+# ============================================================
+# 最弱・最強を入れ替えるのに必要な差（パーセント。0 で無効）
+CHANGE_HISTORY_HYSTERESIS_PCT = max(0.0, float(os.getenv('CHANGE_HISTORY_HYSTERESIS_PCT', '0')))
+# 時間足ごとに保持する行数
+CHANGE_HISTORY_MAX_ROWS = 1000
+
+_JST = pytz.timezone('Asia/Tokyo')
+
+_INSERT = '''INSERT INTO change_history
+    (timeframe, weakest, strongest, weakest_percent, strongest_percent, timestamp, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?)'''
+_TRIM = '''DELETE FROM change_history WHERE timeframe = ? AND id IN (
+    SELECT id FROM change_history WHERE timeframe = ? ORDER BY created_at DESC LIMIT -1 OFFSET ?)'''
+
+
+def period_bucket(timeframe, dt):
+    """時間足に応じた期間バケット（例: 5m なら「202603051035」= 2026/03/05 10:35 台）"""
+    if timeframe == '5m':
+        return dt.strftime('%Y%m%d%H') + f'{(dt.minute // 5) * 5:02d}'
+    if timeframe == '15m':
+        return dt.strftime('%Y%m%d%H') + f'{(dt.minute // 15) * 15:02d}'
+    if timeframe == '1H':
+        return dt.strftime('%Y%m%d%H') + '00'
+    if timeframe == '4H':
+        return dt.strftime('%Y%m%d') + f'{(dt.hour // 4) * 4:02d}' + '00'
+    return dt.strftime('%Y%m%d%H%M')
+
+
+def _bucket_from_created_at(timeframe, created_at):
+    try:
+        dt = datetime.fromisoformat(created_at)
+    except (TypeError, ValueError):
+        return None
+    if dt.tzinfo is None:
+        dt = _JST.localize(dt)
+    return period_bucket(timeframe, dt.astimezone(_JST))
+
+
+def _hold(held, candidate, percents, margin, sign):
+    """ヒステリシス: candidate が held を margin 以上（sign=1 は下回る / -1 は上回る）で抜いたときだけ入れ替える"""
+    if margin <= 0 or held is None or held == candidate or held not in percents:
+        return candidate
+    if (percents[held] - percents[candidate]) * sign >= margin:
+        return candidate
+    return held
+
+
+class ChangeHistoryRecorder:
+    """DBファイル1つ分の最弱・最強の変更記録"""
+
+    def __init__(self, db_path, hysteresis_pct=None, max_rows=CHANGE_HISTORY_MAX_ROWS):
+        self.db_path = db_path
+        self.hysteresis_pct = CHANGE_HISTORY_HYSTERESIS_PCT if hysteresis_pct is None else hysteresis_pct
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._recorded = {}     # timeframe -> (weakest, strongest, 期間バケット)  最後に記録した行
+        self._current = {}      # timeframe -> (weakest, strongest)  ヒステリシス適用後の現在の最弱・最強
+        self._loaded = False
+        self._stats = {'recorded': 0, 'skipped_same': 0, 'skipped_period': 0, 'held': 0}
+
+    def load(self):
+        """時間足ごとに change_history の最新行を基準として読み込む"""
+        conn = get_connection(self.db_path)
+        try:
+            rows = conn.execute('''SELECT timeframe, weakest, strongest, created_at FROM change_history AS h
+                                   WHERE id = (SELECT id FROM change_history WHERE timeframe = h.timeframe
+                                               ORDER BY created_at DESC LIMIT 1)''').fetchall()
+        finally:
+            conn.close()
+        recorded = {}
+        for timeframe, weakest, strongest, created_at in rows:
+            recorded[timeframe] = (weakest, strongest, _bucket_from_created_at(timeframe, created_at))
+        with self._lock:
+            self._recorded = recorded
+            self._current = {tf: (w, s) for tf, (w, s, _) in recorded.items()}
+            self._loaded = True
+        print(f'[CHANGE_HISTORY] Loaded baseline for {len(recorded)} timeframes')
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                loaded = self._loaded
+            if not loaded:
+                self.load()
+
+    def record(self, currency_data, denom=350.0):
+        """通貨強弱の結果から最弱・最強の変更を検出して記録（denom: パーセント換算の分母）"""
+        self._ensure_loaded()
+        now = datetime.now(_JST)
+        timestamp = now.strftime('%y/%m/%d/%H:%M:%S')
+        created_at = now.isoformat()
+        denom = float(denom) if denom and denom > 0 else 350.0
+        rows = []
+        for timeframe, data in currency_data.items():
+            if not isinstance(data, dict) or not data.get('currencies'):
+                continue
+            try:
+                currencies = data['currencies']
+                percents = {item['currency']: max(-100, min(100, round((item['score'] / denom) * 100)))
+                            for item in currencies}
+                with self._lock:
+                    held_w, held_s = self._current.get(timeframe, (None, None))
+                    weakest = _hold(held_w, currencies[0]['currency'], percents, self.hysteresis_pct, 1)
+                    strongest = _hold(held_s, currencies[-1]['currency'], percents, self.hysteresis_pct, -1)
+                    if weakest == strongest:
+                        weakest, strongest = currencies[0]['currency'], currencies[-1]['currency']
+                    if (weakest, strongest) != (currencies[0]['currency'], currencies[-1]['currency']):
+                        self._stats['held'] += 1
+                    self._current[timeframe] = (weakest, strongest)
+
+                    bucket = period_bucket(timeframe, now)
+                    last = self._recorded.get(timeframe)
+                    if last is not None and last[:2] == (weakest, strongest):
+                        self._stats['skipped_same'] += 1
+                        skip_reason = 'same values'
+                    elif last is not None and last[2] == bucket:
+                        self._stats['skipped_period'] += 1
+                        skip_reason = 'same period'
+                    else:
+                        self._recorded[timeframe] = (weakest, strongest, bucket)
+                        self._stats['recorded'] += 1
+                        skip_reason = None
+                if skip_reason:
+                    print(f'[CHANGE_HISTORY] Skipped {timeframe} ({skip_reason}): {weakest}⇔{strongest}')
+                    continue
+                weakest_percent, strongest_percent = percents[weakest], percents[strongest]
+                rows.append((timeframe, weakest, strongest, weakest_percent, strongest_percent, timestamp, created_at))
+                print(f'[CHANGE_HISTORY] Recorded for {timeframe}: {weakest}{weakest_percent:+d}%⇔{strongest}{strongest_percent:+d}%')
+            except Exception as tf_error:
+                print(f'[ERROR] Error processing timeframe {timeframe}: {tf_error}')
+        if rows:
+            writer = get_writer(self.db_path)
+            writer.submit(_INSERT, rows, many=True)
+            # 時間足ごとに最新 max_rows 行を維持（古い履歴を削除）
+            writer.submit(_TRIM, [(row[0], row[0], self.max_rows) for row in rows], many=True)
+        return rows
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s['timeframes'] = len(self._recorded)
+        s['hysteresis_pct'] = self.hysteresis_pct
+        return s
+
+
+_recorders = {}
+_recorders_lock = threading.Lock()
+
+
+def get_change_history_recorder(db_path):
+    """DBファイルごとの共有インスタンスを取得"""
+    recorder = _recorders.get(db_path)
+    if recorder is None:
+        with _recorders_lock:
+            recorder = _recorders.get(db_path)
+            if recorder is None:
+                recorder = ChangeHistoryRecorder(db_path)
+                _recorders[db_path] = recorder
+    return recorder
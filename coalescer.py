@@ -0,0 +1,147 @@
+"""
+coalescer.py
+
+キーごとの合流ウィンドウ（バー確定時の Webhook 連打をまとめて1回だけ処理する）
+- 足の確定時、TradingView は同じシンボルの 5 / 15 / 60 / 240 のペイロードを1〜2秒以内に続けて送ってくる
+- 状態の保存は受信ごとに即時に行い、ルール評価・通貨強弱などの派生処理だけをここに投入する
+- キーの最初の投入からウィンドウ（ミリ秒）が経過した時点で、その間に投入された item をまとめて
+  handler(key, items) を1回呼ぶ（ウィンドウは延長しないので遅延は最大でもウィンドウ幅）
+- window_ms=0 なら submit() の中でそのまま handler を呼ぶ（合流なし。以前と同じ同期処理）
+- handler は専用スレッド1本で順に呼ぶ（同じキーの handler が並行して走らない）
+
+使い方:
+    coalescer = Coalescer('rules', 1500, lambda key, items: ...)
+    coalescer.submit('USDJPY', (data, tf))
+    coalescer.flush()       # 保留中のウィンドウを今すぐ処理（テスト・終了時）
+"""
+
+import heapq
+import threading
+import time
+
+
+class Coalescer:
+    """キーごとの合流ウィンドウ"""
+
+    def __init__(self, name, window_ms, handler):
+        self.name = name
+        self.window_seconds = max(0.0, float(window_ms)) / 1000.0
+        self.handler = handler
+        self._cond = threading.Condition()
+        self._pending = {}      # key -> (開いた時刻, [items])
+        self._deadlines = []    # heap of (deadline, seq, key)
+        self._seq = 0
+        self._thread = None
+        self._busy = False
+        self._stats = {
+            'submitted': 0,      # 投入された item 数
+            'batches': 0,        # handler の呼び出し回数
+            'saved': 0,          # 合流で省略した handler 呼び出しの数（処理済み item 数 - batches）
+            'max_batch': 0,
+            'last_batch': 0,
+            'errors': 0,
+            'last_handler_ms': 0.0,
+            'max_delay_ms': 0.0,  # 最初の投入から handler 開始までの最大遅延
+        }
+
+    @property
+    def enabled(self):
+        return self.window_seconds > 0
+
+    def submit(self, key, item):
+        """item を key のウィンドウに投入（新しいウィンドウを開いた場合 True）"""
+        if not self.enabled:
+            with self._cond:
+                self._stats['submitted'] += 1
+            self._run(key, [item], time.monotonic())
+            return True
+        self._ensure_started()
+        with self._cond:
+            self._stats['submitted'] += 1
+            pending = self._pending.get(key)
+            if pending is not None:
+                pending[1].append(item)
+                return False
+            now = time.monotonic()
+            self._pending[key] = (now, [item])
+            self._seq += 1
+            heapq.heappush(self._deadlines, (now + self.window_seconds, self._seq, key))
+            self._cond.notify()
+            return True
+
+    def flush(self, timeout=10):
+        """保留中のウィンドウをすべて今すぐ処理し、handler の完了を待つ"""
+        if not self.enabled:
+            return True
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._deadlines = [(0.0, seq, key) for _, seq, key in self._deadlines]
+            heapq.heapify(self._deadlines)
+            self._cond.notify()
+            while self._deadlines or self._busy:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._cond:
+            if self._thread is None:
+                t = threading.Thread(target=self._loop, daemon=True, name=f'coalescer-{self.name}')
+                t.start()
+                self._thread = t
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._deadlines:
+                        wait = self._deadlines[0][0] - time.monotonic()
+                        if wait <= 0:
+                            break
+                        self._cond.wait(wait)
+                    else:
+                        self._cond.wait()
+                _, _, key = heapq.heappop(self._deadlines)
+                opened_at, items = self._pending.pop(key, (time.monotonic(), []))
+                self._busy = True
+            try:
+                self._run(key, items, opened_at)
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+    def _run(self, key, items, opened_at):
+        if not items:
+            return
+        started = time.monotonic()
+        error = False
+        try:
+            self.handler(key, items)
+        except Exception as e:
+            error = True
+            print(f'[COALESCER] {self.name} handler failed for {key}: {e}')
+        elapsed_ms = (time.monotonic() - started) * 1000.0
+        with self._cond:
+            s = self._stats
+            s['batches'] += 1
+            s['saved'] += len(items) - 1
+            s['max_batch'] = max(s['max_batch'], len(items))
+            s['last_batch'] = len(items)
+            s['last_handler_ms'] = round(elapsed_ms, 3)
+            s['max_delay_ms'] = max(s['max_delay_ms'], round(max(0.0, started - opened_at) * 1000.0, 1))
+            if error:
+                s['errors'] += 1
+
+    def stats(self):
+        with self._cond:
+            s = dict(self._stats)
+            s['pending_keys'] = len(self._pending)
+            s['pending_items'] = sum(len(items) for _, items in self._pending.values())
+        s['window_ms'] = round(self.window_seconds * 1000.0, 1)
+        s['enabled'] = self.enabled
+        return s
@@ -0,0 +1,238 @@
+"""
+comparators.py
+
+ルール条件の比較をコンパイル済みの比較関数で行う
+- 期待値（条件の value）はルール保存時（ルールキャッシュの読み込み時）に1回だけ正規化し、
+  型ごとの比較関数（数値・真偽・列挙コード・文字列・時刻差）にする
+- 実際の値（雲のフィールド値）は状態の更新ごとに1回だけ正規化して Canonical にまとめる
+  （数値化・大文字化を済ませておき、比較関数はスロットを読むだけ）。時刻文字列のミリ秒化はメモ化
+- ichimoku_utils の _normalize_actual / _compare_values / _parse_time_to_ms が参照実装。
+  結果は参照実装と完全に一致させる（python -m bench.equivalence で確認）
+
+使い方:
+    cmp = compile_comparator('==', '▲GC')
+    cmp(canonical_value('gc', cloud.get('gc')))      # _compare_values(_normalize_actual('gc', v), '==', '▲GC') と同じ
+"""
+
+import operator
+from collections import namedtuple
+from datetime import datetime
+
+
+# 比較演算子（これ以外は常に不一致）
+_OPS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '>': operator.gt,
+    '<': operator.lt,
+    '>=': operator.ge,
+    '<=': operator.le,
+}
+
+# 期待値の別名 → 正規化後のコード（_compare_values と同じ表）
+_EXPECTED_ALIASES = {}
+for _alias in ('gc', '▲gc', 'ゴールデンクロス', 'golden', 'goldencross'):
+    _EXPECTED_ALIASES[_alias] = 'GC'
+for _alias in ('dc', '▼dc', 'デッドクロス', 'dead', 'deadcross'):
+    _EXPECTED_ALIASES[_alias] = 'DC'
+for _alias in ('up', '▲', '▲dow', '上', '上昇', 'upward'):
+    _EXPECTED_ALIASES[_alias] = '上昇'
+for _alias in ('down', '▼', '▼dow', '下', '下降', 'downward'):
+    _EXPECTED_ALIASES[_alias] = '下降'
+
+# 実際の値の正規化（_normalize_actual と同じ表）
+_GC_TRUE = frozenset(('true', '1', 'yes', 'y', 'gc', '▲gc'))
+_GC_FALSE = frozenset(('false', '0', 'no', 'n', 'dc', '▼dc'))
+_NUMERIC_FIELDS = frozenset(('distance_from_prev', 'distance_from_price', 'angle', 'thickness'))
+
+# 時刻文字列 → ミリ秒のメモ（同じ時刻文字列は多数の雲・状態で繰り返し現れる）
+_TIME_CACHE_MAX = 8192
+_time_cache = {}
+
+
+# 正規化済みの実際の値
+#   value : _normalize_actual の結果（詳細表示用）
+#   number: float(value)（数値化できない場合 None）
+#   text  : value.strip().upper()（value が文字列でない場合 None）
+Canonical = namedtuple('Canonical', 'value number text')
+
+
+def _normalize(field, val):
+    if field == 'gc':
+        if isinstance(val, bool):
+            return 'GC' if val else 'DC'
+        s = str(val).strip().lower()
+        if s in _GC_TRUE:
+            return 'GC'
+        if s in _GC_FALSE:
+            return 'DC'
+        return 'GC' if s else 'DC'
+    if field == 'dauten':
+        s = str(val).strip().lower()
+        if '▲' in s or 'up' in s or s == '上' or s == '上昇':
+            return '上昇'
+        if '▼' in s or 'down' in s or s == '下' or s == '下降':
+            return '下降'
+        return s
+    if field in _NUMERIC_FIELDS:
+        try:
+            return float(val)
+        except Exception:
+            return val
+    return val
+
+
+def canonical_value(field, val):
+    """実際の値を正規化（val が None なら None）"""
+    if val is None:
+        return None
+    try:
+        value = _normalize(field, val)
+    except Exception:
+        value = val
+    try:
+        number = float(value)
+    except Exception:
+        number = None
+    text = value.strip().upper() if isinstance(value, str) else None
+    return Canonical(value, number, text)
+
+
+def canonical_from_memo(memo, key, field, val):
+    """memo（状態レコードごとの dict）経由で canonical_value（同じ状態では1回だけ計算）"""
+    if memo is None:
+        return canonical_value(field, val)
+    cached = memo.get(key)
+    if cached is None:
+        cached = (canonical_value(field, val),)
+        memo[key] = cached
+    return cached[0]
+
+
+def time_ms(val):
+    """_parse_time_to_ms と同じ変換（文字列はメモ化）"""
+    if val is None:
+        return None
+    if isinstance(val, (int, float)):
+        try:
+            return int(val)
+        except Exception:  # nan / inf
+            return None
+    if not isinstance(val, str):
+        return _parse_time(val)
+    cached = _time_cache.get(val, _time_cache)
+    if cached is not _time_cache:
+        return cached
+    ms = _parse_time(val)
+    if len(_time_cache) >= _TIME_CACHE_MAX:
+        _time_cache.clear()
+    _time_cache[val] = ms
+    return ms
+
+
+def _parse_time(val):
+    try:
+        s = str(val).strip()
+        if s.isdigit():
+            return int(s)
+        # YY/MM/DD/HH:MM（例: '25/10/31/21:35'）
+        parts = s.split('/')
+        if len(parts) >= 4:
+            yy = int(parts[0]); mm = int(parts[1]); dd = int(parts[2]); timepart = parts[3]
+            if ':' in timepart:
+                hp = timepart.split(':'); hh = int(hp[0]); mi = int(hp[1])
+            else:
+                hh = int(timepart); mi = 0
+            year = 2000 + yy if yy < 100 else yy
+            return int(datetime(year, mm, dd, hh, mi).timestamp() * 1000)
+    except Exception:
+        return None
+    return None
+
+
+def _never(actual):
+    return False
+
+
+def _lookup_op(op):
+    try:
+        return _OPS.get(op)
+    except TypeError:  # dict など（ハッシュ不可）
+        return None
+
+
+def expected_kind(expected):
+    """期待値の型（'number' / 'boolean' / 'enum' / 'string' / 'other'）と比較用の値"""
+    if isinstance(expected, str):
+        lowered = expected.strip().lower()
+        if lowered in ('true', 'false'):
+            return 'boolean', lowered == 'true'
+        code = _EXPECTED_ALIASES.get(lowered)
+        if code is not None:
+            return 'enum', code
+        try:
+            return 'number', float(expected)
+        except Exception:
+            return 'string', expected
+    if isinstance(expected, (int, float)):  # bool を含む
+        return ('boolean' if isinstance(expected, bool) else 'number'), expected
+    return 'other', expected
+
+
+def compile_comparator(op, expected):
+    """_compare_values(actual, op, expected) と同じ判定をする関数（引数は canonical_value の結果）"""
+    fn = _lookup_op(op)
+    if fn is None:
+        return _never
+    kind, target = expected_kind(expected)
+
+    if kind in ('number', 'boolean'):
+        # 参照実装では真偽値も数値として比較される（True == 1.0）ため、boolean も float(actual) で比較
+        def compare_number(actual):
+            if actual is None or actual.number is None:
+                return False
+            try:
+                return fn(actual.number, target)
+            except Exception:
+                return False
+        compare_number.kind = kind
+        return compare_number
+
+    if kind in ('enum', 'string'):
+        upper = target.strip().upper()
+
+        def compare_text(actual):
+            if actual is None:
+                return False
+            try:
+                if actual.text is not None:
+                    return fn(actual.text, upper)
+                return fn(actual.value, target)
+            except Exception:
+                return False
+        compare_text.kind = kind
+        return compare_text
+
+    def compare_other(actual):
+        if actual is None:
+            return False
+        try:
+            return fn(actual.text if actual.text is not None else actual.value, target)
+        except Exception:
+            return False
+    compare_other.kind = kind
+    return compare_other
+
+
+def compile_minutes_comparator(op, minutes):
+    """時刻差（分）の比較関数 f(left_ms, right_ms)。timediff 条件と同じく <= / >= / < / > のみ"""
+    fn = _lookup_op(op) if op in ('<=', '>=', '<', '>') else None
+    if fn is None:
+        return lambda left_ms, right_ms: False
+
+    def compare_minutes(left_ms, right_ms):
+        if left_ms is None or right_ms is None:
+            return False
+        return fn(abs(left_ms - right_ms) / 60000.0, minutes)
+    compare_minutes.kind = 'time'
+    return compare_minutes
@@ -0,0 +1,241 @@
+"""
+condition_matrix.py
+
+全シンボルの最新クラウドを「シンボル × (TFラベル, フィールド)」の特徴行列にまとめ、
+ルール条件を全シンボル一括で評価する（match_all_symbols ルールの横断判定用）
+- 状態ストアのバージョンごとに1回だけ構築（シンボルごとの dict 構築・文字列化を毎ルールで繰り返さない）
+- 列は (TFラベル, フィールド) ごとに必要になった時点で符号化
+    present  : その TF のクラウドがある
+    notnone  : 値が None でない（存在チェック用）
+    code     : str(値) のカテゴリコード（一致判定用）
+    dir      : 方向（+1=上昇 / -1=下降 / 0=なし）。GC/DC・ダウ転・PO・bos_count の符号
+- NumPy があれば配列演算、なければ同じ結果を返すリスト演算で評価
+
+判定内容（以前 _evaluate_rules_with_db_state 内でシンボルごとに行っていたもの）:
+    期待値が空なら値が None でないこと、それ以外は str(値) == str(期待値)。
+    方向は成立した条件の方向がすべて同じときだけ採用する。
+"""
+
+import threading
+
+from state_store import cloud_index, get_state_store
+
+try:
+    import numpy as np
+except ImportError:  # NumPy なしでも動作（リスト演算にフォールバック）
+    np = None
+
+
+def symbol_cloud_map(tf_states):
+    """{tf_label: cloud}（新しいレコードに含まれるクラウドを優先）"""
+    local_clouds = {}
+    for tf_state in tf_states.values():
+        try:
+            # 取り込み時に作成済みの索引（正規化ラベル → 雲）を使う
+            for norm_label, cloud in cloud_index(tf_state).items():
+                if norm_label not in local_clouds:
+                    local_clouds[norm_label] = cloud.copy()
+        except Exception:
+            pass
+    return local_clouds
+
+
+def direction_code(field, value):
+    """フィールド値の方向（+1=上昇 / -1=下降 / 0=なし）"""
+    if value is None:
+        return 0
+    if field == 'dauten':
+        v = str(value)
+        if '上昇' in v or 'up' in v.lower():
+            return 1
+        if '下降' in v or 'down' in v.lower():
+            return -1
+    elif field == 'gc':
+        if value is True or str(value).upper() == 'TRUE' or str(value).startswith('▲'):
+            return 1
+        if value is False or str(value).upper() == 'FALSE' or str(value).startswith('▼'):
+            return -1
+    elif field == 'bos_count':
+        try:
+            n = float(value)
+            return 1 if n > 0 else -1 if n < 0 else 0
+        except Exception:
+            return 0
+    elif field == 'po':
+        v = str(value)
+        if '▲' in v or 'up' in v.lower():
+            return 1
+        if '▼' in v or 'down' in v.lower():
+            return -1
+    return 0
+
+
+def _is_blank(expected):
+    return expected is None or expected == '' or (isinstance(expected, str) and expected.strip() == '')
+
+
+class _Column:
+    __slots__ = ('present', 'notnone', 'code', 'dir', 'vocab')
+
+    def __init__(self, present, notnone, code, direction, vocab):
+        self.present = present
+        self.notnone = notnone
+        self.code = code
+        self.dir = direction
+        self.vocab = vocab
+
+
+class ConditionMatrix:
+    """状態ストアの1バージョン分の特徴行列"""
+
+    def __init__(self, cloud_maps, version=None):
+        self.version = version
+        self.symbols = list(cloud_maps)
+        self._row = {sym: i for i, sym in enumerate(self.symbols)}
+        self._maps = cloud_maps
+        self._columns = {}
+        self._results = {}   # rule_id -> (predicates, {symbol: (matched, direction)})
+        self._lock = threading.Lock()
+
+    def has_symbol(self, symbol):
+        return symbol in self._row
+
+    def cloud_map(self, symbol):
+        """シンボルの {tf_label: cloud}（共有のため読み取り専用）"""
+        return self._maps.get(symbol, {})
+
+    def _column(self, tf_label, field):
+        key = (tf_label, field)
+        col = self._columns.get(key)
+        if col is not None:
+            return col
+        present, notnone, codes, dirs = [], [], [], []
+        vocab = {}
+        for sym in self.symbols:
+            cloud = self._maps[sym].get(tf_label)
+            if cloud is None:
+                present.append(False)
+                notnone.append(False)
+                codes.append(-1)
+                dirs.append(0)
+                continue
+            value = cloud.get(field)
+            present.append(True)
+            notnone.append(value is not None)
+            codes.append(vocab.setdefault(str(value), len(vocab)))
+            dirs.append(direction_code(field, value))
+        if np is not None:
+            col = _Column(np.array(present, dtype=bool), np.array(notnone, dtype=bool),
+                          np.array(codes, dtype=np.int32), np.array(dirs, dtype=np.int8), vocab)
+        else:
+            col = _Column(present, notnone, codes, dirs, vocab)
+        self._columns[key] = col
+        return col
+
+    def evaluate(self, predicates):
+        """条件（AND）を全シンボルで評価 → (matched, dirs)。dirs は +1/-1/0（方向が混在・なしは 0）"""
+        n = len(self.symbols)
+        if np is not None:
+            matched = np.ones(n, dtype=bool)
+            up = np.zeros(n, dtype=bool)
+            down = np.zeros(n, dtype=bool)
+            for pred in predicates:
+                col = self._column(pred.tf_label, pred.field)
+                if _is_blank(pred.value):
+                    ok = col.present & col.notnone
+                else:
+                    ok = col.present & (col.code == col.vocab.get(str(pred.value), -2))
+                matched &= ok
+                up |= ok & (col.dir > 0)
+                down |= ok & (col.dir < 0)
+            dirs = np.where(up & ~down, 1, np.where(down & ~up, -1, 0)).astype(np.int8)
+            return matched, dirs
+        matched = [True] * n
+        up = [False] * n
+        down = [False] * n
+        for pred in predicates:
+            col = self._column(pred.tf_label, pred.field)
+            if _is_blank(pred.value):
+                ok = [p and nn for p, nn in zip(col.present, col.notnone)]
+            else:
+                target = col.vocab.get(str(pred.value), -2)
+                ok = [p and c == target for p, c in zip(col.present, col.code)]
+            for i in range(n):
+                if ok[i]:
+                    up[i] = up[i] or col.dir[i] > 0
+                    down[i] = down[i] or col.dir[i] < 0
+                else:
+                    matched[i] = False
+        dirs = [1 if u and not d else -1 if d and not u else 0 for u, d in zip(up, down)]
+        return matched, dirs
+
+    def evaluate_rule(self, compiled):
+        """コンパイル済みルールを評価 → {symbol: (matched, direction)}（direction は '上昇'/'下降'/None）
+
+        同じバージョン内では結果を使い回す（match_all_symbols ルールは対象シンボル数だけ呼ばれる）。
+        """
+        with self._lock:
+            cached = self._results.get(compiled.id)
+            if cached is not None and cached[0] is compiled.predicates:
+                return cached[1]
+            matched, dirs = self.evaluate(compiled.predicates)
+            names = {1: '上昇', -1: '下降', 0: None}
+            result = {sym: (bool(matched[i]), names[int(dirs[i])]) for sym, i in self._row.items()}
+            self._results[compiled.id] = (compiled.predicates, result)
+        return result
+
+
+class _MatrixCache:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._matrix = None
+        self._stats = {'builds': 0, 'hits': 0}
+
+    def get(self):
+        store = get_state_store(self.db_path)
+        version = store.version
+        with self._lock:
+            if self._matrix is not None and self._matrix.version == version:
+                self._stats['hits'] += 1
+                return self._matrix
+            # 構築中にバージョンが進んでも、構築開始時点のバージョンとして保持する
+            maps = {}
+            for sym in store.symbols():
+                tf_states = store.tf_states(sym)
+                if tf_states:
+                    maps[sym] = symbol_cloud_map(tf_states)
+            self._matrix = ConditionMatrix(maps, version)
+            self._stats['builds'] += 1
+            return self._matrix
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s['symbols'] = len(self._matrix.symbols) if self._matrix is not None else 0
+        s['numpy'] = np is not None
+        return s
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def _get_cache(db_path):
+    cache = _caches.get(db_path)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(db_path)
+            if cache is None:
+                cache = _MatrixCache(db_path)
+                _caches[db_path] = cache
+    return cache
+
+
+def get_condition_matrix(db_path):
+    """状態ストアの現在バージョンの特徴行列"""
+    return _get_cache(db_path).get()
+
+
+def condition_matrix_stats(db_path):
+    return _get_cache(db_path).stats()
@@ -0,0 +1,512 @@
+"""
+currency_strength.py
+
+通貨強弱（時間足ごとの通貨スコア）の差分更新エンジン
+- 状態ストアの変更ジャーナル（changes_since）から差し替えられた (symbol, tf) だけを取り出し、
+  そのペア・時間足の trend_pct の寄与を差し替える（全行の再走査・時間足ごとのループをしない）
+- (時間足, 通貨) ごとに合計と寄与しているペアを保持する。合計は Fraction で持つので、
+  差分の足し引きを何度繰り返しても誤差が溜まらない
+- 並び・内訳は変更のあった時間足・通貨だけ作り直し、Av 行は各時間足の結果から O(通貨数) で作り直す
+- compute_full(rows) が全件再計算（参照実装）。ペア × 通貨の接続行列（左の通貨 +1 / 右の通貨 -1）と
+  ペア × 時間足の trend_pct 行列の積で全時間足を一度に計算する（NumPy がなければ逐次加算）。
+  verify() で差分更新の結果と突き合わせ、不一致なら全件で作り直す
+
+スコアの決め方:
+    時間足ごとに、ペアのレコードから表示TFのラベルの雲（なければ trend_pct を持つ先頭の雲）の trend_pct を取り、
+    trend_pct > 0 なら左の通貨に +、右の通貨に -（< 0 なら逆）。0 / なしは寄与しない。
+    ペアの重み（CURRENCY_PAIR_WEIGHTS。既定 1）を掛けてから足す。
+    Av は各時間足の整数スコアの加重平均（CURRENCY_TF_WEIGHTS。既定はすべて 1 = 単純平均）
+
+通貨ペアの範囲:
+    states にあるシンボルのうち、名前の先頭6文字が CURRENCY_CODES の2通貨の組になっているもの
+    （'USDJPY' / 'OANDA:XAUUSD' / 'EURUSD.a' など）。CURRENCY_PAIRS で個別に上書き・除外できる
+
+使い方:
+    engine = get_currency_strength_engine(DB_PATH)
+    result = engine.snapshot()     # {'5m': {...}, ..., 'D': {...}, 'Av': {...}}（読み取り専用として扱う）
+    engine.verify()                # 全件再計算との差分（なければ []）
+"""
+
+import json
+import os
+import threading
+import time
+from fractions import Fraction
+
+from server_logging import get_logger
+from state_store import get_state_store
+
+try:
+    import numpy as np
+except ImportError:  # NumPy なしでも動作（逐次加算にフォールバック）
+    np = None
+
+_log = get_logger('currency')
+
+
+def _json_env(name):
+    """JSON オブジェクトの環境変数（未設定・不正なら {}）"""
+    raw = os.getenv(name, '').strip()
+    if not raw:
+        return {}
+    try:
+        value = json.loads(raw)
+        if not isinstance(value, dict):
+            raise ValueError('JSON object expected')
+        return value
+    except Exception as e:
+        print(f'[CURRENCY_STRENGTH] Ignoring {name}: {e}')
+        return {}
+
+
+# ============================================================
+# 【設定】環境変数で上書き可能
+# ============================================================
+# 通貨ペアとして扱う通貨コード（メジャー8通貨 + 金・銀）
+CURRENCY_CODES = frozenset(
+    c.strip().upper() for c in os.getenv('CURRENCY_CODES', 'USD,EUR,JPY,GBP,AUD,NZD,CAD,CHF,XAU,XAG').split(',')
+    if c.strip())
+# シンボルごとの上書き（例: {"GOLD": ["XAU", "USD"], "USDJPY.old": null}。null は対象外）
+# 左の通貨が強い=上昇、右の通貨が強い=下降
+CURRENCY_PAIRS = _json_env('CURRENCY_PAIRS')
+# ペアの重み（流動性など。例: {"EURUSD": 1.5, "GBPAUD": 0.5}。未指定は 1）
+CURRENCY_PAIR_WEIGHTS = _json_env('CURRENCY_PAIR_WEIGHTS')
+# Av の時間足の重み（例: {"5m": 0.5, "D": 2}。未指定は 1）
+CURRENCY_TF_WEIGHTS = _json_env('CURRENCY_TF_WEIGHTS')
+
+# 表示する時間足と、データベースの実際の tf 値
+TIMEFRAMES = ('5m', '15m', '1H', '4H', 'D')
+TF_VARIANTS = {
+    '5m': ['5'],
+    '15m': ['15', '15M'],
+    '1H': ['60', '1H'],
+    '4H': ['240', '4H'],
+    'D': ['D', '1440']
+}
+# DB の tf 値 → 表示時間足
+_DISPLAY_TF = {variant: tf_display for tf_display, variants in TF_VARIANTS.items() for variant in variants}
+_TF_INDEX = {tf_display: i for i, tf_display in enumerate(TIMEFRAMES)}
+
+
+def resolve_pair(symbol, overrides=None, codes=None):
+    """シンボル → (左の通貨, 右の通貨)（通貨ペアでなければ None）"""
+    overrides = CURRENCY_PAIRS if overrides is None else overrides
+    codes = CURRENCY_CODES if codes is None else codes
+    if symbol in overrides:
+        pair = overrides[symbol]
+        try:
+            base, quote = (str(pair[0]).upper(), str(pair[1]).upper()) if pair else (None, None)
+        except Exception:
+            return None
+        return (base, quote) if base and quote and base != quote else None
+    if not isinstance(symbol, str):
+        return None
+    # 取引所プレフィックス（'OANDA:'）を外し、6文字の後ろが英数字なら別銘柄（'EURUSDT' など）
+    name = symbol.rsplit(':', 1)[-1].upper()
+    if len(name) < 6 or (len(name) > 6 and name[6].isalnum()):
+        return None
+    base, quote = name[:3], name[3:6]
+    if base == quote or base not in codes or quote not in codes:
+        return None
+    return base, quote
+
+
+def _weight(weights, key):
+    """重み（未指定・不正なら 1。1 のままなら int なので trend_pct の型は変わらない）"""
+    w = weights.get(key, 1)
+    return w if isinstance(w, (int, float)) and not isinstance(w, bool) else 1
+
+
+def pair_trend_pct(rec, tf_display):
+    """ペアのレコードの tf_display での trend_pct（寄与しない場合 None）
+
+    clouds_json には複数 TF のクラウドが含まれる（例: label='15','60','240'）。
+    tf_display に一致するラベルのクラウドを優先し、なければ trend_pct を持つ先頭クラウドを使う。
+    """
+    if not rec.get('row_order') or not rec.get('clouds_json'):
+        return None
+    primary_cloud = rec['cloud_index'].get(tf_display)
+    if primary_cloud is not None and primary_cloud.get('trend_pct') is None:
+        primary_cloud = None
+    if primary_cloud is None:
+        primary_cloud = next((c for c in rec['clouds'] if c.get('trend_pct') is not None), None)
+    if primary_cloud is None:
+        return None
+    raw_pct = primary_cloud.get('trend_pct', 0)
+    if raw_pct is None or raw_pct == 0:
+        return None
+    return raw_pct
+
+
+def _breakdown_item(symbol, raw_pct, side, value=None):
+    """内訳の1行（side: 0=左の通貨 / 1=右の通貨、value: 重みを掛けた寄与）"""
+    value = raw_pct if value is None else value
+    if raw_pct > 0:
+        return f'{symbol} 上昇{raw_pct}点 ({"+" if side == 0 else "-"}{value})'
+    return f'{symbol} 下降{abs(raw_pct)}点 ({"-" if side == 0 else "+"}{abs(value)})'
+
+
+def _tf_entry(sorted_scores, currency_scores, currency_breakdown):
+    # %表示を追加（±100点=±100%）
+    currencies_with_percent = []
+    for currency, score in sorted_scores:
+        currencies_with_percent.append({
+            'currency': currency,
+            'score': int(score),
+            'percentage': int((score / 100.0) * 100)
+        })
+    return {
+        'currencies': currencies_with_percent,
+        'raw_scores': currency_scores,
+        'breakdown': currency_breakdown
+    }
+
+
+def _average_entry(result, tf_weights=None):
+    """Av 行（各時間足の整数スコアの加重平均）"""
+    tf_weights = CURRENCY_TF_WEIGHTS if tf_weights is None else tf_weights
+    avg_scores = {}
+    total_weight = 0
+    for tf_display in TIMEFRAMES:
+        if tf_display not in result:
+            continue
+        w = _weight(tf_weights, tf_display)
+        total_weight += w
+        for item in result[tf_display]['currencies']:
+            currency = item['currency']
+            avg_scores[currency] = avg_scores.get(currency, 0) + w * item['score']
+
+    # 重みの合計で割る（既定は時間足数）
+    if total_weight > 0:
+        for currency in avg_scores:
+            avg_scores[currency] = avg_scores[currency] / total_weight
+
+    # 平均にも%表示を追加
+    avg_with_percent = []
+    for currency, score in sorted(avg_scores.items(), key=lambda x: x[1]):
+        avg_with_percent.append({
+            'currency': currency,
+            'score': int(score),
+            'percentage': int((score / 400.0) * 100)
+        })
+    return {
+        'currencies': avg_with_percent,
+        'raw_scores': avg_scores
+    }
+
+
+def _row_contributions(rows, overrides=None, pair_weights=None):
+    """寄与するレコードの [(tf_display, symbol, base, quote, trend_pct, 重み付きの値)]（rows の順）"""
+    pair_weights = CURRENCY_PAIR_WEIGHTS if pair_weights is None else pair_weights
+    items = []
+    for rec in rows:
+        tf_display = _DISPLAY_TF.get(rec['tf'])
+        symbol = rec['symbol']
+        pair = resolve_pair(symbol, overrides) if tf_display is not None else None
+        if pair is None:
+            continue
+        try:
+            raw_pct = pair_trend_pct(rec, tf_display)
+            if raw_pct is None:
+                continue
+            if not isinstance(raw_pct, (int, float)):
+                raise TypeError(f'trend_pct is {type(raw_pct).__name__}')
+            value = _weight(pair_weights, symbol) * raw_pct
+            Fraction(value)  # NaN / inf は合計できない
+        except Exception as e:
+            _log.warning(f'[CURRENCY_STRENGTH] Error calculating {symbol} {rec["tf"]}: {e}')
+            continue
+        items.append((tf_display, symbol, pair[0], pair[1], raw_pct, value))
+    return items
+
+
+def compute_full(rows, overrides=None, pair_weights=None, tf_weights=None, use_numpy=True):
+    """全レコードからの再計算（参照実装。rows は状態ストアのレコード、書き込み順）
+
+    スコア = 接続行列 A（レコード × 通貨。左の通貨 +1 / 右の通貨 -1）の転置 × V（レコード × 時間足の寄与）
+    """
+    items = _row_contributions(rows, overrides, pair_weights)
+
+    # 時間足ごとの通貨の初出順（同点時の並び）・内訳・float の寄与の有無
+    touched = {tf_display: {} for tf_display in TIMEFRAMES}
+    breakdown = {tf_display: {} for tf_display in TIMEFRAMES}
+    for tf_display, symbol, base, quote, raw_pct, value in items:
+        for currency, side in ((base, 0), (quote, 1)):
+            touched[tf_display][currency] = touched[tf_display].get(currency, False) or isinstance(value, float)
+            breakdown[tf_display].setdefault(currency, []).append(_breakdown_item(symbol, raw_pct, side, value))
+
+    if np is not None and use_numpy and items:
+        currencies = sorted({c for tf_touched in touched.values() for c in tf_touched})
+        index = {c: i for i, c in enumerate(currencies)}
+        incidence = np.zeros((len(items), len(currencies)))
+        values = np.zeros((len(items), len(TIMEFRAMES)))
+        for r, (tf_display, _, base, quote, _, value) in enumerate(items):
+            incidence[r, index[base]] = 1.0
+            incidence[r, index[quote]] = -1.0
+            values[r, _TF_INDEX[tf_display]] = value
+        matrix = incidence.T @ values  # 通貨 × 時間足
+
+        def total(tf_display, currency):
+            return matrix[index[currency], _TF_INDEX[tf_display]]
+    else:
+        sums = {}
+        for tf_display, _, base, quote, _, value in items:
+            sums[(tf_display, base)] = sums.get((tf_display, base), 0) + value
+            sums[(tf_display, quote)] = sums.get((tf_display, quote), 0) - value
+
+        def total(tf_display, currency):
+            return sums[(tf_display, currency)]
+
+    result = {}
+    for tf_display in TIMEFRAMES:
+        # 整数の寄与だけなら int（行列は float64 だが、この範囲の整数の和は正確）
+        currency_scores = {c: float(total(tf_display, c)) if has_float else int(total(tf_display, c))
+                           for c, has_float in touched[tf_display].items()}
+        # スコアでソート（昇順）
+        sorted_scores = sorted(currency_scores.items(), key=lambda x: x[1])
+        result[tf_display] = _tf_entry(sorted_scores, currency_scores, breakdown[tf_display])
+
+    result['Av'] = _average_entry(result, tf_weights)
+    return result
+
+
+def compare_results(a, b, tolerance=1e-6):
+    """2つの結果の違い（なければ []）。raw_scores は tolerance 以内、並びは同点（差が tolerance 以内）を区別しない"""
+    mismatches = []
+    for tf_display in TIMEFRAMES + ('Av',):
+        ea, eb = a[tf_display], b[tf_display]
+        ra, rb = ea['raw_scores'], eb['raw_scores']
+        if set(ra) != set(rb):
+            mismatches.append(f'{tf_display}: currencies {sorted(ra)} != {sorted(rb)}')
+            continue
+        if any(abs(ra[c] - rb[c]) > tolerance for c in ra):
+            mismatches.append(f'{tf_display}: raw_scores {ra} != {rb}')
+            continue
+        # a の並びを b のスコアで見ても昇順であること
+        order = [rb[item['currency']] for item in ea['currencies']]
+        if any(x - y > tolerance for x, y in zip(order, order[1:])):
+            mismatches.append(f'{tf_display}: order {[i["currency"] for i in ea["currencies"]]} != '
+                              f'{[i["currency"] for i in eb["currencies"]]}')
+        if ea.get('breakdown') != eb.get('breakdown'):
+            mismatches.append(f'{tf_display}: breakdown differs')
+    return mismatches
+
+
+class CurrencyStrengthEngine:
+    """DBファイル1つ分の通貨強弱（状態ストアの変更を差分で反映）"""
+
+    def __init__(self, db_path, overrides=None, pair_weights=None, tf_weights=None):
+        self.db_path = db_path
+        self.overrides = CURRENCY_PAIRS if overrides is None else overrides
+        self.pair_weights = CURRENCY_PAIR_WEIGHTS if pair_weights is None else pair_weights
+        self.tf_weights = CURRENCY_TF_WEIGHTS if tf_weights is None else tf_weights
+        self._pairs = {}        # symbol -> (base, quote) / None（resolve_pair のメモ）
+        self._lock = threading.RLock()
+        self._version = None    # 反映済みの状態ストアのバージョン（None = 未構築）
+        self._reset()
+        self._stats = {
+            'updates': 0,           # snapshot() で差分を反映した回数
+            'full_rebuilds': 0,
+            'pairs_applied': 0,     # 寄与が変わったペア・時間足の数
+            'last_update_ms': 0.0,
+            'verifications': 0,
+            'verify_mismatches': 0,
+        }
+
+    def _reset(self):
+        # 時間足ごと:
+        #   contrib  : (symbol, tf) -> (seq, trend_pct, 重み付きの値)（書き込み順）
+        #   totals   : 通貨 -> Fraction（寄与の合計）
+        #   floats   : 通貨 -> float の寄与の数（0 なら合計を int で出す。全件再計算の int + int と同じ）
+        #   members  : 通貨 -> {(symbol, tf): side}（寄与しているペア。書き込み順）
+        #   breakdown: 通貨 -> 内訳の list
+        self._contrib = {tf: {} for tf in TIMEFRAMES}
+        self._totals = {tf: {} for tf in TIMEFRAMES}
+        self._floats = {tf: {} for tf in TIMEFRAMES}
+        self._members = {tf: {} for tf in TIMEFRAMES}
+        self._breakdown = {tf: {} for tf in TIMEFRAMES}
+        self._entries = {}
+        self._dirty = set(TIMEFRAMES)
+        self._average = None
+
+    # ------------------------------------------------------------
+    # 差分の反映
+    # ------------------------------------------------------------
+    def _pair(self, symbol):
+        pair = self._pairs.get(symbol, self._pairs)
+        if pair is self._pairs:
+            pair = resolve_pair(symbol, self.overrides)
+            self._pairs[symbol] = pair
+        return pair
+
+    def _contribution(self, key, rec, tf_display):
+        """(seq, trend_pct, 重み付きの値) またはなし"""
+        if rec is None:
+            return None
+        try:
+            raw_pct = pair_trend_pct(rec, tf_display)
+            if raw_pct is None:
+                return None
+            if not isinstance(raw_pct, (int, float)):
+                raise TypeError(f'trend_pct is {type(raw_pct).__name__}')
+            value = _weight(self.pair_weights, key[0]) * raw_pct
+            Fraction(value)  # NaN / inf は合計できない
+            return rec['seq'], raw_pct, value
+        except Exception as e:
+            _log.warning(f'[CURRENCY_STRENGTH] Error calculating {key[0]} {key[1]}: {e}')
+            return None
+
+    def _apply(self, key, rec):
+        """(symbol, tf) の寄与を差し替え（変わった場合 True）"""
+        tf_display = _DISPLAY_TF.get(key[1])
+        pair = self._pair(key[0]) if tf_display is not None else None
+        if pair is None:
+            return False
+        contrib = self._contrib[tf_display]
+        old = contrib.get(key)
+        new = self._contribution(key, rec, tf_display)
+        if old == new:
+            return False
+        base_currency, quote_currency = pair
+        members = self._members[tf_display]
+        if old is not None and new is not None and old[0] == new[0]:
+            # 同じレコードの列だけ更新（書き込み順はそのまま）
+            contrib[key] = new
+            for currency, sign in ((base_currency, 1), (quote_currency, -1)):
+                self._add(tf_display, currency, -sign * old[2], -1)
+                self._add(tf_display, currency, sign * new[2], 1)
+            old = new = None
+        if old is not None:
+            del contrib[key]
+            for currency, sign in ((base_currency, 1), (quote_currency, -1)):
+                self._add(tf_display, currency, -sign * old[2], -1)
+                del members[currency][key]
+                if not members[currency]:
+                    del members[currency]
+                    del self._totals[tf_display][currency]
+                    del self._floats[tf_display][currency]
+        if new is not None:
+            # 再挿入で書き込み順の末尾に移る（全件再計算の行順と同じ）
+            contrib[key] = new
+            for currency, sign, side in ((base_currency, 1, 0), (quote_currency, -1, 1)):
+                self._add(tf_display, currency, sign * new[2], 1)
+                members.setdefault(currency, {})[key] = side
+        breakdown = self._breakdown[tf_display]
+        for currency in (base_currency, quote_currency):
+            breakdown.pop(currency, None)
+        self._dirty.add(tf_display)
+        self._stats['pairs_applied'] += 1
+        return True
+
+    def _add(self, tf_display, currency, value, count):
+        """通貨の合計に value を足す（count: 寄与の増減 +1 / -1）"""
+        totals = self._totals[tf_display]
+        floats = self._floats[tf_display]
+        totals[currency] = totals.get(currency, 0) + Fraction(value)
+        floats[currency] = floats.get(currency, 0) + (count if isinstance(value, float) else 0)
+
+    def _rebuild(self):
+        self._reset()
+        version, _ = get_state_store(self.db_path).changes_since(None)
+        for rec in get_state_store(self.db_path).all_rows():
+            self._apply((rec['symbol'], rec['tf']), rec)
+        self._version = version
+        self._stats['full_rebuilds'] += 1
+
+    def _sync(self):
+        store = get_state_store(self.db_path)
+        version, keys = store.changes_since(self._version)
+        if keys is None:
+            self._rebuild()
+            return
+        records = [(key, store.get(*key)) for key in keys]
+        # 書き込み順（seq）に反映する（寄与の並びを全件再計算の行順と揃える）
+        records.sort(key=lambda item: item[1]['seq'] if item[1] is not None else 0)
+        for key, rec in records:
+            self._apply(key, rec)
+        self._version = version
+
+    # ------------------------------------------------------------
+    # 結果の組み立て
+    # ------------------------------------------------------------
+    def _first_touch(self, tf_display, currency):
+        """通貨が最初に寄与したペアの位置（同点時の並び = 全件再計算で最初に現れた順）"""
+        key, side = next(iter(self._members[tf_display][currency].items()))
+        return self._contrib[tf_display][key][0], side
+
+    def _build_entry(self, tf_display):
+        totals = self._totals[tf_display]
+        members = self._members[tf_display]
+        contrib = self._contrib[tf_display]
+        breakdown = self._breakdown[tf_display]
+        touch_order = sorted(members, key=lambda c: self._first_touch(tf_display, c))
+        floats = self._floats[tf_display]
+        currency_scores = {c: float(totals[c]) if floats[c] else int(totals[c]) for c in touch_order}
+        currency_breakdown = {}
+        for currency in touch_order:
+            items = breakdown.get(currency)
+            if items is None:
+                items = [_breakdown_item(key[0], contrib[key][1], side, contrib[key][2])
+                         for key, side in members[currency].items()]
+                breakdown[currency] = items
+            currency_breakdown[currency] = list(items)
+        sorted_scores = sorted(currency_scores.items(), key=lambda x: x[1])
+        return _tf_entry(sorted_scores, currency_scores, currency_breakdown)
+
+    def snapshot(self):
+        """最新の状態を反映した通貨強弱（全時間足 + Av）"""
+        with self._lock:
+            started = time.perf_counter()
+            self._sync()
+            if self._dirty:
+                for tf_display in TIMEFRAMES:
+                    if tf_display in self._dirty:
+                        self._entries[tf_display] = self._build_entry(tf_display)
+                self._dirty.clear()
+                self._average = _average_entry(self._entries, self.tf_weights)
+            result = {tf_display: self._entries[tf_display] for tf_display in TIMEFRAMES}
+            result['Av'] = self._average
+            self._stats['updates'] += 1
+            self._stats['last_update_ms'] = round((time.perf_counter() - started) * 1000.0, 3)
+            return result
+
+    def verify(self, rebuild=True):
+        """全件再計算との突き合わせ → 不一致の説明の list（一致なら []）。不一致なら全件で作り直す"""
+        with self._lock:
+            current = self.snapshot()
+            full = compute_full(get_state_store(self.db_path).all_rows(),
+                                self.overrides, self.pair_weights, self.tf_weights)
+            mismatches = compare_results(current, full)
+            self._stats['verifications'] += 1
+            if mismatches:
+                self._stats['verify_mismatches'] += 1
+                _log.warning('[CURRENCY_STRENGTH] Incremental result differs from full recompute: %s', mismatches)
+                if rebuild:
+                    self._rebuild()
+            return mismatches
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s['version'] = self._version
+            s['pairs'] = sorted(sym for sym, pair in self._pairs.items() if pair is not None)
+            s['currencies'] = sorted({c for totals in self._totals.values() for c in totals})
+            s['contributions'] = sum(len(c) for c in self._contrib.values())
+        s['numpy'] = np is not None
+        return s
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_currency_strength_engine(db_path):
+    """DBファイルごとの共有エンジンを取得"""
+    engine = _engines.get(db_path)
+    if engine is None:
+        with _engines_lock:
+            engine = _engines.get(db_path)
+            if engine is None:
+                engine = CurrencyStrengthEngine(db_path)
+                _engines[db_path] = engine
+    return engine
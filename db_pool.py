@@ -0,0 +1,212 @@
+"""
+db_pool.py
+
+SQLite 接続管理モジュール（render_server.py / ichimoku_utils.py 共通）
+- 接続をプールして再利用（毎回の connect / close コストを削減）
+- WAL ジャーナル + synchronous / busy_timeout / mmap_size を一括設定
+- 接続ごとのステートメントキャッシュ（cached_statements）で prepared statement を再利用
+- 永続性は SQLITE_SYNCHRONOUS で設定（リクエスト毎の os.fsync は不要）
+
+使い方は sqlite3.connect と同じ:
+    conn = get_connection(DB_PATH)
+    c = conn.cursor()
+    ...
+    conn.commit()
+    conn.close()   # 実際には閉じずにプールへ返却（未コミット分はロールバック）
+"""
+
+import atexit
+import os
+import sqlite3
+import threading
+
+
+# ============================================================
+# 【設定】環境変数で上書き可能
+# ============================================================
+# WAL / DELETE など
+SQLITE_JOURNAL_MODE = os.getenv('SQLITE_JOURNAL_MODE', 'WAL').strip().upper()
+# OFF / NORMAL / FULL / EXTRA（WAL + NORMAL はプロセス停止では失われない。電源断まで守るなら FULL）
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL').strip().upper()
+# ロック待ち時間（ミリ秒）
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+# メモリマップサイズ（バイト）。0 で無効
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', str(64 * 1024 * 1024)))
+# 接続ごとに保持する prepared statement 数
+SQLITE_CACHED_STATEMENTS = int(os.getenv('SQLITE_CACHED_STATEMENTS', '256'))
+# プールに保持するアイドル接続の上限（DBファイルごと）
+SQLITE_POOL_MAX_IDLE = int(os.getenv('SQLITE_POOL_MAX_IDLE', '8'))
+
+_VALID_SYNCHRONOUS = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+if SQLITE_SYNCHRONOUS not in _VALID_SYNCHRONOUS:
+    print(f'[DB_POOL] Invalid SQLITE_SYNCHRONOUS={SQLITE_SYNCHRONOUS}, using NORMAL')
+    SQLITE_SYNCHRONOUS = 'NORMAL'
+
+
+class PooledConnection:
+    """sqlite3.Connection のラッパー（close() でプールへ返却）"""
+
+    __slots__ = ('_conn', '_pool')
+
+    def __init__(self, conn, pool):
+        object.__setattr__(self, '_conn', conn)
+        object.__setattr__(self, '_pool', pool)
+
+    def __getattr__(self, name):
+        conn = object.__getattribute__(self, '_conn')
+        if conn is None:
+            raise sqlite3.ProgrammingError('Cannot operate on a closed database.')
+        return getattr(conn, name)
+
+    def __setattr__(self, name, value):
+        # row_factory などは実接続に設定（返却時にリセットされる）
+        setattr(self._conn, name, value)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._conn.__exit__(exc_type, exc, tb)
+
+    def close(self):
+        """プールへ返却（二重 close は無視）"""
+        conn = object.__getattribute__(self, '_conn')
+        if conn is None:
+            return
+        object.__setattr__(self, '_conn', None)
+        self._pool._release(conn)
+
+    def __del__(self):
+        # close し忘れた接続も GC 時にプールへ戻す（sqlite3 の GC クローズと同じ扱い）
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """DBファイル1つ分の接続プール"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._idle = []
+        self._lock = threading.Lock()
+        self._journal_checked = False
+        self.created = 0
+        self.reused = 0
+
+    def _open(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=SQLITE_BUSY_TIMEOUT_MS / 1000.0,
+            check_same_thread=False,
+            cached_statements=SQLITE_CACHED_STATEMENTS,
+        )
+        c = conn.cursor()
+        if not self._journal_checked:
+            # journal_mode は DB ファイルに永続化されるため初回のみ設定
+            try:
+                mode = c.execute(f'PRAGMA journal_mode={SQLITE_JOURNAL_MODE}').fetchone()
+                print(f'[DB_POOL] {os.path.basename(self.db_path)} journal_mode={mode[0] if mode else "?"} synchronous={SQLITE_SYNCHRONOUS}')
+            except sqlite3.OperationalError as e:
+                print(f'[DB_POOL] journal_mode change failed: {e}')
+            self._journal_checked = True
+        c.execute(f'PRAGMA synchronous={SQLITE_SYNCHRONOUS}')
+        c.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+        if SQLITE_MMAP_SIZE > 0:
+            c.execute(f'PRAGMA mmap_size={SQLITE_MMAP_SIZE}')
+        c.close()
+        self.created += 1
+        return conn
+
+    def acquire(self):
+        with self._lock:
+            if self._idle:
+                self.reused += 1
+                return PooledConnection(self._idle.pop(), self)
+        return PooledConnection(self._open(), self)
+
+    def _release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = None
+        except sqlite3.Error:
+            # 壊れた接続は捨てる
+            try:
+                conn.close()
+            except Exception:
+                pass
+            return
+        with self._lock:
+            if len(self._idle) < SQLITE_POOL_MAX_IDLE:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close_all(self):
+        """アイドル接続を全てクローズ（終了時に PRAGMA optimize を実行）"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for i, conn in enumerate(idle):
+            try:
+                if i == 0:
+                    conn.execute('PRAGMA optimize')
+                conn.close()
+            except Exception:
+                pass
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _get_pool(db_path):
+    key = os.path.abspath(db_path)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(key)
+                _pools[key] = pool
+    return pool
+
+
+def get_connection(db_path):
+    """プールから接続を取得（sqlite3.connect(db_path) の置き換え）"""
+    return _get_pool(db_path).acquire()
+
+
+def checkpoint(db_path, mode='TRUNCATE'):
+    """WAL の内容を本体DBファイルに反映（ファイルコピー・ダウンロード前に呼ぶ）"""
+    conn = get_connection(db_path)
+    try:
+        return conn.execute(f'PRAGMA wal_checkpoint({mode})').fetchone()
+    except sqlite3.Error as e:
+        print(f'[DB_POOL] checkpoint failed: {e}')
+        return None
+    finally:
+        conn.close()
+
+
+def pool_stats():
+    """プールの統計（診断用）"""
+    return {
+        os.path.basename(path): {
+            'idle': len(pool._idle),
+            'created': pool.created,
+            'reused': pool.reused,
+        }
+        for path, pool in list(_pools.items())
+    }
+
+
+def close_all():
+    """全プールをクローズ"""
+    for pool in list(_pools.values()):
+        pool.close_all()
+
+
+atexit.register(close_all)
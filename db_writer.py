@@ -0,0 +1,222 @@
+"""
+db_writer.py
+
+SQLite グループコミット書き込みスレッド
+- 複数リクエストからの INSERT / UPDATE を1トランザクションにまとめてコミット
+- 数ミリ秒ごと、または N 件たまった時点でコミット（バースト時の fsync を1回に集約）
+- submit() は Future を返す（書き込み完了を待つ場合は .result()）
+- submit_group() は複数の文を1件として投入（全部成功するか、全部巻き戻るか）
+- flush() でそれまでに投入した書き込みのコミット完了を待つ
+
+使い方:
+    writer = get_writer(DB_PATH)
+    writer.submit('UPDATE ...', params)             # 投げっぱなし
+    writer.submit('INSERT ...', params).result()    # コミット完了まで待つ
+    writer.submit_group([('INSERT ...', rows, True), ('INSERT OR REPLACE ...', rows2, True)])
+    writer.flush()
+"""
+
+import atexit
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from db_pool import get_connection
+
+
+# ============================================================
+# 【設定】環境変数で上書き可能
+# ============================================================
+# 最初の書き込みを受けてからコミットするまでの最大待ち時間（ミリ秒）
+DB_WRITER_BATCH_MS = float(os.getenv('DB_WRITER_BATCH_MS', '5'))
+# 1トランザクションに含める最大件数
+DB_WRITER_MAX_BATCH = max(1, int(os.getenv('DB_WRITER_MAX_BATCH', '200')))
+
+
+class _WriteOp:
+    """書き込み1件（sql=None はフラッシュ用マーカー。group は同じ SAVEPOINT で実行する文のリスト）"""
+
+    __slots__ = ('sql', 'params', 'many', 'group', 'future')
+
+    def __init__(self, sql, params, many, group=None):
+        self.sql = sql
+        self.params = params
+        self.many = many
+        self.group = group
+        self.future = Future()
+
+
+class GroupCommitWriter:
+    """DBファイル1つ分の書き込み専用スレッド"""
+
+    def __init__(self, db_path, batch_ms=DB_WRITER_BATCH_MS, max_batch=DB_WRITER_MAX_BATCH):
+        self.db_path = db_path
+        self.batch_seconds = max(0.0, batch_ms) / 1000.0
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'submitted': 0,
+            'committed': 0,
+            'failed': 0,
+            'batches': 0,
+            'max_batch_size': 0,
+            'last_commit_ms': 0.0,
+        }
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                t = threading.Thread(target=self._run, daemon=True, name='db-writer')
+                t.start()
+                self._thread = t
+
+    def submit(self, sql, params=(), many=False):
+        """書き込みを投入して Future を返す（結果は rowcount）"""
+        self._ensure_started()
+        op = _WriteOp(sql, params, many)
+        with self._stats_lock:
+            self._stats['submitted'] += 1
+        self._queue.put(op)
+        return op.future
+
+    def submit_group(self, statements):
+        """複数の文 [(sql, params, many), ...] を1件として投入（結果は rowcount の合計）"""
+        statements = [(sql, params, many) for sql, params, many in statements]
+        if not statements:
+            raise ValueError('submit_group() requires at least one statement')
+        self._ensure_started()
+        op = _WriteOp(statements[0][0], None, False, group=statements)
+        with self._stats_lock:
+            self._stats['submitted'] += 1
+        self._queue.put(op)
+        return op.future
+
+    def flush(self, timeout=None):
+        """これまでに投入した書き込みがコミットされるまで待つ"""
+        self._ensure_started()
+        op = _WriteOp(None, None, False)
+        self._queue.put(op)
+        return op.future.result(timeout)
+
+    def pending(self):
+        """未処理の書き込み件数"""
+        return self._queue.qsize()
+
+    def stats(self):
+        with self._stats_lock:
+            s = dict(self._stats)
+        s['pending'] = self.pending()
+        return s
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.batch_seconds
+            # フラッシュ要求が来たら待たずにコミット
+            while len(batch) < self.max_batch and batch[-1].sql is not None:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining <= 0:
+                        batch.append(self._queue.get_nowait())
+                    else:
+                        batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._commit(batch)
+
+    def _commit(self, batch):
+        started = time.perf_counter()
+        results = []
+        failed = 0
+        conn = None
+        try:
+            conn = get_connection(self.db_path)
+            conn.execute('BEGIN IMMEDIATE')
+            for op in batch:
+                if op.sql is None:
+                    results.append((op, None))
+                    continue
+                # 1件の失敗でバッチ全体が巻き戻らないよう SAVEPOINT で囲む
+                conn.execute('SAVEPOINT group_write')
+                try:
+                    rowcount = 0
+                    for sql, params, many in (op.group or ((op.sql, op.params, op.many),)):
+                        cur = conn.executemany(sql, params) if many else conn.execute(sql, params)
+                        rowcount += cur.rowcount
+                    conn.execute('RELEASE SAVEPOINT group_write')
+                    results.append((op, rowcount))
+                except Exception as e:
+                    conn.execute('ROLLBACK TO SAVEPOINT group_write')
+                    conn.execute('RELEASE SAVEPOINT group_write')
+                    print(f'[DB_WRITER] Write failed: {e} | {" ".join(op.sql.split()[:4])}')
+                    op.future.set_exception(e)
+                    failed += 1
+            conn.commit()
+        except Exception as e:
+            # コミット自体の失敗は未確定の全件に通知
+            print(f'[DB_WRITER] Batch commit failed ({len(batch)} ops): {e}')
+            for op, _ in results:
+                if not op.future.done():
+                    op.future.set_exception(e)
+            for op in batch:
+                if not op.future.done():
+                    op.future.set_exception(e)
+            with self._stats_lock:
+                self._stats['failed'] += len(batch)
+            return
+        finally:
+            if conn is not None:
+                conn.close()
+
+        for op, rowcount in results:
+            op.future.set_result(rowcount)
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
+        writes = sum(1 for op in batch if op.sql is not None)
+        with self._stats_lock:
+            self._stats['committed'] += writes - failed
+            self._stats['failed'] += failed
+            if writes:
+                self._stats['batches'] += 1
+                self._stats['max_batch_size'] = max(self._stats['max_batch_size'], writes)
+            self._stats['last_commit_ms'] = round(elapsed_ms, 2)
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(db_path):
+    """DBファイルごとの共有ライターを取得"""
+    key = os.path.abspath(db_path)
+    writer = _writers.get(key)
+    if writer is None:
+        with _writers_lock:
+            writer = _writers.get(key)
+            if writer is None:
+                writer = GroupCommitWriter(key)
+                _writers[key] = writer
+    return writer
+
+
+def writer_stats():
+    """全ライターの統計（診断用）"""
+    return {os.path.basename(path): w.stats() for path, w in list(_writers.items())}
+
+
+def _flush_all():
+    for w in list(_writers.values()):
+        if w._thread is not None and w._thread.is_alive():
+            try:
+                w.flush(timeout=5)
+            except Exception:
+                pass
+
+
+atexit.register(_flush_all)
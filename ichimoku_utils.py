@@ -5,12 +5,14 @@ ichimoku_utils.py
 render_server.py から分離して保守性を向上
 """
 
-import sqlite3
 import os
 import pytz
 import json
 from datetime import datetime
 
+from db_pool import get_connection
+from state_store import CloudIndex, cloud_index
+
 
 # データベースパス（render_server.py と同じ）
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -158,7 +160,7 @@ def is_fx_market_open():
     """
     try:
         # 最後の受信時刻を取得
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection(DB_PATH)
         c = conn.cursor()
         c.execute('SELECT last_receive_time FROM market_status WHERE id = 1')
         row = c.fetchone()
@@ -201,59 +203,14 @@ def _get_nth_weekday(year, month, weekday, n):
 # ========== ルール評価ヘルパー関数 ==========
 
 def _find_cloud_field(state, label, field):
-    """雲データから指定フィールドを検索"""
-    try:
-        clouds = state.get('clouds', [])
-        # helper: normalize label to minutes if possible
-        def _tf_to_minutes(s):
-            try:
-                if s is None:
-                    return None
-                ss = str(s).strip().lower()
-                if ss.isdigit():
-                    return int(ss)
-                # endswith m (minutes)
-                if ss.endswith('m'):
-                    return int(ss[:-1])
-                # endswith h (hours)
-                if ss.endswith('h'):
-                    return int(ss[:-1]) * 60
-                # contains 'min'
-                if 'min' in ss:
-                    num = ''.join([c for c in ss if c.isdigit()])
-                    return int(num) if num else None
-                # fallback: try to parse digits
-                digits = ''.join([c for c in ss if c.isdigit()])
-                if digits:
-                    return int(digits)
-            except Exception:
-                return None
-            return None
+    """雲データから指定フィールドを検索（ラベルは '60' / '1H' どちらの形式でも可）
 
-        req_min = _tf_to_minutes(label)
-        for c in clouds:
-            c_label = c.get('label')
-            # exact match first
-            if str(c_label) == str(label):
-                val = c.get(field)
-                # Special handling: if field is 'gc' and not present in cloud object,
-                # default to False (DC) to match frontend display behavior
-                if field == 'gc' and val is None and field not in c:
-                    return False  # Default to False/DC when gc field is missing
-                return val
-            # try normalized minutes match
-            try:
-                cmin = _tf_to_minutes(c_label)
-                if req_min is not None and cmin is not None and req_min == cmin:
-                    val = c.get(field)
-                    if field == 'gc' and val is None and field not in c:
-                        return False  # Default to False/DC when gc field is missing
-                    return val
-            except Exception:
-                pass
+    状態ストアのレコードは取り込み時に作成済みの CloudIndex で引く（clouds を走査しない）
+    """
+    try:
+        return cloud_index(state).field(label, field)
     except Exception:
-        pass
-    return None
+        return None
 
 
 def _parse_time_to_ms(val):
@@ -400,23 +357,10 @@ def _evaluate_rule_match(rule, cloud_data):
     
     本番の _evaluate_rules_with_db_state と同じロジックを使用
     """
-    # TFラベル正規化マップ（ルール条件の'1H'/'15m'/'4H' ↔ DBの'60'/'15'/'240'）
-    _tf_normalize = {
-        '5m': ['5m', '5'],
-        '15m': ['15m', '15'],
-        '1H': ['1H', '60'],
-        '4H': ['4H', '240'],
-        'D': ['D', '1440'],
-        'W': ['W', '10080'],
-        'M': ['M', '43200'],
-    }
-    # cloud_data のキーがどちらの形式でも引けるようにエイリアスを追加
-    for canonical, aliases in _tf_normalize.items():
-        for alias in aliases:
-            if alias in cloud_data and canonical not in cloud_data:
-                cloud_data[canonical] = cloud_data[alias]
-            if canonical in cloud_data and alias not in cloud_data:
-                cloud_data[alias] = cloud_data[canonical]
+    # cloud_data のキーはルール条件の'1H'/'15m'/'4H'・DBの'60'/'15'/'240' どちらの形式でも可
+    # （状態レコードの CloudIndex を渡せばそのまま使う）
+    if not isinstance(cloud_data, CloudIndex):
+        cloud_data = CloudIndex.from_mapping(cloud_data)
 
     try:
         direction = None
@@ -431,7 +375,7 @@ def _evaluate_rule_match(rule, cloud_data):
                 field = cond.get('field')
                 value = cond.get('value')
                 
-                tf_data = cloud_data.get(tf_label, {})
+                tf_data = cloud_data.cloud(tf_label) or {}
                 found_value = tf_data.get(field)
                 
                 condition_met = False
@@ -0,0 +1,101 @@
+"""
+notification_store.py
+
+発火通知（notifications.json）のインメモリ正本
+- 起動後の初回アクセスで1回だけファイルを読み込み、以降はメモリから返す
+- 追加は評価1回分をまとめて append_many() で行い、ファイルは一時ファイル経由で1回だけ書き換える
+- 最新 max_items 件のみ保持（従来どおり 100 件）
+"""
+
+import json
+import os
+import threading
+from collections import deque
+
+
+NOTIFICATIONS_MAX_ITEMS = 100
+
+
+class NotificationStore:
+    """notifications.json 1ファイル分の通知リスト"""
+
+    def __init__(self, path, max_items=NOTIFICATIONS_MAX_ITEMS):
+        self.path = path
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        self._items = None
+        self._stats = {'appends': 0, 'appended': 0, 'writes': 0, 'write_errors': 0}
+
+    def _ensure_loaded(self):
+        if self._items is not None:
+            return
+        items = []
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    loaded = json.load(f)
+                if isinstance(loaded, list):
+                    items = loaded
+        except Exception as e:
+            print(f'[NOTIFICATIONS] Failed to load {self.path}: {e}')
+        self._items = deque(items, maxlen=self.max_items)
+
+    def _write(self):
+        tmp_path = f'{self.path}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(list(self._items), f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            self._stats['writes'] += 1
+        except Exception as e:
+            self._stats['write_errors'] += 1
+            print(f'[NOTIFICATIONS] Failed to save {self.path}: {e}')
+
+    def append_many(self, items):
+        """通知をまとめて追加（ファイル書き込みは1回）"""
+        if not items:
+            return
+        with self._lock:
+            self._ensure_loaded()
+            self._items.extend(items)
+            self._stats['appends'] += 1
+            self._stats['appended'] += len(items)
+            self._write()
+
+    def append(self, item):
+        self.append_many([item])
+
+    def recent(self, n=50):
+        """最新 n 件（古い順）"""
+        with self._lock:
+            self._ensure_loaded()
+            items = list(self._items)
+        return items[-n:] if n else items
+
+    def clear(self):
+        with self._lock:
+            self._items = deque(maxlen=self.max_items)
+            self._write()
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s['items'] = len(self._items) if self._items is not None else None
+        return s
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_notification_store(path):
+    """ファイルごとの共有ストアを取得"""
+    key = os.path.abspath(path)
+    store = _stores.get(key)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(key)
+            if store is None:
+                store = NotificationStore(key)
+                _stores[key] = store
+    return store
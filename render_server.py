@@ -3,14 +3,39 @@ import os, sqlite3, json, base64, hashlib, shutil
 from datetime import datetime
 import threading
 import time
+import queue
+import zlib
 import pytz
 import requests
 import urllib.request
 import urllib.error
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room, leave_room
 import traceback
 import subprocess
 import re
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# サブシステム別ロガー（webhook_error.log へバックグラウンドで書き込み・ローテーション）
+from server_logging import get_logger, get_levels, set_level, SUBSYSTEMS
+_server_log = get_logger('server')
+_webhook_log = get_logger('webhook')
+_trend_log = get_logger('trend')
+_rules_log = get_logger('rules')
+_inject_log = get_logger('inject')
+_currency_log = get_logger('currency')
+_states_log = get_logger('states')
+_history_log = get_logger('history')
+
+# SQLite 接続プール（WAL / 接続再利用）
+from db_pool import get_connection, checkpoint, pool_stats
+# グループコミット書き込みスレッド（states / market_status 更新を1トランザクションに集約）
+from db_writer import get_writer, writer_stats
+# Webhook 受信ペイロードのジャーナル（webhook_log.txt の置き換え: セグメント化・索引付き・圧縮・保持期間）
+from webhook_journal import get_journal
+# states テーブルのインメモリ正本（パース済み clouds / 正規化TF / バージョン付き、DB へは write-through）
+from state_store import CloudIndex, cloud_index, get_state_store, normalize_tf_label, normalize_trend_tf
 
 # バックアップデータ定数をインポート
 from backup_constants import HOURLY_DATA_BACKUP, FOUR_HOURLY_DATA_BACKUP
@@ -18,14 +43,24 @@ from backup_constants import HOURLY_DATA_BACKUP, FOUR_HOURLY_DATA_BACKUP
 # ビジネスロジック関数をインポート
 from ichimoku_utils import (
     calculate_trend, is_fx_market_open, _get_nth_weekday,
-    _evaluate_rule_match, _find_cloud_field, _parse_time_to_ms,
-    _normalize_actual, _compare_values,
+    _evaluate_rule_match, _find_cloud_field,
     calculate_trend_strength, get_distance_level, get_multi_cloud_bonus,
     apply_decay_correction
 )
 
 # トレンド強度計算v2.0（パターン検出機能付き）をインポート
-from trend_strength_calculator_v2 import calculate_trend_strength_v2
+from trend_strength_calculator_v2 import calculate_trend_strength_cached, calculate_trend_strength_v2, trend_cache_stats
+from rule_cache import compile_condition, get_rule_cache, touched_keys_from_clouds
+from comparators import canonical_from_memo, canonical_value, compile_minutes_comparator, time_ms
+from rule_state import get_rule_state_store
+from rule_effects import EvaluationBatch, evaluation_batch_stats
+from coalescer import Coalescer
+from currency_strength import TIMEFRAMES as CURRENCY_TIMEFRAMES, get_currency_strength_engine
+from strength_broadcast import BREAKDOWN_ROOM as STRENGTH_BREAKDOWN_ROOM, ROOM as STRENGTH_ROOM, StrengthBroadcaster
+from strength_history import ensure_tables as ensure_strength_history_tables, get_strength_history, parse_time
+from change_history import get_change_history_recorder
+from notification_store import get_notification_store
+from condition_matrix import get_condition_matrix, condition_matrix_stats
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -52,17 +87,12 @@ def _get_rule_eval_lock(symbol):
             _RULE_EVAL_LOCKS[symbol] = threading.Lock()
         return _RULE_EVAL_LOCKS[symbol]
 
-# 通貨強弱の最弱・最強変更履歴記録用グローバル変数
-# 形式: {'15m': {'weakest': 'USD', 'strongest': 'JPY'}, '1H': {...}, ...}
-previous_extreme_currencies = {}
-
 # 履歴パーセント計算用の正規化基準値（クライアントの設定を受け取って更新）
 currency_norm_base = 350
 
 # IMMEDIATELY log the file path to confirm which render_server.py is running
-with open(os.path.join(BASE_DIR, 'webhook_error.log'), 'a', encoding='utf-8') as _f:
-    _f.write(f'\n====== LOADING render_server.py FROM: {__file__} ======\n')
-    _f.write(f'====== BASE_DIR: {BASE_DIR} ======\n\n')
+_server_log.info(f'====== LOADING render_server.py FROM: {__file__} ======')
+_server_log.info(f'====== BASE_DIR: {BASE_DIR} ======')
 
 app = Flask(__name__, template_folder=os.path.join(BASE_DIR, 'templates'))
 app.config['TEMPLATES_AUTO_RELOAD'] = True
@@ -94,6 +124,9 @@ if not os.path.exists(PERSISTENT_DIR):
 # value: {'rule_id': ..., 'rule_name': ..., 'direction': '上昇' or '下降'}
 active_fires: dict = {}
 
+# 発火通知（ポーリング用フォールバック）。読み書きは notification_store 経由で行う
+NOTIFICATIONS_PATH = os.path.join(BASE_DIR, 'notifications.json')
+
 # 全シンボル一括評価の最終実行時刻（エポック秒）
 _last_all_eval_time: float = 0.0
 
@@ -112,7 +145,7 @@ if os.path.exists(DB_PATH):
     
     # DB が writable か確認
     try:
-        test_conn = sqlite3.connect(DB_PATH)
+        test_conn = get_connection(DB_PATH)
         test_conn.execute("SELECT 1")
         test_conn.close()
         print(f"[STORAGE] Database is readable and writable")
@@ -295,7 +328,7 @@ def cleanup_old_data():
     これによりデータベースサイズを最小限に抑える。
     """
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection(DB_PATH)
         c = conn.cursor()
         
         # states テーブルから各(symbol, tf)の最新レコード以外を削除
@@ -370,6 +403,31 @@ def restore_from_json_backup_folder():
     return  # DISABLED - DB persists on Render persistent disk
 
 
+def _state_values_from_payload(data, symbol, tf, timestamp, received_at, sent_time):
+    """Webhook / バックアップJSON から states の1行分（STATE_COLUMNS）を生成"""
+    return {
+        'symbol': symbol,
+        'tf': tf,
+        'timestamp': timestamp,
+        'price': float(data.get('price', 0)),
+        'time': data.get('time', 0),
+        'state_flag': data.get('state', {}).get('flag', ''),
+        'state_word': data.get('state', {}).get('word', ''),
+        'daytrade_status': data.get('daytrade', {}).get('status', ''),
+        'daytrade_bos': data.get('daytrade', {}).get('bos', ''),
+        'daytrade_time': data.get('daytrade', {}).get('time', ''),
+        'swing_status': data.get('swing', {}).get('status', ''),
+        'swing_bos': data.get('swing', {}).get('bos', ''),
+        'swing_time': data.get('swing', {}).get('time', ''),
+        'row_order': ','.join(data.get('row_order', [])),
+        'cloud_order': ','.join(data.get('cloud_order', [])),
+        'clouds_json': json.dumps(data.get('clouds', []), ensure_ascii=False),
+        'meta_json': json.dumps(data.get('meta', {}), ensure_ascii=False),
+        'received_at': received_at,
+        'sent_time': sent_time,
+    }
+
+
 def inject_backup_files_to_db(backup_dir=None, tf_list=None):
     """
     TradingViewBackup_JSONフォルダの最新ファイルをSQLite DBに注入する。
@@ -442,14 +500,10 @@ def inject_backup_files_to_db(backup_dir=None, tf_list=None):
                     except Exception:
                         pass
 
-                conn = sqlite3.connect(DB_PATH)
-                c = conn.cursor()
-
                 # 既存DBのsent_timeと比較：新しい場合のみ尊入
-                c.execute('SELECT sent_time FROM states WHERE symbol=? AND tf=?', (sym, tf))
-                row = c.fetchone()
-                if row and row[0]:
-                    existing_st = row[0]
+                existing = get_state_store(DB_PATH).get(sym, tf)
+                if existing and existing.get('sent_time'):
+                    existing_st = existing['sent_time']
                     try:
                         def _parse_st(s):
                             ps = s.split('/')
@@ -461,48 +515,22 @@ def inject_backup_files_to_db(backup_dir=None, tf_list=None):
                         ex_dt = _parse_st(existing_st)
                         in_dt = _parse_st(sent_time_val) if sent_time_val else None
                         if ex_dt and in_dt and in_dt <= ex_dt:
-                            print(f'[INJECT_BACKUP] SKIP {sym}/{tf}: DB sent_time={existing_st} >= backup={sent_time_val}')
+                            _inject_log.debug('[INJECT_BACKUP] SKIP %s/%s: DB sent_time=%s >= backup=%s', sym, tf, existing_st, sent_time_val)
                             skipped += 1
-                            conn.close()
                             continue
                     except Exception:
                         pass
 
-                c.execute('''INSERT OR REPLACE INTO states (
-                        symbol, tf, timestamp, price, time,
-                        state_flag, state_word,
-                        daytrade_status, daytrade_bos, daytrade_time,
-                        swing_status, swing_bos, swing_time,
-                        row_order, cloud_order, clouds_json, meta_json, received_at, sent_time
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                    (sym, tf,
-                     _datetime.now(jst_z).isoformat(),
-                     float(data.get('price', 0)),
-                     data.get('time', 0),
-                     data.get('state', {}).get('flag', ''),
-                     data.get('state', {}).get('word', ''),
-                     data.get('daytrade', {}).get('status', ''),
-                     data.get('daytrade', {}).get('bos', ''),
-                     data.get('daytrade', {}).get('time', ''),
-                     data.get('swing', {}).get('status', ''),
-                     data.get('swing', {}).get('bos', ''),
-                     data.get('swing', {}).get('time', ''),
-                     ','.join(data.get('row_order', [])),
-                     ','.join(data.get('cloud_order', [])),
-                     _json.dumps(data.get('clouds', []), ensure_ascii=False),
-                     _json.dumps(data.get('meta', {}), ensure_ascii=False),
-                     received_at,
-                     sent_time_val))
-                conn.commit()
-                conn.close()
-                print(f'[INJECT_BACKUP] SAVED {sym}/{tf}: {latest_file.name}')
+                get_state_store(DB_PATH).upsert(_state_values_from_payload(
+                    data, sym, tf, _datetime.now(jst_z).isoformat(), received_at, sent_time_val))
+                _inject_log.debug('[INJECT_BACKUP] SAVED %s/%s: %s', sym, tf, latest_file.name)
                 injected += 1
 
             except Exception as _e:
-                print(f'[INJECT_BACKUP] ERROR {symbol}/{tf_key}: {_e}')
+                _inject_log.warning(f'[INJECT_BACKUP] ERROR {symbol}/{tf_key}: {_e}')
                 errors += 1
 
-    print(f'[INJECT_BACKUP] 完了: Injected={injected}, Skipped={skipped}, Errors={errors}')
+    _inject_log.info(f'[INJECT_BACKUP] 完了: Injected={injected}, Skipped={skipped}, Errors={errors}')
     return (injected, skipped, errors)
 
 
@@ -547,12 +575,11 @@ def init_db():
     FIRST_RECEIVE_FLAGS = {}
     
     # ログに起動時刻を記録
-    with open(os.path.join(BASE_DIR, 'webhook_error.log'), 'a', encoding='utf-8') as f:
-        f.write(f'\n====== SERVER_START_TIME: {SERVER_START_TIME.isoformat()} ======\n')
-        f.write(f'====== Starting init_db at {datetime.now(pytz.timezone("Asia/Tokyo")).isoformat()} ======\n')
-        f.write(f'====== FIRST_RECEIVE_FLAGS reset ======\n\n')
+    _server_log.info(f'====== SERVER_START_TIME: {SERVER_START_TIME.isoformat()} ======')
+    _server_log.info(f'====== Starting init_db at {datetime.now(pytz.timezone("Asia/Tokyo")).isoformat()} ======')
+    _server_log.info('====== FIRST_RECEIVE_FLAGS reset ======')
     
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection(DB_PATH)
     c = conn.cursor()
     c.execute('''CREATE TABLE IF NOT EXISTS states (
         symbol TEXT NOT NULL,
@@ -632,7 +659,7 @@ def init_db():
     print('[OK] DB initialized')
 
     # rules テーブル（ルール保存用）
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection(DB_PATH)
     c = conn.cursor()
     c.execute('''CREATE TABLE IF NOT EXISTS rules (
         id TEXT PRIMARY KEY,
@@ -660,7 +687,7 @@ def init_db():
     print('[OK] Rules table ensured')
     
     # fire_history テーブル（発火履歴記録用）
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection(DB_PATH)
     c = conn.cursor()
     c.execute('''CREATE TABLE IF NOT EXISTS fire_history (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -686,9 +713,15 @@ def init_db():
     conn.commit()
     conn.close()
     print('[OK] Fire history table ensured')
+
+    # rule_state テーブル（ルールごとの前回評価状態。fire_history の目印行から1回だけ移行）
+    try:
+        get_rule_state_store(DB_PATH).migrate_from_fire_history()
+    except Exception as e:
+        print(f'[WARN] rule_state migration failed: {e}')
     
     # market_status テーブル（最後の受信時刻記録用）
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection(DB_PATH)
     c = conn.cursor()
     c.execute('''CREATE TABLE IF NOT EXISTS market_status (
         id INTEGER PRIMARY KEY CHECK (id = 1),
@@ -701,7 +734,7 @@ def init_db():
     print('[OK] Market status table ensured')
     
     # currency_order テーブル（通貨ペアの表示順序管理用）
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection(DB_PATH)
     c = conn.cursor()
     c.execute('''CREATE TABLE IF NOT EXISTS currency_order (
         symbol TEXT PRIMARY KEY,
@@ -713,7 +746,7 @@ def init_db():
     print('[OK] Currency order table ensured')
     
     # change_history テーブル（通貨強弱の最弱・最強変更履歴記録用）
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection(DB_PATH)
     c = conn.cursor()
     c.execute('''CREATE TABLE IF NOT EXISTS change_history (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -747,9 +780,25 @@ def init_db():
     conn.commit()
     conn.close()
     print('[OK] Change history table ensured')
+
+    # 最弱・最強の変更検出の基準（時間足ごとの最新行）を読み込む
+    try:
+        get_change_history_recorder(DB_PATH).load()
+    except Exception as e:
+        print(f'[WARN] change_history baseline load failed: {e}')
+
+    # strength_samples / strength_rollup テーブル（通貨強弱の時系列と 1m/5m/1h/1d 集計）
+    conn = get_connection(DB_PATH)
+    ensure_strength_history_tables(conn)
+    conn.commit()
+    conn.close()
+    print('[OK] Strength history tables ensured')
     
     # 古いデータのクリーンアップ（最新データのみ保持）
     cleanup_old_data()
+
+    # states をメモリへ読み込み（以降の読み出しは全て状態ストアから）
+    get_state_store(DB_PATH).load()
     
     # ↓↓↓ 起動時の状態データ復元処理は全て廃止 ↓↓↓
     # RenderはSQLite DBをPersistent Diskに永続保存するため、
@@ -793,7 +842,7 @@ def _restore_rules_from_backup():
             print('[RULES] No rules_backup.json found in persistent or bundled paths, skipping restore')
             return
 
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection(DB_PATH)
         c = conn.cursor()
         c.execute('SELECT COUNT(*) FROM rules')
         count = c.fetchone()[0]
@@ -835,6 +884,7 @@ def _restore_rules_from_backup():
             restored += 1
         conn.commit()
         conn.close()
+        get_rule_cache(DB_PATH).invalidate()
         print(f'[RULES] Restored {restored} rules from {rules_backup_path}')
     except Exception as e:
         print(f'[RULES] Failed to restore rules from backup: {e}')
@@ -843,7 +893,7 @@ def _restore_rules_from_backup():
 def _save_rules_backup():
     """ルールをrules_backup.jsonに保存（gitに含めてデプロイ後の復元に備える）"""
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection(DB_PATH)
         c = conn.cursor()
         c.execute('SELECT id, name, enabled, scope_json, rule_json, created_at, updated_at, sort_order FROM rules ORDER BY sort_order ASC, created_at ASC')
         rows = c.fetchall()
@@ -1059,202 +1109,35 @@ def test_simple():
     response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
     return response
 
-def calculate_currency_strength_data():
-    """通貨強弱データを計算する（内部関数）"""
-    jst = pytz.timezone('Asia/Tokyo')
-    current_time = datetime.now(jst).strftime('%Y-%m-%d %H:%M:%S')
-    print(f'[CURRENCY_STRENGTH] Calculating at {current_time}')
-    
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    # 全通貨ペアと全時間足のトレンドデータを取得
-    c.execute('SELECT symbol, tf, row_order, clouds_json FROM states')
-    rows = c.fetchall()
-    conn.close()
-    
-    print(f'[CURRENCY_STRENGTH] Fetched {len(rows)} rows from database')
-    
-    # 通貨ペアの定義（実在するペアのみ）
-    # 左の通貨が強い=上昇、右の通貨が強い=下降
-    PAIR_DEFINITIONS = {
-        'USDJPY': ('USD', 'JPY'),
-        'EURUSD': ('EUR', 'USD'),
-        'GBPUSD': ('GBP', 'USD'),
-        'AUDUSD': ('AUD', 'USD'),
-        'EURJPY': ('EUR', 'JPY'),
-        'GBPJPY': ('GBP', 'JPY'),
-        'AUDJPY': ('AUD', 'JPY'),
-        'EURGBP': ('EUR', 'GBP'),
-        'EURAUD': ('EUR', 'AUD'),
-        'GBPAUD': ('GBP', 'AUD')
-    }
-    
-    # 時間足ごとの通貨強弱を計算
-    timeframes = ['5m', '15m', '1H', '4H', 'D']
-    # データベースの実際の値とマッピング
-    tf_map = {
-        '5m': ['5'],
-        '15m': ['15', '15M'],
-        '1H': ['60', '1H'],
-        '4H': ['240', '4H'],
-        'D': ['D', '1440']
-    }
-    
-    result = {}
-    
-    for tf_display in timeframes:
-        tf_variants = tf_map[tf_display]
-        currency_scores = {}  # 通貨ごとのスコア合計
-        currency_breakdown = {}  # 通貨ごとの内訳（デバッグ用）
-        
-        for symbol, tf, row_order, clouds_json in rows:
-            if tf not in tf_variants:
-                continue
-            
-            if symbol not in PAIR_DEFINITIONS:
-                continue
-            
-            base_currency, quote_currency = PAIR_DEFINITIONS[symbol]
-            
-            # トレンド強度を計算
-            if not row_order or not clouds_json:
-                continue
-            
-            try:
-                clouds = json.loads(clouds_json) if clouds_json else []
-
-                # ---- TradingView Pine の trend_pct を直接使用 ----
-                # clouds_json には複数 TF のクラウドが含まれる（例: label='15','60','240'）。
-                # tf_variants に一致するラベルのクラウドを優先して使う。
-                # ※ 先頭要素を使うと 1H クエリでも 15m の値を拾ってしまうため修正。
-                #   trend_pct > 0 → BASE が強い (direction='up')
-                #   trend_pct < 0 → QUOTE が強い (direction='down')
-                #   trend_pct == 0 / 存在しない → range（スキップ）
-
-                # まず tf_variants（例: ['60','1H']）と一致する label のクラウドを探す
-                primary_cloud = next(
-                    (c for c in clouds
-                     if str(c.get('label', '')) in tf_variants
-                     and c.get('trend_pct') is not None),
-                    None
-                )
-                # 一致しない場合は trend_pct を持つ先頭クラウドにフォールバック
-                if primary_cloud is None:
-                    primary_cloud = next(
-                        (c for c in clouds if c.get('trend_pct') is not None),
-                        None
-                    )
-                if primary_cloud is None:
-                    continue
+# 通貨強弱の差分更新を全件再計算と突き合わせる間隔（計算 N 回ごと。0 で無効）
+CURRENCY_STRENGTH_VERIFY_EVERY = max(0, int(os.getenv('CURRENCY_STRENGTH_VERIFY_EVERY', '500')))
 
-                raw_pct = primary_cloud.get('trend_pct', 0)
-                if raw_pct is None or raw_pct == 0:
-                    continue
 
-                if raw_pct > 0:
-                    direction = 'up'
-                    score = raw_pct
-                else:
-                    direction = 'down'
-                    score = abs(raw_pct)
+def calculate_currency_strength_data(verify=False):
+    """通貨強弱データを計算する（内部関数）
 
-                # デバッグログ
-                print(f'[CURRENCY_STRENGTH] {symbol} tf={tf} (表示:{tf_display}): direction={direction}, score={score}, trend_pct={raw_pct}, label={primary_cloud.get("label")}')
-                # ---- ここまで ----
-                
-                # 方向に応じてスコアを配分
-                if direction == 'up':
-                    # 上昇 = 左の通貨が強い
-                    currency_scores[base_currency] = currency_scores.get(base_currency, 0) + score
-                    currency_scores[quote_currency] = currency_scores.get(quote_currency, 0) - score
-                    
-                    # 内訳を記録
-                    if base_currency not in currency_breakdown:
-                        currency_breakdown[base_currency] = []
-                    currency_breakdown[base_currency].append(f'{symbol} 上昇{score}点 (+{score})')
-                    
-                    if quote_currency not in currency_breakdown:
-                        currency_breakdown[quote_currency] = []
-                    currency_breakdown[quote_currency].append(f'{symbol} 上昇{score}点 (-{score})')
-                    
-                elif direction == 'down':
-                    # 下降 = 右の通貨が強い
-                    currency_scores[base_currency] = currency_scores.get(base_currency, 0) - score
-                    currency_scores[quote_currency] = currency_scores.get(quote_currency, 0) + score
-                    
-                    # 内訳を記録
-                    if base_currency not in currency_breakdown:
-                        currency_breakdown[base_currency] = []
-                    currency_breakdown[base_currency].append(f'{symbol} 下降{score}点 (-{score})')
-                    
-                    if quote_currency not in currency_breakdown:
-                        currency_breakdown[quote_currency] = []
-                    currency_breakdown[quote_currency].append(f'{symbol} 下降{score}点 (+{score})')
-            
-            except Exception as e:
-                print(f'[CURRENCY_STRENGTH] Error calculating {symbol} {tf}: {e}')
-                continue
-        
-        # スコアでソート（降順）
-        sorted_currencies = sorted(currency_scores.items(), key=lambda x: x[1])
-        
-        # 内訳をログ出力
-        print(f'\n[CURRENCY_STRENGTH] ===== {tf_display} =====')
-        for currency, score in sorted_currencies:
-            breakdown = currency_breakdown.get(currency, [])
-            print(f'{currency} 合計: {int(score)}点')
-            for item in breakdown:
-                print(f'  - {item}')
-        
-        # %表示を追加（±100点=±100%）
-        currencies_with_percent = []
-        for currency, score in sorted_currencies:
-            percentage = int((score / 100.0) * 100)
-            currencies_with_percent.append({
-                'currency': currency,
-                'score': int(score),
-                'percentage': percentage
-            })
-        
-        result[tf_display] = {
-            'currencies': currencies_with_percent,
-            'raw_scores': currency_scores,
-            'breakdown': currency_breakdown
-        }
-    
-    # 平均を計算
-    avg_scores = {}
-    for tf_display in timeframes:
-        if tf_display not in result:
-            continue
-        for item in result[tf_display]['currencies']:
-            currency = item['currency']
-            score = item['score']
-            avg_scores[currency] = avg_scores.get(currency, 0) + score
-    
-    # 平均を時間足数で割る
-    num_tfs = len([tf for tf in timeframes if tf in result])
-    if num_tfs > 0:
-        for currency in avg_scores:
-            avg_scores[currency] = avg_scores[currency] / num_tfs
+    状態ストアで変わったペア・時間足の寄与だけを差分で反映する（currency_strength.CurrencyStrengthEngine）。
+    verify=True または CURRENCY_STRENGTH_VERIFY_EVERY 回ごとに全件再計算と突き合わせる。
+    """
+    jst = pytz.timezone('Asia/Tokyo')
+    current_time = datetime.now(jst).strftime('%Y-%m-%d %H:%M:%S')
+    print(f'[CURRENCY_STRENGTH] Calculating at {current_time}')
     
-    sorted_avg = sorted(avg_scores.items(), key=lambda x: x[1])
+    engine = get_currency_strength_engine(DB_PATH)
+    result = dict(engine.snapshot())
     
-    # 平均にも%表示を追加
-    avg_with_percent = []
-    for currency, score in sorted_avg:
-        percentage = int((score / 400.0) * 100)
-        avg_with_percent.append({
-            'currency': currency,
-            'score': int(score),
-            'percentage': percentage
-        })
+    if verify or (CURRENCY_STRENGTH_VERIFY_EVERY and engine.stats()['updates'] % CURRENCY_STRENGTH_VERIFY_EVERY == 0):
+        if engine.verify():
+            result = dict(engine.snapshot())
     
-    result['Av'] = {
-        'currencies': avg_with_percent,
-        'raw_scores': avg_scores
-    }
+    # 内訳をログ出力
+    if _currency_log.isEnabledFor(logging.DEBUG):
+        for tf_display in CURRENCY_TIMEFRAMES:
+            _currency_log.debug('[CURRENCY_STRENGTH] ===== %s =====', tf_display)
+            for item in result[tf_display]['currencies']:
+                _currency_log.debug('%s 合計: %s点', item['currency'], item['score'])
+                for line in result[tf_display]['breakdown'].get(item['currency'], []):
+                    _currency_log.debug('  - %s', line)
     
     # 更新時刻を追加
     result['last_updated'] = current_time
@@ -1263,133 +1146,11 @@ def calculate_currency_strength_data():
     return result
 
 def detect_and_record_extreme_changes(currency_data):
-    """通貨強弱の最弱・最強の変更を検出してDBに記録"""
-    global previous_extreme_currencies
-    jst = pytz.timezone('Asia/Tokyo')
-    
+    """通貨強弱の最弱・最強の変更を検出してDBに記録（書き込みは db_writer 経由）"""
     try:
-        current_time = datetime.now(jst).strftime('%y/%m/%d/%H:%M:%S')
-        
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        
-        for timeframe, data in currency_data.items():
-            try:
-                if 'currencies' not in data or len(data['currencies']) == 0:
-                    continue
-                
-                currencies = data['currencies']
-                weakest = currencies[0]['currency']
-                strongest = currencies[-1]['currency']
-                # scoreから正しいパーセントを算出（フロントエンドと同じ分母350で計算）
-                weakest_score = currencies[0]['score']
-                strongest_score = currencies[-1]['score']
-                denom = float(currency_norm_base) if currency_norm_base > 0 else 350.0
-                weakest_percent = max(-100, min(100, round((weakest_score / denom) * 100)))
-                strongest_percent = max(-100, min(100, round((strongest_score / denom) * 100)))
-                
-                # 時間足に応じた期間バケット（例:5mなら「202603051035」=2026/03/05 10:35台）
-                now_jst = datetime.now(jst)
-                if timeframe == '5m':
-                    b = (now_jst.minute // 5) * 5
-                    current_bucket = now_jst.strftime('%Y%m%d%H') + f'{b:02d}'
-                elif timeframe == '15m':
-                    b = (now_jst.minute // 15) * 15
-                    current_bucket = now_jst.strftime('%Y%m%d%H') + f'{b:02d}'
-                elif timeframe == '1H':
-                    current_bucket = now_jst.strftime('%Y%m%d%H') + '00'
-                elif timeframe == '4H':
-                    b = (now_jst.hour // 4) * 4
-                    current_bucket = now_jst.strftime('%Y%m%d') + f'{b:02d}' + '00'
-                else:
-                    current_bucket = now_jst.strftime('%Y%m%d%H%M')
-                
-                # DBの最新レコードを取得して「値変化」と「期間」の両方を確認
-                c.execute('''SELECT weakest, strongest, created_at FROM change_history 
-                             WHERE timeframe = ? ORDER BY created_at DESC LIMIT 1''', (timeframe,))
-                last_db = c.fetchone()
-                
-                skip_insert = False
-                skip_reason = ''
-                if last_db:
-                    last_w, last_s, last_cat_str = last_db
-                    # 同じ値ならスキップ（1H後も同じ最強・最弱ならスキップ）
-                    if last_w == weakest and last_s == strongest:
-                        skip_insert = True
-                        skip_reason = 'same values'
-                    else:
-                        # 値が変わっていても同じ期間内ならスキップ（時間足毎に1件）
-                        try:
-                            last_dt = datetime.fromisoformat(last_cat_str)
-                            if last_dt.tzinfo is None:
-                                last_dt = jst.localize(last_dt)
-                            last_dt_jst = last_dt.astimezone(jst)
-                            if timeframe == '5m':
-                                lb = (last_dt_jst.minute // 5) * 5
-                                last_bucket = last_dt_jst.strftime('%Y%m%d%H') + f'{lb:02d}'
-                            elif timeframe == '15m':
-                                lb = (last_dt_jst.minute // 15) * 15
-                                last_bucket = last_dt_jst.strftime('%Y%m%d%H') + f'{lb:02d}'
-                            elif timeframe == '1H':
-                                last_bucket = last_dt_jst.strftime('%Y%m%d%H') + '00'
-                            elif timeframe == '4H':
-                                lb = (last_dt_jst.hour // 4) * 4
-                                last_bucket = last_dt_jst.strftime('%Y%m%d') + f'{lb:02d}' + '00'
-                            else:
-                                last_bucket = last_dt_jst.strftime('%Y%m%d%H%M')
-                            if current_bucket == last_bucket:
-                                skip_insert = True
-                                skip_reason = 'same period'
-                        except Exception:
-                            pass
-                
-                if not skip_insert:
-                    try:
-                        c.execute('''INSERT INTO change_history 
-                                     (timeframe, weakest, strongest, weakest_percent, strongest_percent, timestamp, created_at) 
-                                     VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                                  (timeframe, weakest, strongest, weakest_percent, strongest_percent, current_time, datetime.now(jst).isoformat()))
-                        conn.commit()
-                        print(f'[CHANGE_HISTORY] Recorded for {timeframe}: {weakest}{weakest_percent:+d}%⇔{strongest}{strongest_percent:+d}%')
-                        
-                        # 各時間足ごとに最大1000件を維持（古い履歴を削除）
-                        c.execute('''SELECT id FROM change_history 
-                                     WHERE timeframe = ? 
-                                     ORDER BY created_at DESC 
-                                     LIMIT -1 OFFSET 1000''', (timeframe,))
-                        old_ids = [row[0] for row in c.fetchall()]
-                        if old_ids:
-                            placeholders = ','.join(['?'] * len(old_ids))
-                            c.execute(f'DELETE FROM change_history WHERE id IN ({placeholders})', old_ids)
-                            conn.commit()
-                            print(f'[CHANGE_HISTORY] Deleted {len(old_ids)} old records for {timeframe}')
-                        
-                    except Exception as e:
-                        print(f'[ERROR] Failed to record change history for {timeframe}: {e}')
-                else:
-                    print(f'[CHANGE_HISTORY] Skipped {timeframe} ({skip_reason}): {weakest}⇔{strongest}')
-                
-                # メモリを常に最新に更新（変更追跡用）
-                previous_extreme_currencies[timeframe] = {
-                    'weakest': weakest,
-                    'strongest': strongest
-                }
-            except Exception as tf_error:
-                print(f'[ERROR] Error processing timeframe {timeframe}: {tf_error}')
-                continue
-        
-        conn.close()
-        
+        get_change_history_recorder(DB_PATH).record(currency_data, currency_norm_base)
     except Exception as e:
-        print(f'[CRITICAL ERROR] detect_and_record_extreme_changes failed: {e}')
-        import traceback
-        traceback.print_exc()
-        try:
-            with open(os.path.join(BASE_DIR, 'webhook_error.log'), 'a', encoding='utf-8') as f:
-                f.write(f'{datetime.now(jst).isoformat()} - [CRITICAL] detect_and_record_extreme_changes: {e}\n')
-                f.write(traceback.format_exc())
-        except:
-            pass
+        _history_log.critical(f'[CRITICAL] detect_and_record_extreme_changes: {e}', exc_info=True)
 
 # サーバーバージョン識別子（デプロイ確認用）
 CURRENCY_STRENGTH_VERSION = 'fix-label-match-d02572e'
@@ -1413,7 +1174,8 @@ def api_save_client_settings():
 def api_currency_strength():
     """通貨強弱を計算して返す（APIエンドポイント）"""
     try:
-        data = calculate_currency_strength_data()
+        # ?verify=1 で全件再計算との突き合わせも行う（不一致はログに出し、全件で作り直す）
+        data = calculate_currency_strength_data(verify=request.args.get('verify') == '1')
         return jsonify({
             'status': 'success',
             'data': data
@@ -1424,6 +1186,25 @@ def api_currency_strength():
         traceback.print_exc()
         return jsonify({'status': 'error', 'msg': str(e)}), 500
 
+@app.route('/api/currency_strength/history', methods=['GET'])
+def api_currency_strength_history():
+    """通貨強弱の時系列（?tf=&from=&to=&resolution=auto|raw|1m|5m|1h|1d）"""
+    try:
+        # from / to は UNIX 秒・ミリ秒・ISO 8601（省略時は直近24時間）
+        end = parse_time(request.args.get('to'), time.time())
+        start = parse_time(request.args.get('from'), end - 86400)
+        tf = request.args.get('tf') or 'Av'
+        if tf not in CURRENCY_TIMEFRAMES and tf != 'Av':
+            raise ValueError(f'unknown tf: {tf}')
+        result = get_strength_history(DB_PATH).query(tf, start, end, request.args.get('resolution', 'auto'))
+        return jsonify(dict(result, status='success')), 200
+    except ValueError as e:
+        return jsonify({'status': 'error', 'msg': str(e)}), 400
+    except Exception as e:
+        print(f'[ERROR][api/currency_strength/history] {e}')
+        traceback.print_exc()
+        return jsonify({'status': 'error', 'msg': str(e)}), 500
+
 @app.route('/api/change_history', methods=['GET'])
 def api_change_history():
     """通貨強弱の最弱・最強変更履歴を取得（APIエンドポイント）"""
@@ -1431,7 +1212,7 @@ def api_change_history():
         timeframe = request.args.get('timeframe')  # optional
         limit = int(request.args.get('limit', 5))
         
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection(DB_PATH)
         c = conn.cursor()
         
         # テーブルのカラムを確認
@@ -1680,28 +1461,182 @@ def _normalize_row_order(row_order_list):
     
     return normalized
 
-@app.route('/webhook', methods=['POST', 'OPTIONS'])
-def webhook():
-    # OPTIONSリクエストに対応（CORS プリフライト）
-    if request.method == 'OPTIONS':
-        response = make_response('', 204)
-        response.headers['Access-Control-Allow-Origin'] = '*'
-        response.headers['Access-Control-Allow-Methods'] = 'POST, OPTIONS'
-        response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
-        response.headers['Access-Control-Max-Age'] = '3600'
-        return response
-    
+# ============================================================
+# 非同期インジェストキュー（WEBHOOK_ASYNC_INGEST=1 で有効）
+# ============================================================
+# 有効時は /webhook が検証→キュー投入だけ行い 202 を即返す。
+# シンボルのハッシュでワーカーに振り分けるため、同一シンボルは受信順に直列処理される。
+WEBHOOK_ASYNC_INGEST = os.getenv('WEBHOOK_ASYNC_INGEST', '0').strip().lower() in ('1', 'true', 'yes', 'on')
+WEBHOOK_INGEST_WORKERS = max(1, int(os.getenv('WEBHOOK_INGEST_WORKERS', '4')))
+WEBHOOK_INGEST_QUEUE_SIZE = max(1, int(os.getenv('WEBHOOK_INGEST_QUEUE_SIZE', '1000')))
+
+# ワーカーごとの bounded queue（要素: (enqueued_at_epoch, data, fingerprint)）
+_ingest_queues = []
+_ingest_workers_started = False
+_ingest_lock = threading.Lock()
+# 処理統計（/api/ingest/status で公開）
+_ingest_stats = {
+    'enqueued': 0,
+    'processed': 0,
+    'skipped': 0,
+    'failed': 0,
+    'rejected': 0,
+    'last_lag_ms': 0.0,
+    'max_lag_ms': 0.0,
+    'last_processed_at': None,
+}
+
+
+# ============================================================
+# 重複ペイロードの除外（TradingView の再送・send_to_target の再送信対策）
+# ============================================================
+# (symbol, tf, sent_time, 内容ハッシュ) が一定時間内に既に受け付け済みなら、何も処理せずに応答する。
+WEBHOOK_DEDUP_ENABLED = os.getenv('WEBHOOK_DEDUP_ENABLED', '1').strip().lower() in ('1', 'true', 'yes', 'on')
+# 重複とみなす期間（秒）
+WEBHOOK_DEDUP_WINDOW_SEC = float(os.getenv('WEBHOOK_DEDUP_WINDOW_SEC', '86400'))
+# 保持する指紋の上限件数（古い順に破棄）
+WEBHOOK_DEDUP_MAX_ENTRIES = max(1, int(os.getenv('WEBHOOK_DEDUP_MAX_ENTRIES', '20000')))
+
+# 指紋 -> 受付時刻（受付順）
+_dedup_index = OrderedDict()
+_dedup_lock = threading.Lock()
+_dedup_stats = {
+    'checked': 0,
+    'hits': 0,
+    'expired': 0,
+    'released': 0,
+    'last_hit': None,
+}
+
+
+def _payload_fingerprint(data):
+    """ペイロードの指紋 (symbol, tf, sent_time, 内容の SHA1)"""
+    body = json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+    return (str(data.get('symbol', 'UNKNOWN')), str(data.get('tf', '')), str(data.get('sent_time', '')),
+            hashlib.sha1(body.encode('utf-8')).hexdigest())
+
+
+def _dedup_claim(fingerprint):
+    """未受付なら登録して True、期間内の重複なら False を返す"""
+    now = time.time()
+    with _dedup_lock:
+        _dedup_stats['checked'] += 1
+        # 期限切れ・上限超過分を古い順に破棄
+        while _dedup_index:
+            oldest_fp, seen_at = next(iter(_dedup_index.items()))
+            if now - seen_at <= WEBHOOK_DEDUP_WINDOW_SEC and len(_dedup_index) < WEBHOOK_DEDUP_MAX_ENTRIES:
+                break
+            _dedup_index.popitem(last=False)
+            _dedup_stats['expired'] += 1
+        if fingerprint in _dedup_index:
+            _dedup_stats['hits'] += 1
+            _dedup_stats['last_hit'] = {
+                'symbol': fingerprint[0], 'tf': fingerprint[1], 'sent_time': fingerprint[2],
+                'at': datetime.now(pytz.timezone('Asia/Tokyo')).isoformat(),
+            }
+            return False
+        _dedup_index[fingerprint] = now
+        return True
+
+
+def _dedup_release(fingerprint):
+    """処理に失敗したペイロードの指紋を外す（再送を受け付けるため）"""
+    if fingerprint is None:
+        return
+    with _dedup_lock:
+        if _dedup_index.pop(fingerprint, None) is not None:
+            _dedup_stats['released'] += 1
+
+
+def _dedup_status():
+    with _dedup_lock:
+        stats = dict(_dedup_stats)
+        stats['entries'] = len(_dedup_index)
+    stats['enabled'] = WEBHOOK_DEDUP_ENABLED
+    stats['window_sec'] = WEBHOOK_DEDUP_WINDOW_SEC
+    stats['max_entries'] = WEBHOOK_DEDUP_MAX_ENTRIES
+    return stats
+
+
+def _ingest_shard(symbol):
+    """シンボルから担当ワーカー番号を決定（プロセス内で安定なハッシュ）"""
+    return zlib.crc32(str(symbol).encode('utf-8')) % WEBHOOK_INGEST_WORKERS
+
+
+def _ingest_worker(shard):
+    """キューからペイロードを取り出して順番に処理するワーカー"""
+    q = _ingest_queues[shard]
+    while True:
+        enqueued_at, data, fingerprint = q.get()
+        try:
+            lag_ms = round((time.time() - enqueued_at) * 1000.0, 1)
+            result, status_code = _process_webhook_payload(data)
+            if status_code >= 500:
+                _dedup_release(fingerprint)
+            with _ingest_lock:
+                _ingest_stats['last_lag_ms'] = lag_ms
+                _ingest_stats['max_lag_ms'] = max(_ingest_stats['max_lag_ms'], lag_ms)
+                _ingest_stats['last_processed_at'] = datetime.now(pytz.timezone('Asia/Tokyo')).isoformat()
+                if status_code >= 400:
+                    _ingest_stats['failed'] += 1
+                elif result.get('status') == 'skipped':
+                    _ingest_stats['skipped'] += 1
+                else:
+                    _ingest_stats['processed'] += 1
+        except Exception as e:
+            print(f'[INGEST ERROR] worker={shard}: {e}')
+            traceback.print_exc()
+            _dedup_release(fingerprint)
+            with _ingest_lock:
+                _ingest_stats['failed'] += 1
+        finally:
+            q.task_done()
+
+
+def _start_ingest_workers():
+    """ワーカースレッドを起動（初回のみ。gunicorn 起動でも動くよう遅延起動）"""
+    global _ingest_workers_started
+    if _ingest_workers_started:
+        return
+    with _ingest_lock:
+        if _ingest_workers_started:
+            return
+        per_queue = max(1, -(-WEBHOOK_INGEST_QUEUE_SIZE // WEBHOOK_INGEST_WORKERS))
+        for i in range(WEBHOOK_INGEST_WORKERS):
+            _ingest_queues.append(queue.Queue(maxsize=per_queue))
+        for i in range(WEBHOOK_INGEST_WORKERS):
+            threading.Thread(target=_ingest_worker, args=(i,), daemon=True, name=f'ingest-{i}').start()
+        _ingest_workers_started = True
+        print(f'[INGEST] Started {WEBHOOK_INGEST_WORKERS} workers (queue size {per_queue} each)')
+
+
+def _enqueue_webhook(data, fingerprint=None):
+    """ペイロードをキューに投入。満杯なら False を返す"""
+    _start_ingest_workers()
+    q = _ingest_queues[_ingest_shard(data.get('symbol', 'UNKNOWN'))]
+    try:
+        q.put_nowait((time.time(), data, fingerprint))
+    except queue.Full:
+        with _ingest_lock:
+            _ingest_stats['rejected'] += 1
+        return False
+    with _ingest_lock:
+        _ingest_stats['enqueued'] += 1
+    return True
+
+
+def _ingest_queue_depth():
+    """全ワーカーの未処理件数の合計"""
+    return sum(q.qsize() for q in _ingest_queues)
+
+
+def _process_webhook_payload(data):
+    """Webhookペイロードを保存→トレンド計算→ルール評価→配信まで処理
+
+    Returns:
+        (dict, int): レスポンス本体と HTTPステータス
+    """
     try:
-        data = request.json
-        if not data:
-            error_msg = 'No JSON data received'
-            print(f'[WEBHOOK ERROR] {error_msg}')
-            with open(os.path.join(BASE_DIR, 'webhook_error.log'), 'a', encoding='utf-8') as f:
-                f.write(f'{datetime.now(pytz.timezone("Asia/Tokyo")).isoformat()} - {error_msg}\n')
-            response = jsonify({'status': 'error', 'msg': error_msg})
-            response.headers['Access-Control-Allow-Origin'] = '*'
-            return response, 400
-        
         # FX休場時は更新を無視（データ受信ベースなので常に保存）
         # 受信したら営業中と判定するため、チェックを削除
         
@@ -1731,19 +1666,13 @@ def webhook():
 
         print(f'[WEBHOOK RECEIVED] sent_time={sent_time_val} received_at={received_at} - {symbol_val}/{tf_val}')
         
-        # ログをファイルに保存
+        # ログをジャーナルに保存
         try:
-            log_entry = f'{received_at} - {symbol_val}/{tf_val} (Sent: {sent_time_val}) - {json.dumps(data, ensure_ascii=False)}\n'
-            with open(os.path.join(BASE_DIR, 'webhook_log.txt'), 'a', encoding='utf-8') as f:
-                f.write(log_entry)
+            get_journal().append(received_at, symbol_val, tf_val, sent_time_val, data)
             # 同時にエラーログにも記録（トラッキング用）
-            with open(os.path.join(BASE_DIR, 'webhook_error.log'), 'a', encoding='utf-8') as f:
-                f.write(f'{received_at} - OK: {symbol_val}/{tf_val} (Sent: {sent_time_val})\n')
+            _webhook_log.info('OK: %s/%s (Sent: %s)', symbol_val, tf_val, sent_time_val)
         except Exception as e:
-            error_msg = f'[LOG ERROR] Failed to write logs: {str(e)}'
-            print(error_msg)
-            with open(os.path.join(BASE_DIR, 'webhook_error.log'), 'a', encoding='utf-8') as f:
-                f.write(f'{datetime.now(jst).isoformat()} - {error_msg}\n')
+            _webhook_log.error(f'[LOG ERROR] Failed to write logs: {str(e)}')
         
         # 設定から更新遅延時間を取得
         settings_path = os.path.join(BASE_DIR, 'settings.json')
@@ -1756,75 +1685,6 @@ def webhook():
         except Exception as e:
             print(f'[WARNING] Failed to load settings: {e}')
         
-        # ============================================================
-        # スコア計算を実行（DB保存前）
-        # ============================================================
-        with open(os.path.join(BASE_DIR, 'webhook_error.log'), 'a', encoding='utf-8') as f:
-            f.write(f'{datetime.now(jst).isoformat()} - [DEBUG_TREND] Starting trend calculation for {symbol_val}/{tf_val}\n')
-            f.flush()
-        
-        try:
-            tf_for_calc = tf_val
-            # tf を正規化（'5' -> '5m', '15' -> '15m', '60' -> '1H', '240' -> '4H'）
-            tf_map_norm = {'5': '5m', '15': '15m', '60': '1H', '240': '4H', 'D': 'D', 'W': 'W', 'M': 'M', 'Y': 'Y'}
-            tf_for_calc = tf_map_norm.get(tf_val, tf_val)
-            
-            with open(os.path.join(BASE_DIR, 'webhook_error.log'), 'a', encoding='utf-8') as f:
-                f.write(f'{datetime.now(jst).isoformat()} - [DEBUG_TREND] tf_for_calc={tf_for_calc}\n')
-                f.flush()
-            
-            # row_order を文字列に変換（calculate_trend_strength_v2 が string を期待）
-            row_order_for_calc = data.get('row_order', [])
-            if isinstance(row_order_for_calc, list):
-                row_order_for_calc = ','.join(row_order_for_calc)
-            
-            # データコピーを作成して calculate_trend_strength_v2 に渡す
-            calc_data = dict(data)
-            calc_data['row_order'] = row_order_for_calc
-            
-            with open(os.path.join(BASE_DIR, 'webhook_error.log'), 'a', encoding='utf-8') as f:
-                f.write(f'{datetime.now(jst).isoformat()} - [DEBUG_TREND] row_order_for_calc={row_order_for_calc}\n')
-                f.flush()
-            
-            # スコア計算を実行
-            trend_result = calculate_trend_strength_v2(tf_for_calc, calc_data, None)
-            
-            with open(os.path.join(BASE_DIR, 'webhook_error.log'), 'a', encoding='utf-8') as f:
-                f.write(f'{datetime.now(jst).isoformat()} - [DEBUG_TREND] Calculation result: direction={trend_result.get("direction")}, score={trend_result.get("score")}\n')
-                f.flush()
-            
-            # 計算結果を meta に追加
-            meta = data.get('meta', {})
-            if isinstance(meta, dict):
-                meta['trend_direction'] = trend_result.get('direction', 'range')
-                meta['trend_score'] = trend_result.get('score', 0)
-                meta['trend_strength'] = trend_result.get('strength', 'レンジ')
-                meta['trend_breakdown'] = trend_result.get('breakdown', {})
-                data['meta'] = meta
-                
-                with open(os.path.join(BASE_DIR, 'webhook_error.log'), 'a', encoding='utf-8') as f:
-                    f.write(f'{datetime.now(jst).isoformat()} - [DEBUG_TREND] Meta updated: {symbol_val}/{tf_val}\n')
-                    f.flush()
-            
-        except Exception as e:
-            error_msg = f"{type(e).__name__}: {str(e)}"
-            tb_msg = traceback.format_exc()
-            
-            # log に記録
-            with open(os.path.join(BASE_DIR, 'webhook_error.log'), 'a', encoding='utf-8') as f:
-                f.write(f'{datetime.now(jst).isoformat()} - [DEBUG_TREND_ERROR] {symbol_val}/{tf_val}: {error_msg}\n')
-                f.write(f'{tb_msg}\n')
-                f.flush()
-            
-            # meta に exception 情報を入れる
-            meta = data.get('meta', {})
-            if isinstance(meta, dict):
-                meta['trend_direction'] = 'range'
-                meta['trend_score'] = 0
-                meta['trend_strength'] = 'レンジ'
-                meta['exception_msg'] = error_msg
-                data['meta'] = meta
-        
         # ---- tf値の正規化（旧形式→正規化形式）----
         tf_val_normalized = _normalize_tf(tf_val)
         if tf_val_normalized != tf_val:
@@ -1838,24 +1698,20 @@ def webhook():
         incoming_clouds = data.get('clouds', [])
         if not incoming_clouds:
             print(f'[WEBHOOK SKIP] Empty clouds payload for {symbol_val}/{tf_val} - DB not updated (sent_time={sent_time_val})')
-            response = jsonify({'status': 'skipped', 'reason': 'empty_clouds'})
-            response.headers['Access-Control-Allow-Origin'] = '*'
-            return response, 200
+            return {'status': 'skipped', 'reason': 'empty_clouds'}, 200
         # ---- シグナルペイロード拒否ここまで ----
         
         # 遅延処理を削除して即時保存
         try:
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
+            state_store = get_state_store(DB_PATH)
 
             # --- sent_time 同士を比較して古いペイロードをスキップ ---
             # 既存レコードの sent_time と受信データの sent_time を比較。
             # 既存の sent_time が空（スタブ）の場合は常に受け入れる。
             # 受信データの sent_time が既存より古い場合のみスキップ。
             try:
-                c.execute('SELECT sent_time FROM states WHERE symbol = ? AND tf = ? ORDER BY rowid DESC LIMIT 1', (symbol_val, tf_val))
-                row = c.fetchone()
-                existing_sent_time = row[0] if row and row[0] else ''
+                existing = state_store.get(symbol_val, tf_val)
+                existing_sent_time = existing.get('sent_time') or '' if existing else ''
                 if existing_sent_time and sent_time_val:
                     # sent_time 形式: YY/MM/DD/HH:MM → 文字列比較可能な形式に変換
                     def parse_sent_time(s):
@@ -1872,56 +1728,17 @@ def webhook():
                     incoming_dt = parse_sent_time(sent_time_val)
                     if existing_dt and incoming_dt and incoming_dt < existing_dt:
                         print(f"[WEBHOOK SKIP] Older sent_time for {symbol_val}/{tf_val}: existing={existing_sent_time} incoming={sent_time_val}")
-                        conn.close()
-                        response = jsonify({'status': 'skipped', 'reason': 'older_sent_time'})
-                        response.headers['Access-Control-Allow-Origin'] = '*'
-                        return response, 200
+                        return {'status': 'skipped', 'reason': 'older_sent_time'}, 200
             except Exception:
                 pass
             # --- sent_time 比較ここまで ---
 
             received_timestamp = datetime.now(jst).isoformat()  # 最終更新（サーバー受信時刻）
             # received_at は sent_time ベース（上で解析済み）
-            c.execute('''INSERT OR REPLACE INTO states (
-                        symbol, tf, timestamp, price, time,
-                        state_flag, state_word,
-                        daytrade_status, daytrade_bos, daytrade_time,
-                        swing_status, swing_bos, swing_time,
-                        row_order, cloud_order, clouds_json, meta_json, received_at, sent_time
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                    (symbol_val, tf_val,
-                     received_timestamp, float(data.get('price', 0)),
-                     data.get('time', 0),
-                     data.get('state', {}).get('flag', ''),
-                     data.get('state', {}).get('word', ''),
-                     data.get('daytrade', {}).get('status', ''),
-                     data.get('daytrade', {}).get('bos', ''),
-                     data.get('daytrade', {}).get('time', ''),
-                     data.get('swing', {}).get('status', ''),
-                     data.get('swing', {}).get('bos', ''),
-                     data.get('swing', {}).get('time', ''),
-                     ','.join(data.get('row_order', [])),
-                     ','.join(data.get('cloud_order', [])),
-                     json.dumps(data.get('clouds', []), ensure_ascii=False),
-                     json.dumps(data.get('meta', {}), ensure_ascii=False),
-                     received_at,      # ← sent_time ベース
-                     sent_time_val))
-            conn.commit()
-            # WALモード有効時の即時書き込み確保
-            try:
-                c.execute('PRAGMA optimize')
-            except:
-                pass
-            conn.close()
-            
-            # 【重要】ファイルレベルの同期（Renderで再起動時のデータ損失防止）
-            try:
-                fd = os.open(DB_PATH, os.O_RDONLY)
-                os.fsync(fd)
-                os.close(fd)
-                print(f'[DB_SYNC] [OK] Forced disk sync for {symbol_val}/{tf_val}')
-            except Exception as e:
-                print(f'[DB_SYNC] ⚠ Sync failed: {e}')
+            # 書き込みスレッドでコミット後に状態ストアへ反映（write-through）
+            state_store.upsert(_state_values_from_payload(
+                data, symbol_val, tf_val, received_timestamp, received_at, sent_time_val))
+            # 永続性は db_pool の SQLITE_SYNCHRONOUS で制御（リクエスト毎の os.fsync は廃止）
             
             saved_at = datetime.now(jst).isoformat()
             print(f'[OK] Saved immediately: {symbol_val}/{tf_val} at {saved_at}')
@@ -1930,175 +1747,76 @@ def webhook():
             # if tf_val in ['D', '240', '60']:
             #     save_dynamic_backup(symbol_val, tf_val, data)  # DISABLED
             
-            with open(os.path.join(BASE_DIR, 'webhook_error.log'), 'a', encoding='utf-8') as f:
-                f.write(f'{saved_at} - [CHECKPOINT 1] Before trend calculation block\n')
-                f.flush()
+            _webhook_log.debug('[CHECKPOINT 1] Before trend calculation block')
             
-            # トレンド強度計算v2（パターン検出含む）を実行
+            # トレンド強度計算v2（状態更新後に1回だけ実行。同じ雲データの結果はメモ化から返す）
+            meta = data.get('meta', {})
             try:
-                with open(os.path.join(BASE_DIR, 'webhook_error.log'), 'a', encoding='utf-8') as f:
-                    f.write(f'{saved_at} - [TREND_CALC] Calculating trend for {symbol_val}/{tf_val}...\n')
-                    f.flush()
-                print(f'[TREND_CALC] Calculating trend for {symbol_val}/{tf_val}...')
+                _trend_log.debug('[TREND_CALC] Calculating trend for %s/%s...', symbol_val, tf_val)
                 # tf_valを正規化
-                tf_normalized = tf_val
-                if tf_val == '5':
-                    tf_normalized = '5m'
-                elif tf_val == '15':
-                    tf_normalized = '15m'
-                elif tf_val in ('1', '60'):
-                    tf_normalized = '1H'
-                elif tf_val in ('4', '240'):
-                    tf_normalized = '4H'
+                tf_normalized = normalize_trend_tf(tf_val)
                 
-                # DBから同じ通貨ペアの全タイムフレームデータを取得
-                conn_trend = sqlite3.connect(DB_PATH)
-                c_trend = conn_trend.cursor()
-                c_trend.execute('SELECT * FROM states WHERE symbol = ?', (symbol_val,))
-                rows = c_trend.fetchall()
-                cols = [d[0] for d in c_trend.description] if c_trend.description else []
-                conn_trend.close()
-                
-                # all_states構築: {tf_normalized: {clouds: [...]}, ...}
-                all_states = {}
-                for row in rows:
-                    row_dict = dict(zip(cols, row))
-                    row_tf = row_dict.get('tf', '')
-                    # tfを正規化
-                    row_tf_norm = row_tf
-                    if row_tf == '5':
-                        row_tf_norm = '5m'
-                    elif row_tf == '15':
-                        row_tf_norm = '15m'
-                    elif row_tf in ('1', '60'):
-                        row_tf_norm = '1H'
-                    elif row_tf in ('4', '240'):
-                        row_tf_norm = '4H'
-                    
-                    clouds_json = row_dict.get('clouds_json', '[]')
-                    row_order = row_dict.get('row_order', '')
-                    try:
-                        clouds = json.loads(clouds_json)
-                        all_states[row_tf_norm] = {
-                            'clouds': clouds,
-                            'clouds_json': clouds_json,
-                            'row_order': row_order
-                        }
-                    except:
-                        pass
+                # 状態ストアから同じ通貨ペアの全タイムフレームデータを取得（パース済み）
+                # all_states: {tf_normalized: {clouds: [...]}, ...}
+                all_states = state_store.trend_states(symbol_val)
                 
                 # state_dataは現在のタイムフレームデータ
                 state_data = all_states.get(tf_normalized, {
                     'clouds': data.get('clouds', []),
-                    'row_order': data.get('row_order', '')
+                    'row_order': ','.join(data.get('row_order', []))
                 })
                 
-                # トレンド強度計算v2を実行
+                # トレンド強度計算v2を実行（受信した雲は直前と違うのがふつうなのでメモ化を通さない）
                 trend_result = calculate_trend_strength_v2(tf_normalized, state_data, all_states)
-                result_msg = f'[TREND_CALC] {symbol_val}/{tf_normalized}: {trend_result["strength"]} ({trend_result["score"]}点)'
-                print(result_msg)
-                # 詳細情報も出力
-                if trend_result.get('details'):
-                    print(f'[TREND_DETAILS] {symbol_val}/{tf_normalized}: {trend_result["details"]}')
-                with open(os.path.join(BASE_DIR, 'webhook_error.log'), 'a', encoding='utf-8') as f:
-                    f.write(f'{saved_at} - {result_msg}\n')
-                    if trend_result.get('details'):
-                        f.write(f'{saved_at} - [TREND_DETAILS] {json.dumps(trend_result["details"], ensure_ascii=False)}\n')
-                    f.flush()
+                _trend_log.info('[TREND_CALC] %s/%s: %s (%s点)', symbol_val, tf_normalized,
+                                trend_result['strength'], trend_result['score'])
+                # 詳細情報も出力（DEBUG 有効時のみ JSON 化）
+                if trend_result.get('details') and _trend_log.isEnabledFor(logging.DEBUG):
+                    _trend_log.debug(f'[TREND_DETAILS] {symbol_val}/{tf_normalized}: {json.dumps(trend_result["details"], ensure_ascii=False)}')
                 
-                # トレンド計算結果をデータベースに保存
-                try:
-                    conn_trend = sqlite3.connect(DB_PATH)
-                    c_trend = conn_trend.cursor()
-                    c_trend.execute('''UPDATE states SET 
-                        trend_direction = ?,
-                        trend_score = ?,
-                        trend_percentage = ?,
-                        trend_strength = ?,
-                        trend_breakdown_json = ?
-                        WHERE symbol = ? AND tf = ?''',
-                        (trend_result.get('direction', 'range'),
-                         trend_result.get('score', 0),
-                         int((trend_result.get('score', 0) / 100.0) * 100),
-                         trend_result.get('strength', ''),
-                         json.dumps(trend_result.get('breakdown', {}), ensure_ascii=False),
-                         symbol_val,
-                         tf_val))
-                    conn_trend.commit()
-                    conn_trend.close()
-                    print(f'[OK] Trend results saved to DB: {symbol_val}/{tf_val}')
-                except Exception as db_err:
-                    print(f'[WARNING] Failed to save trend results to DB: {db_err}')
-                    
+                trend_fields = {
+                    'trend_direction': trend_result.get('direction', 'range'),
+                    'trend_score': trend_result.get('score', 0),
+                    'trend_percentage': int((trend_result.get('score', 0) / 100.0) * 100),
+                    'trend_strength': trend_result.get('strength', ''),
+                    'trend_breakdown_json': json.dumps(trend_result.get('breakdown', {}), ensure_ascii=False),
+                }
+                # 計算結果を meta にも追加
+                if isinstance(meta, dict):
+                    meta['trend_direction'] = trend_result.get('direction', 'range')
+                    meta['trend_score'] = trend_result.get('score', 0)
+                    meta['trend_strength'] = trend_result.get('strength', 'レンジ')
+                    meta['trend_breakdown'] = trend_result.get('breakdown', {})
             except Exception as trend_err:
-                error_msg = f'[ERROR] Trend calculation failed: {trend_err}'
-                print(error_msg)
-                with open(os.path.join(BASE_DIR, 'webhook_error.log'), 'a', encoding='utf-8') as f:
-                    f.write(f'{saved_at} - {error_msg}\n')
-                    f.flush()
-                import traceback
-                traceback.print_exc()
-            
-            # トレンド計算完了マーカー
-            with open(os.path.join(BASE_DIR, 'webhook_error.log'), 'a', encoding='utf-8') as f:
-                f.write(f'{saved_at} - [TREND_CALC_BLOCK] Trend calculation block completed\n')
-                f.flush()
+                _trend_log.error(f'[ERROR] Trend calculation failed for {symbol_val}/{tf_val}: {trend_err}', exc_info=True)
+                trend_fields = {}
+                # meta に exception 情報を入れる
+                if isinstance(meta, dict):
+                    meta['trend_direction'] = 'range'
+                    meta['trend_score'] = 0
+                    meta['trend_strength'] = 'レンジ'
+                    meta['exception_msg'] = f'{type(trend_err).__name__}: {trend_err}'
             
-            # 全てのタイムフレーム（5, 15, 60, 240）でルール評価と発火を実行
+            # トレンド計算結果を状態ストアと DB に保存（DB 書き込みは完了を待たない）
             try:
-                print(f'[DEBUG] RULE_EVAL_START for {symbol_val}/{tf_val}')
-                with open(os.path.join(BASE_DIR, 'webhook_error.log'), 'a', encoding='utf-8') as f:
-                    f.write(f'{saved_at} - RULE_EVAL_START for {symbol_val}/{tf_val}\n')
-                    f.flush()
-                evaluate_and_fire_rules(data, symbol_val, tf_val)
-                print(f'[DEBUG] RULE_EVAL_END for {symbol_val}/{tf_val}')
-                # evaluate_all_symbols_from_db() はここでは呼ばない。
-                # evaluate_and_fire_rules() が最新Webhookデータで正確に評価済みのため、
-                # 直後に空の all_clouds={} で再評価すると active_fires が誤ってクリアされるバグを防ぐ。
-                # /current_states エンドポイントが cooldown=5.0 で再評価する。
-                with open(os.path.join(BASE_DIR, 'webhook_error.log'), 'a', encoding='utf-8') as f:
-                    f.write(f'{saved_at} - RULE_EVAL_END for {symbol_val}/{tf_val}\n')
-                    f.flush()
-            except Exception as e:
-                print(f'[ERROR] Rule evaluation failed: {str(e)}')
-                with open(os.path.join(BASE_DIR, 'webhook_error.log'), 'a', encoding='utf-8') as f:
-                    f.write(f'{saved_at} - RULE ERROR for {symbol_val}/{tf_val}: {str(e)}\n')
-                    import traceback
-                    f.write(traceback.format_exc())
-                    f.flush()
+                if isinstance(meta, dict):
+                    data['meta'] = meta
+                    trend_fields['meta_json'] = json.dumps(meta, ensure_ascii=False)
+                if trend_fields:
+                    state_store.update_fields(symbol_val, tf_val, trend_fields)
+                    print(f'[OK] Trend results queued for DB: {symbol_val}/{tf_val}')
+            except Exception as db_err:
+                print(f'[WARNING] Failed to save trend results to DB: {db_err}')
             
-            print(f'[DEBUG] After rule evaluation, before emit for {symbol_val}/{tf_val}')
+            # トレンド計算完了マーカー
+            _trend_log.debug('[TREND_CALC_BLOCK] Trend calculation block completed')
             
-            # Socket.IOで即時更新通知（全クライアントに配信）
-            print(f'[DEBUG] About to emit update_table for {symbol_val}/{tf_val}')
-            socketio.emit('update_table', {'message': 'New data received', 'symbol': symbol_val, 'tf': tf_val})
-            print(f'[DEBUG] update_table emitted successfully for {symbol_val}/{tf_val}')
+            # 全てのタイムフレーム（5, 15, 60, 240）でルール評価と発火を実行し、update_table を通知
+            # （WEBHOOK_COALESCE_MS > 0 ならシンボルごとの合流ウィンドウの終わりにまとめて1回）
+            _rule_coalescer.submit(symbol_val, (data, tf_val))
             
-            # 通貨強弱データを計算してemit
-            try:
-                currency_data = calculate_currency_strength_data()
-                
-                # 変更を検出してDBに記録（エラーが発生してもWebhook処理を継続）
-                try:
-                    detect_and_record_extreme_changes(currency_data)
-                except Exception as history_error:
-                    print(f'[ERROR] Change history recording failed (continuing): {history_error}')
-                    import traceback
-                    traceback.print_exc()
-                    with open(os.path.join(BASE_DIR, 'webhook_error.log'), 'a', encoding='utf-8') as f:
-                        f.write(f'{datetime.now(jst).isoformat()} - [HISTORY_ERROR] {history_error}\n')
-                        f.write(traceback.format_exc())
-                
-                socketio.emit('currency_strength_update', {
-                    'status': 'success',
-                    'data': currency_data,
-                    'timestamp': datetime.now(jst).isoformat()
-                })
-                print(f'[CURRENCY_STRENGTH] Emitted update via SocketIO')
-            except Exception as e:
-                print(f'[ERROR] Failed to emit currency strength: {e}')
-                import traceback
-                traceback.print_exc()
+            # 通貨強弱データを計算してemit（全シンボル共通の合流ウィンドウでまとめて1回）
+            _strength_coalescer.submit(None, symbol_val)
             
             # 市場ステータス更新通知
             market_open = is_fx_market_open()
@@ -2106,40 +1824,129 @@ def webhook():
             
             # 最後の受信時刻を更新
             try:
-                conn_time = sqlite3.connect(DB_PATH)
-                c_time = conn_time.cursor()
-                c_time.execute('UPDATE market_status SET last_receive_time = ? WHERE id = 1', 
-                              (datetime.now(pytz.UTC).isoformat(),))
-                conn_time.commit()
-                conn_time.close()
+                get_writer(DB_PATH).submit('UPDATE market_status SET last_receive_time = ? WHERE id = 1', 
+                                           (datetime.now(pytz.UTC).isoformat(),))
                 print(f'[OK] Updated last receive time')
             except Exception as e:
                 print(f'[ERROR] Updating last receive time: {e}')
         except Exception as e:
             error_msg = f'Database save failed: {str(e)}'
-            print(f'[ERROR] {error_msg}')
-            with open(os.path.join(BASE_DIR, 'webhook_error.log'), 'a', encoding='utf-8') as f:
-                f.write(f'{datetime.now(jst).isoformat()} - SAVE ERROR for {symbol_val}/{tf_val}: {str(e)}\n')
+            _webhook_log.error(f'SAVE ERROR for {symbol_val}/{tf_val}: {str(e)}')
+            return {'status': 'error', 'msg': error_msg}, 500
+        
+        return {'status': 'success'}, 200
+    except Exception as e:
+        error_msg = f'Webhook handler exception: {str(e)}'
+        _webhook_log.error(f'[ERROR] {error_msg}', exc_info=True)
+        return {'status': 'error', 'msg': error_msg}, 500
+
+
+@app.route('/webhook', methods=['POST', 'OPTIONS'])
+def webhook():
+    # OPTIONSリクエストに対応（CORS プリフライト）
+    if request.method == 'OPTIONS':
+        response = make_response('', 204)
+        response.headers['Access-Control-Allow-Origin'] = '*'
+        response.headers['Access-Control-Allow-Methods'] = 'POST, OPTIONS'
+        response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+        response.headers['Access-Control-Max-Age'] = '3600'
+        return response
+
+    try:
+        data = request.json
+        if not data:
+            error_msg = 'No JSON data received'
+            _webhook_log.warning(f'[WEBHOOK ERROR] {error_msg}')
             response = jsonify({'status': 'error', 'msg': error_msg})
             response.headers['Access-Control-Allow-Origin'] = '*'
-            return response, 500
-        
-        response = jsonify({'status': 'success'})
+            return response, 400
+        if not isinstance(data, dict):
+            response = jsonify({'status': 'error', 'msg': 'JSON object expected'})
+            response.headers['Access-Control-Allow-Origin'] = '*'
+            return response, 400
+
+        # 完全一致の再送は何もせずに応答（ジャーナル・DB・ルール評価・配信すべてスキップ）
+        fingerprint = None
+        if WEBHOOK_DEDUP_ENABLED:
+            fingerprint = _payload_fingerprint(data)
+            if not _dedup_claim(fingerprint):
+                print(f'[WEBHOOK SKIP] Duplicate payload for {fingerprint[0]}/{fingerprint[1]} (sent_time={fingerprint[2]})')
+                response = jsonify({'status': 'skipped', 'reason': 'duplicate'})
+                response.headers['Access-Control-Allow-Origin'] = '*'
+                return response, 200
+
+        # 非同期モード: キューに積んで即 202 を返す（処理はワーカーが実施）
+        if WEBHOOK_ASYNC_INGEST:
+            if not _enqueue_webhook(data, fingerprint):
+                _dedup_release(fingerprint)
+                print(f'[INGEST] Queue full - rejected {data.get("symbol", "UNKNOWN")}/{data.get("tf", "")}')
+                response = jsonify({'status': 'error', 'msg': 'ingest queue full'})
+                response.headers['Access-Control-Allow-Origin'] = '*'
+                response.headers['Retry-After'] = '1'
+                return response, 503
+            response = jsonify({'status': 'queued', 'queue_depth': _ingest_queue_depth()})
+            response.headers['Access-Control-Allow-Origin'] = '*'
+            return response, 202
+
+        result, status_code = _process_webhook_payload(data)
+        if status_code >= 500:
+            _dedup_release(fingerprint)
+        response = jsonify(result)
         response.headers['Access-Control-Allow-Origin'] = '*'
-        return response, 200
+        return response, status_code
     except Exception as e:
         error_msg = f'Webhook handler exception: {str(e)}'
-        print(f'[ERROR] {error_msg}')
-        jst = pytz.timezone('Asia/Tokyo')
-        try:
-            with open(os.path.join(BASE_DIR, 'webhook_error.log'), 'a', encoding='utf-8') as f:
-                f.write(f'{datetime.now(jst).isoformat()} - {error_msg}\n')
-        except:
-            pass
+        _webhook_log.error(f'[ERROR] {error_msg}', exc_info=True)
         response = jsonify({'status': 'error', 'msg': error_msg})
         response.headers['Access-Control-Allow-Origin'] = '*'
         return response, 500
 
+
+@app.route('/api/log_levels', methods=['GET', 'POST'])
+def api_log_levels():
+    """サブシステム別ログレベルの取得・変更（POST: {"rules": "DEBUG", ...}）"""
+    try:
+        if request.method == 'POST':
+            payload = request.get_json() or {}
+            for name, level in payload.items():
+                if name not in SUBSYSTEMS:
+                    return jsonify({'status': 'error', 'msg': f'unknown subsystem: {name}'}), 400
+                set_level(name, level)
+        return jsonify({'status': 'success', 'levels': get_levels()}), 200
+    except Exception as e:
+        return jsonify({'status': 'error', 'msg': str(e)}), 500
+
+
+@app.route('/api/ingest/status', methods=['GET'])
+def api_ingest_status():
+    """非同期インジェストのキュー深さ・遅延・処理件数を返す"""
+    try:
+        now = time.time()
+        oldest_age_ms = 0.0
+        per_worker = []
+        for q in _ingest_queues:
+            with q.mutex:
+                depth = len(q.queue)
+                if depth:
+                    oldest_age_ms = max(oldest_age_ms, (now - q.queue[0][0]) * 1000.0)
+            per_worker.append(depth)
+        with _ingest_lock:
+            stats = dict(_ingest_stats)
+        return jsonify({
+            'status': 'success',
+            'mode': 'async' if WEBHOOK_ASYNC_INGEST else 'sync',
+            'workers': len(per_worker),
+            'queue_capacity': WEBHOOK_INGEST_QUEUE_SIZE,
+            'queue_depth': sum(per_worker),
+            'queue_depth_per_worker': per_worker,
+            'oldest_pending_ms': round(oldest_age_ms, 1),
+            'stats': stats,
+            'dedup': _dedup_status(),
+        }), 200
+    except Exception as e:
+        return jsonify({'status': 'error', 'msg': str(e)}), 500
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """ヘルスチェックエンドポイント（サーバーが起動しているか確認）"""
@@ -2148,7 +1955,7 @@ def health_check():
         
         # データベース接続テスト
         try:
-            conn = sqlite3.connect(DB_PATH)
+            conn = get_connection(DB_PATH)
             c = conn.cursor()
             c.execute('SELECT COUNT(*) FROM states')
             states_count = c.fetchone()[0]
@@ -2158,8 +1965,8 @@ def health_check():
             db_ok = False
             states_count = None
         
-        # webhook_log.txt 確認
-        webhook_log_exists = os.path.exists(os.path.join(BASE_DIR, 'webhook_log.txt'))
+        # ジャーナル確認
+        webhook_log_exists = get_journal().count() > 0
         
         return jsonify({
             'status': 'healthy',
@@ -2167,6 +1974,21 @@ def health_check():
             'database_ok': db_ok,
             'states_count': states_count,
             'webhook_log_exists': webhook_log_exists,
+            'db_pool': pool_stats(),
+            'db_writer': writer_stats(),
+            'state_store': get_state_store(DB_PATH).stats(),
+            'trend_cache': trend_cache_stats(),
+            'rule_cache': get_rule_cache(DB_PATH).stats(),
+            'rule_state': get_rule_state_store(DB_PATH).stats(),
+            'rule_evaluator': _rule_eval_status(),
+            'condition_matrix': condition_matrix_stats(DB_PATH),
+            'evaluation_batch': evaluation_batch_stats(),
+            'notifications': get_notification_store(NOTIFICATIONS_PATH).stats(),
+            'coalescer': _coalescer_status(),
+            'strength_broadcast': _strength_broadcaster.stats(),
+            'currency_strength': get_currency_strength_engine(DB_PATH).stats(),
+            'strength_history': get_strength_history(DB_PATH).stats(),
+            'change_history': get_change_history_recorder(DB_PATH).stats(),
             'uptime_message': 'Server is running normally',
             'code_version': 'async-backup-fetch-v1'
         }), 200
@@ -2179,70 +2001,37 @@ def health_check():
 @app.route('/current_states')
 def current_states():
     print('[ACCESS] Current states request')
-    # 全通貨ルール評価を常に更新（クールダウンなし）して発火マークを常に最新状態に一致させる
+    # ルール評価はバックグラウンド評価スレッドが行う（ここでは結果の active_fires を読むだけ）
+    # 起動直後だけは初回の全シンボル評価を待って発火マークを復元してから返す
     try:
-        evaluate_all_symbols_from_db(cooldown=5.0)
+        _start_rule_evaluator()
+        if not _rule_eval_first_sweep.is_set():
+            _rule_eval_first_sweep.wait(RULE_EVAL_STARTUP_WAIT_SEC)
     except Exception as _ae:
-        print(f'[WARN] evaluate_all_symbols_from_db failed: {_ae}')
+        print(f'[WARN] rule evaluator start failed: {_ae}')
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection(DB_PATH)
         c = conn.cursor()
         
         # 通貨ペアの表示順序を取得
         c.execute('SELECT symbol FROM currency_order ORDER BY sort_order ASC')
         ordered_symbols = [row[0] for row in c.fetchall()]
         
-        c.execute('SELECT * FROM states')
-        rows, cols = c.fetchall(), [d[0] for d in c.description]
         conn.close()
         
-        print(f'[INFO] Found {len(rows)} states in DB')
-        
-        # デバッグ: GBPJPYのtfを表示
-        gbpjpy_tfs = [dict(zip(cols, r)).get('tf') for r in rows if dict(zip(cols, r)).get('symbol') == 'GBPJPY']
-        print(f'[DEBUG] GBPJPY timeframes in DB: {gbpjpy_tfs}')
+        # 状態ストアから取得（clouds / meta はパース済み）
+        state_store = get_state_store(DB_PATH)
+        records = state_store.all_rows()
         
-        # まず全データを辞書化し、シンボルごとにグループ化
-        all_data = []
-        for r in rows:
-            d = dict(zip(cols, r))
-            d['clouds'] = json.loads(d.get('clouds_json', '[]'))
-            d['meta'] = json.loads(d.get('meta_json', '{}'))
-            all_data.append(d)
+        _states_log.debug('[INFO] Found %s states in store (version=%s)', len(records), state_store.version)
         
-        # シンボルごとにall_statesを構築
+        # シンボルごとのall_states（トレンド計算用）
         symbol_groups = {}
-        for d in all_data:
-            symbol = d.get('symbol')
-            if symbol not in symbol_groups:
-                symbol_groups[symbol] = {}
-            tf = d.get('tf')
-            # tf を正規化（'5' -> '5m', '15' -> '15m', '1'/'60' -> '1H', '4'/'240' -> '4H'）
-            if tf in ('5', '15', '1', '60', '4', '240'):
-                if tf == '5':
-                    tf_normalized = '5m'
-                elif tf == '15':
-                    tf_normalized = '15m'
-                elif tf in ('1', '60'):
-                    tf_normalized = '1H'
-                elif tf in ('4', '240'):
-                    tf_normalized = '4H'
-                else:
-                    tf_normalized = tf
-            else:
-                tf_normalized = tf
-            symbol_groups[symbol][tf_normalized] = {
-                'clouds': d['clouds'],
-                'clouds_json': d.get('clouds_json', '[]'),
-                'row_order': d.get('row_order', ''),
-                'time': d.get('time')
-            }
         
         states = []
-        for r in rows:
-            d = dict(zip(cols, r))
-            d['clouds'] = json.loads(d.get('clouds_json', '[]'))
-            d['meta'] = json.loads(d.get('meta_json', '{}'))
+        for rec in records:
+            # ストアのレコードは共有なのでコピーして加工（内部用のキーは返さない）
+            d = {k: v for k, v in rec.items() if k not in ('tf_label', 'tf_trend', 'version', 'seq', 'canonical', 'cloud_index')}
             d['row_order'] = d.get('row_order', '').split(',') if d.get('row_order') else []
             d['cloud_order'] = d.get('cloud_order', '').split(',') if d.get('cloud_order') else []
             d['state'] = {'flag': d.get('state_flag', ''), 'word': d.get('state_word', '')}
@@ -2254,24 +2043,14 @@ def current_states():
             symbol = d.get('symbol')
             tf = d.get('tf')
             # tf を正規化（'5' -> '5m', '15' -> '15m', '1'/'60' -> '1H', '4'/'240' -> '4H'）
-            if tf in ('5', '15', '1', '60', '4', '240'):
-                if tf == '5':
-                    tf_normalized = '5m'
-                elif tf == '15':
-                    tf_normalized = '15m'
-                elif tf in ('1', '60'):
-                    tf_normalized = '1H'
-                elif tf in ('4', '240'):
-                    tf_normalized = '4H'
-                else:
-                    tf_normalized = tf
-            else:
-                tf_normalized = tf
+            tf_normalized = rec['tf_trend']
             
             # ★ 返すデータに正規化済み tf も含める（HTMLでのマッチング用）
             d['tf_normalized'] = tf_normalized
             
-            all_states = symbol_groups.get(symbol, {})
+            if symbol not in symbol_groups:
+                symbol_groups[symbol] = state_store.trend_states(symbol)
+            all_states = symbol_groups[symbol]
             state_data = all_states.get(tf_normalized, {
                 'clouds': d['clouds'],
                 'row_order': d.get('row_order', '')
@@ -2290,37 +2069,26 @@ def current_states():
                     d['trend_percentage'] = db_trend_percentage
                     d['trend_strength'] = d.get('trend_strength', '')
                     d['trend_breakdown'] = json.loads(d.get('trend_breakdown_json', '{}')) if d.get('trend_breakdown_json') else {}
-                    print(f'[TREND] {symbol}/{tf}(→{tf_normalized}): Loaded from DB - score={db_trend_score}, direction={db_trend_direction}')
+                    _states_log.debug('[TREND] %s/%s(→%s): Loaded from DB - score=%s, direction=%s', symbol, tf, tf_normalized, db_trend_score, db_trend_direction)
                 else:
                     # DBに値がない場合は計算して保存
-                    trend_result = calculate_trend_strength_v2(tf_normalized, state_data, all_states)
+                    trend_result = calculate_trend_strength_cached(tf_normalized, state_data, all_states)
                     d['trend_strength'] = trend_result['strength']  # 横/弱/中/強/極
                     d['trend_score'] = trend_result['score']  # 0-100点
                     d['trend_direction'] = trend_result['direction']  # 'up', 'down', 'range'
                     d['trend_percentage'] = int((trend_result['score'] / 100.0) * 100)  # パーセント表示（0-100%）
                     d['trend_breakdown'] = trend_result.get('breakdown', {})  # 詳細内訳
-                    print(f'[TREND] {symbol}/{tf}(→{tf_normalized}): Calculated - {trend_result["strength"]} ({trend_result["score"]}点) {trend_result["direction"]}')
+                    _states_log.debug('[TREND] %s/%s(→%s): Calculated - %s (%s点) %s', symbol, tf, tf_normalized, trend_result['strength'], trend_result['score'], trend_result['direction'])
                     
-                    # 計算結果をDBに保存
+                    # 計算結果を状態ストアと DB に保存（書き込みスレッドでまとめてコミット）
                     try:
-                        conn_save = sqlite3.connect(DB_PATH)
-                        c_save = conn_save.cursor()
-                        c_save.execute('''UPDATE states SET 
-                            trend_direction = ?,
-                            trend_score = ?,
-                            trend_percentage = ?,
-                            trend_strength = ?,
-                            trend_breakdown_json = ?
-                            WHERE symbol = ? AND tf = ?''',
-                            (d['trend_direction'],
-                             d['trend_score'],
-                             d['trend_percentage'],
-                             d['trend_strength'],
-                             json.dumps(d['trend_breakdown'], ensure_ascii=False),
-                             symbol,
-                             tf))
-                        conn_save.commit()
-                        conn_save.close()
+                        state_store.update_fields(symbol, tf, {
+                            'trend_direction': d['trend_direction'],
+                            'trend_score': d['trend_score'],
+                            'trend_percentage': d['trend_percentage'],
+                            'trend_strength': d['trend_strength'],
+                            'trend_breakdown_json': json.dumps(d['trend_breakdown'], ensure_ascii=False),
+                        })
                     except Exception as save_err:
                         print(f'[WARNING] Failed to save trend to DB: {save_err}')
             except Exception as trend_err:
@@ -2331,7 +2099,7 @@ def current_states():
                 d['trend_percentage'] = 0
                 d['trend_breakdown'] = {}
             
-            print(f'[INFO] State: {d.get("symbol")}/{d.get("tf")} (clouds={clouds_count})')
+            _states_log.debug('[INFO] State: %s/%s (clouds=%s)', d.get('symbol'), d.get('tf'), clouds_count)
             states.append(d)
         
         # 通貨ペアの表示順序に従ってソート
@@ -2342,7 +2110,7 @@ def current_states():
         
         # レスポンス前にログ出力（最初の3つの state で trend 値を確認）
         for i, s in enumerate(states[:3]):
-            print(f'[RESPONSE] State {i}: {s.get("symbol")}/{s.get("tf")} trend_direction={s.get("trend_direction")}, trend_score={s.get("trend_score")}')
+            _states_log.debug('[RESPONSE] State %s: %s/%s trend_direction=%s, trend_score=%s', i, s.get('symbol'), s.get('tf'), s.get('trend_direction'), s.get('trend_score'))
         
         # active_fires をもとに各 state に last_fire を付加
         for s in states:
@@ -2350,7 +2118,7 @@ def current_states():
             tf_norm = s.get('tf_normalized') or s.get('tf', '')
             fire_info = active_fires.get((sym, tf_norm))
             if fire_info:
-                print(f'[INJECT] last_fire for {sym}/{tf_norm} = {fire_info}')
+                _inject_log.debug('[INJECT] last_fire for %s/%s = %s', sym, tf_norm, fire_info)
             s['last_fire'] = fire_info  # None or {'rule_id', 'rule_name', 'direction'}
 
         response = jsonify({'status': 'success', 'states': states})
@@ -2377,6 +2145,9 @@ def download_db():
         db_size_mb = os.path.getsize(DB_PATH) / (1024 * 1024)
         print(f'[DOWNLOAD] Database size: {db_size_mb:.2f} MB')
         
+        # WAL の未反映分を本体ファイルに書き出してから送信
+        checkpoint(DB_PATH)
+        
         # データベースファイルを送信
         directory = os.path.dirname(DB_PATH)
         filename = os.path.basename(DB_PATH)
@@ -2408,6 +2179,7 @@ def cleanup_old_tf_formats():
             f'webhook_data_backup_cleanup_{datetime.now(jst).strftime("%Y%m%d_%H%M%S")}.db'
         )
         try:
+            checkpoint(DB_PATH)
             shutil.copy(DB_PATH, backup_path)
             print(f'[CLEANUP] Backup created: {backup_path}')
         except Exception as e:
@@ -2415,7 +2187,7 @@ def cleanup_old_tf_formats():
             return jsonify({'status': 'error', 'msg': f'Backup creation failed: {str(e)}'}), 500
         
         # DB接続
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection(DB_PATH)
         c = conn.cursor()
         
         # 削除対象の古い形式
@@ -2455,6 +2227,7 @@ def cleanup_old_tf_formats():
         
         conn.commit()
         conn.close()
+        get_state_store(DB_PATH).reload()
 
         # dynamic_backup.json も同時クリーンアップ
         dynamic_backup_path = os.path.join(BASE_DIR, 'dynamic_backup.json')
@@ -2501,7 +2274,7 @@ def cleanup_old_tf_formats():
 def api_rules_export():
     """全ルールをJSONとして返す（ダウンロード用）"""
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection(DB_PATH)
         c = conn.cursor()
         c.execute('SELECT id, name, enabled, scope_json, rule_json, created_at, updated_at, sort_order FROM rules ORDER BY sort_order ASC, created_at ASC')
         rows = c.fetchall()
@@ -2540,7 +2313,7 @@ def api_rules_import():
         if not rules_list:
             return jsonify({'status': 'error', 'msg': 'rules が空です'}), 400
 
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection(DB_PATH)
         c = conn.cursor()
         jst = pytz.timezone('Asia/Tokyo')
         now = datetime.now(jst).isoformat()
@@ -2577,6 +2350,8 @@ def api_rules_import():
 
         conn.commit()
         conn.close()
+        get_rule_cache(DB_PATH).invalidate()
+        request_full_rule_evaluation()
         return jsonify({'status': 'success', 'imported': imported, 'skipped': skipped}), 200
     except Exception as e:
         import traceback; traceback.print_exc()
@@ -2587,7 +2362,7 @@ def api_rules_import():
 def rules():
     try:
         if request.method == 'GET':
-            conn = sqlite3.connect(DB_PATH)
+            conn = get_connection(DB_PATH)
             c = conn.cursor()
             # sort_orderでソート（小さい順）
             c.execute('SELECT id, name, enabled, scope_json, rule_json, created_at, updated_at, sort_order FROM rules ORDER BY sort_order ASC, created_at ASC')
@@ -2683,7 +2458,7 @@ def rules():
         rule_json = json.dumps(rule_data, ensure_ascii=False)
         updated_at = datetime.now().isoformat()
 
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection(DB_PATH)
         c = conn.cursor()
         # Check if rule exists to preserve created_at and sort_order
         c.execute('SELECT created_at, sort_order FROM rules WHERE id = ?', (rid,))
@@ -2695,6 +2470,8 @@ def rules():
                   (rid, name, enabled, scope_json, rule_json, created_at, updated_at, sort_order))
         conn.commit()
         conn.close()
+        get_rule_cache(DB_PATH).invalidate()
+        request_full_rule_evaluation()
         # ルール変更をJSONバックアップに保存（デプロイ後の自動復元に使用）
         threading.Thread(target=_save_rules_backup, daemon=True).start()
         return jsonify({'status': 'success', 'id': rid}), 200
@@ -2713,7 +2490,7 @@ def reorder_rules():
         
         order = payload['order']  # [{id: rule_id, sort_order: idx}, ...] または [rule_id, ...] の配列
         
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection(DB_PATH)
         c = conn.cursor()
         
         for idx, item in enumerate(order):
@@ -2730,6 +2507,8 @@ def reorder_rules():
         
         conn.commit()
         conn.close()
+        get_rule_cache(DB_PATH).invalidate()
+        request_full_rule_evaluation()
         threading.Thread(target=_save_rules_backup, daemon=True).start()
         return jsonify({'status': 'success'}), 200
     except Exception as e:
@@ -2740,11 +2519,13 @@ def reorder_rules():
 @app.route('/rules/<rule_id>', methods=['DELETE'])
 def delete_rule(rule_id):
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection(DB_PATH)
         c = conn.cursor()
         c.execute('DELETE FROM rules WHERE id = ?', (rule_id,))
         conn.commit()
         conn.close()
+        get_rule_cache(DB_PATH).invalidate()
+        request_full_rule_evaluation()
         threading.Thread(target=_save_rules_backup, daemon=True).start()
         return jsonify({'status': 'success', 'deleted': rule_id}), 200
     except Exception as e:
@@ -2760,7 +2541,7 @@ def toggle_rule(rule_id):
         enabled = data.get('enabled', True)
         enabled_int = 1 if enabled else 0
         
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection(DB_PATH)
         c = conn.cursor()
         
         # rule_json内のenabledフィールドも更新する
@@ -2777,6 +2558,8 @@ def toggle_rule(rule_id):
         
         conn.commit()
         conn.close()
+        get_rule_cache(DB_PATH).invalidate()
+        request_full_rule_evaluation()
         
         print(f'[RULE] Toggled rule {rule_id} enabled={enabled}')
         return jsonify({'status': 'success', 'rule_id': rule_id, 'enabled': enabled}), 200
@@ -2789,7 +2572,7 @@ def toggle_rule(rule_id):
 def get_currency_order():
     """通貨ペアの表示順序を取得"""
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection(DB_PATH)
         c = conn.cursor()
         c.execute('SELECT symbol FROM currency_order ORDER BY sort_order ASC')
         symbols = [row[0] for row in c.fetchall()]
@@ -2810,7 +2593,7 @@ def save_currency_order():
         if not symbols:
             return jsonify({'status': 'error', 'msg': 'No symbols provided'}), 400
         
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection(DB_PATH)
         c = conn.cursor()
         
         # 既存データをクリア
@@ -2836,7 +2619,7 @@ def save_currency_order():
 def test_single_rule(rule_id):
     """単一ルールをテスト"""
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection(DB_PATH)
         c = conn.cursor()
         
         # ルールを取得
@@ -2883,6 +2666,7 @@ def test_single_rule(rule_id):
             for vals in _tf_label_to_db.values():
                 candidate_db_tfs.extend(vals)
 
+        state_store = get_state_store(DB_PATH)
         matches = []
         for sym in symbols:
             try:
@@ -2891,35 +2675,26 @@ def test_single_rule(rule_id):
                 if scope_symbol and scope_symbol != sym:
                     continue
 
-                # 条件の最細TFから順にDB検索し、雲データがあるレコードを使用
-                found_row = None
+                # 条件の最細TFから順に状態ストアを検索し、雲データがあるレコードを使用
+                found_rec = None
                 for db_tf in candidate_db_tfs:
-                    c.execute('SELECT clouds_json, cloud_order FROM states WHERE symbol = ? AND tf = ?', (sym, db_tf))
-                    row_tf = c.fetchone()
-                    if row_tf and row_tf[0]:
-                        found_row = row_tf
+                    rec = state_store.get(sym, db_tf)
+                    if rec and rec.get('clouds_json'):
+                        found_rec = rec
                         break
 
-                # 候補TFに見つからなければ雲データがある任意のレコードを使用
-                if not found_row:
-                    c.execute(
-                        "SELECT clouds_json, cloud_order FROM states WHERE symbol = ? AND clouds_json IS NOT NULL AND clouds_json != '[]' ORDER BY rowid DESC LIMIT 1",
-                        (sym,)
-                    )
-                    found_row = c.fetchone()
+                # 候補TFに見つからなければ雲データがある最新のレコードを使用
+                if not found_rec:
+                    found_rec = next((r for r in state_store.symbol_rows(sym)
+                                      if r.get('clouds_json') and r['clouds_json'] != '[]'), None)
 
-                if not found_row or not found_row[0]:
+                if not found_rec:
                     continue
 
-                clouds = json.loads(found_row[0])
-                cloud_order = found_row[1] if len(found_row) > 1 else None
+                cloud_order = found_rec.get('cloud_order')
 
-                # clouds配列を {tf_label: cloud_data} の辞書に変換
-                cloud_data = {}
-                for cloud in clouds:
-                    label = cloud.get('label')
-                    if label:
-                        cloud_data[label] = cloud
+                # {正規化ラベル: cloud_data}（取り込み時に作成済みの索引をコピー。下で __cloud_order__ を足すため）
+                cloud_data = CloudIndex(found_rec['cloud_index'])
 
                 # cloud_orderを特別なキーで追加（雲整列判定用）
                 if cloud_order:
@@ -2955,7 +2730,23 @@ def rules_test():
         # determine state to use
         used_state = None
         states_for_symbol = []
-        
+        # id(状態) -> 正規化済みフィールド値のメモ（ストアのレコードのメモを共有し、状態の更新ごとに1回だけ正規化）
+        canonical_memos = {}
+        # id(状態) -> CloudIndex（ストアのレコードは取り込み時に作成済み）
+        cloud_indexes = {}
+
+        def _from_record(rec):
+            # ストアのレコードは共有なのでコピーして加工（内部用のキーは返さない）
+            d = {k: v for k, v in rec.items() if k not in ('tf_label', 'tf_trend', 'version', 'seq', 'canonical', 'cloud_index')}
+            d['row_order'] = d.get('row_order','').split(',') if d.get('row_order') else []
+            d['cloud_order'] = d.get('cloud_order','').split(',') if d.get('cloud_order') else []
+            d['state'] = {'flag': d.get('state_flag',''), 'word': d.get('state_word','')}
+            d['daytrade'] = {'status': d.get('daytrade_status',''), 'bos': d.get('daytrade_bos',''), 'time': d.get('daytrade_time','')}
+            d['swing'] = {'status': d.get('swing_status',''), 'bos': d.get('swing_bos',''), 'time': d.get('swing_time','')}
+            canonical_memos[id(d)] = rec['canonical']
+            cloud_indexes[id(d)] = rec['cloud_index']
+            return d
+
         if state_override:
             # state_override を使用（5m JSON には全TFの雲データが含まれる）
             used_state = state_override
@@ -2984,104 +2775,42 @@ def rules_test():
             if 'swing' not in used_state:
                 used_state['swing'] = {'status': used_state.get('swing_status', ''), 'bos': used_state.get('swing_bos', ''), 'time': used_state.get('swing_time', '')}
         else:
-            # query DB for latest state matching scope.symbol if provided
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            if scope and scope.get('symbol'):
-                c.execute('SELECT * FROM states WHERE symbol = ? ORDER BY rowid DESC LIMIT 1', (scope.get('symbol'),))
-            else:
-                c.execute('SELECT * FROM states ORDER BY rowid DESC LIMIT 1')
-            row = c.fetchone()
-            cols = [d[0] for d in c.description] if c.description else []
-            conn.close()
-            if not row:
+            # latest state matching scope.symbol if provided（状態ストアから。ORDER BY rowid DESC 相当）
+            rec = get_state_store(DB_PATH).latest(scope.get('symbol') if scope else None)
+            if not rec:
                 return jsonify({'status':'error','msg':'no state available for test'}), 400
-            d = dict(zip(cols, row))
-            try:
-                d['clouds'] = json.loads(d.get('clouds_json','[]'))
-            except Exception:
-                d['clouds'] = d.get('clouds_json')
-            try:
-                d['meta'] = json.loads(d.get('meta_json','{}'))
-            except Exception:
-                d['meta'] = d.get('meta_json')
-            d['row_order'] = d.get('row_order','').split(',') if d.get('row_order') else []
-            d['cloud_order'] = d.get('cloud_order','').split(',') if d.get('cloud_order') else []
-            d['state'] = {'flag': d.get('state_flag',''), 'word': d.get('state_word','')}
-            d['daytrade'] = {'status': d.get('daytrade_status',''), 'bos': d.get('daytrade_bos',''), 'time': d.get('daytrade_time','')}
-            d['swing'] = {'status': d.get('swing_status',''), 'bos': d.get('swing_bos',''), 'time': d.get('swing_time','')}
-            used_state = d
+            used_state = _from_record(rec)
 
         # Load other states for the same symbol to allow fallback when a requested TF/cloud is missing
         # (This applies to both state_override and DB-queried cases)
         try:
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
             sym = used_state.get('symbol') if used_state else None
             if sym:
-                c.execute('SELECT * FROM states WHERE symbol = ?', (sym,))
-                rows = c.fetchall()
-                cols = [d[0] for d in c.description] if c.description else []
-                for r in rows:
-                    dd = dict(zip(cols, r))
-                    try:
-                        dd['clouds'] = json.loads(dd.get('clouds_json','[]'))
-                    except Exception:
-                        dd['clouds'] = dd.get('clouds_json')
-                    states_for_symbol.append(dd)
-            conn.close()
+                # 以前の SELECT（PRIMARY KEY (symbol, tf) のインデックス順 = tf 順）と同じ並び
+                records = sorted(get_state_store(DB_PATH).symbol_rows(sym), key=lambda r: str(r.get('tf')))
+                states_for_symbol = [_from_record(r) for r in records]
         except Exception:
             states_for_symbol = []
 
         # helper to find a field, with debug info: search used_state first then other states
         def _find_field_with_fallback(label, field):
                 searched = []
-                # normalize helper (reuse same normalization logic as _find_cloud_field)
-                def _tf_to_minutes_local(s):
-                    try:
-                        if s is None:
-                            return None
-                        ss = str(s).strip().lower()
-                        if ss.isdigit():
-                            return int(ss)
-                        if ss.endswith('m'):
-                            return int(ss[:-1])
-                        if ss.endswith('h'):
-                            return int(ss[:-1]) * 60
-                        if 'min' in ss:
-                            num = ''.join([c for c in ss if c.isdigit()])
-                            return int(num) if num else None
-                        digits = ''.join([c for c in ss if c.isdigit()])
-                        if digits:
-                            return int(digits)
-                    except Exception:
-                        return None
-                    return None
+                canon_label = normalize_tf_label(label)
 
-                req_min = _tf_to_minutes_local(label)
-
-                # search a given state object for a matching cloud
+                # search a given state object for a matching cloud（'60' / '1H' どちらの形式でも CloudIndex で引く）
                 def _search_state_for(state_obj):
-                    clouds = state_obj.get('clouds', [])
-                    for c in clouds:
-                        c_label = c.get('label')
-                        searched.append({'state_tf': state_obj.get('tf'), 'cloud_label': c_label})
-                        if str(c_label) == str(label):
-                            val = c.get(field)
-                            # Apply gc default handling here too
-                            if field == 'gc' and val is None and field not in c:
-                                val = False
-                            return {'value': val, 'found_in': {'state_tf': state_obj.get('tf'), 'cloud_label': c_label}}
-                        try:
-                            cmin = _tf_to_minutes_local(c_label)
-                            if req_min is not None and cmin is not None and req_min == cmin:
-                                val = c.get(field)
-                                if field == 'gc' and val is None and field not in c:
-                                    val = False
-                                return {'value': val, 'found_in': {'state_tf': state_obj.get('tf'), 'cloud_label': c_label}}
-                        except Exception:
-                            pass
-                    return None
+                    index = cloud_indexes.get(id(state_obj))
+                    if index is None:
+                        index = cloud_indexes.setdefault(id(state_obj), cloud_index(state_obj))
+                    c = index.cloud(label)
+                    c_label = c.get('label') if c is not None else None
+                    searched.append({'state_tf': state_obj.get('tf'), 'cloud_label': c_label})
+                    if c is None:
+                        return None
+                    val = index.field(label, field)  # gc が雲にない場合は False（DC）
+                    memo = canonical_memos.setdefault(id(state_obj), {})
+                    return {'value': val, 'canonical': canonical_from_memo(memo, (canon_label, field), field, val),
+                            'found_in': {'state_tf': state_obj.get('tf'), 'cloud_label': c_label}}
 
                 # Strategy: search states with most clouds first (most complete data)
                 # Sort states_for_symbol by number of clouds (descending)
@@ -3140,6 +2869,12 @@ def rules_test():
             except Exception:
                 return {'value': None, 'found_in': None, 'searched': []}
 
+        def _canonical(info, field):
+            # 正規化済みの値（ストアのメモにあればそれを使う）
+            if 'canonical' in info:
+                return info['canonical']
+            return canonical_value(field, info.get('value'))
+
         # evaluate conditions
         conditions = (rule.get('conditions') or [])
         logic = rule.get('logic','AND').upper()
@@ -3202,10 +2937,12 @@ def rules_test():
         for cond in conditions:
             # support simple field conds: {label, field, op, value}
             if cond.get('field'):
-                label = cond.get('timeframe') or cond.get('label')
-                field = cond.get('field')
-                op = cond.get('op', '==')
-                val = cond.get('value')
+                # 期待値の正規化・比較関数はここで1回だけ（保存済みルールはルールキャッシュでコンパイル済み）
+                pred = compile_condition(cond)
+                label = pred.tf_label
+                field = pred.field
+                op = pred.op
+                val = pred.value
                 
                 # Special handling for bos_count: use state-level daytrade_bos instead of cloud.bos_count
                 # This matches the frontend display logic which uses state.daytrade.bos
@@ -3242,7 +2979,8 @@ def rules_test():
                 else:
                     info = _get_info(label, field)
                 
-                actual = _normalize_actual(field, info.get('value'))
+                canonical = _canonical(info, field)
+                actual = canonical.value if canonical is not None else None
                 # keep debug info available in details for missing cases
                 info_searched = info.get('searched')
                 info_found = info.get('found_in')
@@ -3294,13 +3032,13 @@ def rules_test():
                         # Get times
                         dauten_info_t = _get_info(label, 'dauten_start_time_str')
                         cross_info_t = _get_info(label, 'cross_start_time')
-                        dauten_time_ms = _parse_time_to_ms(dauten_info_t.get('value'))
-                        cross_time_ms = _parse_time_to_ms(cross_info_t.get('value'))
+                        dauten_time_ms = time_ms(dauten_info_t.get('value'))
+                        cross_time_ms = time_ms(cross_info_t.get('value'))
                         # Get directions
-                        dauten_info = _get_info(label, 'dauten')
-                        cross_info = _get_info(label, 'gc')
-                        dauten_dir = _normalize_actual('dauten', dauten_info.get('value'))
-                        cross_dir = _normalize_actual('gc', cross_info.get('value'))
+                        dauten_canonical = _canonical(_get_info(label, 'dauten'), 'dauten')
+                        cross_canonical = _canonical(_get_info(label, 'gc'), 'gc')
+                        dauten_dir = dauten_canonical.value if dauten_canonical is not None else None
+                        cross_dir = cross_canonical.value if cross_canonical is not None else None
                         
                         if dauten_time_ms is None or cross_time_ms is None or dauten_dir is None or cross_dir is None:
                             details.append({'cond': f"{label}.{field}", 'value': val, 'result': False, 'reason': 'missing_data', 'dauten_dir': dauten_dir, 'cross_dir': cross_dir})
@@ -3365,7 +3103,7 @@ def rules_test():
                             details.append({'cond': f"{label}.{field}", 'actual': None, 'value': val, 'result': False, 'reason': 'missing_field', 'found_in': info_found, 'searched': info_searched})
                             results.append(False)
                         else:
-                            ok = _compare_values(actual, op, val)
+                            ok = pred.comparator(canonical)
                             details.append({'cond': f"{label}.{field}", 'actual': actual, 'op': op, 'value': val, 'result': bool(ok), 'found_in': info_found, 'searched': info_searched})
                             results.append(bool(ok))
                 except Exception as e:
@@ -3383,15 +3121,15 @@ def rules_test():
                     # spec can be dict {label, field} or string '1H.field'
                     if isinstance(spec, dict):
                         vinfo = _get_info(spec.get('label'), spec.get('field'))
-                        return _parse_time_to_ms(vinfo.get('value'))
+                        return time_ms(vinfo.get('value'))
                     if isinstance(spec, str):
                         if '.' in spec:
                             lab, fld = spec.split('.',1)
                             vinfo = _get_info(lab, fld)
-                            return _parse_time_to_ms(vinfo.get('value'))
+                            return time_ms(vinfo.get('value'))
                         else:
-                            return _parse_time_to_ms(spec)
-                    return _parse_time_to_ms(spec)
+                            return time_ms(spec)
+                    return time_ms(spec)
 
                 left_ms = resolve_time(left)
                 right_ms = resolve_time(right)
@@ -3405,16 +3143,7 @@ def rules_test():
                         compare_val = float(compare_val)
                     except Exception:
                         compare_val = 0
-                    if op == '<=':
-                        ok = delta_min <= compare_val
-                    elif op == '>=':
-                        ok = delta_min >= compare_val
-                    elif op == '<':
-                        ok = delta_min < compare_val
-                    elif op == '>':
-                        ok = delta_min > compare_val
-                    else:
-                        ok = False
+                    ok = compile_minutes_comparator(op, compare_val)(left_ms, right_ms)
                     details.append({'cond':'timediff','left_ms':left_ms,'right_ms':right_ms,'delta_min':delta_min,'op':op,'value':compare_val,'result':bool(ok)})
                     results.append(bool(ok))
                 continue
@@ -3482,7 +3211,7 @@ def api_test_fire():
         payload = request.json or {}
         symbol = payload.get('symbol', 'USDJPY')
         
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection(DB_PATH)
         c = conn.cursor()
         # 指定通貨の最新 5m データを取得
         c.execute('SELECT * FROM states WHERE symbol = ? AND tf = ? ORDER BY rowid DESC LIMIT 1', (symbol, '5'))
@@ -3520,24 +3249,9 @@ def api_test_fire():
             'price': float(state_dict.get('price', 0))
         }
         
-        # 通知をファイルに保存
-        notifications_path = os.path.join(BASE_DIR, 'notifications.json')
+        # 通知をファイルに保存（最新100件のみ保持）
         try:
-            if os.path.exists(notifications_path):
-                with open(notifications_path, 'r', encoding='utf-8') as f:
-                    existing = json.load(f)
-            else:
-                existing = []
-            
-            existing.append(test_notification)
-            
-            # 最新100件のみ保持
-            if len(existing) > 100:
-                existing = existing[-100:]
-            
-            with open(notifications_path, 'w', encoding='utf-8') as f:
-                json.dump(existing, f, ensure_ascii=False, indent=2)
-            
+            get_notification_store(NOTIFICATIONS_PATH).append(test_notification)
             print(f'[TEST FIRE] Test notification created for {symbol}: {test_notification}')
         except Exception as e:
             print(f'[ERROR] Saving test notification: {e}')
@@ -3583,16 +3297,10 @@ def api_notifications():
     user_agent = request.headers.get('User-Agent', 'Unknown')
     print(f'[API/NOTIFICATIONS] Client: {client_ip}, User-Agent: {user_agent[:50]}...')
     
-    notifications_path = os.path.join(BASE_DIR, 'notifications.json')
     try:
-        if os.path.exists(notifications_path):
-            with open(notifications_path, 'r', encoding='utf-8') as f:
-                notifications = json.load(f)
-        else:
-            notifications = []
-        
         # Return latest 50 notifications
-        return jsonify({'status': 'success', 'notifications': notifications[-50:]}), 200
+        notifications = get_notification_store(NOTIFICATIONS_PATH).recent(50)
+        return jsonify({'status': 'success', 'notifications': notifications}), 200
     except Exception as e:
         return jsonify({'status': 'error', 'msg': str(e)}), 500
 
@@ -3970,7 +3678,7 @@ def api_backup_recovery():
         print(f'[BACKUP RECOVERY] Found {len(files)} files to process')
         print(f'[BACKUP RECOVERY] Mode: {mode}, Symbol: {symbol}, TF: {tf}, Date: {date}')
         
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection(DB_PATH)
         c = conn.cursor()
         
         for file_path in files:
@@ -4137,6 +3845,8 @@ def api_backup_recovery():
         
         conn.commit()
         conn.close()
+        # DB を直接更新したので状態ストアを読み直す
+        get_state_store(DB_PATH).reload()
         
         print(f'[BACKUP RECOVERY] Summary: Recovered={recovered_count}, Skipped={skipped_count}, Errors={error_count}')
         
@@ -4188,9 +3898,9 @@ def api_backup_send_to_target():
     try:
         # Diagnostic log for incoming calls from browser / UI
         try:
-            origin = request.headers.get('Origin')
-            with open(os.path.join(BASE_DIR, 'webhook_error.log'), 'a', encoding='utf-8') as _log:
-                _log.write(f"[SEND_TO_TARGET] request from {request.remote_addr} Origin={origin} headers={dict(request.headers)}\n")
+            if _webhook_log.isEnabledFor(logging.DEBUG):
+                origin = request.headers.get('Origin')
+                _webhook_log.debug(f"[SEND_TO_TARGET] request from {request.remote_addr} Origin={origin} headers={dict(request.headers)}")
         except Exception:
             pass
 
@@ -4299,11 +4009,8 @@ def api_backup_send_to_target():
 def api_clear_notifications():
     """Clear all notifications"""
     try:
-        notifications_path = os.path.join(BASE_DIR, 'notifications.json')
-        
         # Clear notifications file
-        with open(notifications_path, 'w', encoding='utf-8') as f:
-            json.dump([], f, ensure_ascii=False, indent=2)
+        get_notification_store(NOTIFICATIONS_PATH).clear()
         
         print('[API/CLEAR_NOTIFICATIONS] Notifications cleared')
         return jsonify({'status': 'success'}), 200
@@ -4332,11 +4039,14 @@ def api_market_status():
 def api_clear_fire_history():
     """Clear fire history database"""
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection(DB_PATH)
         c = conn.cursor()
         c.execute('DELETE FROM fire_history')
         conn.commit()
         conn.close()
+        # 前回評価状態も履歴と一緒にリセット（次回評価は初回受信として扱う）
+        get_rule_state_store(DB_PATH).clear()
+        request_full_rule_evaluation()
         
         print('[API/CLEAR_FIRE_HISTORY] Fire history cleared')
         return jsonify({'status': 'success'}), 200
@@ -4348,7 +4058,7 @@ def api_clear_fire_history():
 def api_get_fire_history():
     """Get fire history from database"""
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection(DB_PATH)
         c = conn.cursor()
         
         # Check if direction column exists
@@ -4380,7 +4090,7 @@ def api_get_fire_history():
                 direction = None
             
             # Get rule name from rules table
-            conn_rule = sqlite3.connect(DB_PATH)
+            conn_rule = get_connection(DB_PATH)
             c_rule = conn_rule.cursor()
             c_rule.execute('SELECT name FROM rules WHERE id = ?', (rule_id,))
             rule_row = c_rule.fetchone()
@@ -4468,64 +4178,79 @@ def api_get_fire_history():
         traceback.print_exc()
         return jsonify({'status': 'error', 'msg': str(e)}), 500
 
+def _parse_time_param(value):
+    """クエリの時刻指定（epoch ms / epoch 秒 / ISO8601）を epoch ms に変換"""
+    if value is None or value == '':
+        return None
+    try:
+        num = float(value)
+        return int(num if num > 1e11 else num * 1000)
+    except ValueError:
+        pass
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = pytz.timezone('Asia/Tokyo').localize(dt)
+    return int(dt.timestamp() * 1000)
+
+
+def _tail_file_lines(path, n, block_size=8192):
+    """ファイル末尾から n 行を読む（ファイル全体は読まない）"""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        data = b''
+        while pos > 0 and data.count(b'\n') <= n:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+    lines = data.decode('utf-8', errors='replace').splitlines(keepends=True)
+    return lines[-n:] if n > 0 else []
+
+
 @app.route('/api/webhook_logs')
 def api_webhook_logs():
+    """受信ログ（既定: 最新50件）
+
+    クエリ: limit, symbol, tf, from, to（from/to は epoch ms / 秒 / ISO8601）
+    """
     try:
-        log_path = os.path.join(BASE_DIR, 'webhook_log.txt')
-        if not os.path.exists(log_path):
-            return jsonify({'status': 'success', 'logs': []}), 200
-        
-        with open(log_path, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-        
-        # 最新50件を返す
-        return jsonify({'status': 'success', 'logs': lines[-50:]}), 200
+        limit = max(1, min(int(request.args.get('limit', 50)), 5000))
+        symbol = request.args.get('symbol') or None
+        tf = request.args.get('tf') or None
+        from_ms = _parse_time_param(request.args.get('from'))
+        to_ms = _parse_time_param(request.args.get('to'))
+        journal = get_journal()
+        if from_ms is None and to_ms is None:
+            lines = journal.tail(limit, symbol=symbol, tf=tf)
+        else:
+            lines = journal.read_range(from_ms, to_ms, symbol=symbol, tf=tf, limit=limit)
+        return jsonify({'status': 'success', 'logs': lines}), 200
+    except ValueError as e:
+        return jsonify({'status': 'error', 'msg': f'invalid parameter: {e}'}), 400
     except Exception as e:
         return jsonify({'status': 'error', 'msg': str(e)}), 500
 
-# ===== TFラベル正規化マップ =====
-# Webhook JSON が送ってくる label 値 ("15", "60", "240", "D" など) を
-# サーバー内部で使用する統一ラベル ("15m", "1H", "4H", "D" など) に変換
-_TF_LABEL_NORMALIZE = {
-    '5': '5m',   '5m': '5m',
-    '15': '15m', '15m': '15m',
-    '60': '1H',  '1H': '1H',  '1h': '1H',
-    '240': '4H', '4H': '4H',  '4h': '4H',
-    'D':  'D',   '1D': 'D',   '1440': 'D',
-    'W':  'W',   '1W': 'W',   '10080': 'W',
-    'M':  'M',   '1M': 'M',
-}
+# ===== TFラベル正規化 =====
+# normalize_tf_label は state_store と共通（"15" → "15m", "60" → "1H" など）
 _TF_INTERNAL_TO_RAW = {
     '5m': '5', '15m': '15', '1H': '60', '4H': '240', 'D': 'D', 'W': 'W', 'M': 'M'
 }
 
-def normalize_tf_label(label):
-    """TFラベルを正規化 (例: "15" → "15m", "60" → "1H", "240" → "4H")"""
-    if label is None:
-        return None
-    return _TF_LABEL_NORMALIZE.get(str(label), str(label))
-
 
-def evaluate_and_fire_rules(data, symbol, tf_val):
+def evaluate_and_fire_rules(data, symbol, tf_val, earlier=None):
     """Evaluate all enabled rules against the incoming data and fire notifications if matched.
     
     各タイムフレーム（5, 15, 60, 240）のJSONについて、独立してルール評価を実行。
     - tf=5 の場合：全雲情報を含むため、通常のルール評価
     - tf=15,60,240 の場合：当該時間足のダウ転・突破数・時間情報でルール評価
+    earlier: 合流ウィンドウ内で data より前に届いた [(data, tf_val), ...]（状態は保存済み）。
+             data を主体TFとして1回だけ評価し、earlier の clouds が更新し得るルールも評価対象に含める
     """
-    def wlog(msg):
-        """Debug message to both console and file"""
-        print(msg)
-        try:
-            with open(os.path.join(BASE_DIR, 'webhook_error.log'), 'a', encoding='utf-8') as f:
-                f.write(f'{msg}\n')
-        except:
-            pass
-    
     try:
         global FIRST_RECEIVE_FLAGS, SERVER_START_TIME
         jst = pytz.timezone('Asia/Tokyo')
-        wlog(f'[EVALUATE] Starting rule evaluation for {symbol}/{tf_val}')
+        _rules_log.debug('[EVALUATE] Starting rule evaluation for %s/%s', symbol, tf_val)
         
         # サーバー起動後のデータのみ評価（起動前のデータはスキップ）
         if SERVER_START_TIME is not None:
@@ -4533,7 +4258,7 @@ def evaluate_and_fire_rules(data, symbol, tf_val):
             if webhook_time_ms > 0:
                 webhook_time = datetime.fromtimestamp(webhook_time_ms / 1000, tz=pytz.UTC)
                 if webhook_time < SERVER_START_TIME:
-                    wlog(f'[STARTUP_CHECK] Data from before server startup ({webhook_time.isoformat()} < {SERVER_START_TIME.isoformat()}), skipping evaluation')
+                    _rules_log.debug('[STARTUP_CHECK] Data from before server startup (%s < %s), skipping evaluation', webhook_time.isoformat(), SERVER_START_TIME.isoformat())
                     return
         
         # 受信タイムフレームのラベルを取得
@@ -4545,39 +4270,32 @@ def evaluate_and_fire_rules(data, symbol, tf_val):
         is_first_receive = tf_key not in FIRST_RECEIVE_FLAGS
         
         if is_first_receive:
-            wlog(f'[FIRST_RECEIVE] First data reception for {symbol}/{received_tf_label}')
+            _rules_log.debug('[FIRST_RECEIVE] First data reception for %s/%s', symbol, received_tf_label)
             FIRST_RECEIVE_FLAGS[tf_key] = True
         else:
-            wlog(f'[RECEIVE] Subsequent data reception for {symbol}/{received_tf_label}')
-        
-        # 全タイムフレームの最新データをDBから取得
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        
-        # 全TFのデータを取得（5m/15m/1H/4H/D/W対応）
-        # DBカラムtfは Webhook の生のtf値 ("5","15","60","240","D","W") で保存されている
-        tf_states = {}
-        base_cols = None
-        # 全レコードをシンボルで取得し、最新行だけをtfごとに保持
-        c.execute('SELECT * FROM states WHERE symbol = ? ORDER BY rowid DESC', (symbol,))
-        all_rows = c.fetchall()
-        if all_rows and base_cols is None:
-            base_cols = [d[0] for d in c.description] if c.description else []
-        for tf_row in all_rows:
-            tf_state = dict(zip(base_cols, tf_row))
-            raw_tf = str(tf_state.get('tf', ''))
-            norm_label = normalize_tf_label(raw_tf)
-            if norm_label and norm_label not in tf_states:  # 最新1件のみ保持
-                tf_states[norm_label] = tf_state
+            _rules_log.debug('[RECEIVE] Subsequent data reception for %s/%s', symbol, received_tf_label)
+
+        # 合流ウィンドウ内の先行ペイロード: 受信済みとして記録し、更新し得る (TF, フィールド) を集める
+        extra_touched_keys = set()
+        for earlier_data, earlier_tf in earlier or ():
+            FIRST_RECEIVE_FLAGS[f'{symbol}_{tf_label_map.get(earlier_tf, earlier_tf)}'] = True
+            earlier_clouds = {}
+            for cloud in earlier_data.get('clouds', []) or []:
+                norm_label = normalize_tf_label(cloud.get('label'))
+                if norm_label:
+                    earlier_clouds[norm_label] = cloud
+            extra_touched_keys |= touched_keys_from_clouds(earlier_clouds, normalize_tf_label(earlier_tf))
         
-        conn.close()
+        # 全タイムフレームの最新データを状態ストアから取得（5m/15m/1H/4H/D/W対応）
+        # tfは Webhook の生のtf値 ("5","15","60","240","D","W") で保存され、ラベルごとに最新1件を保持
+        tf_states = get_state_store(DB_PATH).tf_states(symbol)
         
         if not tf_states:
-            wlog(f'[FIRE] No state data found for {symbol} in database')
+            _rules_log.debug('[FIRE] No state data found for %s in database', symbol)
             return
         
-        wlog(f'[FIRE] Retrieved states from DB for {symbol}: {list(tf_states.keys())}')
-        wlog(f'[DEBUG] Calling _evaluate_rules_with_db_state for {symbol}')
+        _rules_log.debug('[FIRE] Retrieved states from DB for %s: %s', symbol, list(tf_states.keys()))
+        _rules_log.debug('[DEBUG] Calling _evaluate_rules_with_db_state for %s', symbol)
         
         # webhook JSON の clouds 配列を正規化して抽出
         # JSON の label 値 ("15", "60", "240", "D") → 内部ラベル ("15m", "1H", "4H", "D") に変換
@@ -4593,23 +4311,22 @@ def evaluate_and_fire_rules(data, symbol, tf_val):
                     all_clouds[norm_label] = cloud
                     if norm_label == current_tf_norm:
                         current_cloud = cloud
-                        wlog(f'[DEBUG] Found current cloud for {norm_label}: dauten={cloud.get("dauten")}, gc={cloud.get("gc")}')
+                        _rules_log.debug('[DEBUG] Found current cloud for %s: dauten=%s, gc=%s', norm_label, cloud.get("dauten"), cloud.get("gc"))
                     else:
-                        wlog(f'[DEBUG] Extracted cloud from webhook: {norm_label} (raw={raw_label}) - dauten={cloud.get("dauten")}, gc={cloud.get("gc")}')
+                        _rules_log.debug('[DEBUG] Extracted cloud from webhook: %s (raw=%s) - dauten=%s, gc=%s', norm_label, raw_label, cloud.get("dauten"), cloud.get("gc"))
         
         if not current_cloud:
-            wlog(f'[WARNING] No cloud data found in webhook for tf={tf_val} (normalized={current_tf_norm})')
+            _rules_log.warning('[WARNING] No cloud data found in webhook for tf=%s (normalized=%s)', tf_val, current_tf_norm)
         
         # 統合データを使用してルール評価（初回受信フラグを渡す）
         # シンボル別ロックで複数Webhookの同時評価によるrace conditionを防止
         with _get_rule_eval_lock(symbol):
-            _evaluate_rules_with_db_state(tf_states, symbol, all_clouds, tf_val, is_first_receive)
-        wlog(f'[DEBUG] _evaluate_rules_with_db_state completed for {symbol}')
+            _evaluate_rules_with_db_state(tf_states, symbol, all_clouds, tf_val, is_first_receive,
+                                          extra_touched_keys=extra_touched_keys)
+        _rules_log.debug('[DEBUG] _evaluate_rules_with_db_state completed for %s', symbol)
         
     except Exception as e:
-        wlog(f'[ERROR] evaluate_and_fire_rules: {e}')
-        import traceback
-        traceback.print_exc()
+        _rules_log.error(f'[ERROR] evaluate_and_fire_rules: {e}', exc_info=True)
 
 
 def evaluate_all_symbols_from_db(cooldown: float = 10.0):
@@ -4626,46 +4343,331 @@ def evaluate_all_symbols_from_db(cooldown: float = 10.0):
 
     print('[ALL_EVAL] Evaluating rules for all symbols in DB')
     try:
-        conn_ae = sqlite3.connect(DB_PATH)
-        c_ae = conn_ae.cursor()
-        c_ae.execute('SELECT DISTINCT symbol FROM states')
-        symbols = [row[0] for row in c_ae.fetchall()]
-        conn_ae.close()
+        symbols = get_state_store(DB_PATH).symbols()
     except Exception as e:
         print(f'[ALL_EVAL] DB error fetching symbols: {e}')
         return
 
+    started = time.perf_counter()
+    timings = evaluate_symbols_from_db(symbols)
+
+    print(f'[ALL_EVAL] Done in {(time.perf_counter() - started) * 1000.0:.1f}ms ({len(symbols)} symbols). active_fires has {len(active_fires)} entries')
+    # 起動直後の初回評価が完了したのでフラグをクリア
+    if _server_just_started:
+        _server_just_started = False
+        print('[ALL_EVAL] サーバー起動後初回評価完了。次回評価から通常発火に戻ります。')
+    return timings
+
+
+# 全シンボル評価の並列数（1 で従来どおり直列）
+RULE_EVAL_POOL_SIZE = max(1, int(os.getenv('RULE_EVAL_POOL_SIZE', '4')))
+_rule_eval_pool = None
+_rule_eval_pool_lock = threading.Lock()
+
+
+def _get_rule_eval_pool():
+    global _rule_eval_pool
+    if _rule_eval_pool is None:
+        with _rule_eval_pool_lock:
+            if _rule_eval_pool is None:
+                _rule_eval_pool = ThreadPoolExecutor(max_workers=RULE_EVAL_POOL_SIZE, thread_name_prefix='rule-eval')
+    return _rule_eval_pool
+
+
+def _symbol_eval_groups(symbols):
+    """同じタスクで直列に評価すべきシンボルのグループ
+
+    match_all_symbols ルールは対象シンボル全体で1つの状態（rule_state / active_fires）を
+    共有するため、そのルールでつながるシンボルは同じグループにまとめる。
+    """
+    parent = {sym: sym for sym in symbols}
+
+    def find(sym):
+        while parent[sym] != sym:
+            parent[sym] = parent[parent[sym]]
+            sym = parent[sym]
+        return sym
+
+    for compiled in get_rule_cache(DB_PATH).enabled_rules():
+        if not (compiled.match_all_symbols and len(compiled.scope_symbols) > 1):
+            continue
+        linked = [sym for sym in compiled.scope_symbols if sym in parent]
+        for sym in linked[1:]:
+            parent[find(sym)] = find(linked[0])
+
+    groups = OrderedDict()
     for sym in symbols:
+        groups.setdefault(find(sym), []).append(sym)
+    return list(groups.values())
+
+
+def _evaluate_symbol_group(group):
+    """グループ内のシンボルを順に評価して {symbol: ms} を返す"""
+    state_store = get_state_store(DB_PATH)
+    timings = {}
+    for sym in group:
+        started = time.perf_counter()
         try:
-            conn_sym = sqlite3.connect(DB_PATH)
-            c_sym = conn_sym.cursor()
-            c_sym.execute('SELECT * FROM states WHERE symbol = ? ORDER BY rowid DESC', (sym,))
-            rows_sym = c_sym.fetchall()
-            cols_sym = [d[0] for d in c_sym.description] if c_sym.description else []
-            conn_sym.close()
-
-            tf_states_sym = {}
-            for row_sym in rows_sym:
-                ts = dict(zip(cols_sym, row_sym))
-                raw_tf = str(ts.get('tf', ''))
-                norm_lbl = normalize_tf_label(raw_tf)
-                if norm_lbl and norm_lbl not in tf_states_sym:
-                    tf_states_sym[norm_lbl] = ts
+            tf_states_sym = state_store.tf_states(sym)
 
             if tf_states_sym:
                 with _get_rule_eval_lock(sym):
                     _evaluate_rules_with_db_state(tf_states_sym, sym, {}, None, False)
         except Exception as e:
             print(f'[ALL_EVAL] Error evaluating {sym}: {e}')
+        timings[sym] = round((time.perf_counter() - started) * 1000.0, 2)
+    return timings
 
-    print(f'[ALL_EVAL] Done. active_fires has {len(active_fires)} entries')
-    # 起動直後の初回評価が完了したのでフラグをクリア
-    if _server_just_started:
-        _server_just_started = False
-        print('[ALL_EVAL] サーバー起動後初回評価完了。次回評価から通常発火に戻ります。')
+
+def evaluate_symbols_from_db(symbols):
+    """指定シンボルのルールを状態ストアの内容だけで評価する（Webhook の clouds なし）
+
+    シンボル（グループ）単位でスレッドプールに振り分ける。シンボルごとの評価ロックは
+    これまでどおり取得するので、同じシンボルの Webhook 評価とは直列になる。
+    戻り値: {symbol: 評価時間ms}
+    """
+    symbols = list(dict.fromkeys(symbols))
+    groups = _symbol_eval_groups(symbols)
+    timings = {}
+    if RULE_EVAL_POOL_SIZE == 1 or len(groups) <= 1:
+        for group in groups:
+            timings.update(_evaluate_symbol_group(group))
+        return timings
+    pool = _get_rule_eval_pool()
+    for future in [pool.submit(_evaluate_symbol_group, group) for group in groups]:
+        try:
+            timings.update(future.result())
+        except Exception as e:
+            print(f'[ALL_EVAL] Evaluation task failed: {e}')
+    return timings
+
+
+# ============================================================
+# バックグラウンドルール評価（dirty シンボル + 定期 tick）
+# ============================================================
+# Webhook 取り込みで状態が変わったシンボルを dirty として記録し、評価スレッドが
+# RULE_EVAL_TICK_SEC ごとにまとめて状態ストアから再評価する（以前は GET /current_states が
+# cooldown=5 秒で全シンボルを評価していた）。起動直後・ルール変更時は全シンボルを評価する。
+RULE_EVAL_TICK_SEC = max(0.5, float(os.getenv('RULE_EVAL_TICK_SEC', '5')))
+# dirty がなくても全シンボルを評価する間隔（秒、0 で無効）
+RULE_EVAL_FULL_SWEEP_SEC = max(0.0, float(os.getenv('RULE_EVAL_FULL_SWEEP_SEC', '300')))
+# 起動直後の初回評価を /current_states が待つ最大秒数
+RULE_EVAL_STARTUP_WAIT_SEC = max(0.0, float(os.getenv('RULE_EVAL_STARTUP_WAIT_SEC', '10')))
+
+_rule_eval_dirty = set()
+_rule_eval_full_requested = True  # 起動直後は全シンボル評価から始める
+_rule_eval_lock = threading.Lock()
+_rule_eval_wakeup = threading.Event()
+_rule_eval_first_sweep = threading.Event()
+_rule_eval_started = False
+# 評価統計（/health で公開）
+_rule_eval_stats = {
+    'ticks': 0,
+    'full_sweeps': 0,
+    'dirty_sweeps': 0,
+    'symbols_evaluated': 0,
+    'last_sweep_ms': 0.0,
+    'last_sweep_at': None,
+    'last_symbol_ms': {},  # 直前の評価のシンボル別所要時間（遅い順）
+}
+
+
+def mark_symbols_dirty(*symbols):
+    """状態が変わったシンボルを次の tick で再評価する"""
+    with _rule_eval_lock:
+        _rule_eval_dirty.update(sym for sym in symbols if sym)
+    _start_rule_evaluator()
+
+
+def request_full_rule_evaluation():
+    """全シンボルをすぐに再評価する（ルール変更時など）"""
+    global _rule_eval_full_requested
+    with _rule_eval_lock:
+        _rule_eval_full_requested = True
+    _start_rule_evaluator()
+    _rule_eval_wakeup.set()
+
+
+def _rule_eval_loop():
+    global _rule_eval_full_requested
+    last_full = 0.0
+    while True:
+        _rule_eval_wakeup.wait(RULE_EVAL_TICK_SEC)
+        _rule_eval_wakeup.clear()
+        now = time.monotonic()
+        with _rule_eval_lock:
+            full = _rule_eval_full_requested or (RULE_EVAL_FULL_SWEEP_SEC > 0 and now - last_full >= RULE_EVAL_FULL_SWEEP_SEC)
+            dirty = sorted(_rule_eval_dirty)
+            _rule_eval_dirty.clear()
+            _rule_eval_full_requested = False
+            _rule_eval_stats['ticks'] += 1
+        if not full and not dirty:
+            continue
+        started = time.perf_counter()
+        timings = {}
+        try:
+            if full:
+                timings = evaluate_all_symbols_from_db(cooldown=0) or {}
+                last_full = now
+            else:
+                timings = evaluate_symbols_from_db(dirty)
+        except Exception as e:
+            print(f'[RULE_EVAL] Sweep failed: {e}')
+            traceback.print_exc()
+        finally:
+            if full:
+                _rule_eval_first_sweep.set()
+        with _rule_eval_lock:
+            _rule_eval_stats['full_sweeps' if full else 'dirty_sweeps'] += 1
+            _rule_eval_stats['symbols_evaluated'] += len(timings)
+            _rule_eval_stats['last_sweep_ms'] = round((time.perf_counter() - started) * 1000.0, 1)
+            _rule_eval_stats['last_symbol_ms'] = dict(sorted(timings.items(), key=lambda kv: kv[1], reverse=True))
+            _rule_eval_stats['last_sweep_at'] = datetime.now(pytz.timezone('Asia/Tokyo')).isoformat()
+
+
+def _start_rule_evaluator():
+    """評価スレッドを起動（初回のみ。gunicorn 起動でも動くよう遅延起動）"""
+    global _rule_eval_started
+    if _rule_eval_started:
+        return
+    with _rule_eval_lock:
+        if _rule_eval_started:
+            return
+        threading.Thread(target=_rule_eval_loop, daemon=True, name='rule-evaluator').start()
+        _rule_eval_started = True
+    _rule_eval_wakeup.set()
+    print(f'[RULE_EVAL] Started background evaluator (tick={RULE_EVAL_TICK_SEC}s, full sweep={RULE_EVAL_FULL_SWEEP_SEC}s)')
+
+
+def _rule_eval_status():
+    with _rule_eval_lock:
+        s = dict(_rule_eval_stats)
+        s['dirty'] = len(_rule_eval_dirty)
+        s['full_requested'] = _rule_eval_full_requested
+    s['started'] = _rule_eval_started
+    s['tick_sec'] = RULE_EVAL_TICK_SEC
+    s['pool_size'] = RULE_EVAL_POOL_SIZE
+    s['full_sweep_sec'] = RULE_EVAL_FULL_SWEEP_SEC
+    return s
+
+
+# ============================================================
+# バー確定時の合流ウィンドウ（WEBHOOK_COALESCE_MS > 0 で有効）
+# ============================================================
+# 足の確定時は同じシンボルの 5/15/60/240 のペイロードが1〜2秒以内に続けて届く。
+# 状態（states・トレンド計算）は受信ごとに即時保存し、ルール評価・update_table 通知はシンボルごとの
+# ウィンドウの終わりに1回だけ、最後のペイロードを主体TFとして合流後の状態で行う。
+# 通貨強弱の計算・極値変化の記録・配信は全シンボル共通なので、キー1つのウィンドウでまとめる。
+# 0 なら合流しない（受信ごとに同期で処理。以前と同じ）。省略できた回数は /health の coalescer.*.saved
+WEBHOOK_COALESCE_MS = max(0.0, float(os.getenv('WEBHOOK_COALESCE_MS', '0')))
+
+
+def _run_coalesced_rules(symbol, items):
+    """合流ウィンドウ1つ分のルール評価（items: [(data, tf_val), ...] 受信順）"""
+    data, tf_val = items[-1]
+    try:
+        _rules_log.debug('RULE_EVAL_START for %s/%s (payloads=%s)', symbol, tf_val, len(items))
+        evaluate_and_fire_rules(data, symbol, tf_val, earlier=items[:-1])
+        # evaluate_all_symbols_from_db() はここでは呼ばない。
+        # evaluate_and_fire_rules() が最新Webhookデータで正確に評価済みのため、
+        # 直後に空の all_clouds={} で再評価すると active_fires が誤ってクリアされるバグを防ぐ。
+        # DB 状態からの再評価はバックグラウンド評価スレッドが次の tick でまとめて行う。
+        mark_symbols_dirty(symbol)
+        _rules_log.debug('RULE_EVAL_END for %s/%s', symbol, tf_val)
+    except Exception as e:
+        _rules_log.error(f'RULE ERROR for {symbol}/{tf_val}: {str(e)}', exc_info=True)
+    
+    # Socket.IOで即時更新通知（全クライアントに配信）
+    update = {'message': 'New data received', 'symbol': symbol, 'tf': tf_val}
+    if len(items) > 1:
+        update['tfs'] = [tf for _, tf in items]
+    socketio.emit('update_table', update)
+    _webhook_log.debug('update_table emitted for %s/%s', symbol, tf_val)
 
 
-def _evaluate_rules_with_db_state(tf_states, symbol, all_clouds=None, current_tf=None, is_first_receive=False):
+def _run_coalesced_currency_strength(_key, symbols):
+    """合流ウィンドウ1つ分の通貨強弱計算・極値変化の記録・配信（symbols: 受信したシンボル）"""
+    try:
+        currency_data = calculate_currency_strength_data()
+        
+        # 変更を検出してDBに記録（エラーが発生してもWebhook処理を継続）
+        try:
+            detect_and_record_extreme_changes(currency_data)
+        except Exception as history_error:
+            _history_log.error(f'[HISTORY_ERROR] Change history recording failed (continuing): {history_error}', exc_info=True)
+        
+        # 時系列に追記（書き込みは db_writer 経由）
+        try:
+            get_strength_history(DB_PATH).record(currency_data)
+        except Exception as history_error:
+            _history_log.error(f'[HISTORY_ERROR] Strength history recording failed (continuing): {history_error}', exc_info=True)
+        
+        # 前回配信からの差分だけを STRENGTH_BROADCAST_MS ごとにまとめて配信
+        _strength_broadcaster.publish(currency_data)
+    except Exception as e:
+        print(f'[ERROR] Failed to emit currency strength: {e}')
+        traceback.print_exc()
+
+
+_rule_coalescer = Coalescer('rules', WEBHOOK_COALESCE_MS, _run_coalesced_rules)
+_strength_coalescer = Coalescer('currency_strength', WEBHOOK_COALESCE_MS, _run_coalesced_currency_strength)
+
+
+def _coalescer_status():
+    return {'rules': _rule_coalescer.stats(), 'currency_strength': _strength_coalescer.stats()}
+
+
+# ============================================================
+# 通貨強弱の差分配信（currency_strength_update）
+# ============================================================
+# 配信の最短間隔（ミリ秒）。この間の更新はまとめて、前回配信からの差分だけを送る（0 なら毎回すぐ送る）
+STRENGTH_BROADCAST_MS = max(0.0, float(os.getenv('STRENGTH_BROADCAST_MS', '500')))
+
+_strength_broadcaster = StrengthBroadcaster(socketio, STRENGTH_BROADCAST_MS, calculate_currency_strength_data)
+
+
+@socketio.on('connect')
+def handle_socket_connect(auth=None):
+    """接続時: 通貨強弱の配信ルームに入れ、スナップショットを送る"""
+    try:
+        join_room(STRENGTH_ROOM)
+        _strength_broadcaster.send_snapshot(request.sid)
+    except Exception as e:
+        print(f'[ERROR] Failed to send currency strength snapshot: {e}')
+
+
+@socketio.on('currency_strength_resync')
+def handle_currency_strength_resync(data=None):
+    """差分のバージョンが飛んだクライアントへスナップショットを送り直す"""
+    try:
+        breakdown = bool((data or {}).get('breakdown'))
+        _strength_broadcaster.send_snapshot(request.sid, breakdown=breakdown, resync=True)
+    except Exception as e:
+        print(f'[ERROR] Failed to resync currency strength: {e}')
+
+
+@socketio.on('currency_strength_subscribe')
+def handle_currency_strength_subscribe(data=None):
+    """breakdown（内訳）の購読を切り替える（{'breakdown': true / false}）"""
+    try:
+        breakdown = bool((data or {}).get('breakdown'))
+        join_room(STRENGTH_BREAKDOWN_ROOM if breakdown else STRENGTH_ROOM)
+        leave_room(STRENGTH_ROOM if breakdown else STRENGTH_BREAKDOWN_ROOM)
+        _strength_broadcaster.send_snapshot(request.sid, breakdown=breakdown)
+    except Exception as e:
+        print(f'[ERROR] Failed to update currency strength subscription: {e}')
+
+
+def _state_clouds(tf_state):
+    """状態レコードの clouds（状態ストアのレコードはパース済みのものを使う）"""
+    clouds = tf_state.get('clouds')
+    if isinstance(clouds, list):
+        return clouds
+    return json.loads(tf_state.get('clouds_json') or '[]')
+
+
+def _evaluate_rules_with_db_state(tf_states, symbol, all_clouds=None, current_tf=None, is_first_receive=False,
+                                  extra_touched_keys=None):
     """DBから取得した全タイムフレームのデータを使用してルール評価
     
     表に表示されている現在値を基にルール判定
@@ -4673,96 +4675,20 @@ def _evaluate_rules_with_db_state(tf_states, symbol, all_clouds=None, current_tf
     - 各TF（15m, 1H, 4H）のDBレコードにはそのTFのダウ転換情報
     all_clouds: webhook から受け取った全TFのクラウドデータ {tf_label: cloud_data, ...}
     is_first_receive: このタイムフレーム・通貨ペアの組み合わせで初回受信かどうか
+    extra_touched_keys: all_clouds 以外に更新された (TF, フィールド)（合流ウィンドウ内の先行ペイロード分）
     """
     global active_fires  # 発火表示状態マップへのアクセス
     global _server_just_started, _restart_baseline  # 起動直後フラグ
-    # Simple inline logging function - writes directly to file
-    def wlog(msg):
-        """Write log directly to file"""
-        try:
-            with open(os.path.join(BASE_DIR, 'webhook_error.log'), 'a', encoding='utf-8') as f:
-                f.write(f'[RULE_V3] {msg}\n')
-                f.flush()
-        except:
-            pass
-    
-    wlog('===== FUNCTION ENTRY =====')
+    _rules_log.debug('[RULE_V3] ===== FUNCTION ENTRY =====')
     
     try:
         # tf_label -> {field: value, ...} のマッピングを作成
         # 表の視覚的内容を正確に反映するため、各TFのDBレコードから取得
         tf_cloud_data = {}
         
-        def build_tf_cloud_data_from_states(tf_states_local):
-            local_clouds = {}
-            for tf_label_norm, tf_state in tf_states_local.items():
-                clouds_json_str = tf_state.get('clouds_json', '[]')
-                try:
-                    clouds_list = json.loads(clouds_json_str)
-                    for cloud in clouds_list:
-                        raw_label2 = cloud.get('label')
-                        norm_label2 = normalize_tf_label(raw_label2)
-                        if norm_label2 and norm_label2 not in local_clouds:
-                            local_clouds[norm_label2] = cloud.copy()
-                except Exception:
-                    pass
-            return local_clouds
-
-        def _match_value(value, expected):
-            if expected is None or expected == '' or (isinstance(expected, str) and expected.strip() == ''):
-                return value is not None
-            return str(value) == str(expected)
-
-        def _direction_from_field(field, value):
-            if value is None:
-                return None
-            if field == 'dauten':
-                v = str(value)
-                if '上昇' in v or 'up' in v.lower():
-                    return '上昇'
-                if '下降' in v or 'down' in v.lower():
-                    return '下降'
-            elif field == 'gc':
-                if value is True or str(value).upper() == 'TRUE' or str(value).startswith('▲'):
-                    return '上昇'
-                if value is False or str(value).upper() == 'FALSE' or str(value).startswith('▼'):
-                    return '下降'
-            elif field == 'bos_count':
-                try:
-                    n = float(value)
-                    return '上昇' if n > 0 else '下降' if n < 0 else None
-                except Exception:
-                    return None
-            elif field == 'po':
-                v = str(value)
-                if '▲' in v or 'up' in v.lower():
-                    return '上昇'
-                if '▼' in v or 'down' in v.lower():
-                    return '下降'
-            return None
-
-        def _evaluate_conditions_on_cloud_data(cloud_data_map, conditions):
-            local_directions = []
-            for cond in conditions:
-                tf_label = cond.get('timeframe') or cond.get('label')
-                field = cond.get('field')
-                expected = cond.get('value')
-                cloud_data = cloud_data_map.get(tf_label)
-                if cloud_data is None:
-                    return False, None
-                found_value = cloud_data.get(field)
-                if not _match_value(found_value, expected):
-                    return False, None
-                dir_val = _direction_from_field(field, found_value)
-                if dir_val:
-                    local_directions.append(dir_val)
-            if not local_directions:
-                return True, None
-            if len(set(local_directions)) == 1:
-                return True, local_directions[0]
-            return True, None
-
-        wlog(f'[DEBUG] all_clouds={list(all_clouds.keys()) if all_clouds else None}, current_tf={current_tf}')
+        # マルチシンボル（match_all_symbols）ルールの横断判定は condition_matrix で全シンボル一括評価する
+
+        _rules_log.debug('[RULE_V3] [DEBUG] all_clouds=%s, current_tf=%s', list(all_clouds.keys()) if all_clouds else None, current_tf)
         
         # ===== Step1: 主体時間足のDBレコードから全TFの雲情報（gc, thickness等）を取得 =====
         # 主体時間足 = current_tf（送信元の時間足）
@@ -4770,44 +4696,35 @@ def _evaluate_rules_with_db_state(tf_states, symbol, all_clouds=None, current_tf
         current_tf_label = normalize_tf_label(str(current_tf))
         tf_state_main = tf_states.get(current_tf_label)
         if tf_state_main:
-            clouds_json_str = tf_state_main.get('clouds_json', '[]')
             try:
-                clouds_in_db = json.loads(clouds_json_str)
-                for cloud in clouds_in_db:
-                    raw_label = cloud.get('label')
-                    norm_label = normalize_tf_label(raw_label)
-                    if norm_label:
-                        tf_cloud_data[norm_label] = cloud.copy()
-                        wlog(f'[DB] Loaded cloud for {norm_label} (raw={raw_label}) from main TF ({current_tf_label}) DB: gc={cloud.get("gc")}, dauten={cloud.get("dauten")}')
+                for norm_label, cloud in cloud_index(tf_state_main).items():
+                    tf_cloud_data[norm_label] = cloud.copy()
+                    _rules_log.debug('[RULE_V3] [DB] Loaded cloud for %s (raw=%s) from main TF (%s) DB: gc=%s, dauten=%s', norm_label, cloud.get('label'), current_tf_label, cloud.get("gc"), cloud.get("dauten"))
             except Exception as e:
-                wlog(f'[ERROR] Failed to parse {current_tf_label} clouds_json: {e}')
+                _rules_log.error('[RULE_V3] [ERROR] Failed to parse %s clouds_json: %s', current_tf_label, e)
         
         # ===== Step2: 各TFのDBレコードからダウ転換情報を上書き（最も信頼できる値）=====
         # 各TFは自分自身のWebhookで正確なdautenを送信する → 各TFのDBレコードを優先
         for tf_label_norm, tf_state in tf_states.items():
-            clouds_json_str = tf_state.get('clouds_json', '[]')
             try:
-                clouds_in_db = json.loads(clouds_json_str)
-                # 自TFのcloudを検索（labelが一致するものを優先、なければ先頭）
-                own_cloud = None
-                for c_item in clouds_in_db:
-                    if normalize_tf_label(c_item.get('label')) == tf_label_norm:
-                        own_cloud = c_item
-                        break
-                if own_cloud is None and clouds_in_db:
-                    own_cloud = clouds_in_db[0]  # fallback
+                # 自TFのcloudを索引で検索（labelが一致するものを優先、なければ先頭）
+                own_cloud = cloud_index(tf_state).get(tf_label_norm)
+                if own_cloud is None:
+                    clouds_in_db = _state_clouds(tf_state)
+                    if clouds_in_db:
+                        own_cloud = clouds_in_db[0]  # fallback
                 if own_cloud:
                     if tf_label_norm in tf_cloud_data:
                         # 既存エントリにダウ転換情報を上書き
                         tf_cloud_data[tf_label_norm]['dauten'] = own_cloud.get('dauten')
                         tf_cloud_data[tf_label_norm]['bos_count'] = own_cloud.get('bos_count')
                         tf_cloud_data[tf_label_norm]['dauten_start_time'] = own_cloud.get('dauten_start_time')
-                        wlog(f'[DB] Overwrote dauten for {tf_label_norm}: dauten={own_cloud.get("dauten")}, bos={own_cloud.get("bos_count")}')
+                        _rules_log.debug('[RULE_V3] [DB] Overwrote dauten for %s: dauten=%s, bos=%s', tf_label_norm, own_cloud.get("dauten"), own_cloud.get("bos_count"))
                     else:
                         tf_cloud_data[tf_label_norm] = own_cloud.copy()
-                        wlog(f'[DB] Loaded {tf_label_norm} data from DB: dauten={own_cloud.get("dauten")}')
+                        _rules_log.debug('[RULE_V3] [DB] Loaded %s data from DB: dauten=%s', tf_label_norm, own_cloud.get("dauten"))
             except Exception as e:
-                wlog(f'[ERROR] Failed to parse {tf_label_norm} clouds_json: {e}')
+                _rules_log.error('[RULE_V3] [ERROR] Failed to parse %s clouds_json: %s', tf_label_norm, e)
         
         # 3. webhook から受け取ったデータで上書き
         # 【重要】dauten/bos_count は各TF自身のWebhookのみ信頼する
@@ -4822,7 +4739,7 @@ def _evaluate_rules_with_db_state(tf_states, symbol, all_clouds=None, current_tf
                         tf_cloud_data[tf_label].update(cloud)
                     else:
                         tf_cloud_data[tf_label] = cloud.copy()
-                    wlog(f'[WEBHOOK] Updated {tf_label} (self TF, all fields): dauten={cloud.get("dauten")}, gc={cloud.get("gc")}')
+                    _rules_log.debug('[RULE_V3] [WEBHOOK] Updated %s (self TF, all fields): dauten=%s, gc=%s', tf_label, cloud.get("dauten"), cloud.get("gc"))
                 else:
                     # 他TFのWebhook: dauten/bos_count/dauten_start_timeは除外してgc等のみ更新
                     # （security()の1バー遅れ問題を回避するためdautenはDBの値を維持）
@@ -4832,81 +4749,52 @@ def _evaluate_rules_with_db_state(tf_states, symbol, all_clouds=None, current_tf
                         tf_cloud_data[tf_label].update(cloud_without_dauten)
                     else:
                         tf_cloud_data[tf_label] = cloud_without_dauten
-                    wlog(f'[WEBHOOK] Updated {tf_label} (other TF, dauten excluded): gc={cloud.get("gc")}')
-        
-        wlog(f'[DEBUG] tf_cloud_data final keys: {list(tf_cloud_data.keys())}')
-        for tf_label, data in tf_cloud_data.items():
-            wlog(f'[DEBUG] {tf_label}: dauten={data.get("dauten")}, gc={data.get("gc")}')
-        
-        # ルールを取得
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute('SELECT id, name, enabled, scope_json, rule_json FROM rules WHERE enabled = 1')
-        rows = c.fetchall()
-        conn.close()
-        
-        if not rows:
+                    _rules_log.debug('[RULE_V3] [WEBHOOK] Updated %s (other TF, dauten excluded): gc=%s', tf_label, cloud.get("gc"))
+        
+        if _rules_log.isEnabledFor(logging.DEBUG):
+            _rules_log.debug('[RULE_V3] [DEBUG] tf_cloud_data final keys: %s', list(tf_cloud_data.keys()))
+            for tf_label, data in tf_cloud_data.items():
+                _rules_log.debug('[RULE_V3] [DEBUG] %s: dauten=%s, gc=%s', tf_label, data.get("dauten"), data.get("gc"))
+        
+        # ルールを取得（コンパイル済みキャッシュ。ルール変更時のみ読み直し）
+        # 逆引きインデックスで、このシンボルのスコープに入り、Webhook の clouds が
+        # 更新し得る (TF, フィールド) を参照するルールだけを評価する
+        # （clouds なしの Webhook・全シンボル再評価では TF/フィールドで絞り込まない）
+        touched_keys = None
+        if all_clouds and current_tf is not None:
+            touched_keys = touched_keys_from_clouds(all_clouds, normalize_tf_label(str(current_tf)))
+            if extra_touched_keys:
+                touched_keys |= extra_touched_keys
+        rules, total_rules = get_rule_cache(DB_PATH).select(symbol, touched_keys)
+        
+        if not total_rules:
             print('[FIRE] No enabled rules')
             return
         
-        print(f'[FIRE] Evaluating {len(rows)} enabled rules for {symbol} using DB state')
+        print(f'[FIRE] Evaluating {len(rules)}/{total_rules} enabled rules for {symbol} using DB state (skipped {total_rules - len(rules)} by index)')
+        if not rules:
+            return
         
         jst = pytz.timezone('Asia/Tokyo')
-        fired_notifications = []
-        for row in rows:
-            rule_id, rule_name, enabled, scope_json, rule_json = row
+        # 発火履歴・ルール状態・発火表示・通知はこの評価の最後にまとめて反映する
+        batch = EvaluationBatch(DB_PATH, active_fires, NOTIFICATIONS_PATH)
+        for compiled in rules:
+            rule_id, rule_name = compiled.id, compiled.name
             try:
-                scope = json.loads(scope_json) if scope_json else {}
-                rule = json.loads(rule_json) if rule_json else {}
+                scope = compiled.scope
+                rule = compiled.rule
                 
-                # ルールの音声設定を取得
-                voice_settings = rule.get('voice', {})
+                # ルールの音声設定（キー名はコンパイル時に snake_case へ統一済み）
+                voice_settings = compiled.voice
                 
-                # フロントエンド互換のためキー名を統一（camelCase -> snake_case）
-                # chime -> chime_file
-                if voice_settings.get('chime') and not voice_settings.get('chime_file'):
-                    voice_settings['chime_file'] = voice_settings['chime']
-                # voiceFile -> voice_file
-                if voice_settings.get('voiceFile') and not voice_settings.get('voice_file'):
-                    voice_settings['voice_file'] = voice_settings['voiceFile']
-                # insertSymbol -> insert_symbol
-                if voice_settings.get('insertSymbol') and not voice_settings.get('insert_symbol'):
-                    voice_settings['insert_symbol'] = voice_settings['insertSymbol']
-                # symbolInsertPosition -> symbol_insert_position
-                if voice_settings.get('symbolInsertPosition') and not voice_settings.get('symbol_insert_position'):
-                    voice_settings['symbol_insert_position'] = voice_settings['symbolInsertPosition']
-                # directionBased -> direction_based
-                if voice_settings.get('directionBased') and not voice_settings.get('direction_based'):
-                    voice_settings['direction_based'] = voice_settings['directionBased']
-                # messagePosition -> message_position
-                if voice_settings.get('messagePosition') and not voice_settings.get('message_position'):
-                    voice_settings['message_position'] = voice_settings['messagePosition']
-                # insertCloudAngle -> insert_cloud_angle
-                if voice_settings.get('insertCloudAngle') and not voice_settings.get('insert_cloud_angle'):
-                    voice_settings['insert_cloud_angle'] = voice_settings['insertCloudAngle']
-                # cloudAnglePosition -> cloud_angle_position
-                if voice_settings.get('cloudAnglePosition') and not voice_settings.get('cloud_angle_position'):
-                    voice_settings['cloud_angle_position'] = voice_settings['cloudAnglePosition']
-                # messageUp -> message_up
-                if voice_settings.get('messageUp') and not voice_settings.get('message_up'):
-                    voice_settings['message_up'] = voice_settings['messageUp']
-                # messageDown -> message_down
-                if voice_settings.get('messageDown') and not voice_settings.get('message_down'):
-                    voice_settings['message_down'] = voice_settings['messageDown']
-                # playChimeFirst -> play_chime_first
-                if voice_settings.get('playChimeFirst') and not voice_settings.get('play_chime_first'):
-                    voice_settings['play_chime_first'] = voice_settings['playChimeFirst']
-                
-                wlog(f'[RULE] Processing rule "{rule_name}" scope={scope}')
-                wlog(f'[RULE] Voice settings: {voice_settings}')
+                _rules_log.debug('[RULE_V3] [RULE] Processing rule "%s" scope=%s', rule_name, scope)
+                _rules_log.debug('[RULE_V3] [RULE] Voice settings: %s', voice_settings)
                 
                 # Check scope: symbol / symbols（複数選択）対応
-                _scope_symbols = scope.get('symbols') or []
-                if not _scope_symbols and scope.get('symbol'):
-                    _scope_symbols = [scope['symbol']]
-                require_all_symbols = bool(scope.get('match_all_symbols'))
+                _scope_symbols = list(compiled.scope_symbols)
+                require_all_symbols = compiled.match_all_symbols
                 if _scope_symbols and symbol not in _scope_symbols:
-                    wlog(f'[RULE] Rule "{rule_name}" skipped: {symbol} not in scope {_scope_symbols}')
+                    _rules_log.debug('[RULE_V3] [RULE] Rule "%s" skipped: %s not in scope %s', rule_name, symbol, _scope_symbols)
                     continue
 
                 rule_identity_symbol = symbol
@@ -4915,51 +4803,33 @@ def _evaluate_rules_with_db_state(tf_states, symbol, all_clouds=None, current_tf
                 if multi_symbol_mode:
                     ordered_symbols = sorted(_scope_symbols)
                     rule_identity_symbol = ','.join(ordered_symbols)
-                    symbol_cloud_data_map = {}
-                    for target_symbol in ordered_symbols:
-                        if target_symbol == symbol:
-                            symbol_cloud_data_map[target_symbol] = build_tf_cloud_data_from_states(tf_states)
-                        else:
-                            conn_sym = sqlite3.connect(DB_PATH)
-                            c_sym = conn_sym.cursor()
-                            c_sym.execute('SELECT * FROM states WHERE symbol = ? ORDER BY rowid DESC', (target_symbol,))
-                            rows_sym = c_sym.fetchall()
-                            cols_sym = [d[0] for d in c_sym.description] if c_sym.description else []
-                            conn_sym.close()
-                            if not rows_sym:
-                                symbol_cloud_data_map = {}
-                                break
-                            target_tf_states = {}
-                            for row_sym in rows_sym:
-                                ts = dict(zip(cols_sym, row_sym))
-                                raw_tf = str(ts.get('tf', ''))
-                                norm_lbl = normalize_tf_label(raw_tf)
-                                if norm_lbl and norm_lbl not in target_tf_states:
-                                    target_tf_states[norm_lbl] = ts
-                            symbol_cloud_data_map[target_symbol] = build_tf_cloud_data_from_states(target_tf_states)
-                    if len(symbol_cloud_data_map) != len(ordered_symbols):
-                        wlog(f'[RULE] Multi-symbol rule "{rule_name}" skipped because some symbol data missing: {_scope_symbols}')
+                    # 全シンボルの特徴行列で条件を一括評価（状態ストアのバージョンごとに1回だけ構築・評価）
+                    condition_matrix = get_condition_matrix(DB_PATH)
+                    if not all(condition_matrix.has_symbol(s) for s in ordered_symbols):
+                        _rules_log.debug('[RULE_V3] [RULE] Multi-symbol rule "%s" skipped because some symbol data missing: %s', rule_name, _scope_symbols)
                         continue
+                    symbol_cloud_data_map = {s: condition_matrix.cloud_map(s) for s in ordered_symbols}
+                    symbol_results = condition_matrix.evaluate_rule(compiled)
                     cross_match = True
                     cross_directions = []
-                    for target_symbol, target_cloud_data in symbol_cloud_data_map.items():
-                        matched, direction = _evaluate_conditions_on_cloud_data(target_cloud_data, rule.get('conditions', []))
+                    for target_symbol in ordered_symbols:
+                        matched, direction = symbol_results[target_symbol]
                         if not matched:
                             cross_match = False
                             break
                         if direction:
                             cross_directions.append(direction)
                     if not cross_match:
-                        wlog(f'[RULE] Multi-symbol rule "{rule_name}" not matched across all symbols: {_scope_symbols}')
+                        _rules_log.debug('[RULE_V3] [RULE] Multi-symbol rule "%s" not matched across all symbols: %s', rule_name, _scope_symbols)
                         # continueせず all_matched=False として状態保存ロジックに流す（条件が崩れた状態を記録し再整合時に発火するため）
                         _multi_result = False
                         condition_directions = []
                     elif cross_directions and len(set(cross_directions)) > 1:
-                        wlog(f'[RULE] Multi-symbol rule "{rule_name}" directions differ across symbols: {cross_directions}')
+                        _rules_log.debug('[RULE_V3] [RULE] Multi-symbol rule "%s" directions differ across symbols: %s', rule_name, cross_directions)
                         _multi_result = False
                         condition_directions = []
                     else:
-                        wlog(f'[RULE] Multi-symbol rule "{rule_name}" matched across all symbols: {_scope_symbols}')
+                        _rules_log.debug('[RULE_V3] [RULE] Multi-symbol rule "%s" matched across all symbols: %s', rule_name, _scope_symbols)
                         _multi_result = True
                         if cross_directions:
                             condition_directions = ['up' if cross_directions[0] == '上昇' else 'down']
@@ -4968,16 +4838,14 @@ def _evaluate_rules_with_db_state(tf_states, symbol, all_clouds=None, current_tf
                 else:
                     condition_directions = []
 
-                wlog(f'[RULE] Testing rule "{rule_name}" for {symbol} with identity {rule_identity_symbol}')
+                _rules_log.debug('[RULE_V3] [RULE] Testing rule "%s" for %s with identity %s', rule_name, symbol, rule_identity_symbol)
                 
                 # ルール条件を評価（AND条件：すべての条件が満たされる必要がある）
-                conditions = rule.get('conditions', [])
+                conditions = compiled.conditions
                 current_tf_label = normalize_tf_label(str(current_tf)) if current_tf is not None else None
-                rule_timeframes = [normalize_tf_label(str(cond.get('timeframe') or cond.get('label'))) for cond in conditions if cond.get('timeframe') or cond.get('label')]
-                rule_timeframes = [tf for tf in rule_timeframes if tf]
-                rule_timeframes_set = set(rule_timeframes)
+                rule_timeframes_set = compiled.tf_labels
                 if current_tf_label and len(rule_timeframes_set) == 1 and current_tf_label != next(iter(rule_timeframes_set)) and not multi_symbol_mode:
-                    wlog(f'[RULE] Skipping single-timeframe rule "{rule_name}" because webhook TF={current_tf_label} does not match rule TF={next(iter(rule_timeframes_set))}')
+                    _rules_log.debug('[RULE_V3] [RULE] Skipping single-timeframe rule "%s" because webhook TF=%s does not match rule TF=%s', rule_name, current_tf_label, next(iter(rule_timeframes_set)))
                     continue
                 
                 all_matched = True
@@ -5019,17 +4887,17 @@ def _evaluate_rules_with_db_state(tf_states, symbol, all_clouds=None, current_tf
                         elif dauten_for_bos == '▼Dow':
                             rule_expected_direction = 'down'
 
-                wlog(f'[RULE][V4_FIXED] Evaluating {len(conditions)} conditions (expected_direction={rule_expected_direction})')
+                _rules_log.debug('[RULE_V3] [RULE][V4_FIXED] Evaluating %s conditions (expected_direction=%s)', len(conditions), rule_expected_direction)
                 
-                for cond in conditions:
-                    tf_label = cond.get('timeframe') or cond.get('label')  # '5m', '15m', '1H', '4H'
-                    field = cond.get('field')      # 'dauten', 'bos_count', 'gc' など
-                    value = cond.get('value')      # 期待値
+                for cond, pred in zip(conditions, compiled.predicates):
+                    tf_label = pred.tf_label  # '5m', '15m', '1H', '4H'
+                    field = pred.field        # 'dauten', 'bos_count', 'gc' など
+                    value = pred.value        # 期待値
                     
                     # クラウドデータから値を取得
                     cloud_data = tf_cloud_data.get(tf_label)
                     if cloud_data is None:
-                        wlog(f'[RULE] Cloud data not available for {tf_label}')
+                        _rules_log.debug('[RULE_V3] [RULE] Cloud data not available for %s', tf_label)
                         all_matched = False
                         break
                     
@@ -5037,8 +4905,8 @@ def _evaluate_rules_with_db_state(tf_states, symbol, all_clouds=None, current_tf
                     
                     # 条件をチェック
                     condition_met = False
-                    # 空文字列('')も「存在チェック」として扱う
-                    is_presence_check = (value is None) or (value == '') or (str(value).strip() == '')
+                    # 空文字列('')も「存在チェック」として扱う（コンパイル時に判定済み）
+                    is_presence_check = pred.is_presence_check
                     if is_presence_check:
                         # Presence check: フィールドが存在し、有効な値を持つかチェック
                         if field == 'gc':
@@ -5069,7 +4937,9 @@ def _evaluate_rules_with_db_state(tf_states, symbol, all_clouds=None, current_tf
                         if field == 'angle':
                             try:
                                 angle_val = float(found_value)
-                                threshold = float(value)
+                                threshold = pred.threshold
+                                if threshold is None:
+                                    raise ValueError(f'invalid angle threshold: {value!r}')
                                 if rule_expected_direction == 'up':
                                     condition_met = angle_val >= threshold
                                 elif rule_expected_direction == 'down':
@@ -5083,7 +4953,7 @@ def _evaluate_rules_with_db_state(tf_states, symbol, all_clouds=None, current_tf
                     
                     if condition_met:
                         matched_conditions.append(cond)
-                        wlog(f'[RULE] Condition met: {tf_label}.{field} = {found_value}')
+                        _rules_log.debug('[RULE_V3] [RULE] Condition met: %s.%s = %s', tf_label, field, found_value)
                         
                         # 各フィールドから方向を判定（JSON形式: ▲Dow/▼Dow/▲GC/▼DC）
                         direction = None
@@ -5107,7 +4977,7 @@ def _evaluate_rules_with_db_state(tf_states, symbol, all_clouds=None, current_tf
                                 direction = 'up'
                             elif dauten_for_bos == '▼Dow':
                                 direction = 'down'
-                            wlog(f'[RULE] bos_count direction from dauten: {dauten_for_bos} -> {direction}')
+                            _rules_log.debug('[RULE_V3] [RULE] bos_count direction from dauten: %s -> %s', dauten_for_bos, direction)
                         elif field == 'angle':
                             try:
                                 angle_num = float(found_value)
@@ -5119,7 +4989,7 @@ def _evaluate_rules_with_db_state(tf_states, symbol, all_clouds=None, current_tf
                                     direction = None
                             except Exception:
                                 direction = None
-                            wlog(f'[RULE] angle direction: {found_value} -> {direction}')
+                            _rules_log.debug('[RULE_V3] [RULE] angle direction: %s -> %s', found_value, direction)
                         elif field == 'po':
                             # POは先頭の▲/▼で方向判定（P2/P3は無視）
                             if isinstance(found_value, str):
@@ -5127,40 +4997,40 @@ def _evaluate_rules_with_db_state(tf_states, symbol, all_clouds=None, current_tf
                                     direction = 'up'
                                 elif found_value.startswith('▼'):
                                     direction = 'down'
-                            wlog(f'[RULE] po direction: {found_value} -> {direction}')
+                            _rules_log.debug('[RULE_V3] [RULE] po direction: %s -> %s', found_value, direction)
                         
                         condition_directions.append(direction)
-                        wlog(f'[RULE] Added direction: {direction}')
+                        _rules_log.debug('[RULE_V3] [RULE] Added direction: %s', direction)
                     else:
                         all_matched = False
-                        wlog(f'[RULE] Condition not met: {tf_label}.{field} (found={found_value}, expected={value})')
+                        _rules_log.debug('[RULE_V3] [RULE] Condition not met: %s.%s (found=%s, expected=%s)', tf_label, field, found_value, value)
                         break
                 
                 # 複数条件の場合、方向の整合性をチェック
-                wlog(f'[RULE] === Direction check START === all_matched={all_matched}, num_conditions={len(conditions)}, directions={condition_directions}')
+                _rules_log.debug('[RULE_V3] [RULE] === Direction check START === all_matched=%s, num_conditions=%s, directions=%s', all_matched, len(conditions), condition_directions)
                 if all_matched and len(conditions) > 1:
                     # None以外の方向を収集
                     valid_directions = [d for d in condition_directions if d is not None]
-                    wlog(f'[RULE] Valid directions: {valid_directions}')
+                    _rules_log.debug('[RULE_V3] [RULE] Valid directions: %s', valid_directions)
                     
                     if len(valid_directions) > 1:
                         # 方向が複数ある場合、すべて同じ方向かチェック
                         if len(set(valid_directions)) > 1:
                             # 方向が一致していない
                             all_matched = False
-                            wlog(f'[RULE] Direction mismatch: {valid_directions} - not firing')
+                            _rules_log.debug('[RULE_V3] [RULE] Direction mismatch: %s - not firing', valid_directions)
                         else:
-                            wlog(f'[RULE] Direction aligned: {valid_directions[0]}')
+                            _rules_log.debug('[RULE_V3] [RULE] Direction aligned: %s', valid_directions[0])
                     elif len(valid_directions) == 1:
-                        wlog(f'[RULE] Single direction: {valid_directions[0]}')
+                        _rules_log.debug('[RULE_V3] [RULE] Single direction: %s', valid_directions[0])
                     else:
-                        wlog(f'[RULE] No direction info available')
+                        _rules_log.debug('[RULE_V3] [RULE] No direction info available')
                 
                 # マルチシンボルモードの場合、単一シンボル評価結果を上書き
                 # （単一シンボルのtf_cloud_dataだけで判定すると「他シンボルが条件不成立」を見落とす）
                 if multi_symbol_mode and _multi_result is not None:
                     all_matched = _multi_result
-                    wlog(f'[RULE] Multi-symbol override: all_matched={all_matched}')
+                    _rules_log.debug('[RULE_V3] [RULE] Multi-symbol override: all_matched=%s', all_matched)
                 
                 # ===== Alignment チェック =====
                 # ルールに alignment 設定がある場合、cloud_order の並び順をチェック
@@ -5177,7 +5047,7 @@ def _evaluate_rules_with_db_state(tf_states, symbol, all_clouds=None, current_tf
                         alignment_is_active = True
                 
                 if alignment_is_active and all_matched:
-                    wlog(f'[RULE] Checking alignment: {alignment_config}')
+                    _rules_log.debug('[RULE_V3] [RULE] Checking alignment: %s', alignment_config)
                     
                     # timeframes (new) または tfs (old) をサポート
                     tfs = alignment_config.get('timeframes') or alignment_config.get('tfs', [])  # ['5m', '15m', '1H', '4H']
@@ -5186,15 +5056,11 @@ def _evaluate_rules_with_db_state(tf_states, symbol, all_clouds=None, current_tf
                     if alignment_config.get('allTimeframes') and not tfs:
                         tfs = ['5m', '15m', '1H', '4H']
                     
-                    # DBから現在の cloud_order を取得
-                    conn_order = sqlite3.connect(DB_PATH)
-                    c_order = conn_order.cursor()
-                    c_order.execute('SELECT cloud_order FROM states WHERE symbol = ? AND tf = ? LIMIT 1', (symbol, '5'))
-                    row_order = c_order.fetchone()
-                    conn_order.close()
+                    # 状態ストアから現在の cloud_order を取得
+                    rec_5m = get_state_store(DB_PATH).get(symbol, '5')
                     
-                    if row_order and row_order[0]:
-                        cloud_order_str = row_order[0]  # '5m,15m,1H,4H,価格' のような文字列
+                    if rec_5m and rec_5m.get('cloud_order'):
+                        cloud_order_str = rec_5m['cloud_order']  # '5m,15m,1H,4H,価格' のような文字列
                         cloud_order = [x.strip() for x in cloud_order_str.split(',')]
                         
                         # 「価格」を除外してTFのみ抽出
@@ -5219,15 +5085,15 @@ def _evaluate_rules_with_db_state(tf_states, symbol, all_clouds=None, current_tf
                                 alignment_direction = '上昇'
                             else:
                                 alignment_direction = '下降'
-                            wlog(f'[RULE] Alignment OK: {selected_order} matches expected order (direction={alignment_direction})')
+                            _rules_log.debug('[RULE_V3] [RULE] Alignment OK: %s matches expected order (direction=%s)', selected_order, alignment_direction)
                         else:
                             all_matched = False
-                            wlog(f'[RULE] Alignment failed: {selected_order} does not match expected order (asc={expected_asc}, desc={expected_desc})')
+                            _rules_log.debug('[RULE_V3] [RULE] Alignment failed: %s does not match expected order (asc=%s, desc=%s)', selected_order, expected_asc, expected_desc)
                     else:
                         all_matched = False
-                        wlog(f'[RULE] Alignment failed: cloud_order not found in DB')
+                        _rules_log.debug('[RULE_V3] [RULE] Alignment failed: cloud_order not found in DB')
                 
-                wlog(f'[RULE] Rule "{rule_name}" result: all_matched={all_matched}')
+                _rules_log.debug('[RULE_V3] [RULE] Rule "%s" result: all_matched=%s', rule_name, all_matched)
 
                 
                 # ===== 値を正規化する関数（比較と保存で共通使用）=====
@@ -5299,36 +5165,19 @@ def _evaluate_rules_with_db_state(tf_states, symbol, all_clouds=None, current_tf
                 num_conditions = len(conditions)
                 should_fire = False
                 
-                # ===== 前回の発火状態を取得 =====
-                # 最新の fire_history から直前の状態を読み出す。
-                # no_fire/initial 行も含めれば、条件が崩れた後の再発火判定が正しくなる。
-                conn_check = sqlite3.connect(DB_PATH)
-                c_check = conn_check.cursor()
-                c_check.execute('''SELECT last_state_snapshot, conditions_snapshot FROM fire_history 
-                                   WHERE rule_id = ? AND symbol = ? AND tf = ?
-                                   ORDER BY id DESC LIMIT 1''', 
-                               (rule_id, rule_identity_symbol, ''))
-                last_fire = c_check.fetchone()
-                conn_check.close()
+                # ===== 前回の評価状態を取得 =====
+                # rule_state（メモリ常駐・write-through）から直前の条件成立フラグとセル値を読み出す。
+                # 条件不成立で記録した状態も含めるので、条件が崩れた後の再発火判定が正しくなる。
+                _prev_state = batch.get_state(rule_id, rule_identity_symbol)
                 
                 last_state = None
                 last_all_matched = False
                 
-                if last_fire and last_fire[0]:
+                if _prev_state is not None:
                     try:
-                        _ls_raw = json.loads(last_fire[0])
-                        _cs_raw = None
-                        if last_fire[1]:
-                            try:
-                                _cs_raw = json.loads(last_fire[1])
-                            except:
-                                _cs_raw = None
-                        # no_fire/initial/restart 行は直前の条件成立が false だったとみなす
-                        if isinstance(_cs_raw, dict) and any(k in _cs_raw for k in ('restart', 'initial', 'no_fire')):
-                            last_all_matched = False
-                        else:
-                            last_all_matched = True
-                        # restart/initial/no_fire フラグ形式でも現在値は保存されている可能性があるため、比較用に復元
+                        _ls_raw = _prev_state.snapshot
+                        last_all_matched = _prev_state.matched
+                        # 旧フォーマットで保存されたセル値も比較用に復元
                         if isinstance(_ls_raw, dict):
                             _has_v3_format = any('.' in k for k in _ls_raw.keys()) or 'tf_order' in _ls_raw
                             if _has_v3_format:
@@ -5347,7 +5196,7 @@ def _evaluate_rules_with_db_state(tf_states, symbol, all_clouds=None, current_tf
                                         _mapped_last[_new_key] = normalize_value_for_comparison(_ls_raw[_c_field], _c_field)
                                 last_state = _mapped_last if _mapped_last else None
                                 if last_state:
-                                    wlog(f'[RULE] 旧フォーマットDB → V3キーにマッピング: {last_state}')
+                                    _rules_log.debug('[RULE_V3] [RULE] 旧フォーマットDB → V3キーにマッピング: %s', last_state)
                             else:
                                 last_state = _ls_raw
                         else:
@@ -5377,7 +5226,7 @@ def _evaluate_rules_with_db_state(tf_states, symbol, all_clouds=None, current_tf
                             _raw = _tcd.get(_tf, {}).get(_fld)
                             _norm = normalize_value_for_comparison(_raw, _fld)
                             current_values[f'{_ts}.{_tf}.{_fld}'] = _norm
-                            wlog(f'[RULE] Multi current: {_ts}.{_tf}.{_fld} = {_raw} → {_norm}')
+                            _rules_log.debug('[RULE_V3] [RULE] Multi current: %s.%s.%s = %s → %s', _ts, _tf, _fld, _raw, _norm)
                 else:
                     for cond in conditions:
                         tf_label = cond.get('timeframe') or cond.get('label')
@@ -5385,7 +5234,7 @@ def _evaluate_rules_with_db_state(tf_states, symbol, all_clouds=None, current_tf
                         raw_value = tf_cloud_data.get(tf_label, {}).get(field)
                         normalized_val = normalize_value_for_comparison(raw_value, field)
                         current_values[f'{tf_label}.{field}'] = normalized_val
-                        wlog(f'[RULE] Current value: {tf_label}.{field} = {raw_value} → {normalized_val}')
+                        _rules_log.debug('[RULE_V3] [RULE] Current value: %s.%s = %s → %s', tf_label, field, raw_value, normalized_val)
                 
                 current_values['__all_matched__'] = all_matched
                 
@@ -5433,20 +5282,18 @@ def _evaluate_rules_with_db_state(tf_states, symbol, all_clouds=None, current_tf
                                         if isinstance(_v, str):
                                             if _v.startswith('▲'): _fire_dir = '上昇'; break
                                             elif _v.startswith('▼'): _fire_dir = '下降'; break
-                                wlog(f'[RULE] _fire_dir fallback from cloud values: {_fire_dir}')
-                        _fa_existing = active_fires.get(_fire_key, {}).get('fired_at')
+                                _rules_log.debug('[RULE_V3] [RULE] _fire_dir fallback from cloud values: %s', _fire_dir)
+                        _fa_existing = (batch.get_active_fire(_fire_key) or {}).get('fired_at')
                         if not _fa_existing:
                             # active_fires が空の場合（サーバー再起動後など）
                             # fire_history から実際の発火日時を取得して再起動後も同じ fp を維持
                             try:
-                                _conn_fh = sqlite3.connect(DB_PATH)
+                                _conn_fh = get_connection(DB_PATH)
                                 _c_fh = _conn_fh.cursor()
                                 _c_fh.execute(
                                     "SELECT fired_at FROM fire_history "
                                     "WHERE rule_id=? AND symbol=? "
                                     "AND conditions_snapshot IS NOT NULL "
-                                    "AND conditions_snapshot NOT LIKE '{\"initial%' "
-                                    "AND conditions_snapshot NOT LIKE '{\"no_fire%' "
                                     "ORDER BY fired_at DESC LIMIT 1",
                                     (rule_id, symbol)
                                 )
@@ -5460,63 +5307,45 @@ def _evaluate_rules_with_db_state(tf_states, symbol, all_clouds=None, current_tf
                                         pass
                             except Exception:
                                 pass
-                        active_fires[_fire_key] = {
+                        _fire_info = {
                             'rule_id': rule_id,
                             'rule_name': rule_name,
                             'direction': _fire_dir,
                             'fired_at': _fa_existing or datetime.now(pytz.timezone('Asia/Tokyo')).strftime('%y/%m/%d %H:%M')
                         }
-                        wlog(f'[ACTIVE_FIRE] Set {_fire_key} = {_fire_dir} fired_at={active_fires[_fire_key]["fired_at"]}')
+                        batch.set_active_fire(_fire_key, _fire_info)
+                        _rules_log.debug('[RULE_V3] [ACTIVE_FIRE] Set %s = %s fired_at=%s', _fire_key, _fire_dir, _fire_info["fired_at"])
                     else:
-                        if _fire_key in active_fires and active_fires[_fire_key].get('rule_id') == rule_id:
-                            del active_fires[_fire_key]
-                            wlog(f'[ACTIVE_FIRE] Cleared {_fire_key} (conditions no longer met)')
+                        if batch.clear_active_fire(_fire_key, rule_id):
+                            _rules_log.debug('[RULE_V3] [ACTIVE_FIRE] Cleared %s (conditions no longer met)', _fire_key)
 
                 # ===== サーバー起動直後：現在値を記録するだけで発火しない =====
-                # (active_fires 更新は上で完了済み → セル表示は即時復元される)
+                # (active_fires 更新は上で予約済み → この評価の最後に反映され、セル表示は即時復元される)
                 if _server_just_started:
-                    wlog(f'[RULE] サーバー起動直後モード: "{rule_name}" の現在値を初期状態として記録（発火しない）')
+                    _rules_log.debug('[RULE_V3] [RULE] サーバー起動直後モード: "%s" の現在値を初期状態として記録（発火しない）', rule_name)
                     _restart_baseline[(rule_id, rule_identity_symbol)] = current_values
                     # 起動直後は初回受信即発火ロジックをスキップするため continue
                     try:
-                        conn_init = sqlite3.connect(DB_PATH)
-                        c_init = conn_init.cursor()
-                        c_init.execute('''INSERT INTO fire_history 
-                                         (rule_id, symbol, tf, fired_at, conditions_snapshot, last_state_snapshot)
-                                         VALUES (?, ?, ?, ?, ?, ?)''',
-                                      (rule_id, rule_identity_symbol, '', datetime.now(jst).isoformat(),
-                                       json.dumps({'initial': True}, ensure_ascii=False),
-                                       json.dumps(current_values, ensure_ascii=False)))
-                        conn_init.commit()
-                        conn_init.close()
+                        batch.set_state(rule_id, rule_identity_symbol, False, current_values)
                     except Exception as e:
-                        wlog(f'[RULE] Error recording startup state: {e}')
+                        _rules_log.error('[RULE_V3] [RULE] Error recording startup state: %s', e)
                     continue
                 # ===== 初回受信（履歴なし）=====
                 if last_state is None:
                     if not _server_just_started and all_matched:
                         # 初回受信かつ条件成立 → 即発火（サーバー起動直後は除く）
-                        wlog(f'[RULE] 初回受信かつ条件成立 → 即発火')
+                        _rules_log.debug('[RULE_V3] [RULE] 初回受信かつ条件成立 → 即発火')
                         should_fire = True
                         # last_state を current_values と同値にして has_change=False にする
                         # (should_fire=True は保持されるため fire ブロックへ到達する)
                         last_state = current_values
                     else:
                         # 条件不成立 or サーバー起動直後 → 現在値を記録するだけ
-                        wlog(f'[RULE] No history found, recording initial state without firing')
+                        _rules_log.debug('[RULE_V3] [RULE] No history found, recording initial state without firing')
                         try:
-                            conn_init = sqlite3.connect(DB_PATH)
-                            c_init = conn_init.cursor()
-                            c_init.execute('''INSERT INTO fire_history 
-                                             (rule_id, symbol, tf, fired_at, conditions_snapshot, last_state_snapshot)
-                                             VALUES (?, ?, ?, ?, ?, ?)''',
-                                          (rule_id, rule_identity_symbol, '', datetime.now(jst).isoformat(),
-                                           json.dumps({'initial': True}, ensure_ascii=False),
-                                           json.dumps(current_values, ensure_ascii=False)))
-                            conn_init.commit()
-                            conn_init.close()
+                            batch.set_state(rule_id, rule_identity_symbol, False, current_values)
                         except Exception as e:
-                            wlog(f'[RULE] Error recording initial state: {e}')
+                            _rules_log.error('[RULE_V3] [RULE] Error recording initial state: %s', e)
                         continue
                 # ===== セルが変化したかチェック =====
                 has_change = False
@@ -5526,75 +5355,48 @@ def _evaluate_rules_with_db_state(tf_states, symbol, all_clouds=None, current_tf
                     if last_val is None and current_val is not None:
                         # 前回値不明(None)→今回値あり: 初期データ取得のため発火しない
                         _unknown_to_known = True
-                        wlog(f'[RULE] Cell initial-known (no fire): {key}: None → {current_val}')
+                        _rules_log.debug('[RULE_V3] [RULE] Cell initial-known (no fire): %s: None → %s', key, current_val)
                     elif current_val != last_val:
                         has_change = True
-                        wlog(f'[RULE] Cell change detected: {key}: {last_val} → {current_val}')
+                        _rules_log.debug('[RULE_V3] [RULE] Cell change detected: %s: %s → %s', key, last_val, current_val)
                         break
                     else:
-                        wlog(f'[RULE] Cell unchanged: {key} = {current_val}')
+                        _rules_log.debug('[RULE_V3] [RULE] Cell unchanged: %s = %s', key, current_val)
                 
                 # None→値遷移のみで has_change=False の場合: 状態を更新して発火しない
                 if _unknown_to_known and not has_change:
-                    wlog(f'[RULE] Initial data received for rule "{rule_name}", updating state without firing')
+                    _rules_log.debug('[RULE_V3] [RULE] Initial data received for rule "%s", updating state without firing', rule_name)
                     try:
-                        conn_unk = sqlite3.connect(DB_PATH)
-                        c_unk = conn_unk.cursor()
-                        c_unk.execute('''INSERT INTO fire_history
-                                         (rule_id, symbol, tf, fired_at, conditions_snapshot, last_state_snapshot)
-                                         VALUES (?, ?, ?, ?, ?, ?)''',
-                                      (rule_id, rule_identity_symbol, '', datetime.now(jst).isoformat(),
-                                       json.dumps({'no_fire': True}, ensure_ascii=False),
-                                       json.dumps(current_values, ensure_ascii=False)))
-                        conn_unk.commit()
-                        conn_unk.close()
+                        batch.set_state(rule_id, rule_identity_symbol, False, current_values)
                     except Exception as e:
-                        wlog(f'[RULE] Error saving initial-known state: {e}')
+                        _rules_log.error('[RULE_V3] [RULE] Error saving initial-known state: %s', e)
                     continue
 
                 # ===== 発火判定: 前回条件不成立から成立に遷移したタイミングのみ発火 =====
                 if all_matched and not last_all_matched:
                     should_fire = True
-                    wlog(f'[RULE] Conditions became met after previous false → FIRE')
+                    _rules_log.debug('[RULE_V3] [RULE] Conditions became met after previous false → FIRE')
                 elif all_matched and last_all_matched and has_change:
-                    wlog(f'[RULE] Conditions still met but state changed → update matched state without firing')
+                    _rules_log.debug('[RULE_V3] [RULE] Conditions still met but state changed → update matched state without firing')
                     try:
-                        conn_mc = sqlite3.connect(DB_PATH)
-                        c_mc = conn_mc.cursor()
-                        c_mc.execute('''INSERT INTO fire_history 
-                                         (rule_id, symbol, tf, fired_at, conditions_snapshot, last_state_snapshot)
-                                         VALUES (?, ?, ?, ?, ?, ?)''',
-                                      (rule_id, rule_identity_symbol, '', datetime.now(jst).isoformat(),
-                                       json.dumps({'matched': True}, ensure_ascii=False),
-                                       json.dumps(current_values, ensure_ascii=False)))
-                        conn_mc.commit()
-                        conn_mc.close()
+                        batch.set_state(rule_id, rule_identity_symbol, True, current_values)
                     except Exception as e:
-                        wlog(f'[RULE] Error saving matched state: {e}')
+                        _rules_log.error('[RULE_V3] [RULE] Error saving matched state: %s', e)
                 elif has_change:
-                    wlog(f'[RULE] Cell changed but conditions not met → no fire')
+                    _rules_log.debug('[RULE_V3] [RULE] Cell changed but conditions not met → no fire')
                     # 値が変化したので次回比較用に状態を更新
                     try:
-                        conn_nc = sqlite3.connect(DB_PATH)
-                        c_nc = conn_nc.cursor()
-                        c_nc.execute('''INSERT INTO fire_history 
-                                         (rule_id, symbol, tf, fired_at, conditions_snapshot, last_state_snapshot)
-                                         VALUES (?, ?, ?, ?, ?, ?)''',
-                                      (rule_id, rule_identity_symbol, '', datetime.now(jst).isoformat(),
-                                       json.dumps({'no_fire': True}, ensure_ascii=False),
-                                       json.dumps(current_values, ensure_ascii=False)))
-                        conn_nc.commit()
-                        conn_nc.close()
+                        batch.set_state(rule_id, rule_identity_symbol, False, current_values)
                     except Exception as e:
-                        wlog(f'[RULE] Error saving state (no fire): {e}')
+                        _rules_log.error('[RULE_V3] [RULE] Error saving state (no fire): %s', e)
                 elif all_matched:
-                    wlog(f'[RULE] Conditions met but no cell change → no fire')
+                    _rules_log.debug('[RULE_V3] [RULE] Conditions met but no cell change → no fire')
                 else:
-                    wlog(f'[RULE] No cell change and conditions not met → no fire')
+                    _rules_log.debug('[RULE_V3] [RULE] No cell change and conditions not met → no fire')
 
                 # ===== 発火処理 =====
                 if should_fire:
-                    wlog(f'[RULE] [OK] FIRING Rule: {rule_name}')
+                    _rules_log.info('[RULE_V3] [RULE] [OK] FIRING Rule: %s', rule_name)
                     
                     # 方向を判定
                     direction = None
@@ -5602,17 +5404,17 @@ def _evaluate_rules_with_db_state(tf_states, symbol, all_clouds=None, current_tf
                     # Alignment ルールの場合は alignment_direction を優先
                     if alignment_direction:
                         direction = alignment_direction
-                        wlog(f'[RULE] Direction from alignment: {direction}')
+                        _rules_log.debug('[RULE_V3] [RULE] Direction from alignment: %s', direction)
                     elif conditions:
                         primary_field = conditions[0].get('field')
                         primary_tf_label = conditions[0].get('timeframe') or conditions[0].get('label')
                         cloud_data = tf_cloud_data.get(primary_tf_label, {})
                         
-                        wlog(f'[RULE] Direction check: primary_field={primary_field}, tf={primary_tf_label}, cloud_data keys={list(cloud_data.keys()) if cloud_data else None}')
+                        _rules_log.debug('[RULE_V3] [RULE] Direction check: primary_field=%s, tf=%s, cloud_data keys=%s', primary_field, primary_tf_label, list(cloud_data.keys()) if cloud_data else None)
                         
                         if primary_field == 'dauten':
                             dauten_value = cloud_data.get('dauten')
-                            wlog(f'[RULE] Direction from dauten: {dauten_value}')
+                            _rules_log.debug('[RULE_V3] [RULE] Direction from dauten: %s', dauten_value)
                             if dauten_value == '▲Dow':
                                 direction = '上昇'
                             elif dauten_value == '▼Dow':
@@ -5621,7 +5423,7 @@ def _evaluate_rules_with_db_state(tf_states, symbol, all_clouds=None, current_tf
                         elif primary_field == 'gc':
                             # ▲GC は上昇（青）、▼DC は下降（赤）
                             gc_value = cloud_data.get('gc')
-                            wlog(f'[RULE] Direction from gc: {gc_value}')
+                            _rules_log.debug('[RULE_V3] [RULE] Direction from gc: %s', gc_value)
                             if gc_value == '▲GC':
                                 direction = '上昇'
                             elif gc_value == '▼DC':
@@ -5631,7 +5433,7 @@ def _evaluate_rules_with_db_state(tf_states, symbol, all_clouds=None, current_tf
                             # BOSの方向は同じTFのdautenから判定
                             dauten_value = cloud_data.get('dauten')
                             bos_value = cloud_data.get('bos_count')
-                            wlog(f'[RULE] Direction from bos_count: bos={bos_value}, dauten={dauten_value}')
+                            _rules_log.debug('[RULE_V3] [RULE] Direction from bos_count: bos=%s, dauten=%s', bos_value, dauten_value)
                             if dauten_value == '▲Dow':
                                 direction = '上昇'
                             elif dauten_value == '▼Dow':
@@ -5640,7 +5442,7 @@ def _evaluate_rules_with_db_state(tf_states, symbol, all_clouds=None, current_tf
                         elif primary_field == 'po':
                             # POは先頭の▲/▼で方向判定（P2/P3は無視）
                             po_value = cloud_data.get('po')
-                            wlog(f'[RULE] Direction from po: {po_value}')
+                            _rules_log.debug('[RULE_V3] [RULE] Direction from po: %s', po_value)
                             if isinstance(po_value, str):
                                 if po_value.startswith('▲'):
                                     direction = '上昇'
@@ -5667,24 +5469,18 @@ def _evaluate_rules_with_db_state(tf_states, symbol, all_clouds=None, current_tf
                                         if _v.startswith('▲'): direction = '上昇'; break
                                         elif _v.startswith('▼'): direction = '下降'; break
                     
-                    wlog(f'[RULE] Final direction for "{rule_name}": {direction}')
+                    _rules_log.debug('[RULE_V3] [RULE] Final direction for "%s": %s', rule_name, direction)
                     
                     # 発火履歴を保存（direction含む）
                     fired_at = datetime.now(jst).isoformat()
                     try:
-                        conn_fire = sqlite3.connect(DB_PATH)
-                        c_fire = conn_fire.cursor()
-                        c_fire.execute('''INSERT INTO fire_history 
-                                         (rule_id, symbol, tf, fired_at, conditions_snapshot, last_state_snapshot, direction)
-                                         VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                                      (rule_id, rule_identity_symbol, '', fired_at,
-                                       json.dumps(conditions, ensure_ascii=False),
-                                       json.dumps(current_values, ensure_ascii=False),
-                                       direction))
-                        conn_fire.commit()
-                        conn_fire.close()
+                        batch.add_fire(rule_id, rule_identity_symbol, fired_at, conditions, current_values, direction)
                     except Exception as e:
-                        wlog(f'[RULE] Error saving fire history: {e}')
+                        _rules_log.error('[RULE_V3] [RULE] Error saving fire history: %s', e)
+                    try:
+                        batch.set_state(rule_id, rule_identity_symbol, True, current_values)
+                    except Exception as e:
+                        _rules_log.error('[RULE_V3] [RULE] Error saving rule state: %s', e)
                     
                     # メッセージを構築（方向別メッセージを含む）
                     common_message = voice_settings.get('message', '')
@@ -5747,7 +5543,7 @@ def _evaluate_rules_with_db_state(tf_states, symbol, all_clouds=None, current_tf
                     if not final_message:
                         final_message = rule_name
                     
-                    fired_notifications.append({
+                    batch.add_notification({
                         'rule_id': rule_id,
                         'rule_name': rule_name,
                         'symbol': symbol,
@@ -5758,50 +5554,31 @@ def _evaluate_rules_with_db_state(tf_states, symbol, all_clouds=None, current_tf
                         'direction': direction,
                         'voice_settings': voice_settings
                     })
-                    wlog(f'[FIRE] [OK] Notification fired for rule "{rule_name}" direction={direction}')
-                    wlog(f'[FIRE] [OK] Added to fired_notifications list (count={len(fired_notifications)})')
+                    _rules_log.info('[RULE_V3] [FIRE] [OK] Notification fired for rule "%s" direction=%s', rule_name, direction)
+                    _rules_log.debug('[RULE_V3] [FIRE] [OK] Added to fired_notifications list (count=%s)', len(batch.notifications))
                 else:
                     # 発火しない場合もログ出力
-                    wlog(f'[RULE] Rule "{rule_name}" not firing')
+                    _rules_log.debug('[RULE_V3] [RULE] Rule "%s" not firing', rule_name)
                 
             except Exception as e:
-                error_msg = f'[FIRE] Error evaluating rule "{rule_name}": {e}'
-                print(error_msg)
-                wlog(error_msg)
-                import traceback
-                tb_str = traceback.format_exc()
-                print(tb_str)
-                wlog(tb_str)
+                _rules_log.error(f'[RULE_V3] [FIRE] Error evaluating rule "{rule_name}": {e}', exc_info=True)
         
+        # 発火履歴（executemany 1回）・ルール状態・active_fires・notifications.json（ポーリング用フォールバック）を反映
+        fired_notifications = batch.commit()
+
         # 発火した通知をSocket.IOで配信
-        wlog(f'[FIRE] Checking fired_notifications: count={len(fired_notifications)}')
+        _rules_log.debug('[RULE_V3] [FIRE] Checking fired_notifications: count=%s', len(fired_notifications))
         if fired_notifications:
-            # notifications.json に保存（ポーリング用フォールバック）
-            notifications_path = os.path.join(BASE_DIR, 'notifications.json')
-            try:
-                if os.path.exists(notifications_path):
-                    with open(notifications_path, 'r', encoding='utf-8') as f:
-                        existing = json.load(f)
-                else:
-                    existing = []
-                existing.extend(fired_notifications)
-                if len(existing) > 100:
-                    existing = existing[-100:]
-                with open(notifications_path, 'w', encoding='utf-8') as f:
-                    json.dump(existing, f, ensure_ascii=False, indent=2)
-                wlog(f'[FIRE] Saved {len(fired_notifications)} notifications to file')
-            except Exception as save_error:
-                wlog(f'[FIRE] ERROR saving notifications to file: {save_error}')
             # 各通知を個別に送信
             for notification in fired_notifications:
                 try:
                     socketio.emit('new_notification', notification)
-                    wlog(f'[FIRE] Emitted new_notification event for rule "{notification["rule_name"]}"')
+                    _rules_log.debug('[RULE_V3] [FIRE] Emitted new_notification event for rule "%s"', notification["rule_name"])
                     print(f'[FIRE] Emitted new_notification event for rule "{notification["rule_name"]}"')
                 except Exception as emit_error:
-                    wlog(f'[FIRE] ERROR emitting notification: {emit_error}')
+                    _rules_log.error('[RULE_V3] [FIRE] ERROR emitting notification: %s', emit_error)
                     print(f'[FIRE] ERROR emitting notification: {emit_error}')
-            wlog(f'[FIRE] Total {len(fired_notifications)} notifications sent')
+            _rules_log.debug('[RULE_V3] [FIRE] Total %s notifications sent', len(fired_notifications))
             print(f'[FIRE] Total {len(fired_notifications)} notifications sent')
         
     except Exception as e:
@@ -5839,32 +5616,26 @@ def _evaluate_rules_with_timeframe_data(data, symbol, tf_val):
         
         print(f'[FIRE] Evaluating rules for {symbol}/{tf_val} ({tf_label}) with cloud data: dauten={tf_cloud.get("dauten")}, bos={tf_cloud.get("bos_count")}')
         
-        # ルールを取得して評価
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute('SELECT id, name, enabled, scope_json, rule_json FROM rules WHERE enabled = 1')
-        rows = c.fetchall()
-        conn.close()
+        # ルールを取得して評価（コンパイル済みキャッシュ）
+        rules = get_rule_cache(DB_PATH).enabled_rules()
         
-        if not rows:
+        if not rules:
             print('[FIRE] No enabled rules')
             return
         
-        print(f'[FIRE] Evaluating {len(rows)} enabled rules for {symbol}/{tf_val}')
+        print(f'[FIRE] Evaluating {len(rules)} enabled rules for {symbol}/{tf_val}')
         
         jst = pytz.timezone('Asia/Tokyo')
         fired_notifications = []
         
-        for row in rows:
-            rule_id, rule_name, enabled, scope_json, rule_json = row
+        for compiled in rules:
+            rule_id, rule_name = compiled.id, compiled.name
             try:
-                scope = json.loads(scope_json) if scope_json else {}
-                rule = json.loads(rule_json) if rule_json else {}
+                scope = compiled.scope
+                rule = compiled.rule
                 
                 # Check scope: symbol / symbols（複数選択）対応
-                _scope_symbols = scope.get('symbols') or []
-                if not _scope_symbols and scope.get('symbol'):
-                    _scope_symbols = [scope['symbol']]
+                _scope_symbols = list(compiled.scope_symbols)
                 if _scope_symbols and symbol not in _scope_symbols:
                     print(f'[FIRE] Rule "{rule_name}" scope mismatch: {symbol} not in {_scope_symbols}')
                     continue
@@ -5915,7 +5686,7 @@ def _evaluate_rules_with_timeframe_data(data, symbol, tf_val):
                     print(f'[FIRE] [OK] Rule MATCHED: {rule_name}')
                     
                     # Get last fired state for this rule/tf
-                    conn_check = sqlite3.connect(DB_PATH)
+                    conn_check = get_connection(DB_PATH)
                     c_check = conn_check.cursor()
                     c_check.execute('''SELECT last_state_snapshot FROM fire_history 
                                        WHERE rule_id = ? AND symbol = ? AND tf = ? 
@@ -5959,7 +5730,7 @@ def _evaluate_rules_with_timeframe_data(data, symbol, tf_val):
                     if should_fire:
                         # 通知を記録してメッセージをキューに追加
                         try:
-                            conn_fire = sqlite3.connect(DB_PATH)
+                            conn_fire = get_connection(DB_PATH)
                             c_fire = conn_fire.cursor()
                             
                             # 現在の状態をスナップショットとして保存
@@ -6042,27 +5813,23 @@ def _evaluate_rules_with_state(base_state):
         symbol = base_state.get('symbol', 'UNKNOWN')
         tf = '5'  # 統合データは常に tf=5 ベース
         
-        # Get all enabled rules
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute('SELECT id, name, enabled, scope_json, rule_json FROM rules WHERE enabled = 1')
-        rows = c.fetchall()
-        conn.close()
+        # Get all enabled rules（コンパイル済みキャッシュ）
+        rules = get_rule_cache(DB_PATH).enabled_rules()
         
-        if not rows:
+        if not rules:
             print('[FIRE] No enabled rules')
             return  # No enabled rules
         
-        print(f'[FIRE] Evaluating {len(rows)} enabled rules for {symbol}/{tf}')
+        print(f'[FIRE] Evaluating {len(rules)} enabled rules for {symbol}/{tf}')
         
         jst = pytz.timezone('Asia/Tokyo')
         fired_notifications = []
         
-        for row in rows:
-            rule_id, rule_name, enabled, scope_json, rule_json = row
+        for compiled in rules:
+            rule_id, rule_name = compiled.id, compiled.name
             try:
-                scope = json.loads(scope_json) if scope_json else {}
-                rule = json.loads(rule_json) if rule_json else {}
+                scope = compiled.scope
+                rule = compiled.rule
                 
                 # Check scope: if scope has symbol, must match
                 if scope.get('symbol') and scope['symbol'] != base_state.get('symbol'):
@@ -6127,7 +5894,7 @@ def _evaluate_rules_with_state(base_state):
                     has_alignment = rule.get('cloudAlign') is not None or rule.get('alignment') is not None
                     
                     # Get last fired state for this rule
-                    conn_check = sqlite3.connect(DB_PATH)
+                    conn_check = get_connection(DB_PATH)
                     c_check = conn_check.cursor()
                     c_check.execute('''SELECT last_state_snapshot FROM fire_history 
                                        WHERE rule_id = ? AND symbol = ? AND tf = ? 
@@ -6310,7 +6077,7 @@ def _evaluate_rules_with_state(base_state):
                         direction = '上昇'
                     
                     # Get custom messages from rule
-                    voice_settings = rule.get('voice', {})
+                    voice_settings = compiled.voice
                     message_up = voice_settings.get('message_up', f'{rule_name} が上昇方向で発火しました')
                     message_down = voice_settings.get('message_down', f'{rule_name} が下降方向で発火しました')
                     common_message = voice_settings.get('message', '')
@@ -6366,7 +6133,7 @@ def _evaluate_rules_with_state(base_state):
                     
                     # Record fire event in history with current state snapshot
                     try:
-                        conn_hist = sqlite3.connect(DB_PATH)
+                        conn_hist = get_connection(DB_PATH)
                         c_hist = conn_hist.cursor()
                         c_hist.execute('''INSERT INTO fire_history (rule_id, symbol, tf, fired_at, conditions_snapshot, last_state_snapshot, direction)
                                          VALUES (?, ?, ?, ?, ?, ?, ?)''',
@@ -6387,22 +6154,9 @@ def _evaluate_rules_with_state(base_state):
         
         # Save notifications to file
         if fired_notifications:
-            notifications_path = os.path.join(BASE_DIR, 'notifications.json')
             try:
-                if os.path.exists(notifications_path):
-                    with open(notifications_path, 'r', encoding='utf-8') as f:
-                        existing = json.load(f)
-                else:
-                    existing = []
-                
-                existing.extend(fired_notifications)
-                
                 # Keep only last 100 notifications
-                if len(existing) > 100:
-                    existing = existing[-100:]
-                
-                with open(notifications_path, 'w', encoding='utf-8') as f:
-                    json.dump(existing, f, ensure_ascii=False, indent=2)
+                get_notification_store(NOTIFICATIONS_PATH).append_many(fired_notifications)
                 
                 print(f'[NOTIFICATIONS] Saved {len(fired_notifications)} notifications')
                 
@@ -6425,36 +6179,32 @@ def webhook_diagnostics():
         jst = pytz.timezone('Asia/Tokyo')
         diagnostics = {
             'server_time': datetime.now(jst).isoformat(),
-            'webhook_log_exists': os.path.exists(os.path.join(BASE_DIR, 'webhook_log.txt')),
+            'webhook_log_exists': get_journal().count() > 0,
             'webhook_error_log_exists': os.path.exists(os.path.join(BASE_DIR, 'webhook_error.log')),
             'database_exists': os.path.exists(DB_PATH),
         }
         
-        # webhook_log.txt の最後の行を取得
-        webhook_log_path = os.path.join(BASE_DIR, 'webhook_log.txt')
-        if os.path.exists(webhook_log_path):
-            try:
-                with open(webhook_log_path, 'r', encoding='utf-8') as f:
-                    lines = f.readlines()
-                    diagnostics['webhook_log_last_entries'] = lines[-10:] if lines else []
-                    diagnostics['webhook_log_total_lines'] = len(lines)
-            except:
-                pass
+        # ジャーナルの最後の行を取得（索引から読むのでファイル全体は読まない）
+        try:
+            journal = get_journal()
+            diagnostics['webhook_log_last_entries'] = journal.tail(10)
+            diagnostics['webhook_log_total_lines'] = journal.count()
+            diagnostics['journal'] = journal.stats()
+        except:
+            pass
         
-        # webhook_error.log の最後の行を取得
+        # webhook_error.log の最後の行を取得（末尾から逆読み）
         webhook_error_path = os.path.join(BASE_DIR, 'webhook_error.log')
         if os.path.exists(webhook_error_path):
             try:
-                with open(webhook_error_path, 'r', encoding='utf-8') as f:
-                    lines = f.readlines()
-                    diagnostics['error_log_last_entries'] = lines[-20:] if lines else []
-                    diagnostics['error_log_total_lines'] = len(lines)
+                diagnostics['error_log_last_entries'] = _tail_file_lines(webhook_error_path, 20)
+                diagnostics['error_log_bytes'] = os.path.getsize(webhook_error_path)
             except:
                 pass
         
         # データベースの最後の記録
         try:
-            conn = sqlite3.connect(DB_PATH)
+            conn = get_connection(DB_PATH)
             c = conn.cursor()
             c.execute("SELECT symbol, tf, time, timestamp FROM states WHERE symbol='USDJPY' AND tf='5' ORDER BY timestamp DESC LIMIT 1")
             last_record = c.fetchone()
@@ -6539,14 +6289,9 @@ if __name__ == '__main__':
     
     # ログファイルの初期化
     jst = pytz.timezone('Asia/Tokyo')
-    startup_log = os.path.join(BASE_DIR, 'webhook_error.log')
-    try:
-        with open(startup_log, 'a', encoding='utf-8') as f:
-            f.write(f'\n{"="*80}\n')
-            f.write(f'{datetime.now(jst).isoformat()} - [STARTUP] Starting Flask server on port {port}\n')
-            f.write(f'{"="*80}\n')
-    except:
-        pass
+    _server_log.info('=' * 80)
+    _server_log.info(f'[STARTUP] Starting Flask server on port {port}')
+    _server_log.info('=' * 80)
     
     # バックアップ自動取得スレッドを起動
     # TF別取得設定（手動取得と同じプラン）
@@ -6638,11 +6383,7 @@ if __name__ == '__main__':
         import traceback
         print('[DEBUG] Full traceback:')
         traceback.print_exc()
-        try:
-            with open(startup_log, 'a', encoding='utf-8') as f:
-                f.write(f'{datetime.now(jst).isoformat()} - {error_msg}\n')
-                f.write(f'Full traceback:\n{traceback.format_exc()}\n')
-        except:
-            pass
+        # webhook_error.log へ（終了時に QueueListener が書き出してから止まる）
+        _server_log.critical(error_msg, exc_info=True)
         raise
 
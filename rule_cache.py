@@ -0,0 +1,293 @@
+"""
+rule_cache.py
+
+有効ルールのコンパイル済みキャッシュ
+- rules テーブル（enabled = 1）を1回だけ読み込み、scope_json / rule_json をパース済みで保持
+- 音声設定のキー名（camelCase → snake_case）はコンパイル時に1回だけ正規化
+- 条件ごとに正規化済み TF ラベル・存在チェックかどうか・数値閾値・比較関数（comparators）を事前計算
+- シンボル → ルール、(TFラベル, フィールド) → ルール の逆引きインデックスで、Webhook ごとに影響するルールだけを選ぶ
+- ルールを変更する API（/rules POST・DELETE・toggle・reorder、/api/rules/import）から invalidate() を呼ぶ
+
+コンパイル済みルールは読み取り専用として扱う（評価側で scope / rule / voice を書き換えない）。
+"""
+
+import json
+import os
+import threading
+from collections import namedtuple
+
+from comparators import compile_comparator
+from db_pool import get_connection
+from state_store import normalize_tf_label
+
+
+# 音声設定のキー名対応（フロントエンド互換: camelCase -> snake_case）
+_VOICE_KEY_ALIASES = (
+    ('chime', 'chime_file'),
+    ('voiceFile', 'voice_file'),
+    ('insertSymbol', 'insert_symbol'),
+    ('symbolInsertPosition', 'symbol_insert_position'),
+    ('directionBased', 'direction_based'),
+    ('messagePosition', 'message_position'),
+    ('insertCloudAngle', 'insert_cloud_angle'),
+    ('cloudAnglePosition', 'cloud_angle_position'),
+    ('messageUp', 'message_up'),
+    ('messageDown', 'message_down'),
+    ('playChimeFirst', 'play_chime_first'),
+)
+
+
+def normalize_voice_settings(voice_settings):
+    """音声設定のキー名を統一（snake_case 側が未設定のときだけ camelCase の値をコピー）"""
+    for camel, snake in _VOICE_KEY_ALIASES:
+        if voice_settings.get(camel) and not voice_settings.get(snake):
+            voice_settings[snake] = voice_settings[camel]
+    return voice_settings
+
+
+# 他TFの Webhook では上書きされないフィールド（各TF自身の Webhook の値を使う）
+OWN_TF_ONLY_FIELDS = ('dauten', 'bos_count', 'dauten_start_time')
+
+
+# 条件1件分の事前計算結果
+#   tf_label: 条件に書かれたラベル（'15m' など、未正規化）
+#   tf_norm: 正規化済みラベル
+#   is_presence_check: 期待値が空（存在チェック）
+#   threshold: angle 条件の数値閾値（数値化できない場合 None）
+#   op / comparator: 比較演算子と、期待値を正規化済みの比較関数（_compare_values 相当）
+CompiledCondition = namedtuple('CompiledCondition',
+                               'tf_label tf_norm field value is_presence_check threshold op comparator')
+
+
+def compile_condition(cond):
+    tf_label = cond.get('timeframe') or cond.get('label')
+    value = cond.get('value')
+    is_presence_check = (value is None) or (value == '') or (str(value).strip() == '')
+    threshold = None
+    if cond.get('field') == 'angle' and not is_presence_check:
+        try:
+            threshold = float(value)
+        except (TypeError, ValueError):
+            threshold = None
+    op = cond.get('op', '==')
+    return CompiledCondition(tf_label, normalize_tf_label(str(tf_label)) if tf_label else None,
+                             cond.get('field'), value, is_presence_check, threshold,
+                             op, compile_comparator(op, value))
+
+
+def _alignment_is_active(rule):
+    """cloudAlign（新形式）/ alignment（旧形式）が有効か（render_server の判定と同じ）"""
+    config = rule.get('cloudAlign') or rule.get('alignment')
+    if not isinstance(config, dict):
+        return False
+    tfs = config.get('timeframes') or config.get('tfs', [])
+    return bool(config.get('allTimeframes') or tfs)
+
+
+def _condition_keys(predicates, scope, scope_symbols, rule):
+    # マルチシンボル一致ルールは全シンボルの状態を参照するため絞り込まない
+    if scope.get('match_all_symbols') and len(scope_symbols) > 1:
+        return None
+    # 雲の並び順（5m レコードの cloud_order）を見るルールも条件の (TF, フィールド) では絞り込めない
+    if _alignment_is_active(rule):
+        return None
+    # 条件なし・TF/フィールド未指定の条件を含むルールも絞り込まない
+    if not predicates or any(not p.tf_norm or not p.field for p in predicates):
+        return None
+    return frozenset((p.tf_norm, p.field) for p in predicates)
+
+
+class CompiledRule:
+    """コンパイル済みルール（属性は生成後に変更不可）"""
+
+    __slots__ = ('id', 'name', 'scope', 'rule', 'voice', 'conditions', 'predicates',
+                 'scope_symbols', 'match_all_symbols', 'scope_tf', 'tf_labels', 'keys')
+
+    def __init__(self, rule_id, name, scope, rule):
+        voice = rule.get('voice', {})
+        if isinstance(voice, dict):
+            normalize_voice_settings(voice)
+        conditions = rule.get('conditions', [])
+        scope_symbols = scope.get('symbols') or []
+        if not scope_symbols and scope.get('symbol'):
+            scope_symbols = [scope['symbol']]
+        predicates = tuple(compile_condition(cond) for cond in conditions)
+        values = {
+            'id': rule_id,
+            'name': name,
+            'scope': scope,
+            'rule': rule,
+            'voice': voice,
+            'conditions': conditions,
+            'predicates': predicates,
+            'scope_symbols': tuple(scope_symbols),
+            'match_all_symbols': bool(scope.get('match_all_symbols')),
+            'scope_tf': scope.get('tf'),
+            'tf_labels': frozenset(p.tf_norm for p in predicates if p.tf_norm),
+            # 参照する (TFラベル, フィールド)。None は「どの Webhook でも評価する」
+            'keys': _condition_keys(predicates, scope, scope_symbols, rule),
+        }
+        for key, value in values.items():
+            object.__setattr__(self, key, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('CompiledRule is read-only')
+
+    def applies_to(self, symbol):
+        """scope.symbol / scope.symbols の範囲内か"""
+        return not self.scope_symbols or symbol in self.scope_symbols
+
+    def __repr__(self):
+        return f'CompiledRule({self.id!r}, {self.name!r})'
+
+
+class RuleIndex:
+    """コンパイル済みルールの逆引きインデックス"""
+
+    def __init__(self, rules):
+        self.rules = rules
+        self._position = {rule.id: i for i, rule in enumerate(rules)}
+        self._unscoped = []      # scope.symbol(s) 指定なし
+        self._by_symbol = {}     # symbol -> [rule]
+        self._unkeyed = set()    # (TF, フィールド) で絞り込まないルールID
+        self._by_key = {}        # (tf_label, field) -> {rule_id}
+        for rule in rules:
+            if rule.scope_symbols:
+                for sym in rule.scope_symbols:
+                    self._by_symbol.setdefault(sym, []).append(rule)
+            else:
+                self._unscoped.append(rule)
+            if rule.keys is None:
+                self._unkeyed.add(rule.id)
+            else:
+                for key in rule.keys:
+                    self._by_key.setdefault(key, set()).add(rule.id)
+
+    def for_symbol(self, symbol):
+        """シンボルのスコープに入るルール（格納順）"""
+        scoped = self._by_symbol.get(symbol, [])
+        if not self._unscoped:
+            return list(scoped)
+        if not scoped:
+            return list(self._unscoped)
+        return sorted(scoped + self._unscoped, key=lambda r: self._position[r.id])
+
+    def select(self, symbol, touched_keys=None):
+        """symbol の Webhook で結果が変わり得るルール（touched_keys=None なら TF/フィールドで絞り込まない）"""
+        candidates = self.for_symbol(symbol)
+        if touched_keys is None:
+            return candidates
+        affected = set(self._unkeyed)
+        for key in touched_keys:
+            ids = self._by_key.get(key)
+            if ids:
+                affected |= ids
+        return [rule for rule in candidates if rule.id in affected]
+
+
+def touched_keys_from_clouds(all_clouds, current_tf_label):
+    """Webhook の clouds（{tf_label: cloud}）が更新し得る (TFラベル, フィールド)"""
+    keys = set()
+    for tf_label, cloud in all_clouds.items():
+        for field in cloud:
+            if tf_label != current_tf_label and field in OWN_TF_ONLY_FIELDS:
+                continue
+            keys.add((tf_label, field))
+    return keys
+
+
+class RuleCache:
+    """DBファイル1つ分の有効ルールキャッシュ"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._rules = None
+        self._index = None
+        self._generation = 0
+        self._stats = {'loads': 0, 'hits': 0, 'invalidations': 0, 'compile_errors': 0,
+                       'selections': 0, 'rules_considered': 0, 'rules_skipped': 0}
+
+    def invalidate(self):
+        """ルール変更後に呼ぶ（次回の取得時に読み直す）"""
+        with self._lock:
+            self._rules = None
+            self._index = None
+            self._generation += 1
+            self._stats['invalidations'] += 1
+
+    def enabled_rules(self):
+        """有効ルールのタプル（DB の格納順）"""
+        return self.index().rules
+
+    def index(self):
+        """有効ルールの逆引きインデックス"""
+        with self._lock:
+            index = self._index
+            generation = self._generation
+            if index is not None:
+                self._stats['hits'] += 1
+                return index
+        index = RuleIndex(self._load())
+        with self._lock:
+            # 読み込み中に invalidate された場合は保存しない（次回読み直す）
+            if generation == self._generation:
+                self._rules = index.rules
+                self._index = index
+        return index
+
+    def select(self, symbol, touched_keys=None):
+        """評価対象のルールと有効ルール総数を返す（considered / skipped を集計）"""
+        index = self.index()
+        selected = index.select(symbol, touched_keys)
+        with self._lock:
+            self._stats['selections'] += 1
+            self._stats['rules_considered'] += len(selected)
+            self._stats['rules_skipped'] += len(index.rules) - len(selected)
+        return selected, len(index.rules)
+
+    def _load(self):
+        conn = get_connection(self.db_path)
+        try:
+            c = conn.cursor()
+            c.execute('SELECT id, name, enabled, scope_json, rule_json FROM rules WHERE enabled = 1')
+            rows = c.fetchall()
+        finally:
+            conn.close()
+        compiled = []
+        errors = 0
+        for rule_id, name, _enabled, scope_json, rule_json in rows:
+            try:
+                scope = json.loads(scope_json) if scope_json else {}
+                rule = json.loads(rule_json) if rule_json else {}
+                compiled.append(CompiledRule(rule_id, name, scope, rule))
+            except Exception as e:
+                errors += 1
+                print(f'[RULE_CACHE] Failed to compile rule {rule_id}: {e}')
+        with self._lock:
+            self._stats['loads'] += 1
+            self._stats['compile_errors'] += errors
+        return tuple(compiled)
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s['cached_rules'] = len(self._rules) if self._rules is not None else None
+        return s
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_rule_cache(db_path):
+    """DBファイルごとの共有キャッシュを取得"""
+    key = os.path.abspath(db_path)
+    cache = _caches.get(key)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(key)
+            if cache is None:
+                cache = RuleCache(key)
+                _caches[key] = cache
+    return cache
@@ -0,0 +1,143 @@
+"""
+rule_effects.py
+
+ルール評価1回分の副作用（発火履歴・ルール状態・発火表示・通知）をまとめて反映する
+- 評価中は EvaluationBatch に積むだけで、DB / ファイル / active_fires には触らない
+- commit() で
+    fire_history   : executemany 1回
+    rule_state     : RuleStateStore.put_many() 1回（fire_history の INSERT と同じ書き込み1件 = 同じ SAVEPOINT で
+                     db_writer へ投入するので、発火行と状態は両方書かれるか、両方書かれないか）
+    active_fires   : 変更分をまとめて反映
+    notifications  : NotificationStore.append_many() 1回
+- 評価中の読み取り（get_active_fire / get_state）は未反映の変更を優先する（同じ評価内で後のルールから見える）
+
+使い方:
+    batch = EvaluationBatch(DB_PATH, active_fires, notifications_path)
+    ...
+    batch.add_fire(...); batch.set_state(...); batch.add_notification(...)
+    notifications = batch.commit()
+"""
+
+import json
+import threading
+import time
+
+from db_writer import get_writer
+from notification_store import get_notification_store
+from rule_state import RuleState, get_rule_state_store
+
+
+_FIRE_HISTORY_INSERT = ('INSERT INTO fire_history '
+                        '(rule_id, symbol, tf, fired_at, conditions_snapshot, last_state_snapshot, direction) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?)')
+
+# active_fires から削除する予定を表す目印
+_DELETED = object()
+
+_stats_lock = threading.Lock()
+_stats = {'rounds': 0, 'empty_rounds': 0, 'fires': 0, 'states': 0, 'active_fire_changes': 0,
+          'notifications': 0, 'errors': 0, 'last_commit_ms': None}
+
+
+class EvaluationBatch:
+    """評価1回分の副作用"""
+
+    def __init__(self, db_path, active_fires, notifications_path):
+        self.db_path = db_path
+        self.notifications_path = notifications_path
+        self._active_fires = active_fires
+        self._fire_changes = {}   # key -> 値 or _DELETED
+        self._states = {}         # (rule_id, identity_symbol) -> (matched, snapshot)
+        self._fire_rows = []
+        self.notifications = []
+
+    # ---- active_fires（発火表示） ----
+    def get_active_fire(self, key):
+        value = self._fire_changes.get(key)
+        if value is None:
+            return self._active_fires.get(key)
+        return None if value is _DELETED else value
+
+    def set_active_fire(self, key, value):
+        self._fire_changes[key] = value
+
+    def clear_active_fire(self, key, rule_id):
+        """key の発火表示が rule_id のものなら消す（消した場合 True）"""
+        current = self.get_active_fire(key)
+        if current is not None and current.get('rule_id') == rule_id:
+            self._fire_changes[key] = _DELETED
+            return True
+        return False
+
+    # ---- rule_state（エッジトリガー用の前回状態） ----
+    def get_state(self, rule_id, identity_symbol):
+        """前回の状態（RuleState または None）。この評価内で更新済みならその値"""
+        pending = self._states.get((rule_id, identity_symbol))
+        if pending is not None:
+            return RuleState(pending[0], dict(pending[1]), None)
+        return get_rule_state_store(self.db_path).get(rule_id, identity_symbol)
+
+    def set_state(self, rule_id, identity_symbol, matched, snapshot):
+        self._states[(rule_id, identity_symbol)] = (bool(matched), dict(snapshot))
+
+    # ---- fire_history / 通知 ----
+    def add_fire(self, rule_id, identity_symbol, fired_at, conditions, snapshot, direction):
+        self._fire_rows.append((rule_id, identity_symbol, '', fired_at,
+                                json.dumps(conditions, ensure_ascii=False),
+                                json.dumps(snapshot, ensure_ascii=False),
+                                direction))
+
+    def add_notification(self, notification):
+        self.notifications.append(notification)
+
+    def __len__(self):
+        return len(self._fire_rows) + len(self._states) + len(self._fire_changes) + len(self.notifications)
+
+    def commit(self):
+        """積んだ副作用を反映し、通知のリストを返す"""
+        started = time.perf_counter()
+        errors = 0
+        fire_statements = [(_FIRE_HISTORY_INSERT, self._fire_rows, True)] if self._fire_rows else []
+        if self._states:
+            try:
+                get_rule_state_store(self.db_path).put_many(
+                    [(rule_id, identity, matched, snapshot)
+                     for (rule_id, identity), (matched, snapshot) in self._states.items()],
+                    statements=fire_statements)
+            except Exception as e:
+                errors += 1
+                print(f'[RULE_EFFECTS] Error saving fire history / rule states: {e}')
+        elif fire_statements:
+            try:
+                get_writer(self.db_path).submit_group(fire_statements)
+            except Exception as e:
+                errors += 1
+                print(f'[RULE_EFFECTS] Error saving fire history: {e}')
+        for key, value in self._fire_changes.items():
+            if value is _DELETED:
+                self._active_fires.pop(key, None)
+            else:
+                self._active_fires[key] = value
+        if self.notifications:
+            try:
+                get_notification_store(self.notifications_path).append_many(self.notifications)
+            except Exception as e:
+                errors += 1
+                print(f'[RULE_EFFECTS] Error saving notifications: {e}')
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
+        with _stats_lock:
+            _stats['rounds'] += 1
+            if not len(self):
+                _stats['empty_rounds'] += 1
+            _stats['fires'] += len(self._fire_rows)
+            _stats['states'] += len(self._states)
+            _stats['active_fire_changes'] += len(self._fire_changes)
+            _stats['notifications'] += len(self.notifications)
+            _stats['errors'] += errors
+            _stats['last_commit_ms'] = round(elapsed_ms, 3)
+        return self.notifications
+
+
+def evaluation_batch_stats():
+    with _stats_lock:
+        return dict(_stats)
@@ -0,0 +1,211 @@
+"""
+rule_state.py
+
+ルールごとの評価状態（エッジトリガー発火判定用）のインメモリ正本
+- rule_state テーブル（rule_id, identity_symbol）を起動後1回だけ読み込み、以降はメモリから参照
+- 更新はメモリへ即時反映し、SQLite へは db_writer 経由で write-through
+- 旧方式（fire_history の最新行に initial / no_fire / restart / matched の目印行を書いて状態を運ぶ）
+  からは migrate_from_fire_history() で1回だけ移行し、目印行は fire_history から削除する
+  （実施済みは rule_state_meta に記録。発火履歴クリアで rule_state が空になっても再移行しない）
+
+状態:
+    matched   前回評価で条件がすべて成立していたか
+    snapshot  前回評価時のセル値（current_values）
+"""
+
+import json
+import os
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+import pytz
+
+from db_pool import get_connection
+from db_writer import get_writer
+
+
+# 旧方式で状態を運ぶためだけに fire_history に書かれていた目印（conditions_snapshot のキー）
+_MARKER_KEYS = ('restart', 'initial', 'no_fire')
+_MARKER_PATTERNS = ('{"initial"%', '{"no_fire"%', '{"restart"%', '{"matched"%')
+# rule_state_meta の「fire_history から移行済み」のキー
+_MIGRATED_KEY = 'migrated_from_fire_history'
+
+RuleState = namedtuple('RuleState', 'matched snapshot updated_at')
+
+_UPSERT = ('INSERT OR REPLACE INTO rule_state (rule_id, identity_symbol, matched, snapshot, updated_at) '
+           'VALUES (?, ?, ?, ?, ?)')
+
+
+def ensure_table(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS rule_state (
+        rule_id TEXT NOT NULL,
+        identity_symbol TEXT NOT NULL,
+        matched INTEGER NOT NULL DEFAULT 0,
+        snapshot TEXT,
+        updated_at TEXT,
+        PRIMARY KEY (rule_id, identity_symbol)
+    )''')
+    # 一度だけ行う処理の実施済みの目印（rule_state が空かどうかでは判定しない。発火履歴クリアで空になるため）
+    conn.execute('''CREATE TABLE IF NOT EXISTS rule_state_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )''')
+
+
+class RuleStateStore:
+    """DBファイル1つ分のルール評価状態"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._states = {}   # (rule_id, identity_symbol) -> RuleState
+        self._loaded = False
+        self._stats = {'reads': 0, 'writes': 0}
+
+    def load(self):
+        conn = get_connection(self.db_path)
+        try:
+            ensure_table(conn)
+            rows = conn.execute('SELECT rule_id, identity_symbol, matched, snapshot, updated_at FROM rule_state').fetchall()
+        finally:
+            conn.close()
+        states = {}
+        for rule_id, identity_symbol, matched, snapshot, updated_at in rows:
+            try:
+                parsed = json.loads(snapshot) if snapshot else None
+            except Exception:
+                parsed = None
+            if isinstance(parsed, dict):
+                states[(rule_id, identity_symbol)] = RuleState(bool(matched), parsed, updated_at)
+        with self._lock:
+            self._states = states
+            self._loaded = True
+        print(f'[RULE_STATE] Loaded {len(states)} rule states')
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                loaded = self._loaded
+            if not loaded:
+                self.load()
+
+    def get(self, rule_id, identity_symbol):
+        """前回の状態（なければ None）。snapshot は呼び出し側で変更してよいコピー"""
+        self._ensure_loaded()
+        with self._lock:
+            self._stats['reads'] += 1
+            state = self._states.get((rule_id, identity_symbol))
+        if state is None:
+            return None
+        return state._replace(snapshot=dict(state.snapshot))
+
+    def put(self, rule_id, identity_symbol, matched, snapshot):
+        """状態を更新（メモリは即時、DB 書き込みは完了を待たない）"""
+        return self.put_many([(rule_id, identity_symbol, matched, snapshot)])
+
+    def put_many(self, items, statements=()):
+        """複数の状態をまとめて更新（DB へは executemany 1回）
+
+        items: [(rule_id, identity_symbol, matched, snapshot), ...]
+        statements: 同じ書き込み（SAVEPOINT）で先に実行する文 [(sql, params, many), ...]。
+                    発火履歴と状態が片方だけ書かれることがないようにする
+        """
+        self._ensure_loaded()
+        updated_at = datetime.now(pytz.timezone('Asia/Tokyo')).isoformat()
+        rows = []
+        states = {}
+        for rule_id, identity_symbol, matched, snapshot in items:
+            snapshot_json = json.dumps(snapshot, ensure_ascii=False)
+            # JSON 往復後の値で保持（DB から読み直した場合と比較結果を揃える）
+            states[(rule_id, identity_symbol)] = RuleState(bool(matched), json.loads(snapshot_json), updated_at)
+            rows.append((rule_id, identity_symbol, 1 if matched else 0, snapshot_json, updated_at))
+        statements = list(statements)
+        if rows:
+            statements.append((_UPSERT, rows, True))
+        if not statements:
+            return None
+        # メモリの更新と投入の順序を揃える（同じキーの古い状態が後から書かれないように）
+        with self._lock:
+            self._stats['writes'] += len(rows)
+            self._states.update(states)
+            future = get_writer(self.db_path).submit_group(statements)
+        return future
+
+    def clear(self):
+        """全状態を削除（発火履歴クリア時）"""
+        self._ensure_loaded()
+        with self._lock:
+            self._states = {}
+            future = get_writer(self.db_path).submit('DELETE FROM rule_state')
+        return future
+
+    def migrate_from_fire_history(self):
+        """fire_history の最新行（tf=''）から状態を移し、状態用の目印行を削除する（1回だけ）"""
+        conn = get_connection(self.db_path)
+        try:
+            ensure_table(conn)
+            if conn.execute('SELECT 1 FROM rule_state_meta WHERE key = ?', (_MIGRATED_KEY,)).fetchone():
+                return 0
+            where = ' OR '.join('conditions_snapshot LIKE ?' for _ in _MARKER_PATTERNS)
+            # 目印の導入前に移行済みの DB（rule_state に行がある / 目印行が残っていない）は移行せず目印だけ書く
+            if (conn.execute('SELECT 1 FROM rule_state LIMIT 1').fetchone()
+                    or not conn.execute(f'SELECT 1 FROM fire_history WHERE {where} LIMIT 1', _MARKER_PATTERNS).fetchone()):
+                conn.execute('INSERT OR REPLACE INTO rule_state_meta (key, value) VALUES (?, ?)',
+                             (_MIGRATED_KEY, datetime.now(pytz.timezone('Asia/Tokyo')).isoformat()))
+                conn.commit()
+                return 0
+            rows = conn.execute('''SELECT f.rule_id, f.symbol, f.conditions_snapshot, f.last_state_snapshot, f.fired_at
+                                   FROM fire_history f
+                                   JOIN (SELECT MAX(id) AS id FROM fire_history WHERE tf = '' GROUP BY rule_id, symbol) latest
+                                     ON f.id = latest.id''').fetchall()
+            migrated = 0
+            for rule_id, identity_symbol, conditions_snapshot, last_state_snapshot, fired_at in rows:
+                try:
+                    snapshot = json.loads(last_state_snapshot) if last_state_snapshot else None
+                except Exception:
+                    snapshot = None
+                if not isinstance(snapshot, dict):
+                    continue
+                try:
+                    marker = json.loads(conditions_snapshot) if conditions_snapshot else None
+                except Exception:
+                    marker = None
+                matched = not (isinstance(marker, dict) and any(k in marker for k in _MARKER_KEYS))
+                conn.execute('INSERT OR REPLACE INTO rule_state (rule_id, identity_symbol, matched, snapshot, updated_at) VALUES (?, ?, ?, ?, ?)',
+                             (rule_id, identity_symbol, 1 if matched else 0, last_state_snapshot, fired_at))
+                migrated += 1
+            deleted = conn.execute(f'DELETE FROM fire_history WHERE {where}', _MARKER_PATTERNS).rowcount
+            conn.execute('INSERT OR REPLACE INTO rule_state_meta (key, value) VALUES (?, ?)',
+                         (_MIGRATED_KEY, datetime.now(pytz.timezone('Asia/Tokyo')).isoformat()))
+            conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            self._loaded = False
+        print(f'[RULE_STATE] Migrated {migrated} rule states from fire_history (removed {deleted} marker rows)')
+        return migrated
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s['states'] = len(self._states)
+            s['loaded'] = self._loaded
+        return s
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_rule_state_store(db_path):
+    """DBファイルごとの共有ストアを取得"""
+    key = os.path.abspath(db_path)
+    store = _stores.get(key)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(key)
+            if store is None:
+                store = RuleStateStore(key)
+                _stores[key] = store
+    return store
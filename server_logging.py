@@ -0,0 +1,137 @@
+"""
+server_logging.py
+
+サーバー共通のログ設定モジュール
+- サブシステム別ロガー（webhook / trend / rules / inject / currency / states / server）
+- QueueHandler + バックグラウンドの QueueListener でリクエストスレッドはファイルI/Oを行わない
+- webhook_error.log をサイズ or 時刻でローテーション
+- レベルはサブシステムごとに環境変数で設定（無効レベルのログは isEnabledFor で即スキップ）
+
+環境変数:
+    LOG_LEVEL          全体の既定レベル（既定: INFO）
+    LOG_LEVELS         サブシステム別レベル 例: "trend=DEBUG,rules=DEBUG"
+    LOG_FILE           出力先（既定: <BASE_DIR>/webhook_error.log）
+    LOG_ROTATION       size / time（既定: size）
+    LOG_MAX_BYTES      size ローテーションの上限（既定: 10MB）
+    LOG_BACKUP_COUNT   保持世代数（既定: 5）
+    LOG_ROTATE_WHEN    time ローテーションの単位（既定: midnight）
+    LOG_CONSOLE_LEVEL  標準出力へのレベル（既定: INFO、OFF で無効）
+"""
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+from datetime import datetime
+
+import pytz
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LOG_FILE = os.getenv('LOG_FILE', os.path.join(BASE_DIR, 'webhook_error.log'))
+LOG_ROOT = 'tv'
+
+# サブシステム一覧（/api/log_levels で表示）
+SUBSYSTEMS = ('server', 'webhook', 'trend', 'rules', 'inject', 'currency', 'states', 'history')
+
+_configured = False
+_config_lock = threading.Lock()
+_listener = None
+
+
+class _JSTFormatter(logging.Formatter):
+    """タイムスタンプを JST の ISO 形式で出力（既存ログと同じ書式）"""
+
+    _jst = pytz.timezone('Asia/Tokyo')
+
+    def formatTime(self, record, datefmt=None):
+        return datetime.fromtimestamp(record.created, self._jst).isoformat()
+
+
+def _parse_level(value, default=logging.INFO):
+    if value is None:
+        return default
+    s = str(value).strip().upper()
+    if s.isdigit():
+        return int(s)
+    level = logging.getLevelName(s)
+    return level if isinstance(level, int) else default
+
+
+def _build_file_handler():
+    os.makedirs(os.path.dirname(LOG_FILE) or '.', exist_ok=True)
+    backup_count = int(os.getenv('LOG_BACKUP_COUNT', '5'))
+    if os.getenv('LOG_ROTATION', 'size').strip().lower() == 'time':
+        handler = logging.handlers.TimedRotatingFileHandler(
+            LOG_FILE,
+            when=os.getenv('LOG_ROTATE_WHEN', 'midnight'),
+            backupCount=backup_count,
+            encoding='utf-8',
+        )
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            LOG_FILE,
+            maxBytes=int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024))),
+            backupCount=backup_count,
+            encoding='utf-8',
+        )
+    handler.setFormatter(_JSTFormatter('%(asctime)s - %(message)s'))
+    return handler
+
+
+def configure_logging():
+    """ロガーを初期化（2回目以降は何もしない）"""
+    global _configured, _listener
+    if _configured:
+        return
+    with _config_lock:
+        if _configured:
+            return
+        root = logging.getLogger(LOG_ROOT)
+        root.setLevel(_parse_level(os.getenv('LOG_LEVEL'), logging.INFO))
+        root.propagate = False
+
+        for item in os.getenv('LOG_LEVELS', '').split(','):
+            if '=' in item:
+                name, level = item.split('=', 1)
+                logging.getLogger(f'{LOG_ROOT}.{name.strip()}').setLevel(_parse_level(level))
+
+        handlers = []
+        try:
+            handlers.append(_build_file_handler())
+        except Exception as e:
+            print(f'[LOGGING] File handler disabled: {e}')
+
+        console_level = os.getenv('LOG_CONSOLE_LEVEL', 'INFO').strip().upper()
+        if console_level != 'OFF':
+            console = logging.StreamHandler(sys.stdout)
+            console.setLevel(_parse_level(console_level))
+            console.setFormatter(logging.Formatter('%(message)s'))
+            handlers.append(console)
+
+        log_queue = queue.SimpleQueue()
+        root.addHandler(logging.handlers.QueueHandler(log_queue))
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+        _configured = True
+
+
+def get_logger(subsystem):
+    """サブシステム用ロガーを取得"""
+    configure_logging()
+    return logging.getLogger(f'{LOG_ROOT}.{subsystem}')
+
+
+def get_levels():
+    """サブシステムごとの有効レベル"""
+    configure_logging()
+    return {name: logging.getLevelName(get_logger(name).getEffectiveLevel()) for name in SUBSYSTEMS}
+
+
+def set_level(subsystem, level):
+    """実行中にサブシステムのレベルを変更"""
+    get_logger(subsystem).setLevel(_parse_level(level))
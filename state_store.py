@@ -0,0 +1,370 @@
+"""
+state_store.py
+
+states テーブルのインメモリ正本（プロセス共通）
+- 起動時に1回だけ DB から読み込み、以降は Webhook ごとに更新（SQLite へは db_writer 経由で write-through）
+- clouds_json / meta_json はパース済み、TF キーは正規化済みで保持（読み出し側で json.loads や dict(zip()) は不要）
+- 更新のたびに単調増加するバージョン番号を付与
+- レコードは読み取り専用として扱う（更新時は新しい dict に差し替える）
+
+レコード（dict）:
+    DB の全カラム + clouds（list）+ meta（dict）
+    + tf_label（ルール評価用: '15' → '15m'）+ tf_trend（トレンド計算用: '1' → '1H' も含む）
+    + cloud_index（CloudIndex: 正規化ラベル → 雲。clouds の線形探索・ラベル解析の代わり）
+    + version（更新時のストア全体のバージョン）+ seq（書き込み順。ORDER BY rowid の代わり）
+    + canonical（ルール比較用の正規化済みフィールド値のメモ。comparators.canonical_from_memo で使う。
+      レコードの差し替えごとに空になるので、正規化は状態の更新ごとに1回）
+
+使い方:
+    store = get_state_store(DB_PATH)
+    store.upsert({...})                  # INSERT OR REPLACE（コミット完了後にメモリへ反映）
+    store.update_fields(sym, tf, {...})  # UPDATE（メモリは即時、DB は書き込みスレッドへ投入）
+    store.tf_states(sym)                 # {tf_label: record}
+    version, keys = store.changes_since(v)  # v 以降に差し替えられた (symbol, tf)（追えない場合 keys=None）
+"""
+
+import json
+import os
+import threading
+from collections import deque
+
+from db_pool import get_connection
+from db_writer import get_writer
+
+
+# ===== TFラベル正規化マップ =====
+# Webhook JSON が送ってくる label 値 ("15", "60", "240", "D" など) を
+# サーバー内部で使用する統一ラベル ("15m", "1H", "4H", "D" など) に変換
+_TF_LABEL_NORMALIZE = {
+    '5': '5m',   '5m': '5m',
+    '15': '15m', '15m': '15m', '15M': '15m',
+    '60': '1H',  '1H': '1H',  '1h': '1H',
+    '240': '4H', '4H': '4H',  '4h': '4H',
+    'D':  'D',   '1D': 'D',   '1440': 'D',
+    'W':  'W',   '1W': 'W',   '10080': 'W',
+    'M':  'M',   '1M': 'M',   '43200': 'M',
+}
+
+# トレンド計算用の TF キー（旧形式の '1' / '4' も 1H / 4H として扱う）
+_TF_TREND_NORMALIZE = {'5': '5m', '15': '15m', '1': '1H', '60': '1H', '4': '4H', '240': '4H'}
+
+# 変更ジャーナルの長さ（これより古いバージョンからの差分は changes_since が None を返す → 全件で作り直す）
+CHANGE_JOURNAL_SIZE = 4096
+
+# INSERT OR REPLACE で書き込むカラム（Webhook / バックアップ復元と同じ並び）
+STATE_COLUMNS = (
+    'symbol', 'tf', 'timestamp', 'price', 'time',
+    'state_flag', 'state_word',
+    'daytrade_status', 'daytrade_bos', 'daytrade_time',
+    'swing_status', 'swing_bos', 'swing_time',
+    'row_order', 'cloud_order', 'clouds_json', 'meta_json', 'received_at', 'sent_time',
+)
+
+
+def normalize_tf_label(label):
+    """TFラベルを正規化 (例: "15" → "15m", "60" → "1H", "240" → "4H")"""
+    if label is None:
+        return None
+    return _TF_LABEL_NORMALIZE.get(str(label), str(label))
+
+
+def normalize_trend_tf(tf):
+    """トレンド計算用の TF キー (例: "5" → "5m", "60" → "1H", "D" → "D")"""
+    return _TF_TREND_NORMALIZE.get(tf, tf)
+
+
+class CloudIndex(dict):
+    """正規化ラベル → 雲（dict）の索引
+
+    状態レコードの取り込み時に1回だけ作る（同じラベルの雲が複数ある場合は先頭）。
+    雲 dict は共有なので読み取り専用として扱う。
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_clouds(cls, clouds):
+        index = cls()
+        if isinstance(clouds, list):
+            for cloud in clouds:
+                if not isinstance(cloud, dict):
+                    continue
+                label = normalize_tf_label(cloud.get('label'))
+                if label and label not in index:
+                    index[label] = cloud
+        return index
+
+    @classmethod
+    def from_mapping(cls, mapping):
+        """{ラベル: 雲}（'60' / '1H' どちらの形式でも可）から作る。ラベル以外のキーはそのまま"""
+        index = cls()
+        for key, value in mapping.items():
+            label = normalize_tf_label(key)
+            if label not in index:
+                index[label] = value
+        return index
+
+    def cloud(self, label):
+        """label（'60' / '1H' どちらの形式でも可）の雲、なければ None"""
+        found = self.get(label)
+        if found is None and label is not None:
+            found = self.get(normalize_tf_label(label))
+        return found
+
+    def field(self, label, field):
+        """雲のフィールド値（gc が雲にない場合は False = DC 扱い、雲がなければ None）"""
+        cloud = self.cloud(label)
+        if cloud is None:
+            return None
+        val = cloud.get(field)
+        if field == 'gc' and val is None and field not in cloud:
+            return False
+        return val
+
+
+def cloud_index(state):
+    """状態（レコード / dict）の CloudIndex（ストアのレコードなら取り込み時に作成済みのもの）"""
+    index = state.get('cloud_index')
+    if isinstance(index, CloudIndex):
+        return index
+    clouds = state.get('clouds')
+    if not isinstance(clouds, list):
+        clouds = _parse_json(state.get('clouds_json'), [])
+    return CloudIndex.from_clouds(clouds)
+
+
+def _parse_json(value, default):
+    if not value:
+        return default
+    try:
+        return json.loads(value)
+    except Exception:
+        return default
+
+
+class StateStore:
+    """DBファイル1つ分の states キャッシュ"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._records = {}      # (symbol, tf) -> record
+        self._columns = list(STATE_COLUMNS)
+        self._version = 0
+        self._seq = 0
+        self._loaded = False
+        self._changes = deque(maxlen=CHANGE_JOURNAL_SIZE)  # (version, (symbol, tf))
+        self._load_version = 0  # 最後に全件を読み込んだときのバージョン
+
+    # ------------------------------------------------------------
+    # 読み込み
+    # ------------------------------------------------------------
+    def _build(self, row, seq):
+        rec = {col: None for col in self._columns}
+        rec.update(row)
+        rec['clouds'] = _parse_json(rec.get('clouds_json'), [])
+        rec['cloud_index'] = CloudIndex.from_clouds(rec['clouds'])
+        rec['meta'] = _parse_json(rec.get('meta_json'), {})
+        tf = str(rec.get('tf', ''))
+        rec['tf_label'] = normalize_tf_label(tf)
+        rec['tf_trend'] = normalize_trend_tf(tf)
+        rec['version'] = self._version
+        rec['seq'] = seq
+        rec['canonical'] = {}
+        return rec
+
+    def load(self):
+        """DB から全件を読み込む（書き込みスレッドの未コミット分を先に反映）"""
+        try:
+            get_writer(self.db_path).flush(timeout=30)
+        except Exception as e:
+            print(f'[STATE_STORE] Writer flush before load failed: {e}')
+        conn = get_connection(self.db_path)
+        try:
+            c = conn.cursor()
+            c.execute('SELECT * FROM states ORDER BY rowid')
+            cols = [d[0] for d in c.description] if c.description else []
+            rows = c.fetchall()
+        finally:
+            conn.close()
+        with self._lock:
+            self._columns = cols or list(STATE_COLUMNS)
+            self._version += 1
+            records = {}
+            for row in rows:
+                self._seq += 1
+                rec = self._build(dict(zip(cols, row)), self._seq)
+                records[(rec['symbol'], rec['tf'])] = rec
+            self._records = records
+            self._loaded = True
+            self._changes.clear()
+            self._load_version = self._version
+        print(f'[STATE_STORE] Loaded {len(records)} states (version={self._version})')
+
+    # DB を直接書き換えた処理（バックアップ復元・TF形式クリーンアップ等）の後に呼ぶ
+    reload = load
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self.load()
+
+    # ------------------------------------------------------------
+    # 書き込み（write-through）
+    # ------------------------------------------------------------
+    def upsert(self, values, timeout=30):
+        """INSERT OR REPLACE してメモリへ反映（コミット完了を待つ）
+
+        values: STATE_COLUMNS のカラム名 -> 値
+        """
+        self._ensure_loaded()
+        cols = [col for col in STATE_COLUMNS if col in values]
+        with self._lock:
+            # 書き込みスレッドへの投入順 = コミット順なので、seq もここで確定させる
+            self._seq += 1
+            seq = self._seq
+            future = get_writer(self.db_path).submit(
+                f'INSERT OR REPLACE INTO states ({", ".join(cols)}) VALUES ({", ".join("?" * len(cols))})',
+                tuple(values[col] for col in cols))
+        future.result(timeout=timeout)
+        with self._lock:
+            key = (values['symbol'], values['tf'])
+            current = self._records.get(key)
+            if current is not None and current['seq'] > seq:
+                return current  # 後から投入された書き込みが先に反映済み
+            self._version += 1
+            # REPLACE なのでトレンド列などは NULL に戻る（DB と同じ）
+            rec = self._build({col: values[col] for col in cols}, seq)
+            self._records[key] = rec
+            self._changes.append((self._version, key))
+        return rec
+
+    def update_fields(self, symbol, tf, fields):
+        """UPDATE states SET ...（メモリは即時反映、DB 書き込みは完了を待たない）"""
+        self._ensure_loaded()
+        cols = list(fields.keys())
+        future = get_writer(self.db_path).submit(
+            f'UPDATE states SET {", ".join(f"{col} = ?" for col in cols)} WHERE symbol = ? AND tf = ?',
+            tuple(fields[col] for col in cols) + (symbol, tf))
+        with self._lock:
+            old = self._records.get((symbol, tf))
+            if old is not None:
+                self._version += 1
+                rec = dict(old)
+                rec.update(fields)
+                if 'clouds_json' in fields:
+                    rec['clouds'] = _parse_json(fields['clouds_json'], [])
+                    rec['cloud_index'] = CloudIndex.from_clouds(rec['clouds'])
+                if 'meta_json' in fields:
+                    rec['meta'] = _parse_json(fields['meta_json'], {})
+                rec['version'] = self._version
+                rec['canonical'] = {}
+                self._records[(symbol, tf)] = rec
+                self._changes.append((self._version, (symbol, tf)))
+        return future
+
+    # ------------------------------------------------------------
+    # 読み出し
+    # ------------------------------------------------------------
+    @property
+    def version(self):
+        return self._version
+
+    def changes_since(self, version):
+        """version 以降に差し替えられたレコードのキー → (現在のバージョン, [(symbol, tf), ...])
+
+        全件の読み込み（reload）をまたぐ場合やジャーナルから溢れた場合は keys=None（全件で作り直すこと）。
+        """
+        self._ensure_loaded()
+        with self._lock:
+            current = self._version
+            if version is None or version < self._load_version:
+                return current, None
+            if self._changes and self._changes[0][0] > version + 1 and len(self._changes) == self._changes.maxlen:
+                return current, None
+            keys = {}
+            for changed_version, key in reversed(self._changes):
+                if changed_version <= version:
+                    break
+                keys[key] = None
+        return current, list(reversed(keys))
+
+    def get(self, symbol, tf):
+        self._ensure_loaded()
+        return self._records.get((symbol, tf))
+
+    def all_rows(self):
+        """全レコード（書き込み順）"""
+        self._ensure_loaded()
+        with self._lock:
+            records = list(self._records.values())
+        records.sort(key=lambda r: r['seq'])
+        return records
+
+    def symbol_rows(self, symbol):
+        """指定シンボルのレコード（新しい順。ORDER BY rowid DESC 相当）"""
+        self._ensure_loaded()
+        with self._lock:
+            records = [r for (sym, _), r in self._records.items() if sym == symbol]
+        records.sort(key=lambda r: r['seq'], reverse=True)
+        return records
+
+    def symbols(self):
+        """レコードのあるシンボル一覧（初出順）"""
+        seen = {}
+        for rec in self.all_rows():
+            seen.setdefault(rec['symbol'], None)
+        return list(seen)
+
+    def latest(self, symbol=None):
+        """最後に書き込まれたレコード（symbol 指定時はそのシンボル内で）"""
+        rows = self.symbol_rows(symbol) if symbol else list(reversed(self.all_rows()))
+        return rows[0] if rows else None
+
+    def tf_states(self, symbol):
+        """{tf_label: record}（同じラベルが複数ある場合は新しい方）"""
+        result = {}
+        for rec in self.symbol_rows(symbol):
+            label = rec['tf_label']
+            if label and label not in result:
+                result[label] = rec
+        return result
+
+    def trend_states(self, symbol):
+        """トレンド計算用 {tf_trend: {'clouds', 'clouds_json', 'row_order', 'time'}}"""
+        result = {}
+        for rec in reversed(self.symbol_rows(symbol)):
+            result[rec['tf_trend']] = {
+                'clouds': rec['clouds'],
+                'clouds_json': rec.get('clouds_json') or '[]',
+                'row_order': rec.get('row_order') or '',
+                'time': rec.get('time'),
+            }
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'records': len(self._records),
+                'symbols': len({sym for sym, _ in self._records}),
+                'version': self._version,
+                'loaded': self._loaded,
+            }
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_state_store(db_path):
+    """DBファイルごとの共有ストアを取得"""
+    key = os.path.abspath(db_path)
+    store = _stores.get(key)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(key)
+            if store is None:
+                store = StateStore(key)
+                _stores[key] = store
+    return store
@@ -0,0 +1,155 @@
+"""
+strength_broadcast.py
+
+通貨強弱（currency_strength_update）の配信
+- publish() された結果はウィンドウ（STRENGTH_BROADCAST_MS）ごとにまとめ、最後の1件だけを配信する
+- 配信するのは前回配信からの差分だけ（変わった時間足の currencies と、変わった通貨の raw_scores / 削除された通貨）
+- 差分にはバージョン番号を付ける。クライアントは base_version が手元のバージョンと違えば
+  currency_strength_resync を送り、スナップショット（全体）を受け取り直す
+- 接続時にスナップショットを送る（render_server の connect ハンドラ）
+- breakdown（内訳の文字列）は購読したクライアント（currency_strength_subscribe {'breakdown': true}）にだけ送る
+
+メッセージ（イベント名はどちらも currency_strength_update）:
+    スナップショット: {'status': 'success', 'type': 'snapshot', 'version': v, 'data': {...全体...}, 'timestamp'}
+    差分          : {'status': 'success', 'type': 'diff', 'version': v, 'base_version': v - 1,
+                     'data': {tf: {'currencies': [...], 'raw_scores': {変わった通貨}, 'removed': [...],
+                                   'breakdown': {変わった通貨}（購読者のみ）}},
+                     'last_updated', 'server_version', 'timestamp'}
+"""
+
+import threading
+from datetime import datetime
+
+import pytz
+
+from coalescer import Coalescer
+
+
+EVENT = 'currency_strength_update'
+# 接続中のクライアントが入るルーム（breakdown なし / あり）
+ROOM = 'currency_strength'
+BREAKDOWN_ROOM = 'currency_strength_breakdown'
+
+# 結果のうち時間足ごとのエントリではないキー
+_META_KEYS = ('last_updated', 'server_version')
+
+
+def _timestamp():
+    return datetime.now(pytz.timezone('Asia/Tokyo')).isoformat()
+
+
+def strip_breakdown(result):
+    """breakdown を除いた結果（時間足のエントリは浅いコピー）"""
+    stripped = {}
+    for key, entry in result.items():
+        if isinstance(entry, dict) and 'breakdown' in entry:
+            entry = {k: v for k, v in entry.items() if k != 'breakdown'}
+        stripped[key] = entry
+    return stripped
+
+
+def diff_results(old, new):
+    """old → new の差分 → (breakdown なし, breakdown あり)。変化がなければ ({}, {})"""
+    lite, full = {}, {}
+    for tf, entry in new.items():
+        if tf in _META_KEYS or not isinstance(entry, dict):
+            continue
+        prev = old.get(tf) if isinstance(old.get(tf), dict) else {}
+        raw, prev_raw = entry.get('raw_scores') or {}, prev.get('raw_scores') or {}
+        changed = {c: v for c, v in raw.items() if c not in prev_raw or prev_raw[c] != v}
+        removed = [c for c in prev_raw if c not in raw]
+        scores_changed = bool(changed or removed) or entry.get('currencies') != prev.get('currencies')
+        breakdown, prev_breakdown = entry.get('breakdown') or {}, prev.get('breakdown') or {}
+        breakdown_changed = {c: items for c, items in breakdown.items() if prev_breakdown.get(c) != items}
+        if not scores_changed and not breakdown_changed:
+            continue
+        item = {'currencies': entry.get('currencies', []), 'raw_scores': changed, 'removed': removed}
+        if scores_changed:
+            lite[tf] = item
+        if 'breakdown' in entry:
+            full[tf] = dict(item, breakdown=breakdown_changed)
+        else:
+            full[tf] = item
+    return lite, full
+
+
+class StrengthBroadcaster:
+    """通貨強弱の差分配信（プロセスに1つ）"""
+
+    def __init__(self, socketio, interval_ms, compute):
+        self.socketio = socketio
+        self.compute = compute          # スナップショット用に最新の結果を作る関数（まだ配信していない場合）
+        self._lock = threading.RLock()
+        self._state = None              # 最後に配信した結果（breakdown 込み）
+        self._version = 0
+        self._coalescer = Coalescer('strength_broadcast', interval_ms, self._flush)
+        self._stats = {
+            'published': 0,         # publish() された結果の数
+            'broadcasts': 0,        # 差分を配信した回数
+            'unchanged': 0,         # 変化がなく配信しなかった回数
+            'snapshots': 0,         # スナップショットを送った回数（接続・再同期・購読変更）
+            'resyncs': 0,
+            'tfs_sent': 0,          # 差分に含めた時間足の延べ数
+        }
+
+    def publish(self, result):
+        """最新の通貨強弱を投入（ウィンドウの終わりに前回配信との差分を配信）"""
+        with self._lock:
+            self._stats['published'] += 1
+        self._coalescer.submit(None, result)
+
+    def flush(self, timeout=10):
+        return self._coalescer.flush(timeout)
+
+    def _flush(self, _key, results):
+        result = results[-1]
+        with self._lock:
+            lite, full = diff_results(self._state or {}, result)
+            self._state = result
+            if not lite and not full:
+                self._stats['unchanged'] += 1
+                return
+            self._version += 1
+            version = self._version
+            self._stats['broadcasts'] += 1
+            self._stats['tfs_sent'] += len(lite)
+        base = {
+            'status': 'success',
+            'type': 'diff',
+            'version': version,
+            'base_version': version - 1,
+            'last_updated': result.get('last_updated'),
+            'server_version': result.get('server_version'),
+            'timestamp': _timestamp(),
+        }
+        self.socketio.emit(EVENT, dict(base, data=lite), to=ROOM)
+        self.socketio.emit(EVENT, dict(base, data=full), to=BREAKDOWN_ROOM)
+        print(f'[CURRENCY_STRENGTH] Emitted diff v{version} via SocketIO (tfs={list(lite)}, merged={len(results)})')
+
+    def snapshot(self, breakdown=False):
+        """スナップショットのメッセージ（まだ何も配信していなければ compute() の結果を基準にする）"""
+        with self._lock:
+            if self._state is None:
+                self._state = self.compute()
+            state, version = self._state, self._version
+            self._stats['snapshots'] += 1
+        return {
+            'status': 'success',
+            'type': 'snapshot',
+            'version': version,
+            'data': state if breakdown else strip_breakdown(state),
+            'timestamp': _timestamp(),
+        }
+
+    def send_snapshot(self, sid, breakdown=False, resync=False):
+        if resync:
+            with self._lock:
+                self._stats['resyncs'] += 1
+        self.socketio.emit(EVENT, self.snapshot(breakdown), to=sid)
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s['version'] = self._version
+        s['coalescer'] = self._coalescer.stats()
+        return s
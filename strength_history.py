@@ -0,0 +1,346 @@
+"""
+strength_history.py
+
+通貨強弱の時系列（時間足 × 通貨ごとのスコア）と解像度ごとの集計（1m / 5m / 1h / 1d）
+- record(result): 通貨強弱の再計算結果（時間足ごとの raw_scores）を1件追記する
+    strength_samples : 前回から値が変わった (時間足, 通貨) だけを書く（変化点の列。値は次の変化点まで続く）
+    strength_rollup  : 解像度ごとのバケット（open / high / low / close / total / samples）。
+                       メモリ上で前回書き込み以降の分を集計し、STRENGTH_HISTORY_FLUSH_SEC ごとに UPSERT でまとめて書く
+                       （既存行とは high=max / low=min / total・samples は加算でマージするので、再起動をまたいでも壊れない）
+- 書き込みはすべて db_writer 経由（Webhook 処理は DB のコミットを待たない）
+- 保持期間（日数）は解像度ごとに STRENGTH_HISTORY_RETENTION で設定。期限切れの行は1時間に1回削除
+- query(): 時間足・期間・解像度を指定して通貨ごとの系列を返す（まだ書き込んでいない集計もマージする）
+
+時刻はすべて UNIX 秒。バケットの境界は JST（1d は JST の 0 時区切り）。
+
+使い方:
+    history = get_strength_history(DB_PATH)
+    history.record(currency_data)
+    history.query('1H', start, end, 'auto')   # {'resolution': '5m', 'series': {'USD': [[bucket, o, h, l, c, avg], ...]}}
+"""
+
+import atexit
+import os
+import threading
+import time
+from datetime import datetime
+
+import pytz
+
+from currency_strength import TIMEFRAMES
+from db_pool import get_connection
+from db_writer import get_writer
+
+
+# ============================================================
+# 【設定】環境変数で上書き可能
+# ============================================================
+# 集計を DB へ書き込む間隔（秒）
+STRENGTH_HISTORY_FLUSH_SEC = max(0.0, float(os.getenv('STRENGTH_HISTORY_FLUSH_SEC', '30')))
+# 保持期間（日数。0 は無期限）
+_DEFAULT_RETENTION = 'raw=2,1m=14,5m=60,1h=730,1d=0'
+
+# 解像度 → バケット幅（秒）
+RESOLUTIONS = {'1m': 60, '5m': 300, '1h': 3600, '1d': 86400}
+# resolution=auto のとき、通貨ごとの点数がこれ以下になる最も細かい解像度を選ぶ
+AUTO_MAX_POINTS = 1500
+# バケット境界のずらし幅（JST = UTC+9）
+_TZ_OFFSET = 9 * 3600
+_JST = pytz.timezone('Asia/Tokyo')
+
+# 記録する時間足（通貨強弱の時間足 + 平均）
+HISTORY_TIMEFRAMES = TIMEFRAMES + ('Av',)
+# 結果のうち時間足ごとのエントリではないキー
+_META_KEYS = ('last_updated', 'server_version')
+
+
+def _parse_retention(text):
+    retention = {'raw': 2, '1m': 14, '5m': 60, '1h': 730, '1d': 0}
+    for item in text.split(','):
+        name, _, days = item.partition('=')
+        name = name.strip()
+        if name in retention and days.strip():
+            try:
+                retention[name] = max(0.0, float(days))
+            except ValueError:
+                print(f'[STRENGTH_HISTORY] Ignoring retention {item!r}')
+    return retention
+
+
+STRENGTH_HISTORY_RETENTION = _parse_retention(os.getenv('STRENGTH_HISTORY_RETENTION', _DEFAULT_RETENTION))
+
+
+def ensure_tables(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS strength_samples (
+        timeframe TEXT NOT NULL,
+        ts INTEGER NOT NULL,
+        currency TEXT NOT NULL,
+        score REAL NOT NULL,
+        PRIMARY KEY (timeframe, ts, currency)
+    ) WITHOUT ROWID''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS strength_rollup (
+        resolution INTEGER NOT NULL,
+        timeframe TEXT NOT NULL,
+        bucket INTEGER NOT NULL,
+        currency TEXT NOT NULL,
+        open REAL NOT NULL,
+        high REAL NOT NULL,
+        low REAL NOT NULL,
+        close REAL NOT NULL,
+        total REAL NOT NULL,
+        samples INTEGER NOT NULL,
+        PRIMARY KEY (resolution, timeframe, bucket, currency)
+    ) WITHOUT ROWID''')
+
+
+_INSERT_SAMPLE = 'INSERT OR REPLACE INTO strength_samples (timeframe, ts, currency, score) VALUES (?, ?, ?, ?)'
+_UPSERT_ROLLUP = '''INSERT INTO strength_rollup
+    (resolution, timeframe, bucket, currency, open, high, low, close, total, samples)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (resolution, timeframe, bucket, currency) DO UPDATE SET
+        high = max(high, excluded.high),
+        low = min(low, excluded.low),
+        close = excluded.close,
+        total = total + excluded.total,
+        samples = samples + excluded.samples'''
+
+
+def bucket_start(ts, width):
+    """ts を含むバケットの開始時刻（JST 境界）"""
+    return int((ts + _TZ_OFFSET) // width * width - _TZ_OFFSET)
+
+
+def parse_time(value, default):
+    """クエリの時刻 → UNIX 秒（UNIX 秒 / ミリ秒 / ISO 8601。タイムゾーンなしは JST）"""
+    if value is None or str(value).strip() == '':
+        return default
+    text = str(value).strip()
+    try:
+        number = float(text)
+        return number / 1000.0 if number > 1e11 else number
+    except ValueError:
+        pass
+    try:
+        dt = datetime.fromisoformat(text.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f'invalid time: {value}')
+    if dt.tzinfo is None:
+        dt = _JST.localize(dt)
+    return dt.timestamp()
+
+
+def _merge(agg, other):
+    """集計 [open, high, low, close, total, samples] に後の集計 other をマージ"""
+    agg[1] = max(agg[1], other[1])
+    agg[2] = min(agg[2], other[2])
+    agg[3] = other[3]
+    agg[4] += other[4]
+    agg[5] += other[5]
+
+
+class StrengthHistory:
+    """DBファイル1つ分の通貨強弱の時系列"""
+
+    def __init__(self, db_path, flush_sec=None, retention=None):
+        self.db_path = db_path
+        self.flush_sec = STRENGTH_HISTORY_FLUSH_SEC if flush_sec is None else flush_sec
+        self.retention = STRENGTH_HISTORY_RETENTION if retention is None else retention
+        self._lock = threading.Lock()
+        self._last = {}         # (timeframe, currency) -> 最後に書いたスコア
+        self._pending = {}      # (幅, timeframe, bucket, currency) -> [open, high, low, close, total, samples]
+        self._last_flush = time.monotonic()
+        self._last_prune = 0.0
+        self._stats = {
+            'records': 0,
+            'samples_written': 0,
+            'rollup_rows_written': 0,
+            'flushes': 0,
+            'prunes': 0,
+            'queries': 0,
+            'last_query_ms': 0.0,
+        }
+
+    def record(self, result, now=None):
+        """通貨強弱の結果を1件追記（時刻 now は UNIX 秒。省略時は現在）"""
+        now = time.time() if now is None else now
+        ts = int(now)
+        buckets = [(width, bucket_start(ts, width)) for width in RESOLUTIONS.values()]
+        samples = []
+        with self._lock:
+            last, pending = self._last, self._pending
+            for timeframe, entry in result.items():
+                if timeframe in _META_KEYS or not isinstance(entry, dict):
+                    continue
+                for currency, score in (entry.get('raw_scores') or {}).items():
+                    try:
+                        score = float(score)
+                    except (TypeError, ValueError):
+                        continue
+                    key = (timeframe, currency)
+                    if last.get(key) != score:
+                        last[key] = score
+                        samples.append((timeframe, ts, currency, score))
+                    for width, bucket in buckets:
+                        pkey = (width, timeframe, bucket, currency)
+                        agg = pending.get(pkey)
+                        if agg is None:
+                            pending[pkey] = [score, score, score, score, score, 1]
+                        else:
+                            if score > agg[1]:
+                                agg[1] = score
+                            elif score < agg[2]:
+                                agg[2] = score
+                            agg[3] = score
+                            agg[4] += score
+                            agg[5] += 1
+            self._stats['records'] += 1
+            self._stats['samples_written'] += len(samples)
+            due = time.monotonic() - self._last_flush >= self.flush_sec
+        if samples:
+            get_writer(self.db_path).submit(_INSERT_SAMPLE, samples, many=True)
+        if due:
+            self.flush()
+
+    def flush(self):
+        """メモリ上の集計を DB へ書き込む（書き込みスレッドへ投入。コミットは待たない）"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+            prune = time.time() - self._last_prune >= 3600
+            if prune:
+                self._last_prune = time.time()
+            self._stats['flushes'] += 1
+            self._stats['rollup_rows_written'] += len(pending)
+        writer = get_writer(self.db_path)
+        if pending:
+            writer.submit(_UPSERT_ROLLUP, [key + tuple(agg) for key, agg in pending.items()], many=True)
+        if prune:
+            self.prune()
+
+    def prune(self, now=None):
+        """保持期間を過ぎた行を削除"""
+        now = time.time() if now is None else now
+        writer = get_writer(self.db_path)
+        days = self.retention.get('raw', 0)
+        if days:
+            # 主キー (timeframe, ts, currency) の先頭を使うよう時間足ごとに削除する。通貨強弱の時間足は固定の一覧から
+            # （再起動直後や更新が止まった時間足も対象）、それ以外に記録した時間足があれば加える
+            with self._lock:
+                timeframes = set(HISTORY_TIMEFRAMES) | {tf for tf, _ in self._last}
+            for timeframe in sorted(timeframes):
+                writer.submit('DELETE FROM strength_samples WHERE timeframe = ? AND ts < ?',
+                              (timeframe, int(now - days * 86400)))
+        for name, width in RESOLUTIONS.items():
+            days = self.retention.get(name, 0)
+            if days:
+                writer.submit('DELETE FROM strength_rollup WHERE resolution = ? AND bucket < ?',
+                              (width, int(now - days * 86400)))
+        with self._lock:
+            self._stats['prunes'] += 1
+
+    @staticmethod
+    def pick_resolution(start, end):
+        """通貨ごとの点数が AUTO_MAX_POINTS 以下になる最も細かい解像度"""
+        for name, width in RESOLUTIONS.items():
+            if (end - start) / width <= AUTO_MAX_POINTS:
+                return name
+        return '1d'
+
+    def query(self, timeframe, start, end, resolution='auto'):
+        """期間 [start, end] の通貨ごとの系列
+
+        resolution='raw' : {'USD': [[ts, score], ...]}（変化点のみ）
+        それ以外         : {'USD': [[bucket, open, high, low, close, avg], ...]}
+        """
+        started = time.perf_counter()
+        if end < start:
+            raise ValueError('"from" must not be after "to"')
+        resolution = (resolution or 'auto').strip()
+        if resolution == 'auto':
+            resolution = self.pick_resolution(start, end)
+        if resolution != 'raw' and resolution not in RESOLUTIONS:
+            raise ValueError(f'resolution must be one of auto, raw, {", ".join(RESOLUTIONS)}')
+
+        series = {}
+        conn = get_connection(self.db_path)
+        try:
+            if resolution == 'raw':
+                rows = conn.execute(
+                    'SELECT ts, currency, score FROM strength_samples '
+                    'WHERE timeframe = ? AND ts BETWEEN ? AND ? ORDER BY ts',
+                    (timeframe, int(start), int(end))).fetchall()
+                for ts, currency, score in rows:
+                    series.setdefault(currency, []).append([ts, score])
+            else:
+                width = RESOLUTIONS[resolution]
+                first, last = bucket_start(start, width), bucket_start(end, width)
+                rows = conn.execute(
+                    'SELECT bucket, currency, open, high, low, close, total, samples FROM strength_rollup '
+                    'WHERE resolution = ? AND timeframe = ? AND bucket BETWEEN ? AND ? ORDER BY bucket',
+                    (width, timeframe, first, last)).fetchall()
+                # まだ書き込んでいない集計（ふつうは直近のバケットだけ）
+                with self._lock:
+                    pending = {(bucket, currency): list(agg)
+                               for (w, tf, bucket, currency), agg in self._pending.items()
+                               if w == width and tf == timeframe and first <= bucket <= last}
+                if pending:
+                    buckets = {(bucket, currency): list(agg) for bucket, currency, *agg in rows}
+                    for key, agg in pending.items():
+                        if key in buckets:
+                            _merge(buckets[key], agg)
+                        else:
+                            buckets[key] = agg
+                    rows = [key + tuple(agg) for key, agg in sorted(buckets.items())]
+                for bucket, currency, o, h, l, c, total, n in rows:
+                    series.setdefault(currency, []).append([bucket, o, h, l, c, total / n if n else None])
+        finally:
+            conn.close()
+
+        elapsed_ms = round((time.perf_counter() - started) * 1000.0, 3)
+        with self._lock:
+            self._stats['queries'] += 1
+            self._stats['last_query_ms'] = elapsed_ms
+        return {
+            'tf': timeframe,
+            'resolution': resolution,
+            'from': start,
+            'to': end,
+            'series': series,
+            'query_ms': elapsed_ms,
+        }
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s['pending_rollups'] = len(self._pending)
+        s['flush_sec'] = self.flush_sec
+        s['retention_days'] = dict(self.retention)
+        return s
+
+
+_histories = {}
+_histories_lock = threading.Lock()
+
+
+def get_strength_history(db_path):
+    """DBファイルごとの共有インスタンスを取得"""
+    history = _histories.get(db_path)
+    if history is None:
+        with _histories_lock:
+            history = _histories.get(db_path)
+            if history is None:
+                history = StrengthHistory(db_path)
+                _histories[db_path] = history
+    return history
+
+
+def _flush_all():
+    # db_writer の終了時フラッシュより先に登録順の逆で呼ばれる（未書き込みの集計を書き込みスレッドへ渡す）
+    for history in list(_histories.values()):
+        try:
+            history.flush()
+        except Exception as e:
+            print(f'[STRENGTH_HISTORY] Flush at exit failed: {e}')
+
+
+atexit.register(_flush_all)
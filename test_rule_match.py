@@ -1,6 +1,7 @@
 import sqlite3, json, sys
 sys.path.insert(0, '.')
 from ichimoku_utils import _evaluate_rule_match
+from state_store import CloudIndex
 
 conn = sqlite3.connect('webhook_data.db')
 c = conn.cursor()
@@ -61,10 +62,12 @@ for rule_id, rule_name, rule_json in rules:
             print(f"  {sym}: MATCH direction={direction}")
         else:
             # デバッグ: 条件の実際の値を表示
+            # '1H' / '60' どちらの形式のラベルでも引けるよう CloudIndex 経由で参照
+            index = CloudIndex.from_mapping(cloud_data)
             for cond in rule.get('conditions', []):
                 tf_lbl = cond.get('timeframe') or cond.get('label')
                 fld = cond.get('field')
-                td = cloud_data.get(tf_lbl, {})
+                td = index.cloud(tf_lbl)
                 val = td.get(fld) if td else 'KEY_NOT_FOUND'
                 print(f"  {sym}: NO_MATCH tf={tf_lbl} field={fld} actual={val!r} keys={list(cloud_data.keys())[:6]}")
                 break
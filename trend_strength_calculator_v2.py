@@ -11,11 +11,19 @@
 - v5.0.1 (2026/02/04): 時間足レベルをrow_orderから動的に判定するように修正
 """
 
+import logging
+import os
+import threading
+from collections import OrderedDict
+
 # バージョン識別子（サーバーログに出力）
 VERSION = "v5.0.1_dynamic_tf_level_20260204"
 
 print(f"[IMPORT] trend_strength_calculator_v2.py {VERSION} loaded")
 
+# 計算トレース用ロガー（server_logging の trend サブシステム。DEBUG 無効時は出力しない）
+_log = logging.getLogger('tv.trend')
+
 # ============================================================
 # 【設定】減点方式の配点マスター v5.0
 # ============================================================
@@ -170,7 +178,7 @@ def calculate_trend_strength_v2(tf, state_data, all_states=None):
         score = DEDUCTION_CONFIG['base_scores'].get(tf_level, 80)  # デフォルト80点
         deduction_breakdown = {}
         
-        print(f"[CALC] tf={tf}, row_order={row_order}, tf_level={tf_level}, direction={trend_direction}")
+        _log.debug('[CALC] tf=%s, row_order=%s, tf_level=%s, direction=%s', tf, row_order, tf_level, trend_direction)
         
         # ============================================================
         # ステップ 5: 角度減点の判定
@@ -278,6 +286,66 @@ def calculate_trend_strength_v2(tf, state_data, all_states=None):
         return _return_range('exception')
 
 
+# ============================================================
+# 計算結果のメモ化（雲データが変わらない限り再計算しない）
+# ============================================================
+# キャッシュ件数（通貨ペア×時間足の数より十分大きければよい）
+TREND_CACHE_SIZE = int(os.getenv('TREND_CACHE_SIZE', '1024'))
+# スコアに影響する雲フィールド（clouds[0] のみ参照）
+_CACHE_CLOUD_FIELDS = ('angle', 'thickness', 'distance_from_prev', 'dauten', 'gc')
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_stats = {'hits': 0, 'misses': 0}
+
+
+def _cache_key(tf, state_data):
+    """(VERSION, tf, row_order, 雲フィールド) のタプル
+
+    all_states は現行ロジックでは row_order 以外を参照しないためキーに含めない。
+    計算ロジックを変えたら VERSION を更新すること（古い結果は自然に使われなくなる）。
+    """
+    clouds = state_data.get('clouds')
+    cloud = (clouds[0] if isinstance(clouds, list) else clouds) if clouds else None
+    row_order = state_data.get('row_order', '')
+    if isinstance(row_order, list):
+        row_order = tuple(row_order)
+    if isinstance(cloud, dict):
+        return (VERSION, tf, row_order) + tuple(map(cloud.get, _CACHE_CLOUD_FIELDS))
+    return (VERSION, tf, row_order, cloud)
+
+
+def calculate_trend_strength_cached(tf, state_data, all_states=None):
+    """calculate_trend_strength_v2 のメモ化版
+
+    戻り値はキャッシュと共有するため、呼び出し側で書き換えないこと。
+    """
+    key = _cache_key(tf, state_data)
+    try:
+        with _cache_lock:
+            result = _cache.get(key)
+            if result is not None:
+                _cache.move_to_end(key)
+                _cache_stats['hits'] += 1
+                return result
+            _cache_stats['misses'] += 1
+    except TypeError:
+        # 雲フィールドにハッシュできない値（list / dict）が入っている場合はメモ化しない
+        return calculate_trend_strength_v2(tf, state_data, all_states)
+    result = calculate_trend_strength_v2(tf, state_data, all_states)
+    with _cache_lock:
+        _cache[key] = result
+        while len(_cache) > TREND_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
+
+
+def trend_cache_stats():
+    """メモ化キャッシュの統計（診断用）"""
+    with _cache_lock:
+        return dict(_cache_stats, size=len(_cache), max_size=TREND_CACHE_SIZE, version=VERSION)
+
+
 def _return_range(reason=''):
     """レンジを返す"""
     return {
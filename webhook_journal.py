@@ -0,0 +1,503 @@
+"""
+webhook_journal.py
+
+Webhook 受信ペイロードのジャーナル（webhook_log.txt の置き換え）
+- 追記専用のセグメントファイルに1行1レコードで保存（行形式は webhook_log.txt と同じ）
+- セグメントはサイズ / 日付でローテーションし、閉じたセグメントはバックグラウンドで gzip 圧縮
+- 各セグメントにサイドカーのオフセット索引（受信時刻・symbol・tf）を持ち、
+  tail / 期間指定の読み出しは索引から対象レコードだけを seek して読む（ファイル全体を読まない）
+- 保持期間・合計サイズの上限を超えた古いセグメントはバックグラウンドで削除
+  （旧 webhook_log.txt から取り込んだセグメントは保持期間の対象外。合計サイズの上限だけで削除する）
+
+圧縮セグメントは 64KB 程度のブロックごとに独立した gzip メンバーとして書き出すため、
+1レコードの読み出しは該当ブロックの展開だけで済む（gzip.open で全体を読むことも可能）。
+
+索引ファイル（タブ区切り）:
+    <segment>.log.idx     ts_ms  symbol  tf  sent_time  offset  length
+    <segment>.log.gz.idx  ts_ms  symbol  tf  sent_time  block_offset  inner_offset  length
+"""
+
+import bisect
+import gzip
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+
+import pytz
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PERSISTENT_DIR = os.getenv('PERSISTENT_STORAGE_PATH', BASE_DIR)
+
+# ============================================================
+# 【設定】環境変数で上書き可能
+# ============================================================
+JOURNAL_DIR = os.getenv('WEBHOOK_JOURNAL_DIR', os.path.join(PERSISTENT_DIR, 'webhook_journal'))
+# 1セグメントの上限サイズ（バイト）
+JOURNAL_SEGMENT_BYTES = int(os.getenv('WEBHOOK_JOURNAL_SEGMENT_BYTES', str(4 * 1024 * 1024)))
+# 保持日数（0 で無期限）
+JOURNAL_RETENTION_DAYS = float(os.getenv('WEBHOOK_JOURNAL_RETENTION_DAYS', '30'))
+# 全セグメントの合計サイズ上限（バイト、0 で無制限）
+JOURNAL_MAX_BYTES = int(os.getenv('WEBHOOK_JOURNAL_MAX_BYTES', str(200 * 1024 * 1024)))
+# 保持・圧縮処理の実行間隔（秒）
+JOURNAL_MAINTENANCE_SEC = float(os.getenv('WEBHOOK_JOURNAL_MAINTENANCE_SEC', '600'))
+# 圧縮ブロックの目安サイズ（非圧縮バイト）
+JOURNAL_BLOCK_BYTES = 64 * 1024
+
+# 旧形式のログ（初回起動時に取り込む）
+LEGACY_LOG_PATH = os.path.join(BASE_DIR, 'webhook_log.txt')
+
+_jst = pytz.timezone('Asia/Tokyo')
+_SEGMENT_RE = re.compile(r'^segment-(\d{8}-\d{6})-(\d{6})\.log(\.gz)?$')
+# 旧ログ行: "<iso> - SYMBOL/TF (Sent: xx) - {json}" または "<iso> - SYMBOL/TF - {json}"
+_LINE_RE = re.compile(r'^(\S+) - ([^/\s]+)/(\S+?)(?: \(Sent: ([^)]*)\))? - ')
+
+
+def format_line(received_at, symbol, tf, sent_time, data):
+    """ジャーナル1行を生成（webhook_log.txt と同じ形式）"""
+    return f'{received_at} - {symbol}/{tf} (Sent: {sent_time}) - {json.dumps(data, ensure_ascii=False)}\n'
+
+
+def parse_line(line):
+    """ジャーナル1行を (received_at, symbol, tf, sent_time, payload) に分解（失敗時 None）"""
+    m = _LINE_RE.match(line)
+    if not m:
+        return None
+    try:
+        payload = json.loads(line[m.end():])
+    except Exception:
+        return None
+    return m.group(1), m.group(2), m.group(3), m.group(4) or '', payload
+
+
+def _iso_to_ms(value):
+    try:
+        return int(datetime.fromisoformat(value).timestamp() * 1000)
+    except Exception:
+        return None
+
+
+class _Segment:
+    """セグメント1つ分（索引はメモリ上に保持）"""
+
+    __slots__ = ('name', 'path', 'compressed', 'ts', 'entries', 'size')
+
+    def __init__(self, name, path, compressed):
+        self.name = name
+        self.path = path
+        self.compressed = compressed
+        self.ts = []        # 索引の ts_ms（bisect 用）
+        self.entries = []   # (ts_ms, symbol, tf, sent_time, pos...) のタプル
+        self.size = 0
+
+    @property
+    def index_path(self):
+        return self.path + '.idx'
+
+    def load_index(self):
+        self.ts, self.entries = [], []
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            for raw in f:
+                parts = raw.rstrip('\n').split('\t')
+                if len(parts) < 6:
+                    continue  # 書き込み途中の行
+                try:
+                    nums = tuple(int(x) for x in parts[4:])
+                    entry = (int(parts[0]), parts[1], parts[2], parts[3]) + nums
+                except ValueError:
+                    continue
+                self.ts.append(entry[0])
+                self.entries.append(entry)
+        # 索引は時刻順が前提（以前の取り込みで順序が乱れた索引もここで並べ直す）
+        if any(a > b for a, b in zip(self.ts, self.ts[1:])):
+            self.entries.sort(key=lambda e: e[0])
+            self.ts = [e[0] for e in self.entries]
+        try:
+            self.size = os.path.getsize(self.path)
+        except OSError:
+            self.size = 0
+
+
+class WebhookJournal:
+    """セグメント化・索引付きのペイロードジャーナル"""
+
+    def __init__(self, journal_dir=JOURNAL_DIR, segment_bytes=JOURNAL_SEGMENT_BYTES, legacy_path=LEGACY_LOG_PATH):
+        self.dir = journal_dir
+        self.segment_bytes = segment_bytes
+        self.legacy_path = legacy_path
+        self._lock = threading.RLock()
+        self._segments = []          # 古い順
+        self._active = None
+        self._active_fh = None
+        self._active_idx_fh = None
+        self._active_day = None
+        self._seq = 0
+        self._block_cache = OrderedDict()  # (path, block_offset) -> bytes
+        self._maintenance_started = False
+        self._maintenance_lock = threading.Lock()  # 圧縮・削除の多重実行防止
+        self._legacy = set()         # 旧ログから取り込んだセグメント名（.gz なし）
+        os.makedirs(self.dir, exist_ok=True)
+        self._load()
+
+    # ------------------------------------------------------------
+    # 初期化
+    # ------------------------------------------------------------
+    def _load(self):
+        names = []
+        for name in os.listdir(self.dir):
+            m = _SEGMENT_RE.match(name)
+            if m:
+                names.append((m.group(1), int(m.group(2)), name, bool(m.group(3))))
+        names.sort()
+        plain = {n[2] for n in names if not n[3]}
+        for stamp, seq, name, compressed in names:
+            # 圧縮途中で落ちた場合は非圧縮側を正とする
+            if compressed and name[:-3] in plain:
+                continue
+            seg = _Segment(name, os.path.join(self.dir, name), compressed)
+            seg.load_index()
+            self._segments.append(seg)
+            self._seq = max(self._seq, seq)
+        # 目印ファイル: 1行目は取り込み時刻、2行目以降は取り込んだセグメント名
+        marker = os.path.join(self.dir, '.legacy_imported')
+        if os.path.exists(marker):
+            with open(marker, 'r', encoding='utf-8') as f:
+                self._legacy = {line.strip() for line in f.readlines()[1:] if line.strip()}
+            return
+        if not self._segments and self.legacy_path and os.path.exists(self.legacy_path):
+            self._import_legacy(self.legacy_path)
+        with open(marker, 'w', encoding='utf-8') as f:
+            f.write(datetime.now(_jst).isoformat() + '\n')
+            for name in sorted(self._legacy):
+                f.write(name + '\n')
+
+    def _import_legacy(self, path):
+        """旧 webhook_log.txt の内容をジャーナルへ取り込む（初回のみ）
+
+        旧ログは受信時刻順になっていない箇所があるため、受信時刻で並べ替えてから書き込む
+        （セグメントの索引は時刻順であることを前提に bisect で引く）。
+        """
+        records = []
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                m = _LINE_RE.match(line)
+                if not m:
+                    continue
+                ts_ms = _iso_to_ms(m.group(1)) or 0
+                records.append((ts_ms, line if line.endswith('\n') else line + '\n',
+                                m.group(2), m.group(3), m.group(4) or ''))
+        records.sort(key=lambda r: r[0])  # 同時刻は元の順序のまま
+        first = len(self._segments)
+        for ts_ms, line, symbol, tf, sent_time in records:
+            self._append_line(line, ts_ms, symbol, tf, sent_time)
+        self._close_active()
+        self._legacy = {seg.name for seg in self._segments[first:]}
+        print(f'[JOURNAL] Imported {len(records)} records from {os.path.basename(path)}')
+
+    # ------------------------------------------------------------
+    # 書き込み
+    # ------------------------------------------------------------
+    def append(self, received_at, symbol, tf, sent_time, data):
+        """ペイロードを追記"""
+        line = format_line(received_at, symbol, tf, sent_time, data)
+        with self._lock:
+            self._append_line(line, int(time.time() * 1000), symbol, tf, sent_time or '')
+        self.start_maintenance()
+
+    def _append_line(self, line, ts_ms, symbol, tf, sent_time):
+        encoded = line.encode('utf-8')
+        day = datetime.fromtimestamp(ts_ms / 1000.0, _jst).strftime('%Y%m%d') if ts_ms else None
+        if self._active is not None and (
+                self._active.size + len(encoded) > self.segment_bytes
+                or (day and self._active_day and day != self._active_day)):
+            self._close_active()
+        if self._active is None:
+            self._open_active(ts_ms, day)
+        offset = self._active.size
+        self._active_fh.write(encoded)
+        self._active_fh.flush()
+        # タブ・改行は索引の区切りと衝突するため除去
+        symbol, tf, sent_time = (str(v).replace('\t', ' ').replace('\n', ' ') for v in (symbol, tf, sent_time))
+        self._active_idx_fh.write(f'{ts_ms}\t{symbol}\t{tf}\t{sent_time}\t{offset}\t{len(encoded)}\n')
+        self._active_idx_fh.flush()
+        entry = (ts_ms, symbol, tf, sent_time, offset, len(encoded))
+        if self._active.ts and ts_ms < self._active.ts[-1]:
+            # 時計が戻った場合も索引は時刻順に保つ
+            i = bisect.bisect_right(self._active.ts, ts_ms)
+            self._active.ts.insert(i, ts_ms)
+            self._active.entries.insert(i, entry)
+        else:
+            self._active.ts.append(ts_ms)
+            self._active.entries.append(entry)
+        self._active.size += len(encoded)
+
+    def _open_active(self, ts_ms, day):
+        self._seq += 1
+        stamp = datetime.fromtimestamp((ts_ms or time.time() * 1000) / 1000.0, _jst).strftime('%Y%m%d-%H%M%S')
+        name = f'segment-{stamp}-{self._seq:06d}.log'
+        seg = _Segment(name, os.path.join(self.dir, name), False)
+        self._active_fh = open(seg.path, 'ab')
+        self._active_idx_fh = open(seg.index_path, 'a', encoding='utf-8')
+        self._active = seg
+        self._active_day = day
+        self._segments.append(seg)
+
+    def _close_active(self):
+        if self._active is None:
+            return
+        try:
+            self._active_fh.close()
+            self._active_idx_fh.close()
+        finally:
+            self._active = None
+            self._active_fh = None
+            self._active_idx_fh = None
+            self._active_day = None
+
+    # ------------------------------------------------------------
+    # 読み出し
+    # ------------------------------------------------------------
+    def _read_block(self, path, block_offset):
+        key = (path, block_offset)
+        block = self._block_cache.get(key)
+        if block is not None:
+            self._block_cache.move_to_end(key)
+            return block
+        with open(path, 'rb') as f:
+            f.seek(block_offset)
+            d = zlib.decompressobj(wbits=31)
+            chunks = []
+            while not d.eof:
+                buf = f.read(16 * 1024)
+                if not buf:
+                    break
+                chunks.append(d.decompress(buf))
+            block = b''.join(chunks)
+        self._block_cache[key] = block
+        if len(self._block_cache) > 8:
+            self._block_cache.popitem(last=False)
+        return block
+
+    def _read_entries(self, seg, entries):
+        """索引エントリのレコード本文を読み出す"""
+        if not entries:
+            return []
+        lines = []
+        if seg.compressed:
+            for e in entries:
+                block = self._read_block(seg.path, e[4])
+                lines.append(block[e[5]:e[5] + e[6]].decode('utf-8', errors='replace'))
+            return lines
+        with open(seg.path, 'rb') as f:
+            for e in entries:
+                f.seek(e[4])
+                lines.append(f.read(e[5]).decode('utf-8', errors='replace'))
+        return lines
+
+    @staticmethod
+    def _match(entry, symbol, tf):
+        return (symbol is None or entry[1] == symbol) and (tf is None or entry[2] == tf)
+
+    def tail(self, n=50, symbol=None, tf=None):
+        """最新 n 件の行を古い順で返す"""
+        with self._lock:
+            picked = []  # (seg, [entries])、新しい順
+            remaining = n
+            for seg in reversed(self._segments):
+                if remaining <= 0:
+                    break
+                hits = []
+                for e in reversed(seg.entries):
+                    if self._match(e, symbol, tf):
+                        hits.append(e)
+                        if len(hits) >= remaining:
+                            break
+                if hits:
+                    hits.reverse()
+                    picked.append((seg, hits))
+                    remaining -= len(hits)
+            lines = []
+            for seg, hits in reversed(picked):
+                lines.extend(self._read_entries(seg, hits))
+            return lines
+
+    def read_range(self, from_ms=None, to_ms=None, symbol=None, tf=None, limit=1000):
+        """受信時刻 [from_ms, to_ms] の行を古い順で返す（最大 limit 件）"""
+        lo = from_ms if from_ms is not None else float('-inf')
+        hi = to_ms if to_ms is not None else float('inf')
+        lines = []
+        with self._lock:
+            for seg in self._segments:
+                if not seg.ts or seg.ts[-1] < lo or seg.ts[0] > hi:
+                    continue
+                start = bisect.bisect_left(seg.ts, lo)
+                end = bisect.bisect_right(seg.ts, hi)
+                hits = [e for e in seg.entries[start:end] if self._match(e, symbol, tf)]
+                if limit is not None:
+                    hits = hits[:limit - len(lines)]
+                lines.extend(self._read_entries(seg, hits))
+                if limit is not None and len(lines) >= limit:
+                    break
+        return lines
+
+    def _resolve(self, seg):
+        """圧縮で差し替わったセグメントを引き直す（削除済みなら None）"""
+        if seg in self._segments:
+            return seg
+        for s in self._segments:
+            if s.name == seg.name + '.gz':
+                return s
+        return None
+
+    def iter_lines(self, symbol=None, tf=None):
+        """全レコードを古い順に1行ずつ返すジェネレーター（読み出しは 256 件ずつ）"""
+        with self._lock:
+            segments = list(self._segments)
+        for seg in segments:
+            positions = [i for i, e in enumerate(seg.entries) if self._match(e, symbol, tf)]
+            for i in range(0, len(positions), 256):
+                with self._lock:
+                    # 圧縮前後で索引の並びは同じなので位置で対応付ける
+                    cur = self._resolve(seg)
+                    if cur is None:
+                        break
+                    chunk = self._read_entries(cur, [cur.entries[j] for j in positions[i:i + 256]])
+                for line in chunk:
+                    yield line
+
+    def count(self):
+        with self._lock:
+            return sum(len(s.entries) for s in self._segments)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'dir': self.dir,
+                'segments': len(self._segments),
+                'compressed_segments': sum(1 for s in self._segments if s.compressed),
+                'records': sum(len(s.entries) for s in self._segments),
+                'bytes': sum(s.size for s in self._segments),
+                'active': self._active.name if self._active else None,
+            }
+
+    # ------------------------------------------------------------
+    # 圧縮・保持（バックグラウンド）
+    # ------------------------------------------------------------
+    def start_maintenance(self):
+        if self._maintenance_started:
+            return
+        with self._lock:
+            if self._maintenance_started:
+                return
+            self._maintenance_started = True
+        threading.Thread(target=self._maintenance_loop, daemon=True, name='journal-maintenance').start()
+
+    def _maintenance_loop(self):
+        while True:
+            try:
+                self.run_maintenance()
+            except Exception as e:
+                print(f'[JOURNAL] Maintenance failed: {e}')
+            time.sleep(JOURNAL_MAINTENANCE_SEC)
+
+    def run_maintenance(self):
+        """閉じたセグメントの圧縮と保持ポリシーの適用"""
+        with self._maintenance_lock:
+            with self._lock:
+                sealed = [s for s in self._segments if s is not self._active and not s.compressed]
+            for seg in sealed:
+                self._compress(seg)
+            self._apply_retention()
+
+    def _compress(self, seg):
+        gz_path = seg.path + '.gz'
+        tmp_path = gz_path + '.tmp'
+        new_entries = []
+        with open(seg.path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            block, block_entries = [], []
+            block_len = 0
+
+            def flush_block():
+                if not block:
+                    return
+                block_offset = dst.tell()
+                dst.write(gzip.compress(b''.join(block), compresslevel=6))
+                for e, inner in block_entries:
+                    new_entries.append(e[:4] + (block_offset, inner, e[5]))
+                block.clear()
+                block_entries.clear()
+
+            for e in seg.entries:
+                src.seek(e[4])
+                data = src.read(e[5])
+                block_entries.append((e, block_len))
+                block.append(data)
+                block_len += len(data)
+                if block_len >= JOURNAL_BLOCK_BYTES:
+                    flush_block()
+                    block_len = 0
+            flush_block()
+        with open(gz_path + '.idx.tmp', 'w', encoding='utf-8') as f:
+            for e in new_entries:
+                f.write('\t'.join(str(x) for x in e) + '\n')
+        os.replace(tmp_path, gz_path)
+        os.replace(gz_path + '.idx.tmp', gz_path + '.idx')
+        with self._lock:
+            new_seg = _Segment(seg.name + '.gz', gz_path, True)
+            new_seg.ts = [e[0] for e in new_entries]
+            new_seg.entries = new_entries
+            new_seg.size = os.path.getsize(gz_path)
+            self._segments[self._segments.index(seg)] = new_seg
+            for p in (seg.path, seg.index_path):
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+
+    def _apply_retention(self):
+        now_ms = int(time.time() * 1000)
+        with self._lock:
+            sealed = [s for s in self._segments if s is not self._active]
+            total = sum(s.size for s in self._segments)
+            doomed = []
+            for seg in sealed:  # 古い順
+                legacy = seg.name[:-3] in self._legacy if seg.compressed else seg.name in self._legacy
+                too_old = (not legacy and JOURNAL_RETENTION_DAYS > 0 and seg.ts
+                           and now_ms - seg.ts[-1] > JOURNAL_RETENTION_DAYS * 86400 * 1000)
+                too_big = JOURNAL_MAX_BYTES > 0 and total > JOURNAL_MAX_BYTES
+                if not (too_old or too_big):
+                    if legacy:
+                        continue  # 取り込んだ履歴の後ろに期限切れのセグメントがあり得る
+                    break
+                doomed.append(seg)
+                total -= seg.size
+            for seg in doomed:
+                self._segments.remove(seg)
+                for p in (seg.path, seg.index_path):
+                    try:
+                        os.remove(p)
+                    except OSError:
+                        pass
+        for seg in doomed:
+            print(f'[JOURNAL] Retention removed {seg.name} ({len(seg.entries)} records)')
+
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def get_journal():
+    """プロセス共通のジャーナルを取得"""
+    global _journal
+    if _journal is None:
+        with _journal_lock:
+            if _journal is None:
+                _journal = WebhookJournal()
+    return _journal